@@ -0,0 +1,239 @@
+"""
+This file is part of CIUSuite 2
+Copyright (C) 2018 Daniel Polasky
+
+Timing comparisons between the standard and optimized versions of CIUSuite 2 processing methods.
+Synthetic data is generated for each comparison, so no input files are required. Run this module
+directly to print all benchmark results to the console.
+"""
+import os
+import time
+import shutil
+import tempfile
+import numpy as np
+import scipy.signal
+
+import Raw_Processing
+import Original_CIU
+import CIU_Params
+import Gaussian_Fitting
+
+
+def time_method(method, args_list, repeats):
+    """
+    Time a method by calling it repeatedly with the provided arguments
+    :param method: function to time
+    :param args_list: list of arguments to pass to the method
+    :param repeats: number of times to call the method
+    :return: best (minimum) time of all calls in seconds, return value of the last call
+    """
+    best_time = np.inf
+    output = None
+    for _ in range(repeats):
+        start_time = time.perf_counter()
+        output = method(*args_list)
+        elapsed = time.perf_counter() - start_time
+        if elapsed < best_time:
+            best_time = elapsed
+    return best_time, output
+
+
+def make_synthetic_ciu_data(num_dt_bins, num_cv_bins, num_features=3, noise=0.02, seed=0):
+    """
+    Generate a synthetic CIU fingerprint with a few Gaussian features that shift in drift time
+    with activation, plus random noise.
+    :param num_dt_bins: number of drift time bins (rows)
+    :param num_cv_bins: number of collision voltage bins (columns)
+    :param num_features: number of unfolding features to include
+    :param noise: relative intensity of random noise to add
+    :param seed: random seed
+    :return: 2D ciu data array (DT x CV), [dt_axis, cv_axis]
+    """
+    rng = np.random.RandomState(seed)
+    dt_axis = np.linspace(1, 40, num_dt_bins)
+    cv_axis = np.linspace(5, 5 + 2 * (num_cv_bins - 1), num_cv_bins)
+
+    ciu_data = np.zeros((num_dt_bins, num_cv_bins))
+    transition_cvs = np.linspace(cv_axis[0], cv_axis[-1], num_features + 1)
+    for feature_index in range(num_features):
+        centroid = 10 + 8 * feature_index
+        # each feature is present (weight 1) between two transition CVs, with a smooth rise and fall
+        rise = 0.5 * (1 + np.tanh(cv_axis - transition_cvs[feature_index]))
+        fall = 0.5 * (1 + np.tanh(cv_axis - transition_cvs[feature_index + 1]))
+        profile = np.exp(-(dt_axis - centroid) ** 2 / 2.0)
+        ciu_data += np.outer(profile, rise - fall)
+    ciu_data += noise * rng.rand(num_dt_bins, num_cv_bins)
+    return Raw_Processing.normalize_by_col(ciu_data), [dt_axis, cv_axis]
+
+
+def benchmark_raw_import(grid_sizes, repeats=3):
+    """
+    Compare Raw_Processing.get_data (np.genfromtxt) with Raw_Processing.get_data_fast on synthetic
+    _raw.csv files of various sizes. Also confirms that both readers return the same data.
+    :param grid_sizes: list of (num_dt_bins, num_cv_bins) tuples to test
+    :param repeats: number of times to read each file (best time is reported)
+    :return: list of (dt_bins, cv_bins, standard time, fast time) tuples
+    """
+    results = []
+    temp_dir = tempfile.mkdtemp()
+    try:
+        for num_dt_bins, num_cv_bins in grid_sizes:
+            ciu_data, axes = make_synthetic_ciu_data(num_dt_bins, num_cv_bins)
+            raw_path = os.path.join(temp_dir, 'bench_{}x{}_raw.csv'.format(num_dt_bins, num_cv_bins))
+            Original_CIU.write_ciu_csv(raw_path, ciu_data, axes)
+
+            standard_time, standard_obj = time_method(Raw_Processing.get_data, [raw_path], repeats)
+            fast_time, fast_obj = time_method(Raw_Processing.get_data_fast, [raw_path], repeats)
+
+            if not np.array_equal(standard_obj.rawdata, fast_obj.rawdata) \
+                    or not np.array_equal(standard_obj.dt_axis, fast_obj.dt_axis) \
+                    or not np.array_equal(standard_obj.cv_axis, fast_obj.cv_axis):
+                print('WARNING: fast reader output does not match standard reader for grid {}x{}'.format(num_dt_bins, num_cv_bins))
+
+            results.append((num_dt_bins, num_cv_bins, standard_time, fast_time))
+    finally:
+        shutil.rmtree(temp_dir)
+    return results
+
+
+def benchmark_gaussian_fitting(num_files, num_dt_bins, num_cv_bins, engines=('lmfit', 'least_squares', 'batched')):
+    """
+    Compare Gaussian fitting throughput (CV columns per second) of the available fitting engines on a set of
+    synthetic replicate fingerprints with a common DT axis, using the default parameters. The lmfit and
+    least_squares engines fit one file at a time (fit_all_cvs); the batched engine fits all files together.
+    :param num_files: number of replicate fingerprints to fit
+    :param num_dt_bins: number of drift time bins in each fingerprint
+    :param num_cv_bins: number of collision voltage bins in each fingerprint
+    :param engines: fitting engines (gaussian_63_fit_engine values) to compare
+    :return: list of (engine, columns fit, time, columns per second) tuples
+    """
+    params_obj = CIU_Params.Parameters()
+    params_obj.set_params(CIU_Params.parse_params_file_newcsv(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'CIU2_param_info.csv')))
+    params_obj.gaussian_4_save_diagnostics = False
+
+    ciu_data_list, axes_list = [], []
+    for file_index in range(num_files):
+        ciu_data, axes = make_synthetic_ciu_data(num_dt_bins, num_cv_bins, seed=file_index)
+        ciu_data_list.append(ciu_data)
+        axes_list.append(axes)
+    num_columns = num_files * num_cv_bins
+
+    results = []
+    for engine in engines:
+        params_obj.gaussian_63_fit_engine = engine
+        start_time = time.perf_counter()
+        if engine == 'batched':
+            Gaussian_Fitting.fit_files_batched(ciu_data_list, axes_list, params_obj, [None for _ in range(num_files)])
+        else:
+            for ciu_data, axes in zip(ciu_data_list, axes_list):
+                Gaussian_Fitting.fit_all_cvs(ciu_data, axes, params_obj, None)
+        elapsed = time.perf_counter() - start_time
+        results.append((engine, num_columns, elapsed, num_columns / elapsed))
+    return results
+
+
+def column_sav_gol_smooth(ciu_data, smooth_window, smooth_order, iterations):
+    """
+    Reference (previous) 1D smoothing method: savgol_filter applied to one CV column at a time, with the
+    whole pass repeated for each iteration
+    :param ciu_data: 2D ciu data array (DT x CV)
+    :param smooth_window: Savitsky golay smoothing window (odd)
+    :param smooth_order: polynomial order to use for smoothing
+    :param iterations: number of times to apply the smoothing
+    :return: smoothed data
+    """
+    for _ in range(iterations):
+        smoothed_data = np.ndarray(np.shape(ciu_data))
+        for cv_index in range(np.shape(ciu_data)[1]):
+            smoothed_data[:, cv_index] = scipy.signal.savgol_filter(ciu_data[:, cv_index], smooth_window, polyorder=smooth_order)
+        ciu_data = smoothed_data
+    return ciu_data
+
+
+def benchmark_sg_smoothing(grid_sizes, iteration_counts, num_files=10, smooth_window=5, repeats=3):
+    """
+    Compare 1D Savitzky-Golay smoothing of a set of fingerprints one CV column and iteration at a time
+    (column_sav_gol_smooth) with Raw_Processing.sav_gol_smooth_stack, applied to each fingerprint and to the
+    stacked (3D) fingerprints in a single call. Also confirms that all methods return the same data.
+    :param grid_sizes: list of (num_dt_bins, num_cv_bins) tuples to test
+    :param iteration_counts: list of numbers of smoothing iterations to test
+    :param num_files: number of fingerprints to smooth
+    :param smooth_window: smoothing window
+    :param repeats: number of times to smooth the data (best time is reported)
+    :return: list of (dt_bins, cv_bins, iterations, column time, per-file time, stacked time) tuples
+    """
+    results = []
+    for num_dt_bins, num_cv_bins in grid_sizes:
+        ciu_data_stack = np.stack([make_synthetic_ciu_data(num_dt_bins, num_cv_bins, seed=x)[0] for x in range(num_files)])
+        for iterations in iteration_counts:
+            column_time, column_output = time_method(lambda: [column_sav_gol_smooth(x, smooth_window, 2, iterations) for x in ciu_data_stack], [], repeats)
+            file_time, file_output = time_method(lambda: [Raw_Processing.sav_gol_smooth_stack(x, smooth_window, 2, iterations) for x in ciu_data_stack], [], repeats)
+            stack_time, stack_output = time_method(Raw_Processing.sav_gol_smooth_stack, [ciu_data_stack, smooth_window, 2, iterations], repeats)
+
+            if not np.allclose(column_output, file_output, rtol=0, atol=1e-10) or not np.allclose(column_output, stack_output, rtol=0, atol=1e-10):
+                print('WARNING: stacked smoothing output does not match column smoothing for grid {}x{}, {} iterations'.format(num_dt_bins, num_cv_bins, iterations))
+
+            results.append((num_dt_bins, num_cv_bins, iterations, column_time, file_time, stack_time))
+    return results
+
+
+def benchmark_sgolay2d(grid_sizes, iteration_counts, num_files=10, smooth_window=5, repeats=3):
+    """
+    Compare 2D Savitzky-Golay smoothing of a set of fingerprints one file and iteration at a time with
+    Raw_Processing.sgolay2d applying all iterations at once to the stacked (3D) fingerprints. Kernels are
+    cached after the first call, so the reported (best) times do not include computing them.
+    :param grid_sizes: list of (num_dt_bins, num_cv_bins) tuples to test
+    :param iteration_counts: list of numbers of smoothing iterations to test
+    :param num_files: number of fingerprints to smooth
+    :param smooth_window: smoothing window
+    :param repeats: number of times to smooth the data (best time is reported)
+    :return: list of (dt_bins, cv_bins, iterations, per-file time, stacked time) tuples
+    """
+    def smooth_files(ciu_data_stack, iterations):
+        smoothed_list = []
+        for ciu_data in ciu_data_stack:
+            for _ in range(iterations):
+                ciu_data = Raw_Processing.sgolay2d(ciu_data, smooth_window, order=2)
+            smoothed_list.append(ciu_data)
+        return smoothed_list
+
+    results = []
+    for num_dt_bins, num_cv_bins in grid_sizes:
+        ciu_data_stack = np.stack([make_synthetic_ciu_data(num_dt_bins, num_cv_bins, seed=x)[0] for x in range(num_files)])
+        for iterations in iteration_counts:
+            file_time, file_output = time_method(smooth_files, [ciu_data_stack, iterations], repeats)
+            stack_time, stack_output = time_method(Raw_Processing.sgolay2d, [ciu_data_stack, smooth_window, 2, None, iterations], repeats)
+
+            if not np.allclose(file_output, stack_output, rtol=0, atol=1e-10):
+                print('WARNING: stacked 2D smoothing output does not match per-file smoothing for grid {}x{}, {} iterations'.format(num_dt_bins, num_cv_bins, iterations))
+
+            results.append((num_dt_bins, num_cv_bins, iterations, file_time, stack_time))
+    return results
+
+
+def print_results(title, header, results):
+    """
+    Print a table of benchmark results to the console
+    :param title: title of the benchmark
+    :param header: list of column names
+    :param results: list of tuples of values (one tuple per row). Floats are printed to 4 decimal places
+    :return: void
+    """
+    print('\n{}'.format(title))
+    print('\t'.join(header))
+    for result in results:
+        print('\t'.join(['{:.4f}'.format(x) if isinstance(x, float) else str(x) for x in result]))
+
+
+if __name__ == '__main__':
+    import_results = benchmark_raw_import([(200, 50), (1000, 100), (2000, 200), (4000, 400)])
+    print_results('_raw.csv import (s)', ['DT bins', 'CV bins', 'get_data', 'get_data_fast'], import_results)
+
+    smoothing_results = benchmark_sg_smoothing([(200, 50), (1000, 100), (4000, 200)], [1, 3, 10])
+    print_results('1D SG smoothing, 10 files (s)', ['DT bins', 'CV bins', 'iterations', 'by column', 'sav_gol_smooth_stack', 'stacked files'], smoothing_results)
+
+    smoothing_2d_results = benchmark_sgolay2d([(200, 50), (1000, 100), (2000, 400)], [1, 3, 10])
+    print_results('2D SG smoothing, 10 files (s)', ['DT bins', 'CV bins', 'iterations', 'by file', 'stacked files'], smoothing_2d_results)
+
+    fitting_results = benchmark_gaussian_fitting(num_files=2, num_dt_bins=100, num_cv_bins=10)
+    print_results('Gaussian fitting (2 files, 100 DT x 10 CV bins)', ['engine', 'columns', 'time (s)', 'columns/s'], fitting_results)
@@ -0,0 +1,476 @@
+"""
+This file is part of CIUSuite 2
+Copyright (C) 2018 Daniel Polasky and Sugyan Dixit
+
+Command line (no GUI) runner for CIUSuite 2 analyses. Runs a list of analysis stages over all files in
+one or more folders using a pipeline configuration file and a parameter file in the same format as
+CIU2_param_info.csv. Stages that operate on single files are run in parallel across files.
+
+Usage: python CIU2_Batch.py pipeline_config.csv params_file.csv
+
+Pipeline configuration file format (CSV, lines starting with # are ignored):
+    input,folder1,folder2,...           folders containing _raw.csv (if running 'process') or .ciu files
+    output,folder                       (optional) folder in which to save all outputs. Defaults to a new CIU2_Batch_output
+                                        folder inside the first input folder
+    stages,process,gaussian,...         stages to run (always run in the order listed in STAGE_ORDER below). The
+                                        'cluster' stage clusters all files by RMSD (see the cluster parameters). The
+                                        'library_search' stage finds the closest references in the reference library to
+                                        each file, and 'library_add' adds the files to the library. The
+                                        'plots' stage renders plots deferred in the output folder (see plot_20_render_mode)
+    crop,dt_low,dt_high,cv_low,cv_high  crop values (required for the 'crop' stage)
+    cores,4                             (optional) number of files to process in parallel. Defaults to all CPUs
+    class,label1,label2,...             class labels (required for the 'classify' stage), matched against filenames
+    state,label1,label2,...             (optional) state/subclass labels for classification, matched against filenames
+    library,folder                      reference library folder (required for the library stages, see Reference_Library)
+"""
+import os
+import sys
+import logging
+import multiprocessing
+
+import matplotlib
+matplotlib.rcParams.update({'figure.autolayout': True})
+matplotlib.use('Agg')
+
+import CIU_Params
+import CIU_File_IO
+import Raw_Processing
+import Gaussian_Fitting
+import Feature_Detection
+import Classification
+import RMSD_Clustering
+import Reference_Library
+import CIU_Plot_Service
+from CIU_analysis_obj import CIUAnalysisObj
+
+logger = logging.getLogger('main')
+
+# stages that can be requested in the pipeline config, in the order they are run
+STAGE_ORDER = ['process', 'smooth', 'crop', 'interpolate', 'gaussian', 'features', 'ciu50', 'classify', 'cluster', 'library_search', 'library_add', 'plots']
+# stages run on individual files in parallel before and after Gaussian fitting
+PRE_GAUSSIAN_STAGES = ['process', 'smooth', 'crop', 'interpolate']
+POST_GAUSSIAN_STAGES = ['features', 'ciu50']
+# output subfolder (of the first input folder) used if no output folder is given, to avoid overwriting input files
+DEFAULT_OUTPUT_FOLDER = 'CIU2_Batch_output'
+
+
+class PipelineConfig(object):
+    """
+    Container for pipeline configuration information parsed from a config file
+    """
+    def __init__(self):
+        """
+        Initialize empty configuration. Populated by parse_pipeline_config
+        """
+        self.input_dirs = []
+        self.output_dir = None
+        self.stages = []
+        self.crop_vals = None
+        self.num_cores = multiprocessing.cpu_count()
+        self.class_labels = []
+        self.subclass_labels = ['0']
+        self.library_dir = None
+
+
+def parse_pipeline_config(config_file):
+    """
+    Parse a pipeline configuration file. See module docstring for format.
+    :param config_file: full path to config file
+    :return: PipelineConfig
+    :raises: ValueError if the configuration is missing required information
+    """
+    config = PipelineConfig()
+    with open(config_file, 'r') as config_lines:
+        for line in config_lines:
+            # skip headers and blank lines
+            if line.startswith('#') or len(line.strip()) == 0:
+                continue
+            splits = [x.strip() for x in line.rstrip('\n').split(',')]
+            key = splits[0].lower()
+            values = [x for x in splits[1:] if x != '']
+
+            if key == 'input':
+                config.input_dirs = values
+            elif key == 'output':
+                config.output_dir = values[0]
+            elif key == 'stages':
+                unknown_stages = [x for x in values if x.lower() not in STAGE_ORDER]
+                if len(unknown_stages) > 0:
+                    raise ValueError('Unknown stage(s) in pipeline config: {}. Allowed stages are: {}'.format(','.join(unknown_stages), ','.join(STAGE_ORDER)))
+                config.stages = [x for x in STAGE_ORDER if x in [y.lower() for y in values]]
+            elif key == 'crop':
+                config.crop_vals = [float(x) for x in values]
+            elif key == 'cores':
+                config.num_cores = int(values[0])
+            elif key == 'class':
+                config.class_labels = values
+            elif key == 'state' or key == 'subclass':
+                if len(values) > 0:
+                    config.subclass_labels = values
+            elif key == 'library':
+                config.library_dir = values[0]
+            else:
+                logger.warning('Unrecognized line in pipeline config ignored: {}'.format(line.rstrip('\n')))
+
+    if len(config.input_dirs) == 0:
+        raise ValueError('No input folder(s) provided in pipeline config')
+    if 'crop' in config.stages and (config.crop_vals is None or len(config.crop_vals) != 4):
+        raise ValueError('Crop stage requires 4 crop values: dt_low,dt_high,cv_low,cv_high')
+    if 'classify' in config.stages and len(config.class_labels) < 2:
+        raise ValueError('Classify stage requires at least 2 class labels')
+    if ('library_search' in config.stages or 'library_add' in config.stages) and config.library_dir is None:
+        raise ValueError('Library stages require a reference library folder (library,folder)')
+    if config.output_dir is None:
+        config.output_dir = os.path.join(config.input_dirs[0], DEFAULT_OUTPUT_FOLDER)
+    return config
+
+
+def find_input_files(config):
+    """
+    Find all input files in the configured input folders. _raw.csv files are used if raw processing
+    is requested, .ciu files otherwise.
+    :param config: PipelineConfig
+    :type config: PipelineConfig
+    :return: sorted list of full paths to input files
+    """
+    extension = '_raw.csv' if 'process' in config.stages else '.ciu'
+    files = []
+    for folder in config.input_dirs:
+        try:
+            files.extend([os.path.join(folder, x) for x in os.listdir(folder) if x.endswith(extension)])
+        except FileNotFoundError:
+            logger.error('Could not find input folder specified in pipeline config: {}'.format(folder))
+    return sorted(files)
+
+
+def save_batch_obj(analysis_obj, outputdir):
+    """
+    Save an analysis object to a .ciu file in the output directory. The directory index is not
+    updated here, as this is called from parallel processes (see run_pipeline)
+    :param analysis_obj: CIUAnalysisObj to save
+    :type analysis_obj: CIUAnalysisObj
+    :param outputdir: directory in which to save
+    :return: full path to saved file
+    """
+    filepath = os.path.join(outputdir, analysis_obj.short_filename + '.ciu')
+    analysis_obj.filename = filepath
+    CIU_File_IO.save_ciu_container(analysis_obj, filepath)
+    return filepath
+
+
+def interpolate_obj(analysis_obj, params_obj):
+    """
+    Interpolate an analysis object onto new axes using the interpolation parameters. As in the GUI,
+    the original raw data is reprocessed and interpolated to ensure a constant level of interpolation.
+    :param analysis_obj: CIUAnalysisObj to interpolate
+    :type analysis_obj: CIUAnalysisObj
+    :param params_obj: Parameters
+    :type params_obj: CIU_Params.Parameters
+    :return: new CIUAnalysisObj with interpolated data and axes
+    :raises: ValueError if the data cannot be interpolated with the requested mode
+    """
+    interp_cv = params_obj.interpolate_1_axis != 'drift time'
+    interp_dt = params_obj.interpolate_1_axis != 'collision voltage'
+
+    new_obj = Raw_Processing.process_raw_obj(analysis_obj.raw_obj, params_obj, short_filename=analysis_obj.short_filename)
+    new_axes = Raw_Processing.compute_new_axes(old_axes=new_obj.axes, interpolation_scaling=int(params_obj.interpolate_2_scaling), interp_cv=interp_cv, interp_dt=interp_dt)
+    if not params_obj.interpolate_3_onedim:
+        if len(new_obj.axes[0]) < 2 or len(new_obj.axes[1]) < 2:
+            raise ValueError('2D interpolation requires at least 2 bins in both activation and mobility axes')
+        new_obj = Raw_Processing.interpolate_axes(new_obj, new_axes)
+    else:
+        if interp_dt and interp_cv:
+            raise ValueError('1D interpolation can only be performed on one axis at a time')
+        elif interp_dt:
+            new_obj = Raw_Processing.interpolate_axis_1d(new_obj, interp_dt, new_axes[0])
+        else:
+            new_obj = Raw_Processing.interpolate_axis_1d(new_obj, interp_dt, new_axes[1])
+
+    # create a new analysis object to prevent unstable behavior with new axes
+    return CIUAnalysisObj(new_obj.raw_obj, new_obj.ciu_data, new_obj.axes, params_obj, short_filename=new_obj.short_filename)
+
+
+def run_file_stages(filepath, stages, params_dict, config):
+    """
+    Run the requested single-file stages on one file and save the result. Run in a separate process
+    for each file.
+    :param filepath: full path to input file (_raw.csv for 'process' stage, .ciu otherwise)
+    :param stages: list of stages to run (in order)
+    :param params_dict: parameter dictionary to use
+    :param config: PipelineConfig
+    :type config: PipelineConfig
+    :return: path to the saved .ciu file (or None if processing failed), combined output strings dict
+    """
+    params_obj = CIU_Params.Parameters()
+    params_obj.set_params(params_dict)
+    combined_outputs = {}
+    try:
+        if 'process' in stages:
+            raw_obj = Raw_Processing.get_data_fast(filepath)
+            analysis_obj = Raw_Processing.process_raw_obj(raw_obj, params_obj)
+        else:
+            analysis_obj = CIU_File_IO.load_analysis_file(filepath)
+        # record the parameters used in this run (replacing the object's previous parameters)
+        analysis_obj.params = params_obj
+
+        if 'smooth' in stages:
+            analysis_obj = Raw_Processing.smooth_main(analysis_obj, params_obj)
+            analysis_obj.refresh_data()
+        if 'crop' in stages:
+            crop_vals = config.crop_vals
+            analysis_obj = Raw_Processing.crop(analysis_obj, crop_vals)
+            analysis_obj.refresh_data()
+            analysis_obj.crop_vals = crop_vals
+        if 'interpolate' in stages:
+            analysis_obj = interpolate_obj(analysis_obj, params_obj)
+
+        if 'features' in stages:
+            if params_obj.feature_t1_1_ciu50_mode == 'gaussian':
+                if analysis_obj.gaussian_table is None:
+                    raise ValueError('Gaussian fitting has not been performed')
+                analysis_obj = Feature_Detection.feature_detect_gaussians(analysis_obj, params_obj)
+                features_list = analysis_obj.features_gaussian
+            else:
+                analysis_obj = Feature_Detection.feature_detect_col_max(analysis_obj, params_obj)
+                features_list = analysis_obj.features_changept
+            CIU_Plot_Service.submit_plot(params_obj, config.output_dir, Feature_Detection.plot_features, features_list, analysis_obj, params_obj, config.output_dir)
+            outputpath = os.path.join(config.output_dir, analysis_obj.short_filename + '_features.csv')
+            medians, cvs = Feature_Detection.save_features_main(features_list, outputpath, analysis_obj.short_filename, mode=params_obj.feature_t1_1_ciu50_mode, concise_mode=params_obj.feature_t2_7_ciu50_concise_outputs, combine=params_obj.feature_t2_6_ciu50_combine_outputs)
+            combined_outputs['features'] = (medians, cvs)
+
+        if 'ciu50' in stages:
+            gaussian_bool = params_obj.feature_t1_1_ciu50_mode == 'gaussian'
+            feature_list = analysis_obj.get_features(gaussian_bool)
+            if feature_list is None:
+                raise ValueError('Feature detection has not been performed in {} mode'.format(params_obj.feature_t1_1_ciu50_mode))
+            analysis_obj = Feature_Detection.ciu50_main(feature_list, analysis_obj, params_obj, outputdir=config.output_dir, gaussian_bool=gaussian_bool)
+            combined_outputs['ciu50'] = Feature_Detection.save_ciu50_outputs_main(analysis_obj, config.output_dir, params_obj.feature_t2_7_ciu50_concise_outputs, combine=params_obj.feature_t2_6_ciu50_combine_outputs)
+
+    except ValueError as err:
+        logger.error('File {} skipped: {}'.format(os.path.basename(filepath), ' '.join([str(x) for x in err.args])))
+        return None, combined_outputs
+
+    return save_batch_obj(analysis_obj, config.output_dir), combined_outputs
+
+
+def run_stages_parallel(files, stages, params_obj, config):
+    """
+    Run single-file stages across all files using a process pool
+    :param files: list of input file paths
+    :param stages: list of stages to run on each file
+    :param params_obj: Parameters
+    :type params_obj: CIU_Params.Parameters
+    :param config: PipelineConfig
+    :type config: PipelineConfig
+    :return: list of output .ciu paths (failed files removed), list of combined output dicts (in the same order)
+    """
+    num_cores = min(config.num_cores, len(files))
+    argslists = [[file, stages, params_obj.params_dict, config] for file in files]
+    if num_cores > 1:
+        with multiprocessing.Pool(processes=num_cores) as pool:
+            results = pool.starmap(run_file_stages, argslists)
+    else:
+        results = [run_file_stages(*argslist) for argslist in argslists]
+
+    output_files, combined_outputs = [], []
+    for output_file, outputs in results:
+        if output_file is not None:
+            output_files.append(output_file)
+            combined_outputs.append(outputs)
+    return output_files, combined_outputs
+
+
+def run_gaussian_stage(files, params_obj, config):
+    """
+    Run Gaussian fitting on all files. Gaussian_Fitting.main_gaussian_lmfit_wrapper handles
+    parallelization across files (using the gaussian_61_num_cores parameter).
+    :param files: list of .ciu file paths
+    :param params_obj: Parameters
+    :type params_obj: CIU_Params.Parameters
+    :param config: PipelineConfig
+    :type config: PipelineConfig
+    :return: list of output .ciu paths
+    """
+    ciu_objs = [CIU_File_IO.load_analysis_file(x) for x in files]
+    gauss_filenames = [x.short_filename for x in ciu_objs]
+    ciu_objs, all_output, all_file_gaussians = Gaussian_Fitting.main_gaussian_lmfit_wrapper(ciu_objs, params_obj, config.output_dir)
+
+    output_files = []
+    for analysis_obj in ciu_objs:
+        analysis_obj.params = params_obj
+        output_files.append(save_batch_obj(analysis_obj, config.output_dir))
+
+    if params_obj.gaussian_5_combine_outputs:
+        all_output += Gaussian_Fitting.print_combined_params(all_file_gaussians, gauss_filenames)
+        with open(os.path.join(config.output_dir, 'All_gaussians.csv'), 'w') as output:
+            output.write(all_output)
+    return output_files
+
+
+def save_combined_outputs(combined_outputs, params_obj, config):
+    """
+    Save the combined feature detection and CIU50 outputs from all files, if requested in parameters
+    :param combined_outputs: list of combined output dicts from run_stages_parallel
+    :param params_obj: Parameters
+    :type params_obj: CIU_Params.Parameters
+    :param config: PipelineConfig
+    :type config: PipelineConfig
+    :return: void
+    """
+    if not params_obj.feature_t2_6_ciu50_combine_outputs:
+        return
+    concise = params_obj.feature_t2_7_ciu50_concise_outputs == 'concise'
+
+    if 'features' in config.stages:
+        if concise:
+            output_meds = 'Feature Median Centroids\nFilename,Feature 1,Feature 2,Feature 3,(etc)\n'
+            output_cvs = 'Feature CV ranges\nFilename,Feature 1,Feature 2,Feature 3,(etc)\n'
+        else:
+            output_meds = 'Filename,Features Detected\n'
+            output_cvs = ''
+        for outputs in combined_outputs:
+            output_meds += outputs['features'][0]
+            output_cvs += outputs['features'][1]
+        with open(os.path.join(config.output_dir, 'All-features.csv'), 'w') as output:
+            output.write(output_meds + output_cvs)
+
+    if 'ciu50' in config.stages:
+        all_outputs = 'Filename,CIU50 1,CIU50 2,(etc)\n' if concise else ''
+        for outputs in combined_outputs:
+            all_outputs += outputs['ciu50']
+        with open(os.path.join(config.output_dir, 'All_ciu50s.csv'), 'w') as output:
+            output.write(all_outputs)
+
+
+def run_classification_stage(files, params_obj, config):
+    """
+    Build a classification scheme from the processed files, sorting files into classes (and states)
+    by matching the configured labels against filenames.
+    :param files: list of .ciu file paths
+    :param params_obj: Parameters
+    :type params_obj: CIU_Params.Parameters
+    :param config: PipelineConfig
+    :type config: PipelineConfig
+    :return: void
+    """
+    # make sure required fitting results are present (checked from the file index to avoid loading files)
+    required_stage = {'Gaussian_Feat': 'feature_detect_gaussian', 'Gaussian_Raw': 'gaussian_fitting'}.get(params_obj.classif_1_input_mode)
+    if required_stage is not None:
+        for file, index_entry in zip(files, CIU_File_IO.get_index_entries(files)):
+            if required_stage not in index_entry['stages']:
+                logger.error('File {} does not have results required for {} classification. Classification canceled.'.format(os.path.basename(file), params_obj.classif_1_input_mode))
+                return
+
+    cl_inputs_by_label = Classification.load_classif_inputs_from_files(files, config.class_labels, config.subclass_labels)
+    if not Classification.check_classif_data(cl_inputs_by_label, config.subclass_labels):
+        return
+    cl_inputs_by_label, equalized_axes, fingerprint_stack = Raw_Processing.equalize_axes_2d_list_subclass(cl_inputs_by_label)
+
+    scheme = Classification.main_build_classification_new(cl_inputs_by_label, config.subclass_labels, params_obj, config.output_dir, manual_feat_select=False, fingerprint_stack=fingerprint_stack)
+    scheme.final_axis_cropvals = equalized_axes
+    Classification.save_scheme(scheme, config.output_dir, config.subclass_labels)
+
+
+def run_cluster_stage(files, params_obj, config):
+    """
+    Cluster all files by RMSD after equalizing their axes
+    :param files: list of .ciu file paths
+    :param params_obj: Parameters
+    :type params_obj: CIU_Params.Parameters
+    :param config: PipelineConfig
+    :type config: PipelineConfig
+    :return: void
+    """
+    ciu_objs = [CIU_File_IO.load_analysis_file(x) for x in files]
+    ciu_objs, equalized_axes, adjust_flag, fingerprint_stack = Raw_Processing.equalize_axes_main(ciu_objs)
+    if adjust_flag:
+        logger.info('Axes were not identical in all files and were adjusted for clustering')
+    RMSD_Clustering.cluster_fingerprints(fingerprint_stack, params_obj, config.output_dir)
+
+
+def run_pipeline(config, params_obj):
+    """
+    Run all requested stages of the pipeline over the input files
+    :param config: PipelineConfig
+    :type config: PipelineConfig
+    :param params_obj: Parameters
+    :type params_obj: CIU_Params.Parameters
+    :return: list of final .ciu file paths
+    """
+    files = find_input_files(config)
+    if len(files) == 0:
+        logger.error('No input files found in folder(s): {}'.format(','.join(config.input_dirs)))
+        return []
+    if not os.path.exists(config.output_dir):
+        os.makedirs(config.output_dir)
+    logger.info('Running stages {} on {} files'.format(','.join(config.stages), len(files)))
+
+    pre_stages = [x for x in config.stages if x in PRE_GAUSSIAN_STAGES]
+    if len(pre_stages) > 0:
+        files, _ = run_stages_parallel(files, pre_stages, params_obj, config)
+
+    if 'gaussian' in config.stages:
+        logger.info('Starting Gaussian fitting on {} files'.format(len(files)))
+        files = run_gaussian_stage(files, params_obj, config)
+
+    post_stages = [x for x in config.stages if x in POST_GAUSSIAN_STAGES]
+    if len(post_stages) > 0:
+        files, combined_outputs = run_stages_parallel(files, post_stages, params_obj, config)
+        save_combined_outputs(combined_outputs, params_obj, config)
+
+    # files are saved from parallel processes, so update the output directory index once all are done
+    CIU_File_IO.get_index_entries(files)
+
+    if 'classify' in config.stages:
+        logger.info('Starting classification')
+        run_classification_stage(files, params_obj, config)
+
+    if 'cluster' in config.stages:
+        logger.info('Starting RMSD clustering')
+        run_cluster_stage(files, params_obj, config)
+
+    if 'library_search' in config.stages:
+        logger.info('Searching reference library')
+        Reference_Library.search_library([CIU_File_IO.load_analysis_file(x) for x in files], params_obj, config.library_dir, config.output_dir)
+
+    if 'library_add' in config.stages:
+        Reference_Library.add_to_library([CIU_File_IO.load_analysis_file(x) for x in files], params_obj, config.library_dir)
+
+    # finish any plots still being rendered in the background before returning
+    CIU_Plot_Service.wait_for_plots()
+    if 'plots' in config.stages:
+        logger.info('Rendering deferred plots')
+        CIU_Plot_Service.render_deferred_plots(config.output_dir, CIU_Plot_Service.get_num_render_processes(params_obj))
+
+    logger.info('Pipeline finished: {} files processed'.format(len(files)))
+    return files
+
+
+def init_batch_logs():
+    """
+    Log info and above to the console for command line runs
+    :return: logger
+    """
+    mylogger = logging.getLogger('main')
+    if mylogger.hasHandlers():
+        mylogger.handlers.clear()
+    console_handler = logging.StreamHandler()
+    console_handler.setLevel(logging.INFO)
+    console_handler.setFormatter(logging.Formatter('%(asctime)s - %(levelname)s - %(message)s', datefmt='%Y-%m-%d %H:%M:%S'))
+    mylogger.addHandler(console_handler)
+    mylogger.setLevel(logging.INFO)
+    mylogger.propagate = False
+    return mylogger
+
+
+if __name__ == '__main__':
+    multiprocessing.freeze_support()
+    if len(sys.argv) != 3:
+        print(__doc__)
+        sys.exit(1)
+
+    init_batch_logs()
+    main_config = parse_pipeline_config(sys.argv[1])
+    main_params = CIU_Params.Parameters()
+    main_params.set_params(CIU_Params.parse_params_file_newcsv(sys.argv[2]))
+    run_pipeline(main_config, main_params)
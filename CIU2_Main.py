@@ -42,7 +42,6 @@ from tkinter import simpledialog
 from tkinter import messagebox
 import os
 import subprocess
-import pickle
 import multiprocessing
 import logging
 from logging.handlers import RotatingFileHandler
@@ -54,12 +53,16 @@ import Gaussian_Fitting
 import Feature_Detection
 import Classification
 import Raw_Data_Import
+import CIU_File_IO
+import CIU_Plot_Service
 import SimpleToolTip
 
 import matplotlib
 matplotlib.rcParams.update({'figure.autolayout': True})
 matplotlib.use('Agg')
 
+logger = logging.getLogger('main')
+
 
 # hard_params_file = os.path.join(program_data_dir, 'CIU2_param_info_new.csv')
 hard_params_file = os.path.join(program_data_dir, 'CIU2_param_info.csv')
@@ -147,6 +150,8 @@ class CIUSuite2(object):
         Close (destroy) the app window and the Tkinter root window to stop the process.
         :return: void
         """
+        Gaussian_Fitting.close_fitting_pool()
+        CIU_Plot_Service.close_render_pool()
         self.mainwindow.destroy()
         self.tk_root.destroy()
 
@@ -234,7 +239,7 @@ class CIUSuite2(object):
                 analysis_filenames = []
                 for raw_file in raw_filepaths:
                     try:
-                        raw_obj = Raw_Processing.get_data(raw_file)
+                        raw_obj = Raw_Processing.get_data_fast(raw_file)
                     except ValueError as err:
                         messagebox.showerror('Data Import Error', message='{}{}. \nProblem: {}. Press OK to continue'.format(*err.args))
                         continue
@@ -453,7 +458,7 @@ class CIUSuite2(object):
             updated_filelist = []
             for analysis_file in files_to_read:
                 analysis_obj = load_analysis_obj(analysis_file)
-                Original_CIU.ciu_plot(analysis_obj, self.params_obj, self.output_dir)
+                CIU_Plot_Service.submit_plot(self.params_obj, self.output_dir, Original_CIU.ciu_plot, analysis_obj, self.params_obj, self.output_dir)
                 self.update_progress(files_to_read.index(analysis_file), len(files_to_read))
 
                 # save analysis obj to ensure that parameter changes are noted correctly
@@ -490,21 +495,19 @@ class CIUSuite2(object):
                 compare_objs = [load_analysis_obj(file) for file in newfiles]
                 all_objs = [std_obj]
                 all_objs.extend(compare_objs)
-                all_objs = check_axes_and_warn(all_objs)
+                all_objs, fingerprint_stack = check_axes_and_warn(all_objs)
                 if len(all_objs) < 2:
                     logger.warning('Not enough files for comparison. Make sure axes overlap at least partially.')
+                elif all_objs[0] is not std_obj:
+                    logger.warning('Standard file {} could not be compared. Make sure its axes overlap the other files at least partially.'.format(std_obj.short_filename))
                 else:
-                    # compare each CIU analysis object against the standard
-                    index = 0
+                    # compare each CIU analysis object against the standard (first in the stack)
                     updated_filelist = []
-                    for compare_obj in compare_objs:
-                        rmsd = Original_CIU.compare_basic_raw(std_obj, compare_obj, self.params_obj, self.output_dir)
-                        printstring = '{},{},{:.2f}'.format(std_obj.short_filename,
-                                                            compare_obj.short_filename,
-                                                            rmsd)
+                    names = fingerprint_stack.names
+                    for compare_index, rmsd in Original_CIU.compare_to_standard(fingerprint_stack, self.params_obj, self.output_dir):
+                        printstring = '{},{},{:.2f}'.format(names[0], names[compare_index], rmsd)
                         rmsd_print_list.append(printstring)
-                        index += 1
-                        self.update_progress(compare_objs.index(compare_obj), len(compare_objs))
+                    self.update_progress(len(compare_objs), len(compare_objs))
 
                     # save analysis objs to ensure that parameter changes are noted correctly
                     for analysis_obj in all_objs:
@@ -524,7 +527,7 @@ class CIUSuite2(object):
             if param_success:
                 ciu1 = load_analysis_obj(files_to_read[0])
                 ciu2 = load_analysis_obj(files_to_read[1])
-                updated_obj_list = check_axes_and_warn([ciu1, ciu2])
+                updated_obj_list, fingerprint_stack = check_axes_and_warn([ciu1, ciu2])
                 if len(updated_obj_list) < 2:
                     logger.warning('Not enough files for comparison. Make sure axes overlap at least partially.')
                 else:
@@ -538,53 +541,23 @@ class CIUSuite2(object):
                     self.display_analysis_files(updated_filelist)
 
         elif len(files_to_read) > 2:
-            param_keys = [x for x in self.params_obj.params_dict.keys() if 'compare_' in x]
+            param_keys = [x for x in self.params_obj.params_dict.keys() if 'compare_' in x or 'cluster_' in x]
             param_success, param_dict = self.run_param_ui('Plot parameters', param_keys)
             if param_success:
-                rmsd_print_list = ['File 1, File 2, RMSD (%)']
                 # batch compare - compare all against all.
-                f1_index = 0
                 loaded_files = [load_analysis_obj(x) for x in files_to_read]
-                loaded_files = check_axes_and_warn(loaded_files)
+                loaded_files, fingerprint_stack = check_axes_and_warn(loaded_files)
                 if len(loaded_files) < 2:
                     logger.warning('Not enough files for comparison. Make sure axes overlap at least partially.')
                 else:
+                    Original_CIU.batch_compare_all(fingerprint_stack, self.params_obj, self.output_dir)
+
                     updated_filelist = []
                     for analysis_obj in loaded_files:
-                        # don't compare the file against itself
-                        skip_index = loaded_files.index(analysis_obj)
-                        f2_index = 0
-                        while f2_index < len(loaded_files):
-                            # skip either comparisons to self or reverse and self comparisons depending on parameter
-                            if self.params_obj.compare_batch_1_both_dirs:
-                                if f2_index == skip_index:
-                                    f2_index += 1
-                                    continue
-                            else:
-                                # skip reverse and self comparisons
-                                if f2_index >= f1_index:
-                                    f2_index += 1
-                                    continue
-
-                            ciu1 = analysis_obj
-                            ciu2 = loaded_files[f2_index]
-                            rmsd = Original_CIU.compare_basic_raw(ciu1, ciu2, self.params_obj, self.output_dir)
-
-                            printstring = '{},{},{:.2f}'.format(ciu1.short_filename, ciu2.short_filename, rmsd)
-                            rmsd_print_list.append(printstring)
-                            f2_index += 1
-
                         filename = save_analysis_obj(analysis_obj, param_dict, outputdir=self.output_dir)
                         updated_filelist.append(filename)
-
-                        f1_index += 1
                         self.update_progress(loaded_files.index(analysis_obj), len(loaded_files))
                     self.display_analysis_files(updated_filelist)
-
-                    # print output to csv
-                    with open(os.path.join(self.output_dir, 'batch_RMSDs.csv'), 'w') as rmsd_file:
-                        for rmsd_string in rmsd_print_list:
-                            rmsd_file.write(rmsd_string + '\n')
         self.progress_done()
 
     def on_button_smoothing_clicked(self):
@@ -629,12 +602,28 @@ class CIUSuite2(object):
 
         self.progress_started()
 
-        # Check that axes are the same across objects
-        analysis_obj_list = [load_analysis_obj(x) for x in files_to_read]
-        analysis_obj_list = check_axes_and_warn(analysis_obj_list)
+        if self.params_obj.average_1_streaming:
+            # load and average one file at a time
+            try:
+                averaged_obj, std_data, accumulator, adjust_flag = Original_CIU.average_ciu_streaming(files_to_read, self.params_obj)
+            except ValueError as err:
+                messagebox.showerror('Averaging Failed', message='{}. {}'.format(*err.args))
+                self.progress_done()
+                return
+            if adjust_flag:
+                messagebox.showinfo('Different axes in file(s)', 'FYI: At least some of the loaded files had different axes and/or unevely spaced axes. '
+                                                                 'Data was interpolated and/or re-framed onto identical, evenly spaced axes. '
+                                                                 'Please click OK to continue.')
+            input_names, pairwise_rmsds, rmsd_strings = accumulator.names, accumulator.rmsds, accumulator.rmsd_strings
+        else:
+            # Check that axes are the same across objects
+            analysis_obj_list = [load_analysis_obj(x) for x in files_to_read]
+            analysis_obj_list, fingerprint_stack = check_axes_and_warn(analysis_obj_list)
 
-        # Compute averaged CIU data and generate output plots
-        averaged_obj, std_data = Original_CIU.average_ciu(analysis_obj_list)
+            # Compute averaged CIU data and pairwise RMSDs
+            averaged_obj, std_data = Original_CIU.average_ciu(analysis_obj_list, fingerprint_stack)
+            input_names = [x.short_filename for x in analysis_obj_list]
+            pairwise_rmsds, rmsd_strings = Original_CIU.get_pairwise_rmsds(analysis_obj_list, self.params_obj, fingerprint_stack)
 
         # Save averaged object as a .ciu file and write the new average Raw data to _raw.csv text file
         averaged_obj.filename = save_analysis_obj(averaged_obj, {}, self.output_dir)
@@ -643,10 +632,9 @@ class CIUSuite2(object):
         Original_CIU.write_ciu_csv(avg_raw_path, averaged_obj.raw_obj.rawdata, [averaged_obj.raw_obj.dt_axis, averaged_obj.raw_obj.cv_axis])
 
         # plot averaged object and standard deviation and save output average CSV file
-        pairwise_rmsds, rmsd_strings = Original_CIU.get_pairwise_rmsds(analysis_obj_list, self.params_obj)
-        Original_CIU.ciu_plot(averaged_obj, self.params_obj, self.output_dir)
-        Original_CIU.std_dev_plot(averaged_obj, std_data, pairwise_rmsds, self.params_obj, self.output_dir)
-        Original_CIU.save_avg_rmsd_data(analysis_obj_list, self.params_obj, averaged_obj.short_filename, self.output_dir)
+        CIU_Plot_Service.submit_plot(self.params_obj, self.output_dir, Original_CIU.ciu_plot, averaged_obj, self.params_obj, self.output_dir)
+        CIU_Plot_Service.submit_plot(self.params_obj, self.output_dir, Original_CIU.std_dev_plot, averaged_obj, std_data, pairwise_rmsds, self.params_obj, self.output_dir)
+        Original_CIU.write_avg_rmsd_data(input_names, pairwise_rmsds, rmsd_strings, averaged_obj.short_filename, self.output_dir)
 
         self.display_analysis_files([averaged_obj.filename])
         self.progress_done()
@@ -661,16 +649,13 @@ class CIUSuite2(object):
         if len(self.analysis_file_list) > 0:
             # check axes for equality and interpolate if different
             files_to_read = self.check_file_range_entries()
-            loaded_files = [load_analysis_obj(x) for x in files_to_read]
 
             # Warn user if any files have features or Gaussians, as these will be erased by cropping
-            warned_yet_flag = False
-            for quick_obj in loaded_files:
-                if quick_obj.features_changept is not None or quick_obj.raw_protein_gaussians is not None or quick_obj.features_gaussian is not None:
-                    if not warned_yet_flag:
-                        messagebox.showwarning('Processing Results will be Erased', 'All processing results (feature detection, Gaussian fitting, etc.) are erased when cropping files to prevent axes errors. If you do not want this, press cancel on the next screen.')
-                        warned_yet_flag = True
+            index_entries = CIU_File_IO.get_index_entries(files_to_read)
+            if any(CIU_File_IO.has_erasable_results(x) for x in index_entries):
+                messagebox.showwarning('Processing Results will be Erased', 'All processing results (feature detection, Gaussian fitting, etc.) are erased when cropping files to prevent axes errors. If you do not want this, press cancel on the next screen.')
 
+            loaded_files = [load_analysis_obj(x) for x in files_to_read]
             crop_vals = Raw_Processing.run_crop_ui(loaded_files[0].axes, hard_crop_ui)
             if crop_vals is None:
                 # user hit cancel, or no values were provided
@@ -705,13 +690,9 @@ class CIUSuite2(object):
 
             # Warn user if any files have features or Gaussians, as these will be erased by cropping
             files_to_read = self.check_file_range_entries()
-            loaded_files = [load_analysis_obj(x) for x in files_to_read]
-            warned_yet_flag = False
-            for quick_obj in loaded_files:
-                if quick_obj.features_changept is not None or quick_obj.raw_protein_gaussians is not None or quick_obj.features_gaussian is not None:
-                    if not warned_yet_flag:
-                        messagebox.showwarning('Processing Results will be Erased', 'All processing results (feature detection, Gaussian fitting, etc.) are erased when cropping files to prevent axes errors. If you do not want this, press cancel on the next screen.')
-                        warned_yet_flag = True
+            index_entries = CIU_File_IO.get_index_entries(files_to_read)
+            if any(CIU_File_IO.has_erasable_results(x) for x in index_entries):
+                messagebox.showwarning('Processing Results will be Erased', 'All processing results (feature detection, Gaussian fitting, etc.) are erased when cropping files to prevent axes errors. If you do not want this, press cancel on the next screen.')
 
             # interpolation parameters
             param_keys = [x for x in self.params_obj.params_dict.keys() if 'interpolate' in x]
@@ -864,7 +845,8 @@ class CIUSuite2(object):
                     for template_file in template_files:
                         # load Gaussian information and generate a CIUAnalysisObj
                         gaussians_by_cv, axes = Gaussian_Fitting.parse_gaussian_list_from_file(template_file)
-                        new_analysis_obj = Gaussian_Fitting.reconstruct_from_fits(gaussians_by_cv, axes, os.path.basename(template_file).rstrip('.csv'), self.params_obj)
+                        gaussian_table = Gaussian_Fitting.GaussianTable.from_gaussian_lists(gaussians_by_cv, axes[1])
+                        new_analysis_obj = Gaussian_Fitting.reconstruct_from_fits(gaussian_table, axes, os.path.basename(template_file).rstrip('.csv'), self.params_obj)
                         filename = save_analysis_obj(new_analysis_obj, param_dict, outputdir=self.output_dir)
 
                         # also save an _raw.csv file with the generated data
@@ -882,15 +864,16 @@ class CIUSuite2(object):
                     analysis_obj = load_analysis_obj(file)
 
                     # check to make sure the analysis_obj has Gaussian data fitted
-                    if analysis_obj.feat_protein_gaussians is None:
+                    if analysis_obj.feat_gaussian_table is None:
                         messagebox.showerror('Gaussian feature detection required', 'Data in file {} does not have Gaussian feature detection performed. Please run Gaussian feature detection, then try again.')
                         break
 
                     # If gaussian data exists, perform the analysis
-                    final_gausslists, final_axes = Gaussian_Fitting.check_recon_for_crop(analysis_obj.feat_protein_gaussians, analysis_obj.axes)
+                    feat_table = analysis_obj.feat_gaussian_table
+                    final_table, final_axes = Gaussian_Fitting.check_recon_for_crop(feat_table, analysis_obj.axes)
 
                     # Save a new analysis object constructed from the fits. NOTE: saves previous objects parameter information for reference
-                    new_obj = Gaussian_Fitting.reconstruct_from_fits(final_gausslists, final_axes, analysis_obj.short_filename, analysis_obj.params)
+                    new_obj = Gaussian_Fitting.reconstruct_from_fits(final_table, final_axes, analysis_obj.short_filename, analysis_obj.params)
                     filename = save_analysis_obj(new_obj, param_dict, outputdir=self.output_dir)
 
                     # also save an _raw.csv file with the generated data
@@ -942,7 +925,7 @@ class CIUSuite2(object):
                     if self.params_obj.feature_t1_1_ciu50_mode == 'gaussian':
                         # GAUSSIAN MODE
                         # check to make sure the analysis_obj has Gaussian data fitted if needed
-                        if analysis_obj.raw_protein_gaussians is None:
+                        if analysis_obj.gaussian_table is None:
                             messagebox.showwarning('Gaussian fitting required', 'Data in file {} does not have Gaussian fitting'
                                                                                 'performed. Please run Gaussian fitting, then try '
                                                                                 'again.'.format(analysis_obj.short_filename))
@@ -965,7 +948,7 @@ class CIUSuite2(object):
                         new_file_list.append(filename)
 
                     # save output
-                    Feature_Detection.plot_features(features_list, analysis_obj, self.params_obj, self.output_dir)
+                    CIU_Plot_Service.submit_plot(self.params_obj, self.output_dir, Feature_Detection.plot_features, features_list, analysis_obj, self.params_obj, self.output_dir)
                     outputpath = os.path.join(self.output_dir, analysis_obj.short_filename + '_features.csv')
                     medians, cvs = Feature_Detection.save_features_main(features_list, outputpath, analysis_obj.short_filename, mode=self.params_obj.feature_t1_1_ciu50_mode, concise_mode=self.params_obj.feature_t2_7_ciu50_concise_outputs, combine=self.params_obj.feature_t2_6_ciu50_combine_outputs)
 
@@ -1102,15 +1085,16 @@ class CIUSuite2(object):
                     self.output_dir = os.path.dirname(template_file)
 
             # Once data has been loaded, check it (appropriate number of classes, files, subclasses, etc)
-            if check_classif_data(cl_inputs_by_label, subclass_labels):
+            if Classification.check_classif_data(cl_inputs_by_label, subclass_labels):
                 # check axes
                 try:
-                    cl_inputs_by_label, equalized_axes = Raw_Processing.equalize_axes_2d_list_subclass(cl_inputs_by_label)
+                    cl_inputs_by_label, equalized_axes, fingerprint_stack = Raw_Processing.equalize_axes_2d_list_subclass(cl_inputs_by_label)
                 except ValueError as err:
                     # axes equalization failed - don't attempt to classify
                     messagebox.showerror('Axes Could Not Be Equalized',
                                          message='{}. \nProblem: {}. Classification canceled. Make sure training data axes have at least some overlap for all files. Press OK to continue'.format(*err.args))
                     equalized_axes = []
+                    fingerprint_stack = None
                     self.progress_done()
 
                 # get classification parameters
@@ -1129,7 +1113,7 @@ class CIUSuite2(object):
 
                     # Run the classification for all input modes
                     self.progress_print_text('Classification in progress (may take a few minutes - see console for progress)...', 50)
-                    scheme = Classification.main_build_classification_new(cl_inputs_by_label, subclass_labels, self.params_obj, self.output_dir, manual_select)
+                    scheme = Classification.main_build_classification_new(cl_inputs_by_label, subclass_labels, self.params_obj, self.output_dir, manual_select, fingerprint_stack)
                     scheme.final_axis_cropvals = equalized_axes
                     Classification.save_scheme(scheme, self.output_dir, subclass_labels)
 
@@ -1152,7 +1136,7 @@ class CIUSuite2(object):
                 subclass_labels = scheme.get_subclass_labels()
 
                 files_to_read = self.check_file_range_entries()
-                replicate_inputs = load_clinputs_subclass(files_to_read, subclass_labels, class_label='unk')
+                replicate_inputs = Classification.load_clinputs_subclass(files_to_read, subclass_labels, class_label='unk')
 
                 if len(replicate_inputs) > 0:
                     # ensure Gaussian features are present if requested
@@ -1231,7 +1215,7 @@ class CIUSuite2(object):
             subclass_labels = ['0']
 
         # Actually load files
-        cl_inputs_by_label = load_classif_inputs_from_files(files_to_read, class_labels, subclass_labels)
+        cl_inputs_by_label = Classification.load_classif_inputs_from_files(files_to_read, class_labels, subclass_labels)
 
         return cl_inputs_by_label, subclass_labels, class_labels
 
@@ -1244,8 +1228,9 @@ class CIUSuite2(object):
         mismatched_files = []
         file_index = 1
         for file in self.analysis_file_list:
-            analysis_obj = load_analysis_obj(file)
-            if not analysis_obj.params.compare(self.params_obj):
+            # only the parameters are read from binary .ciu files rather than loading the full object
+            file_params = CIU_File_IO.load_params(file)
+            if not file_params.compare(self.params_obj):
                 # parameters don't match, add to list
                 mismatched_files.append(file_index)
             file_index += 1
@@ -1500,16 +1485,16 @@ def check_axes_and_warn(loaded_obj_list):
     if not.
     :param loaded_obj_list: list of loaded objects
     :type loaded_obj_list: list[CIUAnalysisObj]
-    :return: updated list of objects with axes equalized
-    :rtype list[CIUAnalysisObj]
+    :return: updated list of objects with axes equalized, FingerprintStack of the equalized data
+    :rtype list[CIUAnalysisObj], FingerprintStack
     """
-    loaded_obj_list, final_axes, adjust_flag = Raw_Processing.equalize_axes_main(loaded_obj_list)
+    loaded_obj_list, final_axes, adjust_flag, fingerprint_stack = Raw_Processing.equalize_axes_main(loaded_obj_list)
 
     if adjust_flag:
         messagebox.showinfo('Different axes in file(s)', 'FYI: At least some of the loaded files had different axes and/or unevely spaced axes. '
                                                          'Data was interpolated and/or re-framed onto identical, evenly spaced axes. '
                                                          'Please click OK to continue.')
-    return loaded_obj_list
+    return loaded_obj_list, fingerprint_stack
 
 
 def parse_user_cvfeats_input():
@@ -1603,7 +1588,7 @@ def classif_dialogs_run(subclass_labels=None):
 
         if subclass_labels is not None:
             # generate replicates by subclass
-            input_list = load_clinputs_subclass(files, subclass_labels, class_label)
+            input_list = Classification.load_clinputs_subclass(files, subclass_labels, class_label)
             output_dir_file = os.path.dirname(files[0])
             if len(input_list) < 3:
                 messagebox.showerror('Not Enough State Files', 'Not enough replicates could be generated containing all states. Make sure all there are at least 3 CIU files for each state and check that the files selected exactly match the entered state labels.')
@@ -1614,8 +1599,7 @@ def classif_dialogs_run(subclass_labels=None):
             output_dir_file = os.path.dirname(files[0])
             for file in files:
                 subclass_dict = {}
-                with open(file, 'rb') as analysis_file:
-                    obj = pickle.load(analysis_file)
+                obj = load_analysis_obj(file)
                 subclass_dict['0'] = obj
                 cl_input = Classification.ClInput(class_label, subclass_dict)
                 input_list.append(cl_input)
@@ -1625,137 +1609,6 @@ def classif_dialogs_run(subclass_labels=None):
     return class_labels, clinput_lists_by_label, output_dir_file
 
 
-def load_classif_inputs_from_files(files, class_labels, subclass_labels):
-    """
-    Helper method for generating a sorted list of lists of ClInputs by class label from files
-    and labels. Used in both loading from table and template.
-    :param files: list of file paths (strings) to load data from
-    :param class_labels: list of strings. Each will be searched against the filenames to sort by class
-    :param subclass_labels: list of strings. Each will be searched against the filenames to sort by subclass
-    :return: list of lists of ClInputs by class label
-    :rtype: list[list[Classification.ClInput]]
-    """
-    cl_inputs_by_label = []
-
-    # Generate class oriented files for crossval/classification
-    for class_label in class_labels:
-        class_files = [x for x in files if class_label in x]
-
-        # generate dictionary of all subclass data
-        subclass_lists = []
-        if '0' in subclass_labels and len(subclass_labels) == 1:
-            # No subclasses in this analysis - use all class files with default subclass label
-            subclass_lists.append(('0', class_files))
-        else:
-            for subclass_label in subclass_labels:
-                subclass_files = [x for x in class_files if subclass_label in x]
-                subclass_lists.append((subclass_label, subclass_files))
-
-        # reorganize files into individual replicates, each containing all subclasses
-        all_replicates = []
-        for rep_index in range(len(subclass_lists[0][1])):
-            try:
-                subclass_dict = {}
-                for subclass_tup in subclass_lists:
-                    subclass_label = subclass_tup[0]
-                    subclass_files = subclass_tup[1]
-                    subclass_obj = load_analysis_obj(subclass_files[rep_index])
-                    subclass_dict[subclass_label] = subclass_obj
-                cl_input = Classification.ClInput(class_label, subclass_dict)
-                all_replicates.append(cl_input)
-            except IndexError:
-                # not an even number of replicates in all files - stop once reached max number in smallest subclass
-                logger.info('Not all states had {} replicates. Only {} replicates generated.'.format(rep_index + 1, rep_index))
-                break
-        cl_inputs_by_label.append(all_replicates)
-    return cl_inputs_by_label
-
-
-def load_clinputs_subclass(files, subclass_labels, class_label):
-    """
-    Analogue to load_classif_inputs_from_files, except used to load subclass replicate data rather
-    than replicates delineated by classes. Sorts input data into replicates by subclass label (if
-    provided) or containers without subclass info if not.
-    :param files: list of file paths to raw data
-    :param subclass_labels: list of strings corresponding to subclass labels (or ['0'] if not using subclass mode)
-    :param class_label: class label (string) for the inputs. Use 'unk' for unknowns
-    :return: list of ClInputs
-    :rtype: list[Classification.ClInput]
-    """
-    # Generate lists of all subclass data (if using subclass mode)
-    subclass_lists = []
-    if '0' in subclass_labels and len(subclass_labels) == 1:
-        # No subclasses in this analysis - use all class files with default subclass label
-        subclass_lists.append(('0', files))
-    else:
-        for subclass_label in subclass_labels:
-            subclass_files = [x for x in files if subclass_label in x]
-            subclass_lists.append((subclass_label, subclass_files))
-
-    # reorganize files into individual replicates, each containing all subclasses
-    all_replicates = []
-    if len(subclass_lists[0][1]) == 0:
-        logger.warning('State {} did not have any datasets! No replicates could be generated.'.format(subclass_lists[0][0]))
-    for rep_index in range(len(subclass_lists[0][1])):
-        subclass_label = ''
-        try:
-            subclass_dict = {}
-            for subclass_tup in subclass_lists:
-                subclass_label = subclass_tup[0]
-                subclass_files = subclass_tup[1]
-                subclass_obj = load_analysis_obj(subclass_files[rep_index])
-                subclass_dict[subclass_label] = subclass_obj
-            cl_input = Classification.ClInput(class_label, subclass_dict)
-            all_replicates.append(cl_input)
-        except IndexError:
-            # not an even number of replicates in all files - skip odd numbers
-            logger.info('State {} did not have {} datasets. Only {} replicates generated.'.format(subclass_label, rep_index + 1, rep_index))
-            break
-    return all_replicates
-
-
-def check_classif_data(cl_inputs_by_label, subclass_labels):
-    """
-    Check that a set of classification data is organized correctly. It must have at least 2 classes
-    with at least 2 replicates each. All replicates must also have the same number of subclasses.
-    :param cl_inputs_by_label: organized list of ClInputs by label
-    :type cl_inputs_by_label: list[list[Classification.ClInput]]
-    :param subclass_labels: list of subclass labels
-    :return: boolean - True if all good, False if any errors
-    """
-    if len(cl_inputs_by_label) > 1:
-        # check each input list
-        for class_list in cl_inputs_by_label:
-            if len(class_list) < 3:
-                # not enough replicates! return false
-                try:
-                    class_label = class_list[0].class_label
-                except IndexError:
-                    class_label = '(No data in class)'
-                logger.error('Only {} replicates in class {}. At least 3 are required for each class. Classification canceled.'.format(len(class_list), class_label))
-                return False
-
-            # make sure all replicates have same subclasses
-            for cl_input in class_list:
-                subclass_len = len(cl_input.subclass_dict.keys())
-                if not subclass_len == len(subclass_labels):
-                    # if '0' not in cl_input.subclass_dict.keys() and subclass_len == 1:
-                    # not correct number of subclasses
-                    logger.error('Should have {} states, but replicate had {}. Check input data and try again.'.format(len(cl_input.subclass_dict.keys()), len(subclass_labels)))
-                    return False
-                for subclass_label in cl_input.subclass_dict.keys():
-                    if subclass_label not in subclass_labels:
-                        logger.error('State label {} was not supposed to be present! Classification canceled'.format(subclass_label))
-                        return False
-
-        # no errors - return True
-        return True
-    else:
-        # no data (or only one class) loaded! return false
-        logger.error('Only {} complete classes; at least 2 are required. Classification canceled.'.format(len(cl_inputs_by_label)))
-        return False
-
-
 def check_classif_data_gaussians(flat_clinput_list, gaussian_mode, max_gaussians_unk=None):
     """
     Ensure that all provided CIU analyses have Gaussian features fitted prior to attempting to
@@ -1769,7 +1622,7 @@ def check_classif_data_gaussians(flat_clinput_list, gaussian_mode, max_gaussians
     for cl_input in flat_clinput_list:
         for subclass, analysis_obj in cl_input.subclass_dict.items():
             if gaussian_mode == 'Gaussian_Feat':
-                if analysis_obj.feat_protein_gaussians is None:
+                if analysis_obj.feat_gaussian_table is None:
                     messagebox.showerror('No Gaussian Features Fitted',
                                          'Error: No Gaussian Features in file: {} . Gaussian Feature classification selected, '
                                          'but Gaussian Feature Detection has not been performed yet. '
@@ -1777,7 +1630,7 @@ def check_classif_data_gaussians(flat_clinput_list, gaussian_mode, max_gaussians
                                          ' and try again.'.format(analysis_obj.short_filename))
                     return False
             elif gaussian_mode == 'Gaussian_Raw':
-                if analysis_obj.raw_protein_gaussians is None:
+                if analysis_obj.gaussian_table is None:
                     messagebox.showerror('No Gaussians Fitted',
                                          'Error: No Gaussians in file: {} . Gaussian Raw classification selected, '
                                          'but Gaussian Fitting has not been performed yet. '
@@ -1854,7 +1707,7 @@ def parse_classification_template(template_file):
                     return [], []
                 if len(subclass_labels) == 0:
                     subclass_labels = ['0']
-                cl_inputs_by_label = load_classif_inputs_from_files(files, class_labels, subclass_labels)
+                cl_inputs_by_label = Classification.load_classif_inputs_from_files(files, class_labels, subclass_labels)
             else:
                 # non-standard line - ignore
                 continue
@@ -1865,7 +1718,7 @@ def parse_classification_template(template_file):
 
 def save_analysis_obj(analysis_obj, params_dict, outputdir, filename_append=''):
     """
-    Pickle the CIUAnalysisObj for later retrieval
+    Save the CIUAnalysisObj to a .ciu file for later retrieval and record it in the directory index
     :param analysis_obj: CIUAnalysisObj to save
     :type analysis_obj: CIUAnalysisObj
     :param params_dict: Dict with specific params to update in the analysis object's parameters object.
@@ -1896,11 +1749,16 @@ def save_analysis_obj(analysis_obj, params_dict, outputdir, filename_append=''):
 
     # Save the .ciu file and return the final filename
     try:
-        with open(picklefile, 'wb') as pkfile:
-            # wait to set final filename to here to avoid setting it if the save operation fails
-            analysis_obj.filename = picklefile
-            analysis_obj.short_filename = os.path.basename(picklefile.rstrip('.ciu'))
-            pickle.dump(analysis_obj, pkfile)
+        # wait to set final filename to here to avoid setting it if the save operation fails
+        prev_filename, prev_short_filename = analysis_obj.filename, analysis_obj.short_filename
+        analysis_obj.filename = picklefile
+        analysis_obj.short_filename = os.path.basename(picklefile.rstrip('.ciu'))
+        try:
+            CIU_File_IO.save_ciu_container(analysis_obj, picklefile)
+        except IOError:
+            analysis_obj.filename, analysis_obj.short_filename = prev_filename, prev_short_filename
+            raise
+        CIU_File_IO.update_index(analysis_obj, picklefile)
         return picklefile
     except IOError:
         if len_flag:
@@ -1913,7 +1771,7 @@ def save_analysis_obj(analysis_obj, params_dict, outputdir, filename_append=''):
 
 def load_analysis_obj(analysis_filename):
     """
-    Load a pickled analysis object back into program memory
+    Load a saved analysis object (binary container or older pickled file) back into program memory
     :param analysis_filename: full path to file location to load
     :rtype: CIUAnalysisObj
     :return: CIUAnalysisObj
@@ -1922,11 +1780,7 @@ def load_analysis_obj(analysis_filename):
     if len(analysis_filename) > 200:
         messagebox.showwarning('Warning! Long File Path', 'Warning! The loaded file has a path length greater than 200 characters. Windows will not allow you to save files with paths longer than 260 characters. It is strongly recommended to shorten the name of your file and/or the path to the folder containing it to prevent crashes if you exceed 260 characters.')
 
-    with open(analysis_filename, 'rb') as analysis_file:
-        analysis_obj = pickle.load(analysis_file)
-        analysis_obj.filename = analysis_filename
-        analysis_obj.short_filename = os.path.basename(analysis_filename).rstrip('.ciu')
-    return analysis_obj
+    return CIU_File_IO.load_analysis_file(analysis_filename)
 
 
 def init_logs():
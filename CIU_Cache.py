@@ -0,0 +1,216 @@
+"""
+This file is part of CIUSuite 2
+Copyright (C) 2018 Daniel Polasky
+
+On-disk cache of analysis stage results (e.g. Gaussian fitting). Results are stored under a hash of
+the stage input data and only the parameters that the stage uses, so repeating an analysis on
+unchanged data with unchanged parameters returns the previous result instead of recomputing it.
+Gaussian fits are also stored for each CV column, so that after part of a fingerprint changes only the
+changed columns (and the columns whose fits are started from them) are refit.
+The least recently used results are removed once the cache exceeds its maximum size.
+"""
+import os
+import sys
+import pickle
+import hashlib
+import logging
+import numpy as np
+
+logger = logging.getLogger('main')
+
+# increment if the format of any cached stage result changes to invalidate old results
+CACHE_VERSION = 4
+CACHE_FILE_EXTENSION = '.result'
+
+# parameter keys used by each cached stage: (key prefix, keys with the prefix that only affect outputs)
+gaussian_param_keys = ('gauss', ['gaussian_4_save_diagnostics', 'gaussian_5_combine_outputs', 'gaussian_51_sort_outputs_by',
+                                 'gaussian_61_num_cores', 'gaussian_62_parallel_within_file'])
+stage_param_keys = {'gaussian_fitting': gaussian_param_keys,
+                    'gaussian_column': gaussian_param_keys,
+                    'feature_detect_gaussian': ('feature_t', ['feature_t2_6_ciu50_combine_outputs', 'feature_t2_7_ciu50_concise_outputs'])
+                    }
+
+
+def get_default_cache_dir():
+    """
+    Default cache location, in the program data directory (matches CIU2_Main, supporting code bundled
+    by PyInstaller)
+    :return: full path to cache directory
+    """
+    if getattr(sys, 'frozen', False):
+        program_data_dir = os.path.join(os.environ['ALLUSERSPROFILE'], 'CIUSuite2')
+    else:
+        program_data_dir = os.path.dirname(os.path.abspath(__file__))
+    return os.path.join(program_data_dir, 'cache')
+
+
+def get_stage_params(params_obj, stage_name):
+    """
+    Get the parameters read by a given stage
+    :param params_obj: Parameters object
+    :type params_obj: CIU_Params.Parameters
+    :param stage_name: key in stage_param_keys
+    :return: sorted list of (key, value) tuples
+    """
+    prefix, output_only_keys = stage_param_keys[stage_name]
+    return sorted((key, value) for key, value in params_obj.params_dict.items() if key.startswith(prefix) and key not in output_only_keys)
+
+
+def compute_stage_key(stage_name, input_arrays, params_obj):
+    """
+    Compute the cache key for a stage from its input data and parameters
+    :param stage_name: key in stage_param_keys
+    :param input_arrays: list of numpy arrays that are the inputs to the stage (e.g. ciu_data, dt_axis, cv_axis)
+    :param params_obj: Parameters object
+    :type params_obj: CIU_Params.Parameters
+    :return: key (hex string)
+    """
+    hasher = hashlib.sha1()
+    hasher.update('{}:{}'.format(stage_name, CACHE_VERSION).encode('utf-8'))
+    for input_array in input_arrays:
+        input_array = np.ascontiguousarray(input_array)
+        hasher.update('{}{}'.format(input_array.dtype.str, input_array.shape).encode('utf-8'))
+        hasher.update(input_array.tobytes())
+    hasher.update(repr(get_stage_params(params_obj, stage_name)).encode('utf-8'))
+    return hasher.hexdigest()
+
+
+class ResultCache(object):
+    """
+    Directory of pickled stage results named by their cache key. File modification times record
+    when each result was last used for least-recently-used eviction. Safe to share between processes,
+    as results are written to a temporary file and then moved into place.
+    """
+    def __init__(self, cache_dir=None, max_size_mb=500):
+        """
+        Initialize the cache (creating its directory if needed)
+        :param cache_dir: directory in which to store results. Uses the default location if None
+        :param max_size_mb: maximum total size of all stored results in MB
+        """
+        if cache_dir is None:
+            cache_dir = get_default_cache_dir()
+        self.cache_dir = cache_dir
+        self.max_size_bytes = max_size_mb * 1024 * 1024
+        if not os.path.isdir(self.cache_dir):
+            os.makedirs(self.cache_dir, exist_ok=True)
+
+    def get_path(self, key):
+        """
+        Path to the file for a given key
+        :param key: cache key
+        :return: full path
+        """
+        return os.path.join(self.cache_dir, key + CACHE_FILE_EXTENSION)
+
+    def load(self, key):
+        """
+        Load a stored result
+        :param key: cache key
+        :return: stored result, or None if no result is stored for this key
+        """
+        result_path = self.get_path(key)
+        try:
+            with open(result_path, 'rb') as result_file:
+                result = pickle.load(result_file)
+            # mark as recently used
+            os.utime(result_path, None)
+        except (IOError, OSError, EOFError, pickle.UnpicklingError):
+            return None
+        return result
+
+    def save(self, key, result):
+        """
+        Store a result, then remove old results if the cache is over its size limit
+        :param key: cache key
+        :param result: any picklable object
+        :return: void
+        """
+        if self.write(key, result):
+            self.evict()
+
+    def save_many(self, keys_and_results):
+        """
+        Store several results, then remove old results if the cache is over its size limit (once, rather
+        than after each result)
+        :param keys_and_results: list of (key, result) tuples
+        :return: void
+        """
+        for key, result in keys_and_results:
+            if not self.write(key, result):
+                break
+        self.evict()
+
+    def write(self, key, result):
+        """
+        Write a result to its file (without checking the cache size)
+        :param key: cache key
+        :param result: any picklable object
+        :return: True if saved, False if not
+        """
+        result_path = self.get_path(key)
+        temp_path = '{}.{}.tmp'.format(result_path, os.getpid())
+        try:
+            with open(temp_path, 'wb') as result_file:
+                pickle.dump(result, result_file)
+            os.replace(temp_path, result_path)
+        except (IOError, OSError):
+            # the cache is optional, so failing to save to it should not interrupt the analysis
+            logger.warning('Could not save result to cache directory {}'.format(self.cache_dir))
+            return False
+        return True
+
+    def evict(self):
+        """
+        Remove least recently used results until the total size is below the maximum
+        :return: void
+        """
+        entries = []
+        total_size = 0
+        for filename in os.listdir(self.cache_dir):
+            if not filename.endswith(CACHE_FILE_EXTENSION):
+                continue
+            try:
+                file_stats = os.stat(os.path.join(self.cache_dir, filename))
+            except OSError:
+                # removed by another process
+                continue
+            entries.append((file_stats.st_mtime, file_stats.st_size, filename))
+            total_size += file_stats.st_size
+
+        for _, size, filename in sorted(entries):
+            if total_size <= self.max_size_bytes:
+                break
+            try:
+                os.remove(os.path.join(self.cache_dir, filename))
+            except OSError:
+                pass
+            total_size -= size
+
+    def clear(self):
+        """
+        Remove all stored results
+        :return: void
+        """
+        for filename in os.listdir(self.cache_dir):
+            if filename.endswith(CACHE_FILE_EXTENSION):
+                try:
+                    os.remove(os.path.join(self.cache_dir, filename))
+                except OSError:
+                    pass
+
+
+def get_cache(params_obj):
+    """
+    Get the result cache according to the cache parameters
+    :param params_obj: Parameters object
+    :type params_obj: CIU_Params.Parameters
+    :rtype: ResultCache
+    :return: ResultCache, or None if caching is disabled (or the cache directory cannot be created)
+    """
+    if not params_obj.cache_1_use_cache:
+        return None
+    try:
+        return ResultCache(max_size_mb=params_obj.cache_2_max_size_mb)
+    except OSError:
+        logger.warning('Could not create result cache directory. Results will not be cached.')
+        return None
@@ -0,0 +1,459 @@
+"""
+This file is part of CIUSuite 2
+Copyright (C) 2018 Daniel Polasky
+
+Versioned binary container for .ciu files. Replaces the single pickle of the whole CIUAnalysisObj with
+a zip archive of separate sections (numpy .npz format), so that the CIU data, axes, raw data, and
+fitting/feature results can each be read on demand without loading the rest of the file.
+Older pickled .ciu files can still be read and can be converted to the new format.
+
+Also maintains a small JSON index in each output directory with summary information (axes shape,
+completed processing stages, parameter hash) for every .ciu file saved there, so that file lists
+can be checked without loading each file.
+"""
+import os
+import json
+import pickle
+import zipfile
+import logging
+import numpy as np
+
+import CIU_analysis_obj
+import CIU_raw
+
+# typing to allow easier refactoring of custom objects
+from typing import TYPE_CHECKING
+if TYPE_CHECKING:
+    from CIU_analysis_obj import CIUAnalysisObj
+
+logger = logging.getLogger('main')
+
+CIU_FILE_VERSION = 1
+
+# section names for data stored directly as arrays. All other object attributes are stored as
+# individually pickled sections named with the attribute prefix.
+VERSION_SECTION = 'format_version'
+DATA_SECTION = 'ciu_data'
+DT_AXIS_SECTION = 'dt_axis'
+CV_AXIS_SECTION = 'cv_axis'
+RAW_DATA_SECTION = 'raw_data'
+RAW_DT_AXIS_SECTION = 'raw_dt_axis'
+RAW_CV_AXIS_SECTION = 'raw_cv_axis'
+RAW_FILEPATH_SECTION = 'raw_filepath'
+ATTRIBUTE_PREFIX = 'attr_'
+
+# attributes handled by the array sections above rather than pickled
+array_attributes = ['ciu_data', 'axes', 'raw_obj']
+
+INDEX_FILENAME = 'ciu_file_index.json'
+INDEX_VERSION = 2
+
+# processing stages recorded in the index: stage name, attribute that is set once the stage has been run
+stage_attributes = [('gaussian_fitting', 'gaussian_table'),
+                    ('feature_detect_gaussian', 'features_gaussian'),
+                    ('feature_detect_changept', 'features_changept'),
+                    ('ciu50', 'transitions'),
+                    ('classification', 'classif_predicted_label')]
+# stages whose results are erased by cropping/interpolation
+erasable_stages = ['gaussian_fitting', 'feature_detect_gaussian', 'feature_detect_changept']
+
+
+def save_ciu_container(analysis_obj, filepath):
+    """
+    Save a CIUAnalysisObj to a versioned .ciu container at the provided path
+    :param analysis_obj: CIUAnalysisObj to save
+    :type analysis_obj: CIUAnalysisObj
+    :param filepath: full path to the output file (should end in .ciu)
+    :return: void
+    :raises: IOError
+    """
+    sections = {VERSION_SECTION: np.asarray(CIU_FILE_VERSION),
+                DATA_SECTION: np.asarray(analysis_obj.ciu_data),
+                DT_AXIS_SECTION: np.asarray(analysis_obj.axes[0]),
+                CV_AXIS_SECTION: np.asarray(analysis_obj.axes[1])}
+
+    raw_obj = analysis_obj.raw_obj
+    sections[RAW_DATA_SECTION] = np.asarray(raw_obj.rawdata)
+    sections[RAW_DT_AXIS_SECTION] = np.asarray(raw_obj.dt_axis)
+    sections[RAW_CV_AXIS_SECTION] = np.asarray(raw_obj.cv_axis)
+    sections[RAW_FILEPATH_SECTION] = np.asarray(raw_obj.filepath)
+
+    # all other attributes (parameters, Gaussians, features, etc) get their own pickled section
+    for attribute, value in vars(analysis_obj).items():
+        if attribute in array_attributes:
+            continue
+        sections[ATTRIBUTE_PREFIX + attribute] = pack_object(value)
+
+    # write using an open file handle so numpy does not append its own .npz extension
+    with open(filepath, 'wb') as ciu_file:
+        np.savez(ciu_file, **sections)
+
+
+def load_ciu_container(filepath):
+    """
+    Load the full CIUAnalysisObj saved in a .ciu container
+    :param filepath: full path to the .ciu file
+    :rtype: CIUAnalysisObj
+    :return: CIUAnalysisObj
+    """
+    with CIUContainer(filepath) as container:
+        state = {attribute: container.get_attribute(attribute) for attribute in container.get_attribute_names()}
+        state['raw_obj'] = container.get_raw_obj()
+        state['ciu_data'] = container.get_ciu_data()
+        state['axes'] = container.get_axes()
+    # restore as for a pickled object (converts the Gaussian lists of older files to tables and re-attaches fit data)
+    analysis_obj = CIU_analysis_obj.CIUAnalysisObj.__new__(CIU_analysis_obj.CIUAnalysisObj)
+    analysis_obj.__setstate__(state)
+    return analysis_obj
+
+
+def load_analysis_file(filepath):
+    """
+    Load a CIUAnalysisObj from a .ciu file of either format (binary container or older pickle) and
+    set its filename information from the file location
+    :param filepath: full path to the .ciu file
+    :rtype: CIUAnalysisObj
+    :return: CIUAnalysisObj
+    """
+    # files saved by older versions of CIUSuite 2 are pickled objects rather than binary containers
+    if is_ciu_container(filepath):
+        analysis_obj = load_ciu_container(filepath)
+    else:
+        analysis_obj = load_legacy_pickle(filepath)
+    analysis_obj.filename = filepath
+    analysis_obj.short_filename = os.path.basename(filepath).rstrip('.ciu')
+    return analysis_obj
+
+
+def load_axes(filepath):
+    """
+    Load only the axes of a .ciu file (e.g. to determine shared axes before loading many files). Older
+    pickled files must be fully loaded.
+    :param filepath: full path to the .ciu file
+    :return: [dt_axis, cv_axis] list of numpy arrays
+    """
+    if is_ciu_container(filepath):
+        with CIUContainer(filepath) as container:
+            return container.get_axes()
+    return load_legacy_pickle(filepath).axes
+
+
+def load_raw_obj(filepath):
+    """
+    Load only the original raw data (CIURaw object) of a .ciu file. Older pickled files must be fully loaded.
+    :param filepath: full path to the .ciu file
+    :return: CIURaw object saved in the file
+    :rtype: CIU_raw.CIURaw
+    """
+    if is_ciu_container(filepath):
+        with CIUContainer(filepath) as container:
+            return container.get_raw_obj()
+    return load_legacy_pickle(filepath).raw_obj
+
+
+def load_params(filepath):
+    """
+    Load only the Parameters object of a .ciu file (e.g. to compare parameters across many files). Older
+    pickled files must be fully loaded.
+    :param filepath: full path to the .ciu file
+    :return: Parameters object saved in the file
+    :rtype: CIU_Params.Parameters
+    """
+    if is_ciu_container(filepath):
+        with CIUContainer(filepath) as container:
+            return container.get_attribute('params')
+    return load_legacy_pickle(filepath).params
+
+
+def is_ciu_container(filepath):
+    """
+    Check whether a .ciu file is a binary container (True) or a legacy pickled object (False)
+    :param filepath: full path to the .ciu file
+    :return: boolean
+    """
+    return zipfile.is_zipfile(filepath)
+
+
+def load_legacy_pickle(filepath):
+    """
+    Load a CIUAnalysisObj from an older (pickled) .ciu file
+    :param filepath: full path to the .ciu file
+    :rtype: CIUAnalysisObj
+    :return: CIUAnalysisObj
+    """
+    with open(filepath, 'rb') as analysis_file:
+        analysis_obj = pickle.load(analysis_file)
+    return analysis_obj
+
+
+def convert_pickle_to_container(pickle_path, output_path=None):
+    """
+    Convert a legacy pickled .ciu file to the binary container format. Files that have already been
+    converted are left unchanged.
+    :param pickle_path: full path to the pickled .ciu file
+    :param output_path: (optional) path at which to save the converted file. If None, the original file is overwritten
+    :return: path to the converted file
+    """
+    if output_path is None:
+        output_path = pickle_path
+    if is_ciu_container(pickle_path):
+        logger.info('File {} is already in the current .ciu format'.format(os.path.basename(pickle_path)))
+        return pickle_path
+
+    analysis_obj = load_legacy_pickle(pickle_path)
+    save_ciu_container(analysis_obj, output_path)
+    return output_path
+
+
+def pack_object(value):
+    """
+    Pickle an arbitrary object into a uint8 array so that it can be stored as an npz section
+    :param value: object to store
+    :return: 1D numpy array of bytes
+    """
+    return np.frombuffer(pickle.dumps(value), dtype=np.uint8)
+
+
+def unpack_object(byte_array):
+    """
+    Restore an object stored with pack_object
+    :param byte_array: 1D numpy array of bytes
+    :return: original object
+    """
+    return pickle.loads(byte_array.tobytes())
+
+
+def make_index_entry(filepath, axes, stage_values):
+    """
+    Assemble the index information for a single .ciu file
+    :param filepath: full path to the .ciu file
+    :param axes: [dt_axis, cv_axis]
+    :param stage_values: dict of attribute name: value for each attribute in stage_attributes
+    :return: dict of index information
+    """
+    file_stats = os.stat(filepath)
+    stages_done = []
+    for stage, attribute in stage_attributes:
+        value = stage_values[attribute]
+        # transitions default to an empty list rather than None
+        if value is not None and not (attribute == 'transitions' and len(value) == 0):
+            stages_done.append(stage)
+
+    return {'axes_shape': [len(axes[0]), len(axes[1])],
+            'stages': stages_done,
+            'mtime': file_stats.st_mtime,
+            'size': file_stats.st_size}
+
+
+def read_index(directory):
+    """
+    Read the .ciu file index for a directory
+    :param directory: directory containing .ciu files
+    :return: dict of filename: index entry. Empty if there is no (valid) index in the directory
+    """
+    index_path = os.path.join(directory, INDEX_FILENAME)
+    try:
+        with open(index_path, 'r') as index_file:
+            index = json.load(index_file)
+    except (IOError, ValueError):
+        return {}
+    if index.get('version') != INDEX_VERSION:
+        return {}
+    return index['files']
+
+
+def write_index(directory, file_entries):
+    """
+    Write the .ciu file index for a directory. Written to a temporary file first so that an
+    interrupted write does not leave a corrupted index.
+    :param directory: directory containing .ciu files
+    :param file_entries: dict of filename: index entry
+    :return: void
+    """
+    index_path = os.path.join(directory, INDEX_FILENAME)
+    temp_path = index_path + '.tmp'
+    try:
+        with open(temp_path, 'w') as index_file:
+            json.dump({'version': INDEX_VERSION, 'files': file_entries}, index_file, indent=1)
+        os.replace(temp_path, index_path)
+    except (IOError, OSError):
+        # the index is only a cache, so failing to write it should not interrupt the analysis
+        logger.warning('Could not write file index in directory {}'.format(directory))
+
+
+def update_index(analysis_obj, filepath):
+    """
+    Record a (just saved) analysis object in the index of the directory it was saved in
+    :param analysis_obj: CIUAnalysisObj
+    :type analysis_obj: CIUAnalysisObj
+    :param filepath: full path to the saved .ciu file
+    :return: void
+    """
+    stage_values = {attribute: getattr(analysis_obj, attribute, None) for _, attribute in stage_attributes}
+    entry = make_index_entry(filepath, analysis_obj.axes, stage_values)
+
+    directory = os.path.dirname(os.path.abspath(filepath))
+    file_entries = read_index(directory)
+    file_entries[os.path.basename(filepath)] = entry
+    write_index(directory, file_entries)
+
+
+def build_index_entry(filepath):
+    """
+    Generate index information for a .ciu file that is missing from (or out of date in) its directory's
+    index. Only the required sections are read for binary containers; older pickled files must be fully loaded.
+    :param filepath: full path to the .ciu file
+    :return: dict of index information
+    """
+    if is_ciu_container(filepath):
+        with CIUContainer(filepath) as container:
+            axes = container.get_axes()
+            stage_values = {attribute: container.get_attribute(attribute) for _, attribute in stage_attributes}
+            if stage_values['gaussian_table'] is None:
+                # files saved before Gaussian tables were stored only have the Gaussian lists
+                stage_values['gaussian_table'] = container.get_attribute('raw_protein_gaussians')
+    else:
+        analysis_obj = load_legacy_pickle(filepath)
+        axes = analysis_obj.axes
+        stage_values = {attribute: getattr(analysis_obj, attribute, None) for _, attribute in stage_attributes}
+    return make_index_entry(filepath, axes, stage_values)
+
+
+def get_index_entries(filepaths):
+    """
+    Get index information for a list of .ciu files. Entries that are missing or out of date (the file
+    has been changed since it was indexed) are regenerated and saved to the index.
+    :param filepaths: list of full paths to .ciu files
+    :return: list of index entries (dicts) in the same order as the provided paths
+    """
+    entries = []
+    indices_by_dir = {}
+    updated_dirs = set()
+    for filepath in filepaths:
+        directory = os.path.dirname(os.path.abspath(filepath))
+        if directory not in indices_by_dir:
+            indices_by_dir[directory] = read_index(directory)
+        file_entries = indices_by_dir[directory]
+
+        filename = os.path.basename(filepath)
+        entry = file_entries.get(filename)
+        file_stats = os.stat(filepath)
+        if entry is None or entry['mtime'] != file_stats.st_mtime or entry['size'] != file_stats.st_size:
+            entry = build_index_entry(filepath)
+            file_entries[filename] = entry
+            updated_dirs.add(directory)
+        entries.append(entry)
+
+    for directory in updated_dirs:
+        write_index(directory, indices_by_dir[directory])
+    return entries
+
+
+def has_erasable_results(index_entry):
+    """
+    Determine whether a file has processing results (Gaussian fitting or feature detection) that
+    will be erased by cropping or interpolation
+    :param index_entry: index entry dict for the file
+    :return: boolean
+    """
+    return any(stage in index_entry['stages'] for stage in erasable_stages)
+
+
+class CIUContainer(object):
+    """
+    Read-only handle to a .ciu container. Sections are only read from disk when requested, so
+    e.g. the axes or parameters of a file can be checked without loading its Gaussian fits.
+    Use as a context manager (or call close()) to release the file.
+    """
+    def __init__(self, filepath):
+        """
+        Open the container at the provided path
+        :param filepath: full path to the .ciu file
+        :raises: ValueError if the file is not a container or was written by a newer version of CIUSuite 2
+        """
+        if not is_ciu_container(filepath):
+            raise ValueError('File {} is not a CIUSuite 2 binary container'.format(os.path.basename(filepath)))
+        self.filepath = filepath
+        self.npz_file = np.load(filepath, allow_pickle=False)
+
+        self.version = int(self.npz_file[VERSION_SECTION])
+        if self.version > CIU_FILE_VERSION:
+            self.close()
+            raise ValueError('File {} was saved with a newer version of CIUSuite 2 (format {}) and cannot be read'.format(os.path.basename(filepath), self.version))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def close(self):
+        """
+        Close the underlying file
+        :return: void
+        """
+        self.npz_file.close()
+
+    def has_section(self, section_name):
+        """
+        Check whether a section (or attribute) is present in the container
+        :param section_name: section name or CIUAnalysisObj attribute name
+        :return: boolean
+        """
+        return section_name in self.npz_file.files or ATTRIBUTE_PREFIX + section_name in self.npz_file.files
+
+    def get_ciu_data(self):
+        """
+        Read the processed CIU data matrix
+        :return: 2D numpy array (DT x CV)
+        """
+        return self.npz_file[DATA_SECTION]
+
+    def get_axes(self):
+        """
+        Read the axes corresponding to the processed CIU data
+        :return: [dt_axis, cv_axis] list of numpy arrays
+        """
+        return [self.npz_file[DT_AXIS_SECTION], self.npz_file[CV_AXIS_SECTION]]
+
+    def get_raw_obj(self):
+        """
+        Rebuild the CIURaw object holding the original raw data
+        :rtype: CIU_raw.CIURaw
+        :return: CIURaw
+        """
+        return CIU_raw.CIURaw(self.npz_file[RAW_DATA_SECTION],
+                              self.npz_file[RAW_DT_AXIS_SECTION],
+                              self.npz_file[RAW_CV_AXIS_SECTION],
+                              str(self.npz_file[RAW_FILEPATH_SECTION]))
+
+    def get_attribute_names(self):
+        """
+        List all pickled CIUAnalysisObj attributes stored in this container
+        :return: list of attribute names (strings)
+        """
+        return [x[len(ATTRIBUTE_PREFIX):] for x in self.npz_file.files if x.startswith(ATTRIBUTE_PREFIX)]
+
+    def get_attribute(self, attribute):
+        """
+        Read a single CIUAnalysisObj attribute (e.g. 'params', 'gaussian_table', 'features_gaussian')
+        :param attribute: attribute name
+        :return: the stored value, or None if the attribute was not saved
+        """
+        try:
+            return unpack_object(self.npz_file[ATTRIBUTE_PREFIX + attribute])
+        except KeyError:
+            return None
+
+
+if __name__ == '__main__':
+    # convert older pickled .ciu files to the binary container format
+    import tkinter
+    from tkinter import filedialog
+    root = tkinter.Tk()
+    root.withdraw()
+
+    files = filedialog.askopenfilenames(filetypes=[('CIU', '.ciu')])
+    for file in files:
+        convert_pickle_to_container(file)
+        print('converted {}'.format(os.path.basename(file)))
@@ -0,0 +1,130 @@
+"""
+This file is part of CIUSuite 2
+Copyright (C) 2018 Daniel Polasky
+
+Container for a set of CIU fingerprints that have been equalized onto identical axes (e.g. for averaging,
+comparison, or classification). The fingerprints are held in a single contiguous (N x DT x CV) array along
+with the class label, subclass key, and name of each fingerprint, so that methods using all of them can
+operate on the whole array at once rather than looping over analysis objects.
+"""
+import numpy as np
+
+from typing import TYPE_CHECKING
+if TYPE_CHECKING:
+    from CIU_analysis_obj import CIUAnalysisObj
+
+
+class FingerprintStack(object):
+    """
+    N fingerprints with shared axes in one (N x DT x CV) array. Labels, subclass keys, and names are stored
+    as arrays (one entry per fingerprint) to allow selection of fingerprints by boolean masks.
+    """
+    def __init__(self, data, axes, labels=None, subclass_keys=None, names=None):
+        """
+        Initialize a new stack
+        :param data: 3D array (or list of equal-shape 2D arrays) of fingerprint data (N x DT x CV)
+        :param axes: shared axes of all fingerprints in form [dt_axis, cv_axis]
+        :param labels: (optional) list of class labels (one per fingerprint)
+        :param subclass_keys: (optional) list of subclass keys (one per fingerprint)
+        :param names: (optional) list of fingerprint names (e.g. short filenames)
+        """
+        self.data = np.ascontiguousarray(data, dtype=np.float64)
+        self.axes = axes
+        num_fingerprints = len(self.data)
+        self.labels = get_label_array(labels, num_fingerprints)
+        self.subclass_keys = get_label_array(subclass_keys, num_fingerprints)
+        self.names = get_label_array(names, num_fingerprints)
+
+    @classmethod
+    def from_analysis_objs(cls, analysis_obj_list, axes=None, labels=None, subclass_keys=None, share_data=False):
+        """
+        Generate a stack from the ciu_data of a list of analysis objects with identical axes
+        :param analysis_obj_list: list of CIUAnalysisObjs (axes already equalized)
+        :type analysis_obj_list: list[CIUAnalysisObj]
+        :param axes: shared axes. Taken from the first object if not provided (required if the list is empty)
+        :param labels: (optional) list of class labels (one per object)
+        :param subclass_keys: (optional) list of subclass keys (one per object)
+        :param share_data: if True, each object's ciu_data is replaced by a view of its row of the stack, so the
+        data is only held once (and changes to either are seen by both)
+        :return: FingerprintStack
+        :rtype: FingerprintStack
+        :raises: ValueError if the objects' data are not all the same shape
+        """
+        if axes is None:
+            axes = analysis_obj_list[0].axes
+        if len(analysis_obj_list) == 0:
+            data = np.zeros((0, len(axes[0]), len(axes[1])))
+        else:
+            data = np.empty((len(analysis_obj_list),) + np.shape(analysis_obj_list[0].ciu_data))
+            for index, analysis_obj in enumerate(analysis_obj_list):
+                if np.shape(analysis_obj.ciu_data) != data.shape[1:]:
+                    raise ValueError('Data of {} has shape {}, expected {}'.format(analysis_obj.short_filename, np.shape(analysis_obj.ciu_data), data.shape[1:]))
+                data[index] = analysis_obj.ciu_data
+                if share_data:
+                    analysis_obj.ciu_data = data[index]
+        names = [analysis_obj.short_filename for analysis_obj in analysis_obj_list]
+        return cls(data, axes, labels, subclass_keys, names)
+
+    def __len__(self):
+        return len(self.data)
+
+    def select(self, label=None, subclass_key=None):
+        """
+        Get the fingerprints with the provided class label and/or subclass key (all fingerprints
+        if both are None) as a new stack
+        :param label: class label to select
+        :param subclass_key: subclass key to select
+        :return: new FingerprintStack with the selected fingerprints (data is copied)
+        :rtype: FingerprintStack
+        """
+        mask = np.ones(len(self), dtype=bool)
+        if label is not None:
+            mask &= self.labels == label
+        if subclass_key is not None:
+            mask &= self.subclass_keys == subclass_key
+        return FingerprintStack(self.data[mask], self.axes, self.labels[mask], self.subclass_keys[mask], self.names[mask])
+
+    def get_unique_labels(self):
+        """
+        Get the class labels present in the stack, in order of first appearance
+        :return: list of labels
+        """
+        unique_labels = []
+        for label in self.labels:
+            if label not in unique_labels:
+                unique_labels.append(label)
+        return unique_labels
+
+    def mean(self):
+        """
+        Average fingerprint of all fingerprints in the stack
+        :return: 2D array (DT x CV)
+        """
+        return np.mean(self.data, axis=0)
+
+    def std(self):
+        """
+        Standard deviation at each point across all fingerprints in the stack
+        :return: 2D array (DT x CV)
+        """
+        return np.std(self.data, axis=0)
+
+    def __str__(self):
+        return '<FingerprintStack> {} fingerprints, shape {}'.format(len(self), self.data.shape[1:])
+    __repr__ = __str__
+
+
+def get_label_array(label_list, num_fingerprints):
+    """
+    Convert a list of labels (or None) to an object array with one entry per fingerprint
+    :param label_list: list of labels, or None for no labels (all entries None)
+    :param num_fingerprints: number of fingerprints in the stack
+    :return: numpy object array
+    :raises: ValueError if the number of labels does not match the number of fingerprints
+    """
+    label_array = np.empty(num_fingerprints, dtype=object)
+    if label_list is not None:
+        if len(label_list) != num_fingerprints:
+            raise ValueError('Number of labels ({}) does not match number of fingerprints ({})'.format(len(label_list), num_fingerprints))
+        label_array[:] = list(label_list)
+    return label_array
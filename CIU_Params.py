@@ -121,13 +121,26 @@ class Parameters(object):
         self.plot_17_xlim_upper = None
         self.plot_18_ylim_lower = None
         self.plot_19_ylim_upper = None
+        self.plot_20_render_mode = None
+        self.plot_21_render_processes = None
 
         self.output_1_save_csv = None
+        self.average_1_streaming = None
+        self.cache_1_use_cache = None
+        self.cache_2_max_size_mb = None
         self.compare_batch_1_both_dirs = None
+        self.compare_batch_2_plot_pairs = None
         self.compare_2_custom_red = None
         self.compare_1_custom_blue = None
         self.compare_3_high_contrast = None
         self.compare_4_int_cutoff = None
+        self.compare_batch_3_cluster = None
+        self.cluster_1_linkage_method = None
+        self.cluster_2_rmsd_cutoff = None
+        self.cluster_3_num_clusters = None
+        self.library_1_num_matches = None
+        self.library_2_num_candidates = None
+        self.library_3_pca_components = None
 
         # Gaussian fitting
         self.gauss_t1_1_protein_mode = None
@@ -136,6 +149,12 @@ class Parameters(object):
         self.gaussian_5_combine_outputs = None
         self.gaussian_51_sort_outputs_by = None
         self.gaussian_61_num_cores = None
+        self.gaussian_62_parallel_within_file = None
+        self.gaussian_63_fit_engine = None
+        self.gaussian_64_stop_patience = None
+        self.gaussian_65_stop_score_drop = None
+        self.gaussian_66_init_method = None
+        self.gaussian_67_reseed_rsq = None
         self.gaussian_71_max_prot_components = None
         self.gaussian_72_prot_peak_width = None
         self.gaussian_73_prot_width_tol = None
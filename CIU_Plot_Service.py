@@ -0,0 +1,315 @@
+"""
+This file is part of CIUSuite 2
+Copyright (C) 2018 Daniel Polasky
+
+Plot rendering service. Analysis methods submit their plots here (submit_plot) rather than calling the plot
+methods directly, and the plot_20_render_mode parameter determines when they are rendered:
+    inline: immediately, in the calling process (original behavior)
+    background: in a separate process pool, so that the analysis can continue while figures are written. Daemon
+    processes (e.g. the parallel file workers of CIU2_Batch) cannot start a pool, so plots submitted from them
+    are rendered inline in that process instead (logged once per process)
+    deferred: not at all. The plot method and its arguments are saved in a deferred_plots folder in the output
+    directory to be rendered later with render_deferred_plots (or by running this module on the output directory)
+Plot methods draw on their own Figure with an Agg canvas (new_figure) rather than the global pyplot state,
+so they can be run safely in any process.
+
+Usage (deferred plots): python CIU_Plot_Service.py output_folder [num_processes]
+"""
+import os
+import sys
+import time
+import pickle
+import logging
+import atexit
+import multiprocessing
+from tkinter import messagebox
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+
+logger = logging.getLogger('main')
+
+DEFERRED_PLOTS_FOLDER = 'deferred_plots'
+DEFERRED_PLOT_EXTENSION = '.plot'
+# maximum number of queued plots per render process before waiting for earlier plots to finish (limits memory use)
+MAX_PENDING_PER_PROCESS = 8
+
+render_pool = None
+render_pool_size = 0
+pending_plots = []
+deferred_plot_count = 0
+daemon_fallback_logged = False
+
+
+def new_figure(params_obj=None):
+    """
+    Create a new figure (not managed by pyplot) with an Agg canvas attached for saving. Figures are laid
+    out automatically, matching the figure.autolayout setting of the GUI and batch runners.
+    :param params_obj: Parameters with figure size and DPI. Uses matplotlib defaults if None
+    :type params_obj: CIU_Params.Parameters
+    :return: Figure
+    :rtype: Figure
+    """
+    if params_obj is None:
+        figure = Figure(tight_layout=True)
+    else:
+        figure = Figure(figsize=(params_obj.plot_03_figwidth, params_obj.plot_04_figheight), dpi=params_obj.plot_05_dpi, tight_layout=True)
+    FigureCanvasAgg(figure)
+    return figure
+
+
+def set_axis_limits(axes, params_obj):
+    """
+    Set x/y limits of a plot from the plot parameters if applicable, allowing for partial limits
+    (a limit of None leaves that side unchanged)
+    :param axes: matplotlib Axes
+    :param params_obj: Parameters
+    :type params_obj: CIU_Params.Parameters
+    :return: void
+    """
+    if params_obj.plot_16_xlim_lower is not None or params_obj.plot_17_xlim_upper is not None:
+        axes.set_xlim(params_obj.plot_16_xlim_lower, params_obj.plot_17_xlim_upper)
+    if params_obj.plot_18_ylim_lower is not None or params_obj.plot_19_ylim_upper is not None:
+        axes.set_ylim(params_obj.plot_18_ylim_lower, params_obj.plot_19_ylim_upper)
+
+
+def save_figure(figure, output_path, **kwargs):
+    """
+    Save a figure, asking the user to close the file and retry if it is open in another program. The
+    user cannot be asked from a background process, so the plot is skipped (with an error logged) instead.
+    :param figure: Figure to save
+    :type figure: Figure
+    :param output_path: full path to output file. File type is determined by the extension
+    :param kwargs: additional arguments for Figure.savefig
+    :return: void
+    """
+    try:
+        figure.savefig(output_path, **kwargs)
+    except PermissionError:
+        if multiprocessing.current_process().name != 'MainProcess':
+            logger.error('Could not save plot {}: the file is being used by another process'.format(output_path))
+            return
+        messagebox.showerror('Please Close the File Before Saving', 'The file {} is being used by another process! Please close it, THEN press the OK button to retry saving'.format(output_path))
+        figure.savefig(output_path, **kwargs)
+
+
+def get_num_render_processes(params_obj):
+    """
+    Number of plot rendering processes from parameters (1 if not set, e.g. in older parameter files)
+    :param params_obj: Parameters
+    :type params_obj: CIU_Params.Parameters
+    :return: int
+    """
+    if not params_obj.plot_21_render_processes:
+        return 1
+    return int(params_obj.plot_21_render_processes)
+
+
+def submit_plot(params_obj, output_dir, plot_method, /, *args, **kwargs):
+    """
+    Render a plot according to the plot_20_render_mode parameter. Background rendering is not
+    possible from daemon processes (e.g. fitting or batch pool workers), so plots are rendered inline there.
+    Arguments after plot_method are passed to plot_method.
+    :param params_obj: Parameters
+    :type params_obj: CIU_Params.Parameters
+    :param output_dir: output directory of the analysis (in which deferred plots are saved)
+    :param plot_method: plot function (must be a module level function so it can be sent to other processes)
+    :param args: arguments for plot_method
+    :param kwargs: keyword arguments for plot_method
+    :return: void
+    """
+    global daemon_fallback_logged
+    render_mode = params_obj.plot_20_render_mode
+    if render_mode == 'background' and multiprocessing.current_process().daemon:
+        if not daemon_fallback_logged:
+            logger.info('Background plot rendering is not available in worker process {}; rendering its plots inline instead'.format(multiprocessing.current_process().name))
+            daemon_fallback_logged = True
+        render_mode = 'inline'
+
+    if render_mode == 'deferred':
+        save_deferred_plot(output_dir, make_plot_job(plot_method, args, kwargs))
+    elif render_mode == 'background':
+        num_processes = get_num_render_processes(params_obj)
+        pool = get_render_pool(num_processes)
+        check_pending_plots(max_pending=MAX_PENDING_PER_PROCESS * num_processes)
+        pending_plots.append(pool.apply_async(render_plot_job, (make_plot_job(plot_method, args, kwargs),)))
+    else:
+        plot_method(*args, **kwargs)
+
+
+def make_plot_job(plot_method, args, kwargs):
+    """
+    Pickle a plot method and its arguments. Done when the plot is submitted (rather than when the pool
+    sends it to a worker) so that later changes to the arguments (e.g. analysis objects) do not affect the plot.
+    :param plot_method: plot function (module level function)
+    :param args: arguments for plot_method
+    :param kwargs: keyword arguments for plot_method
+    :return: pickled plot job (bytes)
+    """
+    return pickle.dumps((plot_method, args, kwargs), protocol=pickle.HIGHEST_PROTOCOL)
+
+
+def render_plot_job(plot_job):
+    """
+    Render a pickled plot job (see make_plot_job)
+    :param plot_job: pickled plot job (bytes)
+    :return: void
+    """
+    plot_method, args, kwargs = pickle.loads(plot_job)
+    plot_method(*args, **kwargs)
+
+
+def get_render_pool(num_processes):
+    """
+    Get the persistent process pool used for background rendering, creating it on first use (or if
+    the requested number of processes has changed)
+    :param num_processes: number of worker processes
+    :return: multiprocessing.Pool
+    """
+    global render_pool, render_pool_size
+    if render_pool is None or render_pool_size != num_processes:
+        close_render_pool()
+        render_pool = multiprocessing.Pool(processes=num_processes)
+        render_pool_size = num_processes
+    return render_pool
+
+
+def check_pending_plots(max_pending):
+    """
+    Remove finished plots from the pending list (logging any errors), waiting for the oldest plots to
+    finish if more than the maximum number are still pending
+    :param max_pending: maximum number of plots to leave pending
+    :return: void
+    """
+    global pending_plots
+    still_pending = []
+    for async_result in pending_plots:
+        if async_result.ready():
+            get_plot_result(async_result)
+        else:
+            still_pending.append(async_result)
+    while len(still_pending) > max_pending:
+        get_plot_result(still_pending.pop(0))
+    pending_plots = still_pending
+
+
+def get_plot_result(async_result):
+    """
+    Wait for a background plot to finish and log the error if rendering failed
+    :param async_result: AsyncResult from the render pool
+    :return: void
+    """
+    try:
+        async_result.get()
+    except Exception as err:
+        logger.error('Plot rendering failed: {}'.format(err))
+
+
+def wait_for_plots():
+    """
+    Wait for all background plots to finish (e.g. at the end of a batch run, before the outputs are used)
+    :return: void
+    """
+    check_pending_plots(max_pending=0)
+
+
+def close_render_pool():
+    """
+    Wait for any pending plots, then shut down the persistent render pool if it has been started
+    :return: void
+    """
+    global render_pool, render_pool_size
+    if render_pool is not None:
+        wait_for_plots()
+        render_pool.close()
+        render_pool.join()
+        render_pool = None
+        render_pool_size = 0
+
+
+atexit.register(close_render_pool)
+
+
+def save_deferred_plot(output_dir, plot_job):
+    """
+    Save a plot job to the deferred plots folder of the output directory. Each plot is saved to its own
+    file so that plots can be saved from several processes at once.
+    :param output_dir: output directory of the analysis
+    :param plot_job: pickled plot job (see make_plot_job)
+    :return: void
+    """
+    global deferred_plot_count
+    deferred_dir = os.path.join(output_dir, DEFERRED_PLOTS_FOLDER)
+    deferred_plot_count += 1
+    plot_name = '{}_{}_{}'.format(time.time_ns(), os.getpid(), deferred_plot_count)
+    plot_path = os.path.join(deferred_dir, plot_name + DEFERRED_PLOT_EXTENSION)
+    temp_path = plot_path + '.tmp'
+    try:
+        os.makedirs(deferred_dir, exist_ok=True)
+        with open(temp_path, 'wb') as plot_file:
+            plot_file.write(plot_job)
+        os.replace(temp_path, plot_path)
+    except (IOError, OSError):
+        logger.error('Could not save deferred plot to {}'.format(deferred_dir))
+
+
+def render_deferred_plot(plot_path):
+    """
+    Render a single saved plot, removing its file once it has been rendered
+    :param plot_path: full path to saved plot file
+    :return: True if rendered, False if not
+    """
+    try:
+        with open(plot_path, 'rb') as plot_file:
+            render_plot_job(plot_file.read())
+    except Exception as err:
+        logger.error('Could not render deferred plot {}: {}'.format(os.path.basename(plot_path), err))
+        return False
+    os.remove(plot_path)
+    return True
+
+
+def render_deferred_plots(output_dir, num_processes=1):
+    """
+    Render all plots saved in deferred plots folders in an output directory (including its subfolders, e.g.
+    per-file diagnostic folders)
+    :param output_dir: output directory of the analysis in which plots were deferred
+    :param num_processes: number of processes to use for rendering
+    :return: number of plots rendered
+    """
+    deferred_dirs = []
+    plot_paths = []
+    for dir_path, dir_names, file_names in os.walk(output_dir):
+        if os.path.basename(dir_path) == DEFERRED_PLOTS_FOLDER:
+            deferred_dirs.append(dir_path)
+            plot_paths.extend(sorted([os.path.join(dir_path, x) for x in file_names if x.endswith(DEFERRED_PLOT_EXTENSION)]))
+    if len(deferred_dirs) == 0:
+        logger.info('No deferred plots found in {}'.format(output_dir))
+        return 0
+
+    if num_processes > 1 and len(plot_paths) > 1:
+        with multiprocessing.Pool(processes=min(num_processes, len(plot_paths))) as pool:
+            results = pool.map(render_deferred_plot, plot_paths)
+    else:
+        results = [render_deferred_plot(x) for x in plot_paths]
+
+    num_rendered = sum(results)
+    for deferred_dir in deferred_dirs:
+        try:
+            os.rmdir(deferred_dir)
+        except OSError:
+            # plots remaining that could not be rendered (or were deferred while rendering)
+            pass
+    logger.info('Rendered {} of {} deferred plots in {}'.format(num_rendered, len(plot_paths), output_dir))
+    return num_rendered
+
+
+if __name__ == '__main__':
+    multiprocessing.freeze_support()
+    if len(sys.argv) not in [2, 3]:
+        print(__doc__)
+        sys.exit(1)
+
+    main_logger = logging.getLogger('main')
+    main_logger.addHandler(logging.StreamHandler())
+    main_logger.setLevel(logging.INFO)
+    render_deferred_plots(sys.argv[1], int(sys.argv[2]) if len(sys.argv) == 3 else 1)
@@ -37,7 +37,7 @@ class CIUAnalysisObj(object):
         """
         # basic information and objects
         self.raw_obj = ciu_raw_obj  # type: CIU_raw.CIURaw
-        self.raw_obj_list = None    # used for replicates (averaged fingerprints) only
+        self.raw_obj_list = None    # used for replicates (averaged fingerprints) only. Paths to the replicate .ciu files for low memory averages
         self.ciu_data = ciu_data
         self.axes = axes            # convention: axis 0 = DT, axis 1 = CV
         self.crop_vals = None
@@ -58,11 +58,11 @@ class CIUAnalysisObj(object):
         self.features_gaussian = None   # type: List[Feature_Detection.Feature]
         self.features_changept = None   # type: List[Feature_Detection.Feature]
 
-        # Gaussian fitting results - raw and following feature detection included
-        self.raw_protein_gaussians = None       # type: List[List[Gaussian_Fitting.Gaussian]]
-        self.raw_nonprotein_gaussians = None    # type: List[List[Gaussian_Fitting.Gaussian]]
-        self.feat_protein_gaussians = None      # type: List[List[Gaussian_Fitting.Gaussian]]
+        # Gaussian fitting results - raw and following feature detection included. Lists of Gaussians by CV are
+        # generated from the tables when needed (see raw_protein_gaussians, etc.)
         self.gauss_fits_by_cv = None            # type: List[Gaussian_Fitting.SingleFitStats]
+        self.gaussian_table = None              # type: Gaussian_Fitting.GaussianTable     # all raw Gaussians (protein and non-protein)
+        self.feat_gaussian_table = None         # type: Gaussian_Fitting.GaussianTable     # Gaussians assigned to features, with feature IDs
 
         # classification (unknown) outputs
         self.classif_predicted_label = None
@@ -70,7 +70,7 @@ class CIUAnalysisObj(object):
         self.classif_probs_by_cv = None
         self.classif_probs_avg = None
 
-        self.classif_gaussians_by_cv = None   # type: List[List[Gaussian_Fitting.Gaussian]]  # list of Gaussian containers, prior to being prepared into the classif_input_raw matrix
+        self.classif_gaussians_by_cv = None   # type: Gaussian_Fitting.GaussianTable  # table of Gaussians, prior to being prepared into the classif_input_raw matrix
         self.classif_input_raw = None   # for classification, to allow prepared Gaussians and raw data to be used from same field after prep
         self.classif_input_std = None   # for classification, data that has been standardized and ready to classify
 
@@ -82,6 +82,69 @@ class CIUAnalysisObj(object):
         return '<CIUAnalysisObj> file: {}'.format(os.path.basename(self.filename.rstrip('.ciu')))
     __repr__ = __str__
 
+    def __setstate__(self, state):
+        """
+        Restore a pickled object. Objects saved before Gaussian tables were stored (or that also stored the
+        Gaussian lists) have their Gaussian lists converted to tables. Gaussian fits are pickled without their
+        data (see Gaussian_Fitting.SingleFitStats), so the DT axis and CV columns of this object are re-attached.
+        :param state: attribute dictionary of the pickled object
+        :return: void
+        """
+        raw_protein_gaussians = state.pop('raw_protein_gaussians', None)
+        raw_nonprotein_gaussians = state.pop('raw_nonprotein_gaussians', None)
+        feat_protein_gaussians = state.pop('feat_protein_gaussians', None)
+        self.__dict__.update(state)
+        self.__dict__.setdefault('gaussian_table', None)
+        self.__dict__.setdefault('feat_gaussian_table', None)
+
+        if self.gaussian_table is None and raw_protein_gaussians is not None:
+            import Gaussian_Fitting
+            gaussian_lists_by_cv = raw_protein_gaussians
+            if raw_nonprotein_gaussians is not None:
+                gaussian_lists_by_cv = [protein_list + nonprotein_list for protein_list, nonprotein_list in zip(raw_protein_gaussians, raw_nonprotein_gaussians)]
+            self.gaussian_table = Gaussian_Fitting.GaussianTable.from_gaussian_lists(gaussian_lists_by_cv, self.axes[1])
+        if self.feat_gaussian_table is None and feat_protein_gaussians is not None:
+            import Gaussian_Fitting
+            self.feat_gaussian_table = Gaussian_Fitting.GaussianTable.from_gaussian_lists(feat_protein_gaussians, self.axes[1])
+
+        gauss_fits_by_cv = self.__dict__.get('gauss_fits_by_cv')
+        if gauss_fits_by_cv is not None and len(gauss_fits_by_cv) == len(self.axes[1]):
+            for cv_index, fit in enumerate(gauss_fits_by_cv):
+                fit.set_data(self.axes[0], self.ciu_data[:, cv_index])
+
+    @property
+    def raw_protein_gaussians(self):
+        """
+        Protein Gaussians at each CV from Gaussian fitting, generated from the Gaussian table
+        :return: list of lists of Gaussians at each CV, or None if Gaussian fitting has not been performed
+        :rtype: list[list[Gaussian_Fitting.Gaussian]]
+        """
+        if self.gaussian_table is None:
+            return None
+        return self.gaussian_table.protein_only().to_gaussian_lists()
+
+    @property
+    def raw_nonprotein_gaussians(self):
+        """
+        Non-protein Gaussians at each CV from Gaussian fitting, generated from the Gaussian table
+        :return: list of lists of Gaussians at each CV, or None if Gaussian fitting has not been performed
+        :rtype: list[list[Gaussian_Fitting.Gaussian]]
+        """
+        if self.gaussian_table is None:
+            return None
+        return self.gaussian_table.nonprotein_only().to_gaussian_lists()
+
+    @property
+    def feat_protein_gaussians(self):
+        """
+        Gaussians assigned to features by Gaussian feature detection at each CV, generated from the feature Gaussian table
+        :return: list of lists of Gaussians at each CV, or None if Gaussian feature detection has not been performed
+        :rtype: list[list[Gaussian_Fitting.Gaussian]]
+        """
+        if self.feat_gaussian_table is None:
+            return None
+        return self.feat_gaussian_table.to_gaussian_lists()
+
     def refresh_data(self):
         """
         Recalculate column max values and other basic data attributes. Should be performed after any
@@ -7,7 +7,10 @@ Authors: Dan Polasky, Sugyan Dixit
 Date: 1/11/2018
 """
 from Gaussian_Fitting import Gaussian
+import Gaussian_Fitting
+import CIU_File_IO
 import numpy as np
+import scipy.special
 import pandas
 import matplotlib.pyplot as plt
 import matplotlib.patches
@@ -26,7 +29,6 @@ from mpl_toolkits.mplot3d import Axes3D
 from sklearn.preprocessing import LabelEncoder, label_binarize
 from sklearn.discriminant_analysis import LinearDiscriminantAnalysis
 from sklearn.metrics import precision_score, roc_curve, auc
-from sklearn.feature_selection import f_classif, GenericUnivariateSelect
 from sklearn.svm import SVC
 from sklearn.multiclass import OneVsRestClassifier
 
@@ -37,12 +39,13 @@ if TYPE_CHECKING:
     from CIU_analysis_obj import CIUAnalysisObj
     from CIU_Params import Parameters
     from Feature_Detection import Feature
+    from CIU_Fingerprint_Stack import FingerprintStack
 
 # load main logger
 logger = logging.getLogger('main')
 
 
-def main_build_classification_new(cl_inputs_by_label, subclass_labels, params_obj, output_dir, manual_feat_select):
+def main_build_classification_new(cl_inputs_by_label, subclass_labels, params_obj, output_dir, manual_feat_select, fingerprint_stack=None):
     """
     Main method for classification. Performs feature selection followed by LDA and classification
     and generates output and plots. Returns a ClassificationScheme object to be saved for future
@@ -55,6 +58,8 @@ def main_build_classification_new(cl_inputs_by_label, subclass_labels, params_ob
     :param params_obj: Parameters object with classification parameter information
     :type params_obj: Parameters
     :param manual_feat_select: boolean - whether to allow the user to manually choose features
+    :param fingerprint_stack: (optional) stack of the equalized input data from axis equalization, used for standardization in All_Data mode
+    :type fingerprint_stack: FingerprintStack
     :return: ClassificationScheme object with the generated scheme
     :rtype: ClassificationScheme
     """
@@ -62,7 +67,7 @@ def main_build_classification_new(cl_inputs_by_label, subclass_labels, params_ob
 
     # Data preparation for Gaussians (if applicable) and standardization
     max_num_gaussians = prep_data_2d(cl_inputs_by_label, params_obj)
-    cl_inputs_by_label, means, stdevs = standardize_all_2d(cl_inputs_by_label, params_obj)
+    cl_inputs_by_label, means, stdevs = standardize_all_2d(cl_inputs_by_label, params_obj, fingerprint_stack)
 
     # convert to subclass oriented data (if no subclasses, will be a single entry in a list)
     class_labels = [class_list[0].class_label for class_list in cl_inputs_by_label]
@@ -155,35 +160,42 @@ def multi_subclass_ufs(subclass_input_list, params_obj, output_path, subclass_la
 
 def generate_products_for_ufs(analysis_obj_list_by_label, shaped_label_list, params_obj):
     """
-    Generate all combinations of replicate data across classes for feature selection. Will
-    create a DataProduct object with the key information for each combination.
+    Compute univariate feature selection scores for all combinations of replicate data across classes
+    (one replicate from each class). Scores are -log10 of the ANOVA F-test p-values for each CV, computed as
+    in sklearn's f_classif, but for all combinations at once from the sums and sums of squares of each replicate.
     :param analysis_obj_list_by_label: list of lists of CIUAnalysisObj's, sorted by class label
     :type analysis_obj_list_by_label: list[list[CIUAnalysisObj]]
     :param shaped_label_list: list of lists of class labels with matching shape of analysis_obj_by_label
     :param params_obj: parameter info
     :type params_obj: Parameters
-    :return: list of DataProduct objects for each combination
-    :rtype: list[UFSResult]
-    """
-    scores = []
-    for object_tuple, label_tuple in zip(itertools.product(*analysis_obj_list_by_label), itertools.product(*shaped_label_list)):
-        # create a UFSResult object for this combination
-        # data_list = [x.ciu_data for x in object_tuple]
-        data_list = [get_classif_data(x, params_obj, ufs_mode=True) for x in object_tuple]
-
-        label_list = [x for x in label_tuple]
-        product = UFSResult(data_list, label_list)
-
-        # Run feature selection for this combination
-        select = GenericUnivariateSelect(score_func=f_classif, mode='percentile', param=100)
-        select.fit(product.combined_data, product.numeric_label_arr)
-
-        product.fit_pvalues = select.pvalues_
-        product.fit_scores = select.scores_
-        product.fit_sc = -np.log10(select.pvalues_)
-
-        # scores.append(product.fit_scores)
-        scores.append(product.fit_sc)   # don't save whole product to reduce memory load
+    :return: array of scores (combinations x CVs)
+    :rtype: numpy.ndarray
+    """
+    # sum and sum of squares of each replicate's data in each CV column
+    sums_by_class, sq_sums_by_class = [], []
+    for analysis_obj_list in analysis_obj_list_by_label:
+        class_data = np.asarray([get_classif_data(x, params_obj, ufs_mode=True) for x in analysis_obj_list], dtype=np.float64)
+        sums_by_class.append(class_data.sum(axis=1))
+        sq_sums_by_class.append((class_data ** 2).sum(axis=1))
+    num_rows = class_data.shape[1]
+
+    # replicate index in each class for all combinations, in the same order as itertools.product
+    combination_indices = np.asarray(list(itertools.product(*[range(len(x)) for x in analysis_obj_list_by_label])))
+
+    # one-way ANOVA for all combinations at once, summing over classes in label order (as in f_classif)
+    class_order = sorted(range(len(analysis_obj_list_by_label)), key=lambda x: shaped_label_list[x][0])
+    num_classes = len(class_order)
+    num_samples = num_classes * num_rows
+    ss_alldata = sum(sq_sums_by_class[x][combination_indices[:, x]] for x in class_order)
+    sums_args = [sums_by_class[x][combination_indices[:, x]] for x in class_order]
+    square_of_sums_alldata = sum(sums_args) ** 2
+    sstot = ss_alldata - square_of_sums_alldata / float(num_samples)
+    ssbn = sum(x ** 2 / num_rows for x in sums_args) - square_of_sums_alldata / float(num_samples)
+    sswn = sstot - ssbn
+    with np.errstate(divide='ignore', invalid='ignore'):
+        f_values = (ssbn / float(num_classes - 1)) / (sswn / float(num_samples - num_classes))
+        pvalues = scipy.special.fdtrc(num_classes - 1, num_samples - num_classes, f_values)
+        scores = -np.log10(pvalues)
     return scores
 
 
@@ -581,19 +593,14 @@ def arrange_lda_new(subset_list):
     :type subset_list: list[DataSubset]
     :return: x_data, numeric labels, string labels for direct input into LDA
     """
-    x_data = []
-    string_labels, numeric_labels = [], []
-    # assemble each dataset into a single list by combining all columns of the input matrices
-    for subset in subset_list:
-        for column in subset.data:
-            x_data.append(column)
-            string_labels.append(subset.class_label)
-            numeric_labels.append(subset.numeric_label)
-
-    # convert to numpy arrays for SKLearn analyses
-    x_data = np.asarray(x_data)
-    string_labels = np.asarray(string_labels)
-    numeric_labels = np.asarray(numeric_labels)
+    if len(subset_list) == 0:
+        return np.asarray([]), np.asarray([]), np.asarray([])
+
+    # assemble each dataset into a single array by combining all columns of the input matrices
+    x_data = np.vstack([subset.data for subset in subset_list])
+    num_columns = [len(subset.data) for subset in subset_list]
+    string_labels = np.repeat(np.asarray([subset.class_label for subset in subset_list]), num_columns)
+    numeric_labels = np.repeat(np.asarray([subset.numeric_label for subset in subset_list]), num_columns)
     return x_data, numeric_labels, string_labels
 
 
@@ -692,15 +699,8 @@ def get_classif_data(analysis_obj, params_obj, ufs_mode=False):
             # for non-UFS, use full input (standardized) Gaussian dataset.
             classif_data = analysis_obj.classif_input_std
         else:
-            # for UFS, only use centroids - remove
-            centroids_by_cv = []
-            for cv_index, gaussian_data_at_cv in enumerate(analysis_obj.classif_input_std.T):
-                current_centroids = []
-                for feat_index, gaussian_attribute in enumerate(gaussian_data_at_cv):
-                    if feat_index % 3 == 0:
-                        current_centroids.append(gaussian_attribute)
-                centroids_by_cv.append(current_centroids)
-            classif_data = np.asarray(centroids_by_cv).T    # transpose because we transposed at the start (in the loop) to access by CV
+            # for UFS, only use centroids (every third feature row of the standardized data)
+            classif_data = np.asarray(analysis_obj.classif_input_std)[0::3]
 
     return classif_data
 
@@ -755,7 +755,7 @@ def prep_gaussfeats_for_classif(features_list, analysis_obj):
             mean_dt = np.mean(analysis_obj.axes[0])
             final_gaussian_lists[cv_index].append(Gaussian(centroid=mean_dt, amplitude=0, width=0, collision_voltage=cv, pcov=None, protein_bool=False))
 
-    analysis_obj.classif_gaussians_by_cv = final_gaussian_lists
+    analysis_obj.classif_gaussians_by_cv = Gaussian_Fitting.GaussianTable.from_gaussian_lists(final_gaussian_lists, analysis_obj.axes[1])
     return final_gaussian_lists
 
 
@@ -826,16 +826,13 @@ def prep_data_2d(cl_inputs_by_label, params_obj):
                 if not params_obj.classif_1_input_mode == 'All_Data':
                     if params_obj.classif_1_input_mode == 'Gaussian_Feat':
                         # prepare gaussian features if using feature mode for classification (saves to container)
-                        gaussians_by_cv = prep_gaussfeats_for_classif(analysis_obj.features_gaussian, analysis_obj)
+                        prep_gaussfeats_for_classif(analysis_obj.features_gaussian, analysis_obj)
                     else:
                         # Gaussian raw mode, so Gaussians by CV comes directly from the container
-                        gaussians_by_cv = analysis_obj.raw_protein_gaussians
-                        analysis_obj.classif_gaussians_by_cv = gaussians_by_cv
+                        analysis_obj.classif_gaussians_by_cv = analysis_obj.gaussian_table.protein_only()
 
                     # update the max number of gaussians if necessary
-                    for gaussian_list in gaussians_by_cv:
-                        if len(gaussian_list) > max_num_gaussians:
-                            max_num_gaussians = len(gaussian_list)
+                    max_num_gaussians = max(max_num_gaussians, int(np.max(analysis_obj.classif_gaussians_by_cv.counts_by_cv(), initial=0)))
                     # save num Gaussians to ensure all matrices same size
                     params_obj.silent_clf_4_num_gauss = max_num_gaussians
                 else:
@@ -852,44 +849,33 @@ def prep_data_2d(cl_inputs_by_label, params_obj):
     return max_num_gaussians
 
 
-def prep_gaussian_input_raw(gaussians_by_cv, max_num_gaussians, selected_cvs=None):
+def prep_gaussian_input_raw(gaussian_table, max_num_gaussians, selected_cvs=None):
     """
-    Assemble a 2D numpy array of correct final dimensions from a list of Gaussians at
-    each collision voltage. Selected CVs can be provided (e.g. for unknown data)
-    :param gaussians_by_cv:
-    :type gaussians_by_cv: list[list[Gaussian]
+    Assemble a 2D numpy array of correct final dimensions from a table of Gaussians. Each row of the
+    output is one CV (CVs without Gaussians are skipped), with the [centroid, width, amplitude] of each
+    Gaussian at that CV in order, padded with zeros up to max_num_gaussians. Selected CVs can be
+    provided (e.g. for unknown data)
+    :param gaussian_table: table of Gaussians
+    :type gaussian_table: Gaussian_Fitting.GaussianTable
     :param max_num_gaussians: maximum number of Gaussians in the classifying scheme
     :param selected_cvs: list of CVs to consider for unknown data
     :return: 2D numpy array of formatted Gaussian information for input to standardization/classification
     """
-    classif_data = []
-    for gaussian_list in gaussians_by_cv:
-        # skip any non-selected CVs if requested (i.e. in unknown analysis mode)
-        if selected_cvs is not None:
-            if not gaussian_list[0].cv in selected_cvs:
-                continue
-        attributes = ['cent', 'width', 'amp']
-        attribute_list = np.zeros(max_num_gaussians * len(attributes))
-
-        attribute_index = 0
-        if len(gaussian_list) == 0:
-            continue
-        for gaussian in gaussian_list:
-            attribute_list[attribute_index] = gaussian.centroid
-            attribute_index += 1
-            attribute_list[attribute_index] = gaussian.width
-            attribute_index += 1
-            attribute_list[attribute_index] = gaussian.amplitude
-            attribute_index += 1
-
-        classif_data.append(attribute_list)
-    # classif_data = np.asarray(classif_data).T
-    classif_data = np.asarray(classif_data)
+    attributes = ['centroid', 'width', 'amplitude']
+    rows = gaussian_table.rows
+    classif_data = np.zeros((len(gaussian_table.cv_axis), max_num_gaussians * len(attributes)))
+    first_col_indices = gaussian_table.get_ranks() * len(attributes)
+    for attribute_index, attribute in enumerate(attributes):
+        classif_data[rows['cv_index'], first_col_indices + attribute_index] = rows[attribute]
 
-    return classif_data
+    # skip empty CVs and any non-selected CVs if requested (i.e. in unknown analysis mode)
+    cvs_to_keep = gaussian_table.counts_by_cv() > 0
+    if selected_cvs is not None:
+        cvs_to_keep &= np.isin(gaussian_table.cv_axis, selected_cvs)
+    return classif_data[cvs_to_keep]
 
 
-def standardize_all_2d(cl_inputs_by_label, params_obj):
+def standardize_all_2d(cl_inputs_by_label, params_obj, fingerprint_stack=None):
     """
     Standardization wrapper to standardize across the complete input dataset. Intended to be
     called prior to any UFS or crossval. Saves standardized data into a field in the CIUAnalysisObj
@@ -902,6 +888,9 @@ def standardize_all_2d(cl_inputs_by_label, params_obj):
     :type cl_inputs_by_label: list[list[ClInput]]
     :param params_obj: Parameters object with classification parameter information
     :type params_obj: Parameters
+    :param fingerprint_stack: (optional) stack of the equalized data of all inputs (from axis equalization). Used
+    as the raw data in All_Data mode rather than re-assembling it from the analysis objects
+    :type fingerprint_stack: FingerprintStack
     :return: input 2D cl_input list, mean/stdev matrices used for standardization
     """
     # Read input dimensions and prepare mean/stdev dataframes
@@ -911,35 +900,31 @@ def standardize_all_2d(cl_inputs_by_label, params_obj):
     cv_axis = example_obj.axes[1]
     feature_axis = get_feature_axis(example_obj, params_obj.classif_1_input_mode, params_obj.classif_93_std_all_gsns_bool)
 
-    means = {x: pandas.DataFrame(np.zeros((len(feature_axis), len(cv_axis))), index=feature_axis, columns=cv_axis) for x in subclass_labels}
-    stdevs = {x: pandas.DataFrame(np.zeros((len(feature_axis), len(cv_axis))), index=feature_axis, columns=cv_axis) for x in subclass_labels}
-
     # Assemble the data across all classes to standardize by feature/cv/subclass
-    for cv_index, cv in enumerate(cv_axis):
-        for feature_index, feature in enumerate(feature_axis):
-            output_data_by_subcl = {x: [] for x in subclass_labels}
-
-            for class_clinput_list in cl_inputs_by_label:
-                for cl_input in class_clinput_list:
-                    for subclass_label, analysis_obj in cl_input.subclass_dict.items():
-                        if not params_obj.classif_1_input_mode == 'All_Data':
-                            if params_obj.classif_93_std_all_gsns_bool:
-                                # combining all Gaussians to standardize together - get every third feature (all centroids or widths or amplitudes, depending on feat_index)
-                                features = analysis_obj.classif_input_raw[cv_index][feature_index::3]
-                                output_data_by_subcl[subclass_label].extend(features)
-                            else:
-                                # Individual Gaussian mode, append data as normal
-                                output_data_by_subcl[subclass_label].append(analysis_obj.classif_input_raw[cv_index][feature_index])
-                        else:
-                            # In raw data mode, average across whole ATD rather than including each point
-                            cv_col_matrix = np.swapaxes(analysis_obj.classif_input_raw, 0, 1)
-                            cv_col_atd = cv_col_matrix[cv_index]
-                            output_data_by_subcl[subclass_label].extend(cv_col_atd)
-
-            # compute mean/std
-            for subclass_label, data_array in output_data_by_subcl.items():
-                means[subclass_label].loc[feature, cv] = np.mean(data_array)
-                stdevs[subclass_label].loc[feature, cv] = np.std(data_array)
+    means, stdevs = {}, {}
+    for subclass_label in subclass_labels:
+        if params_obj.classif_1_input_mode == 'All_Data' and fingerprint_stack is not None:
+            raw_data = fingerprint_stack.select(subclass_key=subclass_label).data
+        else:
+            raw_data = np.asarray([cl_input.subclass_dict[subclass_label].classif_input_raw for class_clinput_list in cl_inputs_by_label for cl_input in class_clinput_list], dtype=np.float64)
+
+        if params_obj.classif_1_input_mode == 'All_Data':
+            # In raw data mode, average across whole ATD rather than including each point. Data is (file, DT, CV)
+            subclass_means = [np.mean(raw_data, axis=(0, 1))]
+            subclass_stdevs = [np.std(raw_data, axis=(0, 1))]
+        else:
+            # Gaussian data is (file, CV, feature)
+            raw_data = raw_data[:, :len(cv_axis)]
+            if params_obj.classif_93_std_all_gsns_bool:
+                # combining all Gaussians to standardize together - use every third feature (all centroids or widths or amplitudes, depending on feat_index)
+                subclass_means = [np.mean(raw_data[:, :, feature_index::3], axis=(0, 2)) for feature_index in range(len(feature_axis))]
+                subclass_stdevs = [np.std(raw_data[:, :, feature_index::3], axis=(0, 2)) for feature_index in range(len(feature_axis))]
+            else:
+                # Individual Gaussian mode
+                subclass_means = np.mean(raw_data, axis=0).T
+                subclass_stdevs = np.std(raw_data, axis=0).T
+        means[subclass_label] = pandas.DataFrame(np.asarray(subclass_means), index=feature_axis, columns=cv_axis)
+        stdevs[subclass_label] = pandas.DataFrame(np.asarray(subclass_stdevs), index=feature_axis, columns=cv_axis)
 
     # now that means/stdevs are known, loop over the data again to standardize using that information
     for class_clinput_list in cl_inputs_by_label:
@@ -1000,38 +985,18 @@ def standardize_ciu_obj(cl_input, means_dict, stdevs_dict, params_obj):
         means = means_dict[subclass_label].values
         stdevs = stdevs_dict[subclass_label].values
         cv_axis_len = len(means[0])
+        raw_data = np.asarray(analysis_obj.classif_input_raw, dtype=np.float64)
 
-        standardized_data = np.zeros(np.shape(analysis_obj.classif_input_raw))
-        raw_std_data = []
-        for cv_index in range(cv_axis_len):
-            # get correct feature axis shape
-            if params_obj.classif_1_input_mode == 'All_Data':
-                feature_axis_len = len(means)
-            else:
-                feature_axis_len = len(analysis_obj.classif_input_raw[cv_index])
-
-            for feature_index in range(feature_axis_len):
-                if not params_obj.classif_1_input_mode == 'All_Data':
-                    if params_obj.classif_93_std_all_gsns_bool:
-                        # combined Gaussians mode - use single mean/standard for all Gaussians
-                        this_feat_mean = means[feature_index % 3][cv_index]
-                        this_feat_stdev = stdevs[feature_index % 3][cv_index]
-                    else:
-                        # separate Gaussians mode - use unique mean/standard for each Gaussian
-                        this_feat_mean = means[feature_index][cv_index]
-                        this_feat_stdev = stdevs[feature_index][cv_index]
-                    raw_datapoint = analysis_obj.classif_input_raw[cv_index][feature_index]
-                    standardized_data[cv_index][feature_index] = standardize_data(raw_datapoint, this_feat_mean, this_feat_stdev, params_obj.classif_92_standardize)
-                else:
-                    # raw data mode - need to average across whole CV column
-                    this_feat_mean = means[feature_index][cv_index]
-                    this_feat_stdev = stdevs[feature_index][cv_index]
-                    raw_data_col = np.swapaxes(analysis_obj.classif_input_raw, 0, 1)[cv_index]
-                    std_data_col = standardize_data(raw_data_col, this_feat_mean, this_feat_stdev, params_obj.classif_92_standardize)
-                    raw_std_data.append(std_data_col)
         if params_obj.classif_1_input_mode == 'All_Data':
-            standardized_data = np.swapaxes(raw_std_data, 0, 1)
+            # raw data mode - standardize each CV column (DT x CV data) by the mean/stdev for that CV
+            standardized_data = np.array(standardize_data(raw_data[:, :cv_axis_len], means[0], stdevs[0], params_obj.classif_92_standardize))
         else:
+            # Gaussian data is CV x feature. Combined Gaussians mode uses a single mean/stdev for all Gaussians (by attribute)
+            feature_indices = np.arange(raw_data.shape[1])
+            if params_obj.classif_93_std_all_gsns_bool:
+                feature_indices = feature_indices % 3
+            standardized_data = np.zeros(np.shape(raw_data))
+            standardized_data[:cv_axis_len] = standardize_data(raw_data[:cv_axis_len], means[feature_indices].T, stdevs[feature_indices].T, params_obj.classif_92_standardize)
             standardized_data = standardized_data.T
         analysis_obj.classif_input_std = standardized_data
     return cl_input
@@ -1040,7 +1005,8 @@ def standardize_ciu_obj(cl_input, means_dict, stdevs_dict, params_obj):
 def standardize_data(datapoint, mean, stdev, standardize_bool):
     """
     Standardize the input CIU data using the common (xi - x_mean) / stdev approach. Datapoint
-    can be an input value or array.
+    can be an input value or array. Mean and stdev can be single values or arrays (e.g. of values
+    for each CV column) that broadcast against the datapoint.
     :param datapoint: 2D numpy array of CIU data OR single point (feature/CV combination for Gaussian data)
     :param mean: feature mean for standardization
     :param stdev: feature standard deviation
@@ -1051,6 +1017,12 @@ def standardize_data(datapoint, mean, stdev, standardize_bool):
     if not standardize_bool:
         return datapoint
 
+    if np.ndim(stdev) > 0:
+        # standardize all points at once, leaving points with stdev 0 as 0 (see below)
+        difference = np.asarray(datapoint - mean, dtype=np.float64)
+        stdev = np.broadcast_to(stdev, difference.shape)
+        return np.divide(difference, stdev, out=np.zeros(difference.shape), where=stdev != 0)
+
     if stdev == 0:
         # should only occur in cases where data was empty (value of 0) to begin with, as otherwise all replicates would have to have same value to numerical precision
         std_data = 0
@@ -1081,6 +1053,137 @@ def reduce_means_for_unk_standardize(unk_cl_input, input_means, input_stds):
     return input_means, input_stds
 
 
+def load_classif_inputs_from_files(files, class_labels, subclass_labels):
+    """
+    Helper method for generating a sorted list of lists of ClInputs by class label from files
+    and labels. Used in both loading from table and template.
+    :param files: list of file paths (strings) to load data from
+    :param class_labels: list of strings. Each will be searched against the filenames to sort by class
+    :param subclass_labels: list of strings. Each will be searched against the filenames to sort by subclass
+    :return: list of lists of ClInputs by class label
+    :rtype: list[list[ClInput]]
+    """
+    cl_inputs_by_label = []
+
+    # Generate class oriented files for crossval/classification
+    for class_label in class_labels:
+        class_files = [x for x in files if class_label in x]
+
+        # generate dictionary of all subclass data
+        subclass_lists = []
+        if '0' in subclass_labels and len(subclass_labels) == 1:
+            # No subclasses in this analysis - use all class files with default subclass label
+            subclass_lists.append(('0', class_files))
+        else:
+            for subclass_label in subclass_labels:
+                subclass_files = [x for x in class_files if subclass_label in x]
+                subclass_lists.append((subclass_label, subclass_files))
+
+        # reorganize files into individual replicates, each containing all subclasses
+        all_replicates = []
+        for rep_index in range(len(subclass_lists[0][1])):
+            try:
+                subclass_dict = {}
+                for subclass_tup in subclass_lists:
+                    subclass_label = subclass_tup[0]
+                    subclass_files = subclass_tup[1]
+                    subclass_obj = CIU_File_IO.load_analysis_file(subclass_files[rep_index])
+                    subclass_dict[subclass_label] = subclass_obj
+                cl_input = ClInput(class_label, subclass_dict)
+                all_replicates.append(cl_input)
+            except IndexError:
+                # not an even number of replicates in all files - stop once reached max number in smallest subclass
+                logger.info('Not all states had {} replicates. Only {} replicates generated.'.format(rep_index + 1, rep_index))
+                break
+        cl_inputs_by_label.append(all_replicates)
+    return cl_inputs_by_label
+
+
+def load_clinputs_subclass(files, subclass_labels, class_label):
+    """
+    Analogue to load_classif_inputs_from_files, except used to load subclass replicate data rather
+    than replicates delineated by classes. Sorts input data into replicates by subclass label (if
+    provided) or containers without subclass info if not.
+    :param files: list of file paths to raw data
+    :param subclass_labels: list of strings corresponding to subclass labels (or ['0'] if not using subclass mode)
+    :param class_label: class label (string) for the inputs. Use 'unk' for unknowns
+    :return: list of ClInputs
+    :rtype: list[ClInput]
+    """
+    # Generate lists of all subclass data (if using subclass mode)
+    subclass_lists = []
+    if '0' in subclass_labels and len(subclass_labels) == 1:
+        # No subclasses in this analysis - use all class files with default subclass label
+        subclass_lists.append(('0', files))
+    else:
+        for subclass_label in subclass_labels:
+            subclass_files = [x for x in files if subclass_label in x]
+            subclass_lists.append((subclass_label, subclass_files))
+
+    # reorganize files into individual replicates, each containing all subclasses
+    all_replicates = []
+    if len(subclass_lists[0][1]) == 0:
+        logger.warning('State {} did not have any datasets! No replicates could be generated.'.format(subclass_lists[0][0]))
+    for rep_index in range(len(subclass_lists[0][1])):
+        subclass_label = ''
+        try:
+            subclass_dict = {}
+            for subclass_tup in subclass_lists:
+                subclass_label = subclass_tup[0]
+                subclass_files = subclass_tup[1]
+                subclass_obj = CIU_File_IO.load_analysis_file(subclass_files[rep_index])
+                subclass_dict[subclass_label] = subclass_obj
+            cl_input = ClInput(class_label, subclass_dict)
+            all_replicates.append(cl_input)
+        except IndexError:
+            # not an even number of replicates in all files - skip odd numbers
+            logger.info('State {} did not have {} datasets. Only {} replicates generated.'.format(subclass_label, rep_index + 1, rep_index))
+            break
+    return all_replicates
+
+
+def check_classif_data(cl_inputs_by_label, subclass_labels):
+    """
+    Check that a set of classification data is organized correctly. It must have at least 2 classes
+    with at least 2 replicates each. All replicates must also have the same number of subclasses.
+    :param cl_inputs_by_label: organized list of ClInputs by label
+    :type cl_inputs_by_label: list[list[ClInput]]
+    :param subclass_labels: list of subclass labels
+    :return: boolean - True if all good, False if any errors
+    """
+    if len(cl_inputs_by_label) > 1:
+        # check each input list
+        for class_list in cl_inputs_by_label:
+            if len(class_list) < 3:
+                # not enough replicates! return false
+                try:
+                    class_label = class_list[0].class_label
+                except IndexError:
+                    class_label = '(No data in class)'
+                logger.error('Only {} replicates in class {}. At least 3 are required for each class. Classification canceled.'.format(len(class_list), class_label))
+                return False
+
+            # make sure all replicates have same subclasses
+            for cl_input in class_list:
+                subclass_len = len(cl_input.subclass_dict.keys())
+                if not subclass_len == len(subclass_labels):
+                    # if '0' not in cl_input.subclass_dict.keys() and subclass_len == 1:
+                    # not correct number of subclasses
+                    logger.error('Should have {} states, but replicate had {}. Check input data and try again.'.format(len(cl_input.subclass_dict.keys()), len(subclass_labels)))
+                    return False
+                for subclass_label in cl_input.subclass_dict.keys():
+                    if subclass_label not in subclass_labels:
+                        logger.error('State label {} was not supposed to be present! Classification canceled'.format(subclass_label))
+                        return False
+
+        # no errors - return True
+        return True
+    else:
+        # no data (or only one class) loaded! return false
+        logger.error('Only {} complete classes; at least 2 are required. Classification canceled.'.format(len(cl_inputs_by_label)))
+        return False
+
+
 def subclass_inputs_from_class_inputs(cl_inputs_by_label, subclass_label_list, class_labels):
     """
     Generate and return a list of ClassifInput containers (organized by subclass) from the primary
@@ -1924,15 +2027,14 @@ class ClassificationScheme(object):
             if not params_obj.classif_1_input_mode == 'All_Data':
                 if params_obj.classif_1_input_mode == 'Gaussian_Feat':
                     # prepare gaussian features for classification (saves to container)
-                    gaussians_by_cv = prep_gaussfeats_for_classif(analysis_obj.features_gaussian, analysis_obj)
+                    prep_gaussfeats_for_classif(analysis_obj.features_gaussian, analysis_obj)
                 elif params_obj.classif_1_input_mode == 'Gaussian_Raw':
                     # use raw protein Gaussians without feature prep
-                    gaussians_by_cv = analysis_obj.raw_protein_gaussians
+                    analysis_obj.classif_gaussians_by_cv = analysis_obj.gaussian_table.protein_only()
                 else:
-                    gaussians_by_cv = []
+                    analysis_obj.classif_gaussians_by_cv = Gaussian_Fitting.GaussianTable(np.zeros(0, dtype=Gaussian_Fitting.gaussian_table_dtype), analysis_obj.axes[1])
 
-                analysis_obj.classif_gaussians_by_cv = gaussians_by_cv
-                input_classif_raw = prep_gaussian_input_raw(gaussians_by_cv, self.num_gaussians)
+                input_classif_raw = prep_gaussian_input_raw(analysis_obj.classif_gaussians_by_cv, self.num_gaussians)
                 analysis_obj.classif_input_raw = input_classif_raw
             else:
                 # all data mode - initialize raw data for classification
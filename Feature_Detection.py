@@ -8,7 +8,6 @@ Date: 10/10/2017
 """
 
 import numpy as np
-import matplotlib.pyplot as plt
 import scipy.stats
 import scipy.optimize
 import scipy.interpolate
@@ -18,6 +17,8 @@ import logging
 import Raw_Processing
 import Gaussian_Fitting
 import Original_CIU
+import CIU_Cache
+import CIU_Plot_Service
 from tkinter import messagebox
 
 # imports for type checking
@@ -119,15 +120,31 @@ def feature_detect_gaussians(analysis_obj, params_obj):
         # uneven CV spacing - tell user to interpolate axes and re-do gaussian fitting
         raise ValueError
 
+    # reuse previous results if these Gaussians have already been assigned to features with the same parameters
+    result_cache = CIU_Cache.get_cache(params_obj)
+    if result_cache is not None:
+        cache_key = CIU_Cache.compute_stage_key('feature_detect_gaussian', [analysis_obj.axes[0], cv_axis, gaussians_to_array(analysis_obj)], params_obj)
+        cached_result = result_cache.load(cache_key)
+        if cached_result is not None:
+            analysis_obj.features_gaussian, analysis_obj.feat_gaussian_table = cached_result
+            return analysis_obj
+
     # compute width tolerance in DT units and gap tolerance in CV units
     width_tol_dt = params_obj.feature_t2_2_width_tol  # * analysis_obj.bin_spacing
     cv_spacing = analysis_obj.axes[1][1] - analysis_obj.axes[1][0]
     gap_tol_cv = params_obj.feature_t2_3_ciu50_gap_tol * cv_spacing
 
+    gaussian_table = analysis_obj.gaussian_table
+    protein_table = gaussian_table.protein_only()
+    nonprotein_table = gaussian_table.nonprotein_only()
+    # Gaussian objects are only generated for non-protein peaks that are added to a feature (by row index)
+    nonprotein_gaussians = {}
+
     # Search each protein gaussian for features it matches (based on centroid)
-    for cv_index, protein_gauss_list in enumerate(analysis_obj.raw_protein_gaussians):
+    for cv_index in range(len(cv_axis)):
         # First, assign protein Gaussians to features
-        for gaussian in protein_gauss_list:
+        for row in protein_table.get_cv(cv_index):
+            gaussian = Gaussian_Fitting.make_gaussian_from_row(row)
             # check if any current features will accept the Gaussian
             found_feature = False
             for feature in features:
@@ -145,40 +162,12 @@ def feature_detect_gaussians(analysis_obj, params_obj):
 
         # After protein features are done, check if any nonprotein peaks match any features that don't already have a protein peak at this CV
         if params_obj.feature_t2_5_gauss_allow_nongauss:
-            if analysis_obj.raw_nonprotein_gaussians is not None:
-                for nonprot_gaussian in analysis_obj.raw_nonprotein_gaussians[cv_index]:
-                    current_cv = nonprot_gaussian.cv
-                    for feature in features:
-                        protein_cvs = [x.cv for x in feature.gaussians]
-                        if current_cv not in protein_cvs:
-                            # use 2x feature standard deviation as width tolerance for non-protein peaks (95% conf lvl analogy)
-                            nonprot_width_tol = feature.get_std_dev() * 2
-
-                            # this feature does not currently have any entries at this CV value, making it available to add a non-prot peak
-                            if feature.accept_centroid(nonprot_gaussian.centroid, nonprot_width_tol, current_cv, gap_tol_cv, cv_spacing):
-                                # Change this "non-protein" Gaussian to a protein - likely misassigned
-                                nonprot_gaussian.is_protein = True
-                                feature.gaussians.append(nonprot_gaussian)
+            assign_nonprotein_gaussians(nonprotein_table, cv_index, nonprotein_gaussians, features, gap_tol_cv, cv_spacing)
 
     # perform a second pass to add to features that were created after the CV at which these non-protein peaks were considered
     if params_obj.feature_t2_5_gauss_allow_nongauss:
-        if analysis_obj.raw_nonprotein_gaussians is not None:
-            for cv_index, protein_gauss_list in reversed(list(enumerate(analysis_obj.raw_protein_gaussians))):
-                for nonprot_gaussian in analysis_obj.raw_nonprotein_gaussians[cv_index]:
-                    current_cv = nonprot_gaussian.cv
-                    for feature in features:
-                        protein_cvs = [x.cv for x in feature.gaussians]
-                        if current_cv not in protein_cvs:
-                            # use 2x feature standard deviation as width tolerance for non-protein peaks (95% conf lvl analogy)
-                            nonprot_width_tol = feature.get_std_dev() * 2
-
-                            # this feature does not currently have any entries at this CV value, making it available to add a non-prot peak
-                            if feature.accept_centroid(nonprot_gaussian.centroid, nonprot_width_tol, current_cv, gap_tol_cv, cv_spacing):
-                                # Change this "non-protein" Gaussian to a protein - likely misassigned
-                                if nonprot_gaussian not in feature.gaussians:
-                                    # make sure this protein isn't already in this feature
-                                    nonprot_gaussian.is_protein = True
-                                    feature.gaussians.append(nonprot_gaussian)
+        for cv_index in reversed(range(len(cv_axis))):
+            assign_nonprotein_gaussians(nonprotein_table, cv_index, nonprotein_gaussians, features, gap_tol_cv, cv_spacing)
 
     # ensure cvs and Gaussians are sorted in ascending order (only necessary if appending non-protein peaks AND a nonprotein peak is added out of order last)
     for feature in features:
@@ -193,14 +182,82 @@ def feature_detect_gaussians(analysis_obj, params_obj):
         filtered_features = fill_feature_gaps(filtered_features, cv_spacing)
     filtered_features = check_feature_order(filtered_features)
 
-    # save filtered gaussians into analysis object as feat_protein_gaussians
+    # save filtered gaussians into analysis object (as a table, from which feat_protein_gaussians is generated)
     analysis_obj.features_gaussian = filtered_features
-    assigned_gaussians = gaussians_by_cv_from_feats(filtered_features, cv_axis)
-    analysis_obj.feat_protein_gaussians = assigned_gaussians
+    analysis_obj.feat_gaussian_table = gaussian_table_from_feats(filtered_features, cv_axis)
 
+    if result_cache is not None:
+        result_cache.save(cache_key, (analysis_obj.features_gaussian, analysis_obj.feat_gaussian_table))
     return analysis_obj
 
 
+def assign_nonprotein_gaussians(nonprotein_table, cv_index, nonprotein_gaussians, features, gap_tol_cv, cv_spacing):
+    """
+    Add the non-protein Gaussians at one CV to any features that they match and that do not already have a
+    protein peak at this CV. Matching non-protein peaks are likely misassigned, so they are added as protein Gaussians.
+    :param nonprotein_table: table of non-protein Gaussians
+    :type nonprotein_table: Gaussian_Fitting.GaussianTable
+    :param cv_index: index of the CV to check
+    :param nonprotein_gaussians: dict of (table row index: Gaussian) for non-protein peaks already added to features. Updated in place
+    :param features: list of current Features
+    :type features: list[Feature]
+    :param gap_tol_cv: gap tolerance in CV units
+    :param cv_spacing: distance between points along the CV axis
+    :return: void
+    """
+    row_offset = nonprotein_table.cv_offsets[cv_index]
+    for row_index, row in enumerate(nonprotein_table.get_cv(cv_index), start=row_offset):
+        current_cv = row['cv']
+        for feature in features:
+            protein_cvs = [x.cv for x in feature.gaussians]
+            if current_cv not in protein_cvs:
+                # use 2x feature standard deviation as width tolerance for non-protein peaks (95% conf lvl analogy)
+                nonprot_width_tol = feature.get_std_dev() * 2
+
+                # this feature does not currently have any entries at this CV value, making it available to add a non-prot peak
+                if feature.accept_centroid(row['centroid'], nonprot_width_tol, current_cv, gap_tol_cv, cv_spacing):
+                    # Change this "non-protein" Gaussian to a protein - likely misassigned
+                    nonprot_gaussian = nonprotein_gaussians.get(row_index)
+                    if nonprot_gaussian is None:
+                        nonprot_gaussian = Gaussian_Fitting.make_gaussian_from_row(row)
+                        nonprot_gaussian.is_protein = True
+                        nonprotein_gaussians[row_index] = nonprot_gaussian
+                    if nonprot_gaussian not in feature.gaussians:
+                        # make sure this protein isn't already in this feature
+                        feature.gaussians.append(nonprot_gaussian)
+
+
+def gaussians_to_array(analysis_obj):
+    """
+    Collect the parameters of all raw (protein and non-protein) Gaussians in an analysis object into
+    a single array, e.g. for hashing
+    :param analysis_obj: CIUAnalysisObj with Gaussians fitted
+    :type analysis_obj: CIUAnalysisObj
+    :return: 2D numpy array with rows of [cv index, protein (1) or nonprotein (0), amplitude, centroid, width]
+    """
+    rows = analysis_obj.gaussian_table.rows
+    return np.column_stack([rows['cv_index'], rows['is_protein'], rows['amplitude'], rows['centroid'], rows['width']]).astype(float)
+
+
+def gaussian_table_from_feats(feature_list, cv_axis):
+    """
+    Generate a table of all Gaussians in a list of features, with the index of each Gaussian's feature as its feature ID
+    :param feature_list: list of Features
+    :type feature_list: list[Feature]
+    :param cv_axis: CV axis to ensure Gaussians are placed in the correct location
+    :rtype: Gaussian_Fitting.GaussianTable
+    """
+    rows = np.zeros(sum(len(feature.gaussians) for feature in feature_list), dtype=Gaussian_Fitting.gaussian_table_dtype)
+    row_index = 0
+    for feature_id, feature in enumerate(feature_list):
+        for gaussian in feature.gaussians:
+            # gap-filled Gaussians have CVs computed from the spacing, so match to the nearest CV
+            cv_index = np.argmin(np.abs(cv_axis - gaussian.cv))
+            rows[row_index] = (gaussian.cv, cv_index, gaussian.amplitude, gaussian.centroid, gaussian.width, gaussian.is_protein, feature_id)
+            row_index += 1
+    return Gaussian_Fitting.GaussianTable(rows, cv_axis)
+
+
 def gaussians_by_cv_from_feats(feature_list, cv_axis):
     """
     Generate a list of Gaussians by CV from a list of features
@@ -244,7 +301,7 @@ def ciu50_main(features_list, analysis_obj, params_obj, outputdir, gaussian_bool
     if gaussian_bool:
         adjusted_features = adjust_gauss_features(features_list, analysis_obj, params_obj)
         adjusted_features = check_feature_order(adjusted_features)
-        plot_features(adjusted_features, analysis_obj, params_obj, outputdir, filename_append='_adjusted')
+        CIU_Plot_Service.submit_plot(params_obj, outputdir, plot_features, adjusted_features, analysis_obj, params_obj, outputdir, filename_append='_adjusted')
     else:
         adjusted_features = features_list
 
@@ -254,7 +311,7 @@ def ciu50_main(features_list, analysis_obj, params_obj, outputdir, gaussian_bool
         logger.info('No transitions found for file {}'.format(os.path.basename(analysis_obj.filename).rstrip('.ciu')))
 
     # generate output plot
-    plot_transitions(transitions_list, analysis_obj, params_obj, outputdir)
+    CIU_Plot_Service.submit_plot(params_obj, outputdir, plot_transitions, transitions_list, analysis_obj, params_obj, outputdir)
     return analysis_obj
 
 
@@ -460,12 +517,12 @@ def plot_features(feature_list, analysis_obj, params_obj, outputdir, filename_ap
     :return: void
     """
     # initialize plot
-    plt.clf()
-    plt.figure(figsize=(params_obj.plot_03_figwidth, params_obj.plot_04_figheight), dpi=params_obj.plot_05_dpi)
+    figure = CIU_Plot_Service.new_figure(params_obj)
+    axes = figure.add_subplot()
 
     # plot the initial CIU contour plot for reference
     levels = Original_CIU.get_contour_levels(analysis_obj.ciu_data)
-    plt.contourf(analysis_obj.axes[1], analysis_obj.axes[0], analysis_obj.ciu_data, levels=levels, cmap=params_obj.plot_01_cmap)
+    contours = axes.contourf(analysis_obj.axes[1], analysis_obj.axes[0], analysis_obj.ciu_data, levels=levels, cmap=params_obj.plot_01_cmap)
 
     # prepare and plot the actual Features using saved data
     feature_index = 1
@@ -473,75 +530,51 @@ def plot_features(feature_list, analysis_obj, params_obj, outputdir, filename_ap
         # plot the raw data to show what was fit
         for feature in feature_list:
             for gaussian in feature.gaussians:
-                plt.plot(gaussian.cv, gaussian.centroid, 'wo', markersize=params_obj.plot_14_dot_size, markeredgecolor='black')
+                axes.plot(gaussian.cv, gaussian.centroid, 'wo', markersize=params_obj.plot_14_dot_size, markeredgecolor='black')
 
         for feature in feature_list:
             feature_x = feature.cvs
             feature_y = [feature.gauss_median_centroid for _ in feature.cvs]
-            lines = plt.plot(feature_x, feature_y, label='Feature {} median: {:.2f}'.format(feature_index,
-                                                                                            feature.get_median()))
+            axes.plot(feature_x, feature_y, linewidth=3, label='Feature {} median: {:.2f}'.format(feature_index,
+                                                                                                  feature.get_median()))
             feature_index += 1
-            plt.setp(lines, linewidth=3)
     elif params_obj.feature_t1_1_ciu50_mode == 'standard':
         # plot the raw data to show what was fit
-        plt.plot(analysis_obj.axes[1], analysis_obj.col_max_dts, 'wo', markersize=params_obj.plot_14_dot_size, markeredgecolor='black')
+        axes.plot(analysis_obj.axes[1], analysis_obj.col_max_dts, 'wo', markersize=params_obj.plot_14_dot_size, markeredgecolor='black')
 
         for feature in feature_list:
             feature_x = feature.cvs
             feature_y = feature.dt_max_vals
-            lines = plt.plot(feature_x, feature_y, label='Feature {} median: {:.2f}'.format(feature_index,
-                                                                                            feature.get_median()))
+            axes.plot(feature_x, feature_y, linewidth=3, label='Feature {} median: {:.2f}'.format(feature_index,
+                                                                                                  feature.get_median()))
             feature_index += 1
-            plt.setp(lines, linewidth=3)
     else:
         logger.error('invalid mode')
 
     # plot titles, labels, and legends
     if params_obj.plot_12_custom_title is not None:
         plot_title = params_obj.plot_12_custom_title
-        plt.title(plot_title, fontsize=params_obj.plot_13_font_size, fontweight='bold')
+        axes.set_title(plot_title, fontsize=params_obj.plot_13_font_size, fontweight='bold')
     elif params_obj.plot_11_show_title:
         plot_title = analysis_obj.short_filename
-        plt.title(plot_title, fontsize=params_obj.plot_13_font_size, fontweight='bold')
+        axes.set_title(plot_title, fontsize=params_obj.plot_13_font_size, fontweight='bold')
     if params_obj.plot_06_show_colorbar:
-        cbar = plt.colorbar(ticks=[0, .25, .5, .75, 1])
+        cbar = figure.colorbar(contours, ax=axes, ticks=[0, .25, .5, .75, 1])
         cbar.ax.tick_params(labelsize=params_obj.plot_13_font_size)
     if params_obj.plot_08_show_axes_titles:
-        plt.xlabel(params_obj.plot_09_x_title, fontsize=params_obj.plot_13_font_size, fontweight='bold')
-        plt.ylabel(params_obj.plot_10_y_title, fontsize=params_obj.plot_13_font_size, fontweight='bold')
-    plt.xticks(fontsize=params_obj.plot_13_font_size)
-    plt.yticks(fontsize=params_obj.plot_13_font_size)
+        axes.set_xlabel(params_obj.plot_09_x_title, fontsize=params_obj.plot_13_font_size, fontweight='bold')
+        axes.set_ylabel(params_obj.plot_10_y_title, fontsize=params_obj.plot_13_font_size, fontweight='bold')
+    axes.tick_params(labelsize=params_obj.plot_13_font_size)
     if params_obj.plot_07_show_legend:
-        plt.legend(loc='best', fontsize=params_obj.plot_13_font_size)
-
-    # set x/y limits if applicable, allowing for partial limits
-    if params_obj.plot_16_xlim_lower is not None:
-        if params_obj.plot_17_xlim_upper is not None:
-            plt.xlim((params_obj.plot_16_xlim_lower, params_obj.plot_17_xlim_upper))
-        else:
-            plt.xlim(xmin=params_obj.plot_16_xlim_lower)
-    elif params_obj.plot_17_xlim_upper is not None:
-        plt.xlim(xmax=params_obj.plot_17_xlim_upper)
-    if params_obj.plot_18_ylim_lower is not None:
-        if params_obj.plot_19_ylim_upper is not None:
-            plt.ylim((params_obj.plot_18_ylim_lower, params_obj.plot_19_ylim_upper))
-        else:
-            plt.ylim(ymin=params_obj.plot_18_ylim_lower)
-    elif params_obj.plot_19_ylim_upper is not None:
-        plt.ylim(ymax=params_obj.plot_19_ylim_upper)
+        axes.legend(loc='best', fontsize=params_obj.plot_13_font_size)
+    CIU_Plot_Service.set_axis_limits(axes, params_obj)
 
     # save plot
     if filename_append is None:
         output_path = os.path.join(outputdir, analysis_obj.short_filename + '_features' + params_obj.plot_02_extension)
     else:
         output_path = os.path.join(outputdir, analysis_obj.short_filename + filename_append + '_features' + params_obj.plot_02_extension)
-
-    try:
-        plt.savefig(output_path)
-    except PermissionError:
-        messagebox.showerror('Please Close the File Before Saving', 'The file {} is being used by another process! Please close it, THEN press the OK button to retry saving'.format(output_path))
-        plt.savefig(output_path)
-    plt.close()
+    CIU_Plot_Service.save_figure(figure, output_path)
 
 
 def save_features_main(feature_list, outputpath, filename, mode, concise_mode, combine):
@@ -754,13 +787,13 @@ def plot_transitions(transition_list, analysis_obj, params_obj, outputdir):
     :param outputdir: directory in which to save output
     :return: void
     """
-    plt.clf()
     x_axis = analysis_obj.axes[1]
-    plt.figure(figsize=(params_obj.plot_03_figwidth, params_obj.plot_04_figheight), dpi=params_obj.plot_05_dpi)
+    figure = CIU_Plot_Service.new_figure(params_obj)
+    axes = figure.add_subplot()
 
     # plot the initial CIU contour plot for reference
     levels = Original_CIU.get_contour_levels(analysis_obj.ciu_data)
-    plt.contourf(analysis_obj.axes[1], analysis_obj.axes[0], analysis_obj.ciu_data, levels=levels, cmap=params_obj.plot_01_cmap)
+    contours = axes.contourf(analysis_obj.axes[1], analysis_obj.axes[0], analysis_obj.ciu_data, levels=levels, cmap=params_obj.plot_01_cmap)
 
     # plot all transitions
     transition_num = 0
@@ -768,11 +801,11 @@ def plot_transitions(transition_list, analysis_obj, params_obj, outputdir):
         # plot markers for the max/average/median values used in fitting for reference
         for index, cv in enumerate(transition.combined_x_axis):
             if params_obj.ciu50_t2_1_centroiding_mode == 'max':
-                plt.plot(cv, transition.combined_y_vals[index], 'wo', markersize=params_obj.plot_14_dot_size, markeredgecolor='black')
+                axes.plot(cv, transition.combined_y_vals[index], 'wo', markersize=params_obj.plot_14_dot_size, markeredgecolor='black')
             elif params_obj.ciu50_t2_1_centroiding_mode == 'average':
-                plt.plot(cv, transition.combined_y_avg_raw[index], 'wo', markersize=params_obj.plot_14_dot_size, markeredgecolor='black')
+                axes.plot(cv, transition.combined_y_avg_raw[index], 'wo', markersize=params_obj.plot_14_dot_size, markeredgecolor='black')
             elif params_obj.ciu50_t2_1_centroiding_mode == 'median':
-                plt.plot(cv, transition.combined_y_median_raw[index], 'wo', markersize=params_obj.plot_14_dot_size, markeredgecolor='black')
+                axes.plot(cv, transition.combined_y_median_raw[index], 'wo', markersize=params_obj.plot_14_dot_size, markeredgecolor='black')
 
         # prepare and plot the actual transition using fitted parameters
         interp_x = np.linspace(x_axis[0], x_axis[len(x_axis) - 1], 200)
@@ -783,53 +816,31 @@ def plot_transitions(transition_list, analysis_obj, params_obj, outputdir):
             trans_line_color = TRANS_COLOR_DICT[transition_num]
         else:
             trans_line_color = TRANS_COLOR_DICT[6]
-        trans_plot = plt.plot(interp_x, y_fit, color=trans_line_color, label='CIU50: {:.1f}, r2=: {:.2f}'.format(transition.ciu50, transition.rsq))
-        plt.setp(trans_plot, linewidth=2)
+        axes.plot(interp_x, y_fit, color=trans_line_color, linewidth=2, label='CIU50: {:.1f}, r2=: {:.2f}'.format(transition.ciu50, transition.rsq))
         transition_num += 1
-
-    # set x/y limits if applicable, allowing for partial limits
-    if params_obj.plot_16_xlim_lower is not None:
-        if params_obj.plot_17_xlim_upper is not None:
-            plt.xlim((params_obj.plot_16_xlim_lower, params_obj.plot_17_xlim_upper))
-        else:
-            plt.xlim(xmin=params_obj.plot_16_xlim_lower)
-    elif params_obj.plot_17_xlim_upper is not None:
-        plt.xlim(xmax=params_obj.plot_17_xlim_upper)
-    if params_obj.plot_18_ylim_lower is not None:
-        if params_obj.plot_19_ylim_upper is not None:
-            plt.ylim((params_obj.plot_18_ylim_lower, params_obj.plot_19_ylim_upper))
-        else:
-            plt.ylim(ymin=params_obj.plot_18_ylim_lower)
-    elif params_obj.plot_19_ylim_upper is not None:
-        plt.ylim(ymax=params_obj.plot_19_ylim_upper)
+    CIU_Plot_Service.set_axis_limits(axes, params_obj)
 
     # plot titles, labels, and legends
     if params_obj.plot_12_custom_title is not None:
         plot_title = params_obj.plot_12_custom_title
-        plt.title(plot_title, fontsize=params_obj.plot_13_font_size, fontweight='bold')
+        axes.set_title(plot_title, fontsize=params_obj.plot_13_font_size, fontweight='bold')
     elif params_obj.plot_11_show_title:
         plot_title = analysis_obj.short_filename
-        plt.title(plot_title, fontsize=params_obj.plot_13_font_size, fontweight='bold')
+        axes.set_title(plot_title, fontsize=params_obj.plot_13_font_size, fontweight='bold')
     if params_obj.plot_06_show_colorbar:
-        cbar = plt.colorbar(ticks=[0, .25, .5, .75, 1])
+        cbar = figure.colorbar(contours, ax=axes, ticks=[0, .25, .5, .75, 1])
         cbar.ax.tick_params(labelsize=params_obj.plot_13_font_size)
     if params_obj.plot_08_show_axes_titles:
-        plt.xlabel(params_obj.plot_09_x_title, fontsize=params_obj.plot_13_font_size, fontweight='bold')
-        plt.ylabel(params_obj.plot_10_y_title, fontsize=params_obj.plot_13_font_size, fontweight='bold')
-    plt.xticks(fontsize=params_obj.plot_13_font_size)
-    plt.yticks(fontsize=params_obj.plot_13_font_size)
+        axes.set_xlabel(params_obj.plot_09_x_title, fontsize=params_obj.plot_13_font_size, fontweight='bold')
+        axes.set_ylabel(params_obj.plot_10_y_title, fontsize=params_obj.plot_13_font_size, fontweight='bold')
+    axes.tick_params(labelsize=params_obj.plot_13_font_size)
     if params_obj.plot_07_show_legend:
-        plt.legend(loc='best', fontsize=params_obj.plot_13_font_size)
+        axes.legend(loc='best', fontsize=params_obj.plot_13_font_size)
 
     # save plot to file
     filename = analysis_obj.short_filename + '_transition' + params_obj.plot_02_extension
     output_path = os.path.join(outputdir, filename)
-    try:
-        plt.savefig(output_path)
-    except PermissionError:
-        messagebox.showerror('Please Close the File Before Saving', 'The file {} is being used by another process! Please close it, THEN press the OK button to retry saving'.format(output_path))
-        plt.savefig(output_path)
-    plt.close()
+    CIU_Plot_Service.save_figure(figure, output_path)
 
 
 def bin_to_dt(bin_val, min_dt, bin_spacing):
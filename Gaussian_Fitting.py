@@ -7,7 +7,7 @@ author: DP
 date: 10/10/2017
 """
 import numpy as np
-from scipy.optimize import curve_fit
+from scipy.optimize import curve_fit, least_squares
 from scipy.stats import linregress
 import scipy.integrate
 import scipy.interpolate
@@ -25,12 +25,16 @@ import matplotlib.patches
 import lmfit
 import time
 import multiprocessing
+from multiprocessing import shared_memory, resource_tracker
+import atexit
 from tkinter import messagebox
 
 import CIU_raw
 import Raw_Processing
 import CIU_analysis_obj
 import CIU_Params
+import CIU_Cache
+import CIU_Plot_Service
 
 # imports for type checking
 from typing import TYPE_CHECKING
@@ -42,6 +46,20 @@ nonprotein_prefix = 'np'
 baseline_prefix = 'b'
 logger = logging.getLogger('main')
 
+# number of iterations in a row that a fit must pass the convergence test in fit_gaussians_batched
+CONVERGENCE_ITERATIONS = 3
+# minimum numbers of protein components to fit at each CV before early stopping can stop the search
+EARLY_STOP_MIN_COMPONENTS = 3
+# Savitzky-Golay window (bins) for finding shoulders in the raw profile. Narrower than the residual window, as
+# wider windows smooth over shoulders on coarse DT axes
+SHOULDER_WINDOW_LENGTH = 5
+# variance (relative to sigma^2) of the part of a Gaussian above half its height, used to convert moments to widths
+HALF_MAX_VARIANCE_RATIO = 0.25474
+
+# persistent process pool for Gaussian fitting (see get_fitting_pool)
+fitting_pool = None
+fitting_pool_size = 0
+
 
 class Gaussian(object):
     """
@@ -108,6 +126,161 @@ class Gaussian(object):
         return [self.amplitude, self.centroid, self.width]
 
 
+# one row of a GaussianTable. feature_id is the index of the Feature containing the Gaussian (-1 if none)
+gaussian_table_dtype = np.dtype([('cv', np.float64),
+                                 ('cv_index', np.int32),
+                                 ('amplitude', np.float64),
+                                 ('centroid', np.float64),
+                                 ('width', np.float64),
+                                 ('is_protein', np.bool_),
+                                 ('feature_id', np.int32)])
+
+
+class GaussianTable(object):
+    """
+    Array-backed table of all Gaussians in a fingerprint: a structured numpy array (gaussian_table_dtype)
+    with one row per Gaussian, sorted by CV index (rows at the same CV keep the order in which they were
+    added). The rows at each CV are a contiguous slice, so per-CV access returns a view without copying.
+    """
+    def __init__(self, rows, cv_axis):
+        """
+        Initialize a new table
+        :param rows: structured numpy array of gaussian_table_dtype (any order)
+        :param cv_axis: CV axis of the fingerprint (cv_index values refer to this axis)
+        """
+        rows = np.asarray(rows, dtype=gaussian_table_dtype)
+        self.rows = rows[np.argsort(rows['cv_index'], kind='stable')]
+        self.cv_axis = np.asarray(cv_axis, dtype=float)
+        # rows for CV index i are rows[cv_offsets[i]: cv_offsets[i + 1]]
+        self.cv_offsets = np.searchsorted(self.rows['cv_index'], np.arange(len(self.cv_axis) + 1))
+
+    def __len__(self):
+        return len(self.rows)
+
+    def __str__(self):
+        return '<GaussianTable> {} Gaussians at {} CVs'.format(len(self.rows), len(self.cv_axis))
+    __repr__ = __str__
+
+    def get_cv(self, cv_index):
+        """
+        Get the Gaussians at one CV
+        :param cv_index: index of the CV in the CV axis
+        :return: structured array view of the rows at this CV
+        """
+        return self.rows[self.cv_offsets[cv_index]: self.cv_offsets[cv_index + 1]]
+
+    def counts_by_cv(self):
+        """
+        Number of Gaussians at each CV
+        :return: numpy array of counts (same length as the CV axis)
+        """
+        return np.diff(self.cv_offsets)
+
+    def get_ranks(self):
+        """
+        Position of each row within its CV (0 for the first Gaussian at each CV, etc)
+        :return: numpy array of ranks (one per row)
+        """
+        return np.arange(len(self.rows)) - self.cv_offsets[self.rows['cv_index']]
+
+    def select(self, mask):
+        """
+        Get a new table containing only some rows
+        :param mask: boolean array (one per row) or index array of rows to keep
+        :rtype: GaussianTable
+        """
+        return GaussianTable(self.rows[mask], self.cv_axis)
+
+    def protein_only(self):
+        """
+        Get a new table containing only protein Gaussians
+        :rtype: GaussianTable
+        """
+        return self.select(self.rows['is_protein'])
+
+    def nonprotein_only(self):
+        """
+        Get a new table containing only non-protein Gaussians
+        :rtype: GaussianTable
+        """
+        return self.select(~self.rows['is_protein'])
+
+    def crop_cvs(self, start_index, end_index):
+        """
+        Get a new table containing only the CVs in [start_index, end_index), with CV indices shifted to match
+        the cropped CV axis
+        :param start_index: first CV index to keep
+        :param end_index: CV index after the last to keep
+        :rtype: GaussianTable
+        """
+        rows = self.rows[self.cv_offsets[start_index]: self.cv_offsets[end_index]].copy()
+        rows['cv_index'] -= start_index
+        return GaussianTable(rows, self.cv_axis[start_index: end_index])
+
+    def to_gaussian_lists(self):
+        """
+        Generate Gaussian objects from the table
+        :return: list of lists of Gaussian objects at each CV
+        :rtype: list[list[Gaussian]]
+        """
+        return [[make_gaussian_from_row(row) for row in self.get_cv(cv_index)] for cv_index in range(len(self.cv_axis))]
+
+    @classmethod
+    def from_gaussian_lists(cls, gaussian_lists_by_cv, cv_axis, feature_ids_by_cv=None):
+        """
+        Build a table from lists of Gaussian objects
+        :param gaussian_lists_by_cv: list of lists of Gaussian objects at each CV in the CV axis
+        :type gaussian_lists_by_cv: list[list[Gaussian]]
+        :param cv_axis: CV axis (same length as gaussian_lists_by_cv)
+        :param feature_ids_by_cv: (optional) lists of feature IDs matching gaussian_lists_by_cv
+        :rtype: GaussianTable
+        """
+        num_rows = sum(len(gaussian_list) for gaussian_list in gaussian_lists_by_cv)
+        rows = np.zeros(num_rows, dtype=gaussian_table_dtype)
+        rows['feature_id'] = -1
+        row_index = 0
+        for cv_index, gaussian_list in enumerate(gaussian_lists_by_cv):
+            for gauss_index, gaussian in enumerate(gaussian_list):
+                rows[row_index] = (gaussian.cv, cv_index, gaussian.amplitude, gaussian.centroid, gaussian.width, gaussian.is_protein,
+                                   -1 if feature_ids_by_cv is None else feature_ids_by_cv[cv_index][gauss_index])
+                row_index += 1
+        return cls(rows, cv_axis)
+
+    @classmethod
+    def from_fits(cls, best_fits_by_cv):
+        """
+        Build a table directly from the parameter arrays of fits at each CV
+        :param best_fits_by_cv: list of fits at each CV
+        :type best_fits_by_cv: list[SingleFitStats]
+        :rtype: GaussianTable
+        """
+        cv_axis = [fit.cv for fit in best_fits_by_cv]
+        row_blocks = []
+        for cv_index, fit in enumerate(best_fits_by_cv):
+            for params, protein_bool in [(fit.protein_params, True), (fit.nonprotein_params, False)]:
+                block = np.zeros(len(params), dtype=gaussian_table_dtype)
+                block['cv'] = fit.cv
+                block['cv_index'] = cv_index
+                block['amplitude'] = params[:, 0]
+                block['centroid'] = params[:, 1]
+                block['width'] = params[:, 2]
+                block['is_protein'] = protein_bool
+                block['feature_id'] = -1
+                row_blocks.append(block)
+        if len(row_blocks) == 0:
+            return cls(np.zeros(0, dtype=gaussian_table_dtype), cv_axis)
+        return cls(np.concatenate(row_blocks), cv_axis)
+
+
+def make_gaussian_from_row(row):
+    """
+    Generate a Gaussian object from one row of a GaussianTable
+    :param row: structured array row (gaussian_table_dtype)
+    :rtype: Gaussian
+    """
+    return Gaussian(float(row['amplitude']), float(row['centroid']), float(row['width']), float(row['cv']), pcov=None, protein_bool=bool(row['is_protein']))
+
+
 class SingleFitStats(object):
     """
     Container for holding fit information for a single multi-Gaussian fitting (one collision voltage).
@@ -115,27 +288,33 @@ class SingleFitStats(object):
     Intended to use called when initializing a fit.
     *updated to include output from LMFit and original (curve_fit) in same container. Must have
     one of popt OR lmfit_output, and will generate Gaussians and r2 from both for output
-    """
-    def __init__(self, x_data, y_data, cv, amp_cutoff, lmfit_output=None, popt=None):
+    *Only the fitted parameters and scores are stored. The x/y data are references to the shared DT axis and
+    CV column, and the fitted curve and Gaussian lists are regenerated from the parameters when needed.
+    *Pickled fits do NOT include the x/y data: x_data and y_data are None after unpickling until set_data is
+    called, and y_fit, r2, and scoring methods cannot be used until then. Whoever unpickles fits must re-attach
+    the data. CIUAnalysisObj does this for its gauss_fits_by_cv when it is loaded (see CIUAnalysisObj.__setstate__),
+    and fits returned from worker processes or the result cache are re-attached by the fitting code.
+    """
+    def __init__(self, x_data, y_data, cv, amp_cutoff, lmfit_output=None, popt=None, nonprotein_popt=None, baseline_val=0):
         """
         Initialize a new fit between the provided x/y data and optimized Gaussian parameters
         :param x_data: x (DT) raw data being fit by popt
         :param y_data: y (intensity) raw data being fit by popt
-        :param popt: optimized parameters returned from curve_fit
+        :param popt: optimized parameters returned from curve_fit (protein Gaussians only if nonprotein_popt is provided)
         :param amp_cutoff: minimum amplitude for peak to be allowed
         :param cv: collision voltage at which this fit occurred
         :param lmfit_output: output container from LMFit (from model.fit(...))
         :type lmfit_output:
+        :param nonprotein_popt: (optional) non-protein Gaussian parameters, if not using lmfit_output
+        :param baseline_val: (optional) fitted baseline, if not using lmfit_output
         """
         self.x_data = x_data
         self.y_data = y_data
         self.cv = cv
-        self.baseline_val = 0
+        self.baseline_val = baseline_val
 
         if lmfit_output is not None:
             protein_popt, nonprotein_popt = get_popt_from_lmoutput(lmfit_output, amp_cutoff)
-            popt = [x for x in protein_popt]
-            popt.extend(nonprotein_popt)
 
             # Check for baseline as well, and add it to the fit if provided
             keys = sorted(lmfit_output.best_values.keys())
@@ -145,19 +324,17 @@ class SingleFitStats(object):
 
         else:
             protein_popt = popt
-            nonprotein_popt = []
+            if nonprotein_popt is None:
+                nonprotein_popt = []
+
+        # fitted [amplitude, centroid, width] of each protein and non-protein component
+        self.protein_params = np.array(protein_popt, dtype=float).reshape(-1, 3)
+        self.nonprotein_params = np.array(nonprotein_popt, dtype=float).reshape(-1, 3)
+        self.gaussian_lists = None  # Gaussian objects, generated on first use
 
-        self.y_fit = multi_gauss_func(x_data, *popt) + self.baseline_val
         self.slope, self.intercept, self.rvalue, self.pvalue, self.stderr = linregress(self.y_data, self.y_fit)
         self.adjrsq = adjrsquared(self.rvalue ** 2, len(y_data))
 
-        # Gaussian lists specific to protein and non-protein components fitted by LMFit
-        self.gaussians_protein = generate_gaussians_from_popt(protein_popt, protein_bool=True, cv=cv, pcov=None)
-        self.gaussians_nonprotein = generate_gaussians_from_popt(nonprotein_popt, protein_bool=False, cv=cv, pcov=None)
-
-        self.gaussians = [x for x in self.gaussians_protein]
-        self.gaussians.extend(self.gaussians_nonprotein)
-
         # additional information that may be present
         self.p0 = None      # initial guess array used to generate this popt
         self.pcov = None    # output covariance matrix
@@ -165,6 +342,88 @@ class SingleFitStats(object):
         self.score = None   # score from second round fitting (r2 - penalties)
         self.peak_penalties = None      # list of penalties for each peak in the Gaussian list
 
+    def __getstate__(self):
+        """
+        Save only the fit parameters and scores (not the shared x/y data or generated Gaussians). The x/y data
+        must be re-attached with set_data after unpickling.
+        :return: state dict
+        """
+        state = self.__dict__.copy()
+        state['x_data'] = None
+        state['y_data'] = None
+        state['gaussian_lists'] = None
+        return state
+
+    def __setstate__(self, state):
+        """
+        Restore a saved fit. Fits saved by older versions stored full Gaussian lists and curves, which
+        are converted to parameter arrays.
+        :param state: state dict
+        :return: void
+        """
+        if 'gaussians_protein' in state:
+            state['protein_params'] = np.array([x.return_popt() for x in state.pop('gaussians_protein')], dtype=float).reshape(-1, 3)
+            state['nonprotein_params'] = np.array([x.return_popt() for x in state.pop('gaussians_nonprotein')], dtype=float).reshape(-1, 3)
+            state.pop('gaussians', None)
+            state.pop('y_fit', None)
+            state.setdefault('baseline_val', 0)
+        state['gaussian_lists'] = None
+        self.__dict__.update(state)
+
+    def set_data(self, x_data, y_data):
+        """
+        Attach the DT axis and CV column data this fit was made from (e.g. after loading a saved fit)
+        :param x_data: x (DT) data
+        :param y_data: y (intensity) data at this CV
+        :return: void
+        """
+        self.x_data = x_data
+        self.y_data = y_data
+
+    @property
+    def y_fit(self):
+        """
+        Fitted curve (sum of all components and baseline) evaluated on the DT axis
+        :return: ndarray
+        """
+        popt = self.protein_params.ravel().tolist() + self.nonprotein_params.ravel().tolist()
+        return multi_gauss_func(self.x_data, *popt) + self.baseline_val
+
+    def get_gaussian_lists(self):
+        """
+        Generate (on first use) the Gaussian objects for the fitted protein and non-protein components
+        :return: protein Gaussians, non-protein Gaussians, all Gaussians (protein first)
+        """
+        if self.gaussian_lists is None:
+            gaussians_protein = generate_gaussians_from_popt(self.protein_params.ravel().tolist(), protein_bool=True, cv=self.cv, pcov=None)
+            gaussians_nonprotein = generate_gaussians_from_popt(self.nonprotein_params.ravel().tolist(), protein_bool=False, cv=self.cv, pcov=None)
+            self.gaussian_lists = (gaussians_protein, gaussians_nonprotein, gaussians_protein + gaussians_nonprotein)
+        return self.gaussian_lists
+
+    @property
+    def gaussians_protein(self):
+        """
+        Gaussians for the protein components
+        :rtype: list[Gaussian]
+        """
+        return self.get_gaussian_lists()[0]
+
+    @property
+    def gaussians_nonprotein(self):
+        """
+        Gaussians for the non-protein components
+        :rtype: list[Gaussian]
+        """
+        return self.get_gaussian_lists()[1]
+
+    @property
+    def gaussians(self):
+        """
+        Gaussians for all components (protein first)
+        :rtype: list[Gaussian]
+        """
+        return self.get_gaussian_lists()[2]
+
     def __str__(self):
         """
         string rep
@@ -185,15 +444,18 @@ class SingleFitStats(object):
         :return: score (float between 0, 1), penalties by individual peaks
         """
         # compute penalties by peak to allow removal of poorly fit peaks
+        if len(self.gaussians_protein) > 1:
+            area_penalties = compute_area_penalties(self.gaussians_protein, self.x_data, params_obj.gaussian_74_shared_area_mode)
+        else:
+            area_penalties = np.zeros(len(self.gaussians_protein))
         peak_penalties = []
-        for gaussian in self.gaussians_protein:
+        for gaussian, area_penalty in zip(self.gaussians_protein, area_penalties):
             current_penalty = compute_width_penalty(gaussian.width,
                                                     expected_width=fwhm_to_sigma(params_obj.gaussian_72_prot_peak_width),
                                                     tolerance=fwhm_to_sigma(params_obj.gaussian_73_prot_width_tol),
                                                     steepness=1)
-            if len(self.gaussians_protein) > 1:
-                if gaussian.amplitude > params_obj.gaussian_2_int_threshold:
-                    current_penalty += compute_area_penalty(gaussian, self.gaussians_protein, self.x_data, params_obj.gaussian_74_shared_area_mode)
+            if gaussian.amplitude > params_obj.gaussian_2_int_threshold:
+                current_penalty += area_penalty
             peak_penalties.append(current_penalty)
 
         # add up penalties and subtract from the fit adjusted r2 to obtain final score
@@ -242,7 +504,9 @@ class SingleFitStats(object):
 
 def main_gaussian_lmfit_wrapper(analysis_obj_list, params_obj, outputpath):
     """
-    Wrapper method for main_gaussian_lmfit that uses multiprocessing.
+    Wrapper method for main_gaussian_lmfit that uses multiprocessing. Files are fit in a persistent
+    process pool, with the CIU data shared with worker processes through shared memory and only the
+    fitted Gaussian parameters returned.
     :param analysis_obj_list: list of CIU containers to fit Gaussians to
     :type analysis_obj_list: list[CIUAnalysisObj]
     :param params_obj: parameter information container
@@ -255,36 +519,54 @@ def main_gaussian_lmfit_wrapper(analysis_obj_list, params_obj, outputpath):
     all_csv_output = ''
     all_file_gaussians = []
 
-    # don't use more cores than files selected
-    if len(analysis_obj_list) < params_obj.gaussian_61_num_cores:
-        num_cores = len(analysis_obj_list)
-    else:
-        num_cores = params_obj.gaussian_61_num_cores
+    num_cores = params_obj.gaussian_61_num_cores
+    if params_obj.gaussian_63_fit_engine == 'batched' and len(analysis_obj_list) > 1:
+        # fit files with the same DT axis together (files are not split across processes in batched mode)
+        all_file_fits = main_gaussian_batched(analysis_obj_list, params_obj, outputpath)
+        for analysis_obj, best_fits_by_cv in zip(analysis_obj_list, all_file_fits):
+            analysis_obj, csv_output, cv_gaussians = save_fit_outputs(analysis_obj, params_obj, outputpath, best_fits_by_cv)
+            all_csv_output += csv_output
+            all_file_gaussians.append(cv_gaussians)
+            output_objs.append(analysis_obj)
 
-    if num_cores > 1:
-        pool = multiprocessing.Pool(processes=num_cores)
-        results = []
+    elif num_cores > 1 and params_obj.gaussian_62_parallel_within_file:
+        # files are fit one at a time, with the peak combinations at each CV fit in parallel. CVs remain
+        # sequential, as each is started from the best fit at the previous CV.
+        component_pool = get_fitting_pool(num_cores)
         for analysis_obj in analysis_obj_list:
-            # Run fitting and scoring across the provided range of peak options with multiprocessing
-            logger.info('Gaussian fitting process for file {} added to queue'.format(analysis_obj.short_filename))
-            new_params_obj = CIU_Params.Parameters()
-            new_params_obj.set_params(params_obj.params_dict)    # copy the params object to prevent simultaneous access
-            argslist = [analysis_obj, new_params_obj, outputpath]
-            pool_result = pool.apply_async(main_gaussian_lmfit, args=argslist)
-            results.append(pool_result)
-
-        pool.close()  # tell the pool we don't need it to process any more data
-
-        for pool_result_container in results:
-            # save results
-            pool_result = pool_result_container.get()
-            analysis_obj, csv_output, cv_gaussians, fit_time = pool_result[0], pool_result[1], pool_result[2], pool_result[3]
+            logger.info('Started Gaussian fitting for file {}...'.format(analysis_obj.short_filename))
+            analysis_obj, csv_output, cv_gaussians, fit_time = main_gaussian_lmfit(analysis_obj, params_obj, outputpath, component_pool)
             all_csv_output += csv_output
             all_file_gaussians.append(cv_gaussians)
             output_objs.append(analysis_obj)
             logger.info('Fitting for file {} done in {:.2f} s'.format(analysis_obj.short_filename, fit_time))
 
-        pool.join()     # terminate pool processes once finished
+    elif num_cores > 1 and len(analysis_obj_list) > 1:
+        pool = get_fitting_pool(num_cores)
+        results = []
+        shared_blocks = []
+        try:
+            for analysis_obj in analysis_obj_list:
+                # Run fitting and scoring across the provided range of peak options with multiprocessing
+                logger.info('Gaussian fitting process for file {} added to queue'.format(analysis_obj.short_filename))
+                shared_block = share_fit_data(analysis_obj.ciu_data, analysis_obj.axes)
+                shared_blocks.append(shared_block)
+                argslist = [shared_block.name, analysis_obj.ciu_data.shape, analysis_obj.short_filename, params_obj.params_dict, outputpath]
+                results.append(pool.apply_async(fit_shared_data, args=argslist))
+
+            for analysis_obj, pool_result_container in zip(analysis_obj_list, results):
+                # rebuild fits from the returned parameter arrays and save results
+                gaussian_array, cv_array, csv_output, fit_time = pool_result_container.get()
+                best_fits_by_cv = fits_from_arrays(gaussian_array, cv_array, analysis_obj.ciu_data, analysis_obj.axes, params_obj.gaussian_2_int_threshold)
+                save_fits_to_obj(analysis_obj, best_fits_by_cv)
+                all_csv_output += csv_output
+                all_file_gaussians.append(sort_gaussians(analysis_obj.raw_protein_gaussians, params_obj.gaussian_51_sort_outputs_by))
+                output_objs.append(analysis_obj)
+                logger.info('Fitting for file {} done in {:.2f} s'.format(analysis_obj.short_filename, fit_time))
+        finally:
+            for shared_block in shared_blocks:
+                shared_block.close()
+                shared_block.unlink()
 
     else:
         # User specified one thread, so don't use multiprocessing at all
@@ -299,7 +581,217 @@ def main_gaussian_lmfit_wrapper(analysis_obj_list, params_obj, outputpath):
     return output_objs, all_csv_output, all_file_gaussians
 
 
-def main_gaussian_lmfit(analysis_obj, params_obj, outputpath):
+def main_gaussian_batched(analysis_obj_list, params_obj, outputpath):
+    """
+    Fit all files that are not in the result cache with fit_files_batched, grouping files with identical
+    DT axes into the same batch.
+    :param analysis_obj_list: list of CIU containers to fit Gaussians to
+    :type analysis_obj_list: list[CIUAnalysisObj]
+    :param params_obj: parameter information container
+    :type params_obj: Parameters
+    :param outputpath: directory in which to save output
+    :return: list of best fits at each CV for each file
+    :rtype: list[list[SingleFitStats]]
+    """
+    all_file_fits = []
+    files_to_fit = {}
+    cache_info = []
+    for file_index, analysis_obj in enumerate(analysis_obj_list):
+        result_cache, cache_key, best_fits_by_cv = load_cached_fits(analysis_obj, params_obj)
+        all_file_fits.append(best_fits_by_cv)
+        cache_info.append((result_cache, cache_key))
+        if best_fits_by_cv is None:
+            files_to_fit.setdefault(np.asarray(analysis_obj.axes[0], dtype=float).tobytes(), []).append(file_index)
+
+    for file_indices in files_to_fit.values():
+        start_time = time.time()
+        fit_objs = [analysis_obj_list[file_index] for file_index in file_indices]
+        outputfolders = [os.path.join(outputpath, analysis_obj.short_filename) for analysis_obj in fit_objs]
+        if params_obj.gaussian_4_save_diagnostics:
+            for outputfolder in outputfolders:
+                if not os.path.isdir(outputfolder):
+                    os.makedirs(outputfolder)
+
+        column_cache = cache_info[file_indices[0]][0]
+        batch_fits = fit_files_batched([x.ciu_data for x in fit_objs], [x.axes for x in fit_objs], params_obj, outputfolders, column_cache)
+        for file_index, best_fits_by_cv in zip(file_indices, batch_fits):
+            all_file_fits[file_index] = best_fits_by_cv
+            result_cache, cache_key = cache_info[file_index]
+            if result_cache is not None:
+                result_cache.save(cache_key, best_fits_by_cv)
+        logger.info('Batched fitting for files {} done in {:.2f} s'.format(', '.join([x.short_filename for x in fit_objs]), time.time() - start_time))
+    return all_file_fits
+
+
+def get_fitting_pool(num_cores):
+    """
+    Get the persistent process pool used for Gaussian fitting, creating it on first use (or if the
+    requested number of cores has changed). Reusing the pool avoids starting new processes for every fitting run.
+    :param num_cores: number of worker processes
+    :return: multiprocessing.Pool
+    """
+    global fitting_pool, fitting_pool_size
+    if fitting_pool is None or fitting_pool_size != num_cores:
+        close_fitting_pool()
+        if os.name == 'posix':
+            # start the shared memory tracker before the workers so they share it rather than each starting their own
+            resource_tracker.ensure_running()
+        fitting_pool = multiprocessing.Pool(processes=num_cores)
+        fitting_pool_size = num_cores
+    return fitting_pool
+
+
+def close_fitting_pool():
+    """
+    Shut down the persistent Gaussian fitting pool, if it has been started
+    :return: void
+    """
+    global fitting_pool, fitting_pool_size
+    if fitting_pool is not None:
+        fitting_pool.terminate()
+        fitting_pool.join()
+        fitting_pool = None
+        fitting_pool_size = 0
+
+
+atexit.register(close_fitting_pool)
+
+
+def share_fit_data(ciu_data, axes):
+    """
+    Copy CIU data and axes into a new shared memory block for access by fitting processes. The caller
+    is responsible for closing and unlinking the block once fitting is done.
+    :param ciu_data: 2D numpy array (DT x CV)
+    :param axes: [dt_axis, cv_axis]
+    :return: SharedMemory block containing the flattened data, followed by the DT and CV axes
+    :rtype: shared_memory.SharedMemory
+    """
+    num_values = ciu_data.size + len(axes[0]) + len(axes[1])
+    shared_block = shared_memory.SharedMemory(create=True, size=num_values * np.dtype(np.float64).itemsize)
+    shared_array = np.ndarray((num_values,), dtype=np.float64, buffer=shared_block.buf)
+    shared_array[:] = np.concatenate((np.ravel(ciu_data), axes[0], axes[1]))
+    del shared_array
+    return shared_block
+
+
+def read_shared_fit_data(shared_block, data_shape):
+    """
+    Read (copy) CIU data and axes from a shared memory block written by share_fit_data
+    :param shared_block: SharedMemory block
+    :param data_shape: shape of the CIU data (num DT bins, num CV bins)
+    :return: ciu_data, [dt_axis, cv_axis]
+    """
+    num_dt, num_cv = data_shape
+    shared_array = np.ndarray((num_dt * num_cv + num_dt + num_cv,), dtype=np.float64, buffer=shared_block.buf)
+    ciu_data = shared_array[:num_dt * num_cv].reshape(data_shape).copy()
+    dt_axis = shared_array[num_dt * num_cv: num_dt * num_cv + num_dt].copy()
+    cv_axis = shared_array[num_dt * num_cv + num_dt:].copy()
+    del shared_array
+    return ciu_data, [dt_axis, cv_axis]
+
+
+def fit_shared_data(shared_name, data_shape, short_filename, params_dict, outputpath):
+    """
+    Worker method for fitting in the persistent pool. Reads data from shared memory, runs
+    main_gaussian_lmfit (which also saves the plots and output files for this file), and returns only the
+    compact fit results.
+    :param shared_name: name of the SharedMemory block holding the data (see share_fit_data)
+    :param data_shape: shape of the CIU data (num DT bins, num CV bins)
+    :param short_filename: short filename of the analysis being fit (for outputs)
+    :param params_dict: parameter dictionary
+    :param outputpath: directory in which to save output
+    :return: gaussian array, cv array (see fits_to_arrays), csv output string, fit time
+    """
+    shared_block = shared_memory.SharedMemory(name=shared_name)
+    try:
+        ciu_data, axes = read_shared_fit_data(shared_block, data_shape)
+    finally:
+        shared_block.close()
+
+    params_obj = CIU_Params.Parameters()
+    params_obj.set_params(params_dict)
+    raw_obj = CIU_raw.CIURaw(None, axes[0], axes[1], short_filename)
+    analysis_obj = CIU_analysis_obj.CIUAnalysisObj(raw_obj, ciu_data, axes, params_obj, short_filename=short_filename)
+
+    analysis_obj, csv_output, _, fit_time = main_gaussian_lmfit(analysis_obj, params_obj, outputpath)
+    gaussian_array, cv_array = fits_to_arrays(analysis_obj.gauss_fits_by_cv)
+    return gaussian_array, cv_array, csv_output, fit_time
+
+
+def fits_to_arrays(best_fits_by_cv):
+    """
+    Convert a list of best fits at each CV to compact arrays for transfer between processes
+    :param best_fits_by_cv: list of SingleFitStats
+    :type best_fits_by_cv: list[SingleFitStats]
+    :return: gaussian array with rows of [cv index, protein (1) or nonprotein (0), amplitude, centroid, width, penalty (NaN for nonprotein)],
+    cv array with rows of [baseline, score]
+    """
+    gaussian_rows = []
+    cv_rows = []
+    for cv_index, fit in enumerate(best_fits_by_cv):
+        for gaussian, penalty in zip(fit.gaussians_protein, fit.peak_penalties):
+            gaussian_rows.append([cv_index, 1, gaussian.amplitude, gaussian.centroid, gaussian.width, penalty])
+        for gaussian in fit.gaussians_nonprotein:
+            gaussian_rows.append([cv_index, 0, gaussian.amplitude, gaussian.centroid, gaussian.width, np.nan])
+        cv_rows.append([fit.baseline_val, fit.score])
+    return np.asarray(gaussian_rows, dtype=np.float64).reshape(-1, 6), np.asarray(cv_rows, dtype=np.float64).reshape(-1, 2)
+
+
+def fits_from_arrays(gaussian_array, cv_array, ciu_data, axes, amp_cutoff):
+    """
+    Rebuild the list of best fits at each CV from arrays generated by fits_to_arrays
+    :param gaussian_array: array of Gaussian parameters (see fits_to_arrays)
+    :param cv_array: array of baseline and score at each CV (see fits_to_arrays)
+    :param ciu_data: 2D numpy array (DT x CV) that was fit
+    :param axes: [dt_axis, cv_axis]
+    :param amp_cutoff: minimum amplitude parameter
+    :return: list of SingleFitStats
+    :rtype: list[SingleFitStats]
+    """
+    best_fits_by_cv = []
+    for cv_index, cv in enumerate(axes[1]):
+        cv_gaussians = gaussian_array[gaussian_array[:, 0] == cv_index]
+        protein_rows = cv_gaussians[cv_gaussians[:, 1] == 1]
+        nonprotein_rows = cv_gaussians[cv_gaussians[:, 1] == 0]
+        baseline_val, score = cv_array[cv_index]
+
+        fit = SingleFitStats(x_data=axes[0], y_data=ciu_data[:, cv_index], cv=cv, amp_cutoff=amp_cutoff,
+                             popt=list(np.ravel(protein_rows[:, 2:5])),
+                             nonprotein_popt=list(np.ravel(nonprotein_rows[:, 2:5])),
+                             baseline_val=baseline_val)
+        fit.score = score
+        fit.peak_penalties = protein_rows[:, 5].tolist()
+        best_fits_by_cv.append(fit)
+    return best_fits_by_cv
+
+
+def attach_fit_data(best_fits_by_cv, ciu_data, axes):
+    """
+    Attach the DT axis and CV column data to saved fits (which do not store their data)
+    :param best_fits_by_cv: list of fits at each CV
+    :type best_fits_by_cv: list[SingleFitStats]
+    :param ciu_data: 2D numpy array of CIU data (DT x CV) that was fit
+    :param axes: [dt_axis, cv_axis]
+    :return: void
+    """
+    for cv_index, fit in enumerate(best_fits_by_cv):
+        fit.set_data(axes[0], ciu_data[:, cv_index])
+
+
+def save_fits_to_obj(analysis_obj, best_fits_by_cv):
+    """
+    Save Gaussian fitting results into an analysis object
+    :param analysis_obj: CIUAnalysisObj
+    :type analysis_obj: CIUAnalysisObj
+    :param best_fits_by_cv: list of SingleFitStats
+    :type best_fits_by_cv: list[SingleFitStats]
+    :return: void
+    """
+    analysis_obj.gaussian_table = GaussianTable.from_fits(best_fits_by_cv)
+    analysis_obj.gauss_fits_by_cv = best_fits_by_cv
+
+
+def main_gaussian_lmfit(analysis_obj, params_obj, outputpath, component_pool=None):
     """
     Alternative Gaussian fitting method using LMFit for composite modeling of peaks. Estimates initial peak
     parameters using helper methods, then fits optimized Gaussian distributions and saves results. Intended
@@ -309,46 +801,66 @@ def main_gaussian_lmfit(analysis_obj, params_obj, outputpath):
     :param params_obj: parameter information container
     :type params_obj: Parameters
     :param outputpath: directory in which to save output
+    :param component_pool: (optional) process pool in which to fit the peak combinations at each CV in parallel
     :return: updated analysis object
     :rtype: CIUAnalysisObj
     """
     start_time = time.time()
 
-    cv_col_data = np.swapaxes(analysis_obj.ciu_data, 0, 1)
     outputfolder = os.path.join(outputpath, analysis_obj.short_filename)
     if params_obj.gaussian_4_save_diagnostics:
         if not os.path.isdir(outputfolder):
             os.makedirs(outputfolder)
 
-    best_fits_by_cv = []
-    scores_by_cv = []
+    result_cache, cache_key, best_fits_by_cv = load_cached_fits(analysis_obj, params_obj)
+    if best_fits_by_cv is None:
+        best_fits_by_cv = fit_all_cvs(analysis_obj.ciu_data, analysis_obj.axes, params_obj, outputfolder, component_pool, column_cache=result_cache)
+        if result_cache is not None:
+            result_cache.save(cache_key, best_fits_by_cv)
 
-    # User specified one thread, so don't use multiprocessing at all
-    results = []
-    for cv_index, cv_col_intensities in enumerate(cv_col_data):
-        cv = analysis_obj.axes[1][cv_index]
-        if cv_index > 0:
-            best_prev_fit = max(results[cv_index - 1], key=lambda x: x.score)
-            gaussian_guess_list = copy_gaussians_from_prevfit(best_prev_fit, cv)
-        else:
-            # run initial guess method since we have no previous peaks to refer to
-            gaussian_guess_list = guess_gauss_init(cv_col_intensities, analysis_obj.axes[0], cv, rsq_cutoff=0.99,
-                                                   amp_cutoff=params_obj.gaussian_2_int_threshold)
+    # output final results
+    fit_time = time.time() - start_time
+    analysis_obj, combined_output, sorted_gauss_by_cv = save_fit_outputs(analysis_obj, params_obj, outputpath, best_fits_by_cv)
+    return analysis_obj, combined_output, sorted_gauss_by_cv, fit_time
 
-        all_fits = iterate_lmfitting(analysis_obj.axes[0], cv_col_intensities, gaussian_guess_list, cv, params_obj, outputfolder)
-        results.append(all_fits)
 
-    for cv_index, cv_results in enumerate(results):
-        all_fits = cv_results
+def load_cached_fits(analysis_obj, params_obj):
+    """
+    Reuse previous results for identical data and fitting parameters (unless diagnostics were requested,
+    as they are only generated during fitting)
+    :param analysis_obj: analysis container
+    :type analysis_obj: CIUAnalysisObj
+    :param params_obj: parameter information container
+    :type params_obj: Parameters
+    :return: ResultCache (None if not caching), cache key, list of best fits by CV (None if not cached)
+    """
+    result_cache = None
+    if not params_obj.gaussian_4_save_diagnostics:
+        result_cache = CIU_Cache.get_cache(params_obj)
 
-        # save the fit with the highest score out of all fits collected
-        best_fit = max(all_fits, key=lambda x: x.score)
-        best_fits_by_cv.append(best_fit)
-        scores_by_cv.append([fit.score for fit in all_fits])
+    cache_key = None
+    best_fits_by_cv = None
+    if result_cache is not None:
+        cache_key = CIU_Cache.compute_stage_key('gaussian_fitting', [analysis_obj.ciu_data, analysis_obj.axes[0], analysis_obj.axes[1]], params_obj)
+        best_fits_by_cv = result_cache.load(cache_key)
+        if best_fits_by_cv is not None:
+            attach_fit_data(best_fits_by_cv, analysis_obj.ciu_data, analysis_obj.axes)
+            logger.info('Using cached Gaussian fitting results for file {}'.format(analysis_obj.short_filename))
+    return result_cache, cache_key, best_fits_by_cv
 
-    # output final results
-    fit_time = time.time() - start_time
 
+def save_fit_outputs(analysis_obj, params_obj, outputpath, best_fits_by_cv):
+    """
+    Save the best fits at each CV to the analysis object and generate all fitting outputs (plots and CSV)
+    :param analysis_obj: analysis container
+    :type analysis_obj: CIUAnalysisObj
+    :param params_obj: parameter information container
+    :type params_obj: Parameters
+    :param outputpath: directory in which to save output
+    :param best_fits_by_cv: list of best fits at each CV
+    :type best_fits_by_cv: list[SingleFitStats]
+    :return: updated analysis object, combined CSV output string, sorted protein Gaussians by CV
+    """
     prot_gaussians = [fit.gaussians_protein for fit in best_fits_by_cv]
     nonprot_gaussians = [fit.gaussians_nonprotein for fit in best_fits_by_cv]
 
@@ -359,17 +871,301 @@ def main_gaussian_lmfit(analysis_obj, params_obj, outputpath):
     nonprot_centroids = []
     for gauss_list in nonprot_gaussians:
         nonprot_centroids.append([x.centroid for x in gauss_list])
-    plot_centroids(best_centroids, analysis_obj, params_obj, outputpath, nonprotein_centroids=nonprot_centroids)
+    CIU_Plot_Service.submit_plot(params_obj, outputpath, plot_centroids, best_centroids, analysis_obj, params_obj, outputpath, nonprotein_centroids=nonprot_centroids)
 
     # save results to analysis obj
-    analysis_obj.raw_protein_gaussians = prot_gaussians
-    analysis_obj.raw_nonprotein_gaussians = nonprot_gaussians
-    analysis_obj.gauss_fits_by_cv = best_fits_by_cv
+    save_fits_to_obj(analysis_obj, best_fits_by_cv)
 
     # save output
-    save_fits_pdf_new(analysis_obj, params_obj, best_fits_by_cv, outputpath)
+    CIU_Plot_Service.submit_plot(params_obj, outputpath, save_fits_pdf_new, analysis_obj, params_obj, best_fits_by_cv, outputpath)
     combined_output, sorted_gauss_by_cv = save_gauss_params(analysis_obj, outputpath, params_obj.gaussian_51_sort_outputs_by, combine=params_obj.gaussian_5_combine_outputs, protein_only=params_obj.gauss_t1_1_protein_mode)
-    return analysis_obj, combined_output, sorted_gauss_by_cv, fit_time
+    return analysis_obj, combined_output, sorted_gauss_by_cv
+
+
+def fit_all_cvs(ciu_data, axes, params_obj, outputfolder, component_pool=None, column_cache=None):
+    """
+    Fit Gaussians to each CV column of the provided data, using the best fit at each CV as the initial
+    guess for the next CV (re-seeded from peaks found in the column if that gives a poor fit, see gaussian_67_reseed_rsq).
+    :param ciu_data: 2D numpy array of CIU data (DT x CV)
+    :param axes: [dt_axis, cv_axis]
+    :param params_obj: parameter information container
+    :type params_obj: Parameters
+    :param outputfolder: directory in which to save diagnostics (if requested)
+    :param component_pool: (optional) process pool in which to fit the peak combinations at each CV in parallel
+    :param column_cache: (optional) ResultCache from which to reuse the fits of unchanged columns (see get_column_key)
+    :type column_cache: CIU_Cache.ResultCache
+    :return: list of best fits (SingleFitStats) at each CV
+    :rtype: list[SingleFitStats]
+    """
+    if params_obj.gaussian_63_fit_engine == 'batched':
+        return fit_files_batched([ciu_data], [axes], params_obj, [outputfolder], column_cache)[0]
+
+    cv_col_data = np.swapaxes(ciu_data, 0, 1)
+    best_fits_by_cv = []
+    new_column_fits = []
+    num_fits = 0
+    num_reseeded = 0
+    num_reseed_fits = 0
+    for cv_index, cv_col_intensities in enumerate(cv_col_data):
+        cv = axes[1][cv_index]
+        if column_cache is not None:
+            # reuse the previous fit if this column and its starting point (the previous column's fit) are unchanged
+            column_key = get_column_key(cv_col_intensities, axes[0], cv, best_fits_by_cv[-1] if cv_index > 0 else None, params_obj)
+            best_fit = column_cache.load(column_key)
+            if best_fit is not None:
+                best_fit.set_data(axes[0], cv_col_intensities)
+                best_fits_by_cv.append(best_fit)
+                continue
+
+        gaussian_guess_list = get_initial_guesses(best_fits_by_cv, cv_col_intensities, axes[0], cv, params_obj)
+
+        all_fits = iterate_lmfitting(axes[0], cv_col_intensities, gaussian_guess_list, cv, params_obj, outputfolder, component_pool)
+        num_fits += len(all_fits)
+
+        # save the fit with the highest score out of all fits collected (fits returned from a process pool do not include data)
+        best_fit = max(all_fits, key=reseed_score_key)
+        if cv_index > 0 and needs_reseed(best_fit, params_obj):
+            # the previous CV's fit was a poor starting point here: re-seed from peaks found in this column and keep the better fit
+            reseed_guess_list = guess_gauss_peaks(cv_col_intensities, axes[0], cv, amp_cutoff=params_obj.gaussian_2_int_threshold)
+            reseed_fits = iterate_lmfitting(axes[0], cv_col_intensities, reseed_guess_list, cv, params_obj, outputfolder, component_pool)
+            num_reseed_fits += len(reseed_fits)
+            num_reseeded += 1
+            best_fit = max([best_fit] + reseed_fits, key=reseed_score_key)
+        best_fit.set_data(axes[0], cv_col_intensities)
+        best_fits_by_cv.append(best_fit)
+        if column_cache is not None:
+            new_column_fits.append((column_key, best_fit))
+
+    if column_cache is not None:
+        column_cache.save_many(new_column_fits)
+        logger.info('Reused {} of {} column fits ({} refit)'.format(len(axes[1]) - len(new_column_fits), len(axes[1]), len(new_column_fits)))
+
+    if params_obj.gaussian_64_stop_patience:
+        # warm start fits only (re-seeding fits are counted separately below)
+        num_fit_cvs = len(axes[1]) if column_cache is None else len(new_column_fits)
+        num_combinations = len(get_component_combinations(params_obj)) * num_fit_cvs
+        logger.info('Early stopping: performed {} of {} fits ({} skipped, {:.1f} fits per CV)'.format(num_fits, num_combinations, num_combinations - num_fits,
+                                                                                                    num_fits / float(max(num_fit_cvs, 1))))
+    if num_reseeded > 0:
+        logger.info('Re-seeded {} of {} CVs with poor fits from the previous CV ({} additional fits)'.format(num_reseeded, len(axes[1]), num_reseed_fits))
+    return best_fits_by_cv
+
+
+def fit_files_batched(ciu_data_list, axes_list, params_obj, outputfolder_list, column_cache=None):
+    """
+    Batched alternative to fit_all_cvs for one or more files with the same DT axis. CVs are fit in order
+    so that each CV is still started from the best fit at the previous CV, but all peak combinations for
+    the current CV of every file are fit together in a single call to fit_gaussians_batched.
+    :param ciu_data_list: list of 2D numpy arrays of CIU data (DT x CV)
+    :param axes_list: list of [dt_axis, cv_axis] for each file. All DT axes must be identical
+    :param params_obj: parameter information container
+    :type params_obj: Parameters
+    :param outputfolder_list: list of directories in which to save diagnostics for each file (if requested)
+    :param column_cache: (optional) ResultCache from which to reuse the fits of unchanged columns (see get_column_key)
+    :type column_cache: CIU_Cache.ResultCache
+    :return: list of best fits (SingleFitStats) at each CV for each file
+    :rtype: list[list[SingleFitStats]]
+    """
+    dt_axis = axes_list[0][0]
+    combinations = get_component_combinations(params_obj)
+    best_fits_by_file = [[] for _ in ciu_data_list]
+    new_column_fits = []
+    num_columns = 0
+
+    num_cvs = max([len(axes[1]) for axes in axes_list])
+    for cv_index in range(num_cvs):
+        # assemble all fits for this CV
+        fit_info_list = []
+        cached_by_file = {}
+        column_keys = {}
+        for file_index, (ciu_data, axes) in enumerate(zip(ciu_data_list, axes_list)):
+            if cv_index >= len(axes[1]):
+                continue
+            cv = axes[1][cv_index]
+            cv_col_intensities = ciu_data[:, cv_index]
+            num_columns += 1
+            if column_cache is not None:
+                # reuse the previous fit if this column and its starting point (the previous column's fit) are unchanged
+                prev_fit = best_fits_by_file[file_index][-1] if cv_index > 0 else None
+                column_keys[file_index] = get_column_key(cv_col_intensities, dt_axis, cv, prev_fit, params_obj)
+                cached_fit = column_cache.load(column_keys[file_index])
+                if cached_fit is not None:
+                    cached_by_file[file_index] = cached_fit
+                    continue
+            gaussian_guess_list = get_initial_guesses(best_fits_by_file[file_index], cv_col_intensities, dt_axis, cv, params_obj)
+            fit_info_list.extend(get_batch_fit_info(file_index, cv, combinations, gaussian_guess_list, cv_col_intensities, dt_axis, params_obj))
+
+        best_by_file = {}
+        if len(fit_info_list) > 0:
+            fits_by_file = fit_batch(fit_info_list, ciu_data_list, cv_index, dt_axis, params_obj, outputfolder_list)
+            best_by_file = {file_index: max(all_fits, key=reseed_score_key) for file_index, all_fits in fits_by_file.items()}
+
+        if cv_index > 0 and params_obj.gaussian_67_reseed_rsq:
+            # re-seed files with poor fits from peaks found in this column and fit them in a second batch
+            reseed_info_list = []
+            for file_index, best_fit in best_by_file.items():
+                if needs_reseed(best_fit, params_obj):
+                    cv_col_intensities = ciu_data_list[file_index][:, cv_index]
+                    reseed_guess_list = guess_gauss_peaks(cv_col_intensities, dt_axis, best_fit.cv, amp_cutoff=params_obj.gaussian_2_int_threshold)
+                    reseed_info_list.extend(get_batch_fit_info(file_index, best_fit.cv, combinations, reseed_guess_list, cv_col_intensities, dt_axis, params_obj))
+            if len(reseed_info_list) > 0:
+                for file_index, reseed_fits in fit_batch(reseed_info_list, ciu_data_list, cv_index, dt_axis, params_obj, outputfolder_list).items():
+                    best_by_file[file_index] = max([best_by_file[file_index]] + reseed_fits, key=reseed_score_key)
+
+        if column_cache is not None:
+            new_column_fits.extend([(column_keys[file_index], best_fit) for file_index, best_fit in best_by_file.items()])
+        best_by_file.update(cached_by_file)
+        for file_index in sorted(best_by_file.keys()):
+            # reference the file data rather than the batch array, so the batch is not kept in memory
+            best_fit = best_by_file[file_index]
+            best_fit.set_data(dt_axis, ciu_data_list[file_index][:, cv_index])
+            best_fits_by_file[file_index].append(best_fit)
+
+    if column_cache is not None:
+        column_cache.save_many(new_column_fits)
+        logger.info('Reused {} of {} column fits ({} refit)'.format(num_columns - len(new_column_fits), num_columns, len(new_column_fits)))
+    return best_fits_by_file
+
+
+def get_column_key(cv_col_intensities, dt_axis, cv, prev_fit, params_obj):
+    """
+    Cache key for the fit of a single CV column. The fit is fully determined by the column data, DT axis, CV,
+    fitting parameters, and its starting point: the best fit at the previous CV (or the initial guess
+    method for the first CV), so a column is only refit if one of these has changed.
+    :param cv_col_intensities: intensity values along the DT axis at this CV
+    :param dt_axis: DT axis
+    :param cv: collision voltage of this column
+    :param prev_fit: best fit at the previous CV, or None for the first CV
+    :type prev_fit: SingleFitStats
+    :param params_obj: parameter information container
+    :type params_obj: Parameters
+    :return: key (hex string)
+    """
+    if prev_fit is None:
+        warm_start = [np.zeros(0), np.zeros(0)]
+    else:
+        warm_start = [prev_fit.protein_params, prev_fit.nonprotein_params]
+    return CIU_Cache.compute_stage_key('gaussian_column', [dt_axis, cv_col_intensities, np.array([cv], dtype=float)] + warm_start, params_obj)
+
+
+def needs_reseed(best_fit, params_obj):
+    """
+    Determine whether the best fit at a CV (started from the previous CV's fit) is poor enough to re-seed
+    :param best_fit: best fit at this CV
+    :type best_fit: SingleFitStats
+    :param params_obj: parameter information container
+    :type params_obj: Parameters
+    :return: True if re-seeding is enabled and the fit's adjusted r2 is below the threshold (or undefined, e.g. no peaks left)
+    """
+    if not params_obj.gaussian_67_reseed_rsq:
+        return False
+    return not best_fit.adjrsq >= params_obj.gaussian_67_reseed_rsq
+
+
+def reseed_score_key(fit):
+    """
+    Sort key for choosing the best fit at a CV (including between warm start and re-seeded fits). Fits with an
+    undefined score (no peaks above the amplitude cutoff) rank below all others.
+    :param fit: SingleFitStats
+    :return: score
+    """
+    return -np.inf if np.isnan(fit.score) else fit.score
+
+
+def get_batch_fit_info(file_index, cv, combinations, gaussian_guess_list, cv_col_intensities, dt_axis, params_obj):
+    """
+    Assemble the components, initial values, and bounds of each peak combination to fit to one CV column in fit_batch
+    :param file_index: index of the file being fit
+    :param cv: collision voltage of the column
+    :param combinations: list of (num protein peaks, num non-protein peaks) to fit
+    :param gaussian_guess_list: list of Gaussian guesses
+    :type gaussian_guess_list: list[Gaussian]
+    :param cv_col_intensities: intensity values along the DT axis at this CV
+    :param dt_axis: DT axis
+    :param params_obj: parameter information container
+    :type params_obj: Parameters
+    :return: list of (file index, cv, num protein peaks, num non-protein peaks, components, initial values, lower bounds, upper bounds) tuples
+    """
+    fit_info_list = []
+    for num_prot_pks, num_nonprot_pks in combinations:
+        components = assign_components(num_prot_pks, num_nonprot_pks, params_obj, gaussian_guess_list, cv, dt_axis=dt_axis, dt_profile=cv_col_intensities)
+        initial_values, lower_bounds, upper_bounds = get_fit_values_and_bounds(components, params_obj, dt_axis)
+        fit_info_list.append((file_index, cv, num_prot_pks, num_nonprot_pks, components, initial_values, lower_bounds, upper_bounds))
+    return fit_info_list
+
+
+def fit_batch(fit_info_list, ciu_data_list, cv_index, dt_axis, params_obj, outputfolder_list):
+    """
+    Fit all peak combinations for the same CV of one or more files in a single call to fit_gaussians_batched
+    :param fit_info_list: list of fit information tuples from get_batch_fit_info
+    :param ciu_data_list: list of 2D numpy arrays of CIU data (DT x CV)
+    :param cv_index: index of the CV being fit
+    :param dt_axis: DT axis (common to all files)
+    :param params_obj: parameter information container
+    :type params_obj: Parameters
+    :param outputfolder_list: list of directories in which to save diagnostics for each file (if requested)
+    :return: dict of file index: list of fits (SingleFitStats) for that file
+    """
+    use_baseline = bool(params_obj.gaussian_75_baseline)
+
+    # pad fits with fewer components with fixed zero-amplitude Gaussians so all fits have the same number of values
+    max_num_components = max([len(fit_info[4]) for fit_info in fit_info_list])
+    num_values = 3 * max_num_components + (1 if use_baseline else 0)
+    padding = np.tile([0, dt_axis[0], 1.0], max_num_components)
+    initial_batch = np.empty((len(fit_info_list), num_values))
+    lower_batch = np.empty_like(initial_batch)
+    upper_batch = np.empty_like(initial_batch)
+    free_mask = np.zeros(initial_batch.shape, dtype=bool)
+    y_batch = np.empty((len(fit_info_list), len(dt_axis)))
+    for fit_index, fit_info in enumerate(fit_info_list):
+        file_index, _, _, _, components, initial_values, lower_bounds, upper_bounds = fit_info
+        num_gauss_values = 3 * len(components)
+        for batch, values in [(initial_batch, initial_values), (lower_batch, lower_bounds), (upper_batch, upper_bounds)]:
+            batch[fit_index, :3 * max_num_components] = padding
+            batch[fit_index, :num_gauss_values] = values[:num_gauss_values]
+            if use_baseline:
+                batch[fit_index, -1] = values[-1]
+        free_mask[fit_index, :num_gauss_values] = True
+        free_mask[fit_index, 3 * max_num_components:] = True
+        y_batch[fit_index] = ciu_data_list[file_index][:, cv_index]
+
+    fit_values = fit_gaussians_batched(dt_axis, y_batch, initial_batch, lower_batch, upper_batch, free_mask, use_baseline,
+                                       amp_cutoff=params_obj.gaussian_2_int_threshold)
+
+    # score all fits
+    fits_by_file = {}
+    for fit_index, fit_info in enumerate(fit_info_list):
+        file_index, cv, num_prot_pks, num_nonprot_pks, components = fit_info[:5]
+        values = fit_values[fit_index, :3 * len(components)]
+        if use_baseline:
+            values = np.append(values, fit_values[fit_index, -1])
+        current_fit = make_fit_from_values(dt_axis, y_batch[fit_index], cv, components, values, params_obj)
+        if params_obj.gaussian_4_save_diagnostics:
+            save_fit_diagnostics(current_fit, None, dt_axis, num_prot_pks, num_nonprot_pks, outputfolder_list[file_index], params_obj)
+        fits_by_file.setdefault(file_index, []).append(current_fit)
+    return fits_by_file
+
+
+def get_initial_guesses(best_fits_by_cv, cv_col_intensities, dt_axis, cv, params_obj):
+    """
+    Initial peak guesses for fitting a CV column: the best fit at the previous CV if there is one,
+    otherwise guesses from guess_gauss_init or guess_gauss_peaks (gaussian_66_init_method).
+    :param best_fits_by_cv: list of best fits (SingleFitStats) at the preceding CVs
+    :type best_fits_by_cv: list[SingleFitStats]
+    :param cv_col_intensities: intensity values along the DT axis at this CV
+    :param dt_axis: DT axis
+    :param cv: collision voltage of this column
+    :param params_obj: parameter information container
+    :type params_obj: Parameters
+    :return: list of Gaussian guesses
+    :rtype: list[Gaussian]
+    """
+    if len(best_fits_by_cv) > 0:
+        return copy_gaussians_from_prevfit(best_fits_by_cv[-1], cv)
+    # run initial guess method since we have no previous peaks to refer to
+    if params_obj.gaussian_66_init_method == 'peak_find':
+        return guess_gauss_peaks(cv_col_intensities, dt_axis, cv, amp_cutoff=params_obj.gaussian_2_int_threshold)
+    return guess_gauss_init(cv_col_intensities, dt_axis, cv, rsq_cutoff=0.99, amp_cutoff=params_obj.gaussian_2_int_threshold)
 
 
 def copy_gaussians_from_prevfit(prev_fit, new_cv):
@@ -456,6 +1252,129 @@ def guess_gauss_init(ciu_col, dt_axis, cv, rsq_cutoff, amp_cutoff):
     return gaussians
 
 
+def guess_gauss_peaks(ciu_col, dt_axis, cv, amp_cutoff):
+    """
+    Generate initial guesses for Gaussians in a single pass (no fitting). Peaks are found by prominence,
+    with centroid and width estimated from the intensity-weighted moments of the part of each peak
+    above half its height. Shoulders (overlapping peaks without a maximum of their own) show up as extra
+    maxima of the negative second derivative (curvature) of the smoothed profile. A peak with a shoulder on
+    one side is estimated from its other side only, so that the shoulder is not absorbed into a wider peak.
+    Shoulders are then found as curvature maxima of the profile remaining after subtracting the peaks,
+    with width estimated from the curvature (-y'' = A / sigma^2 at the centroid of a Gaussian).
+    :param ciu_col: intensity (y) data at this CV
+    :param dt_axis: DT (x) data
+    :param cv: collision voltage to record for Gaussians
+    :param amp_cutoff: minimum amplitude (and prominence) for a peak to be included
+    :return: list of Gaussian objects with guess parameters, in decreasing order of amplitude
+    :rtype: list[Gaussian]
+    """
+    ciu_col = np.asarray(ciu_col, dtype=float)
+    dt_axis = np.asarray(dt_axis, dtype=float)
+    dt_spacing = (dt_axis[-1] - dt_axis[0]) / (len(dt_axis) - 1)
+
+    peak_indices, _ = scipy.signal.find_peaks(ciu_col, height=amp_cutoff, prominence=amp_cutoff)
+    window_length = min(7, len(ciu_col) - 1 + len(ciu_col) % 2)
+    if window_length >= 5:
+        shoulder_sides = find_shoulder_sides(ciu_col, peak_indices, min(SHOULDER_WINDOW_LENGTH, window_length), dt_spacing, amp_cutoff)
+    else:
+        shoulder_sides = [set() for _ in peak_indices]
+
+    guesses = []
+    half_widths = []
+    for peak_index, sides in zip(peak_indices, shoulder_sides):
+        amplitude = ciu_col[peak_index]
+        # estimate from the side away from a shoulder if there is one (on one side only)
+        clean_side = -sides.pop() if len(sides) == 1 else 0
+        centroid, width, half_width_bins = estimate_peak_moments(ciu_col, dt_axis, peak_index, dt_spacing, clean_side)
+        guesses.append([amplitude, centroid, width])
+        half_widths.append(half_width_bins)
+
+    # shoulders: curvature maxima of the profile remaining after subtracting the peaks found above
+    residual = ciu_col - multi_gauss_func(dt_axis, *[value for guess in guesses for value in guess])
+    if window_length >= 5:
+        curvature = -scipy.signal.savgol_filter(residual, window_length, polyorder=3, deriv=2, delta=dt_spacing)
+        shoulder_indices, _ = scipy.signal.find_peaks(curvature, height=0)
+        for shoulder_index in shoulder_indices:
+            amplitude = residual[shoulder_index]
+            if amplitude < amp_cutoff or any(abs(shoulder_index - peak_index) <= half_width for peak_index, half_width in zip(peak_indices, half_widths)):
+                continue
+            guesses.append([amplitude, dt_axis[shoulder_index], np.sqrt(amplitude / curvature[shoulder_index])])
+
+    guesses = sorted(guesses, key=lambda x: x[0], reverse=True)
+    return [Gaussian(amp, cent, width, cv, pcov=None, protein_bool=True) for amp, cent, width in guesses]
+
+
+def find_shoulder_sides(ciu_col, peak_indices, window_length, dt_spacing, amp_cutoff):
+    """
+    Find the side(s) of each peak on which the profile has a shoulder. The curvature (negative second
+    derivative) of a Gaussian has a single maximum at its centroid, so any curvature maximum other than the
+    one closest to each peak (and above the amplitude cutoff) is taken as a shoulder of the nearest peak.
+    :param ciu_col: intensity (y) data
+    :param peak_indices: indices of the peak maxima
+    :param window_length: Savitzky-Golay window length for the second derivative
+    :param dt_spacing: DT axis spacing
+    :param amp_cutoff: minimum intensity for a shoulder to be included
+    :return: list (one entry per peak) of sets of sides with shoulders (-1 for lower DT, 1 for higher DT)
+    :rtype: list[set]
+    """
+    shoulder_sides = [set() for _ in peak_indices]
+    if len(peak_indices) == 0:
+        return shoulder_sides
+    curvature = -scipy.signal.savgol_filter(ciu_col, window_length, polyorder=3, deriv=2, delta=dt_spacing)
+    curvature_indices, _ = scipy.signal.find_peaks(curvature, height=0)
+    if len(curvature_indices) == 0:
+        return shoulder_sides
+    peak_curvature_indices = {curvature_indices[np.argmin(np.abs(curvature_indices - peak_index))] for peak_index in peak_indices}
+    for curvature_index in curvature_indices:
+        if curvature_index in peak_curvature_indices or ciu_col[curvature_index] < amp_cutoff:
+            continue
+        nearest_peak = np.argmin(np.abs(peak_indices - curvature_index))
+        shoulder_sides[nearest_peak].add(int(np.sign(curvature_index - peak_indices[nearest_peak])))
+    return shoulder_sides
+
+
+def estimate_peak_moments(ciu_col, dt_axis, peak_index, dt_spacing, clean_side=0):
+    """
+    Estimate the centroid and width (sigma) of a peak from the intensity-weighted moments of the contiguous
+    points around the peak index that are above half the peak height (up to the nearest valley). Falls back to the peak max and the
+    half height width if there are too few points to compute moments. If a side is given (e.g. because the
+    other side has a shoulder), the centroid is the peak max and the width is from the half height crossing on that side.
+    :param ciu_col: intensity (y) data
+    :param dt_axis: DT (x) data
+    :param peak_index: index of the peak maximum
+    :param dt_spacing: DT axis spacing
+    :param clean_side: side from which to estimate the peak width (-1 for lower DT, 1 for higher DT), or 0 to use both sides
+    :return: centroid, width (sigma), half width of the window used (in bins)
+    """
+    half_height = ciu_col[peak_index] / 2.0
+    left_index = peak_index
+    # stop at valleys as well, so the window does not extend into an overlapping peak
+    while left_index > 0 and half_height < ciu_col[left_index - 1] <= ciu_col[left_index]:
+        left_index -= 1
+    right_index = peak_index
+    while right_index < len(ciu_col) - 1 and half_height < ciu_col[right_index + 1] <= ciu_col[right_index]:
+        right_index += 1
+    half_width_bins = max(peak_index - left_index, right_index - peak_index) + 1
+
+    if clean_side != 0:
+        edge_index = right_index if clean_side > 0 else left_index
+        crossing_index = edge_index + clean_side
+        if 0 <= crossing_index < len(ciu_col) and ciu_col[crossing_index] <= half_height:
+            # interpolate the half height crossing between the last point above and the first point below it
+            crossing_frac = (ciu_col[edge_index] - half_height) / (ciu_col[edge_index] - ciu_col[crossing_index])
+            half_width = abs(dt_axis[edge_index] - dt_axis[peak_index]) + crossing_frac * abs(dt_axis[crossing_index] - dt_axis[edge_index])
+            return dt_axis[peak_index], fwhm_to_sigma(2 * half_width), abs(edge_index - peak_index) + 1
+
+    weights = ciu_col[left_index: right_index + 1] - half_height
+    dt_values = dt_axis[left_index: right_index + 1]
+    if len(weights) < 3:
+        # too narrow for moments: use the DT spacing as the half width at half max
+        return dt_axis[peak_index], fwhm_to_sigma(2 * dt_spacing), half_width_bins
+    centroid = np.sum(weights * dt_values) / np.sum(weights)
+    variance = np.sum(weights * (dt_values - centroid) ** 2) / np.sum(weights)
+    return centroid, np.sqrt(variance / HALF_MAX_VARIANCE_RATIO), half_width_bins
+
+
 def sequential_fit_rsq(all_peak_guesses, dt_axis, cv_col_intensities, cv, convergence_rsq, amp_cutoff):
     """
     Gaussian fitting 1.0 method - adds peak components from a list of initial guesses (provided)
@@ -518,7 +1437,7 @@ def sequential_fit_rsq(all_peak_guesses, dt_axis, cv_col_intensities, cv, conver
     return popt, pcov, all_fit_rounds
 
 
-def iterate_lmfitting(x_data, y_data, guesses_list, cv, params_obj, outputpath):
+def iterate_lmfitting(x_data, y_data, guesses_list, cv, params_obj, outputpath, component_pool=None):
     """
     Primary fitting method. Iterates over combinations of protein and non-protein peaks using
     models generated with LMFit based on the initial peak guesses in the guesses_list. Fits are
@@ -532,7 +1451,68 @@ def iterate_lmfitting(x_data, y_data, guesses_list, cv, params_obj, outputpath):
     :param params_obj: Parameters container with various parameter information
     :type params_obj: Parameters
     :param outputpath: directory in which to save outputs
-    :return: best fit result as a MinimizerResult/ModelFitResult from LMFit
+    :param component_pool: (optional) process pool in which to fit the peak combinations in parallel
+    :return: list of SingleFitStats for all peak combinations
+    """
+    combinations = get_component_combinations(params_obj)
+    argslists = [[x_data, y_data, cv, num_prot_pks, num_nonprot_pks, guesses_list, params_obj, outputpath] for num_prot_pks, num_nonprot_pks in combinations]
+
+    patience = params_obj.gaussian_64_stop_patience
+    if not patience:
+        return fit_combinations(argslists, component_pool)
+
+    # Early stopping: fit increasing numbers of protein peaks (with all numbers of non-protein peaks at each), and stop
+    # once the best score has not improved for the specified number of steps or has dropped too far below the best.
+    # The first EARLY_STOP_MIN_COMPONENTS numbers of components are always fit, and failed fits (NaN scores) are ignored.
+    output_fits = []
+    best_score = -np.inf
+    steps_without_improvement = 0
+    for num_prot_pks in range(1, params_obj.gaussian_71_max_prot_components + 1):
+        step_fits = fit_combinations([x for x in argslists if x[3] == num_prot_pks], component_pool)
+        output_fits.extend(step_fits)
+
+        step_scores = [x.score for x in step_fits if not np.isnan(x.score)]
+        if num_prot_pks < EARLY_STOP_MIN_COMPONENTS or len(step_scores) == 0:
+            if len(step_scores) > 0:
+                best_score = max(best_score, max(step_scores))
+            continue
+        step_score = max(step_scores)
+        if step_score > best_score:
+            best_score = step_score
+            steps_without_improvement = 0
+        else:
+            steps_without_improvement += 1
+        if steps_without_improvement >= patience:
+            break
+        if params_obj.gaussian_65_stop_score_drop > 0 and step_score < best_score - params_obj.gaussian_65_stop_score_drop:
+            break
+
+    num_skipped = len(argslists) - len(output_fits)
+    if num_skipped > 0:
+        logger.debug('CV {}: early stopping skipped {} of {} fits'.format(cv, num_skipped, len(argslists)))
+    return output_fits
+
+
+def fit_combinations(argslists, component_pool=None):
+    """
+    Run fit_combination for a list of peak combinations. The combinations are independent, so they are
+    fit in parallel if a pool is provided.
+    :param argslists: list of fit_combination argument lists
+    :param component_pool: (optional) process pool in which to fit the peak combinations in parallel
+    :return: list of SingleFitStats
+    :rtype: list[SingleFitStats]
+    """
+    if component_pool is not None:
+        return component_pool.starmap(fit_combination, argslists)
+    return [fit_combination(*argslist) for argslist in argslists]
+
+
+def get_component_combinations(params_obj):
+    """
+    List all combinations of numbers of protein and non-protein components to fit at each CV
+    :param params_obj: Parameters container
+    :type params_obj: Parameters
+    :return: list of (num protein peaks, num non-protein peaks) tuples
     """
     # determine the number of components over which to iterate fitting
     max_num_prot_pks = params_obj.gaussian_71_max_prot_components
@@ -541,32 +1521,75 @@ def iterate_lmfitting(x_data, y_data, guesses_list, cv, params_obj, outputpath):
     else:
         max_num_nonprot_pks = 0
 
-    # cv = guesses_list[0].cv
-    output_fits = []
-    # iterate over all peak combinations
+    combinations = []
     for num_prot_pks in range(1, max_num_prot_pks + 1):
-        # Mass selected mode (no nonprotein peaks)
         if max_num_nonprot_pks == 0:
-            num_nonprot_pks = 0
-            current_fit, lmfit_output = perform_fit(x_data, y_data, cv, num_prot_pks, num_nonprot_pks, guesses_list, params_obj)
-            output_fits.append(current_fit)
-
-            if params_obj.gaussian_4_save_diagnostics:
-                outputname = os.path.join(outputpath, '{}_p{}_fits.png'.format(cv, num_prot_pks))
-                plot_fit_result(current_fit, lmfit_output, x_data, outputname)
+            # Mass selected mode (no nonprotein peaks)
+            combinations.append((num_prot_pks, 0))
         else:
             # No selection mode - iterate over nonprotein peaks as well
             for num_nonprot_pks in range(params_obj.gaussian_81_min_nonprot_comps, max_num_nonprot_pks + 1):
+                combinations.append((num_prot_pks, num_nonprot_pks))
+    return combinations
 
-                # current_fit, lmfit_output = perform_fit(x_data, y_data, cv, num_prot_pks, num_nonprot_pks, guesses_list, extra_guesses, params_obj)
-                current_fit, lmfit_output = perform_fit(x_data, y_data, cv, num_prot_pks, num_nonprot_pks, guesses_list, params_obj)
-                output_fits.append(current_fit)
 
-                if params_obj.gaussian_4_save_diagnostics:
-                    outputname = os.path.join(outputpath, '{}_p{}_np{}_fits.png'.format(cv, num_prot_pks, num_nonprot_pks))
-                    plot_fit_result(current_fit, lmfit_output, x_data, outputname)
+def fit_combination(x_data, y_data, cv, num_prot_pks, num_nonprot_pks, guesses_list, params_obj, outputpath):
+    """
+    Fit a single combination of protein and non-protein peaks and save diagnostic plots if requested.
+    Separate from iterate_lmfitting to allow combinations to be fit in a process pool.
+    :param x_data: DT (x) data to fit (ndarray)
+    :param y_data: intensity (y) data to fit (ndarray)
+    :param cv: collision voltage (float)
+    :param num_prot_pks: (int) number of protein components to fit
+    :param num_nonprot_pks: (int) number of nonprotein components to fit
+    :param guesses_list: list of peak initial guesses (list of Gaussian objects)
+    :type guesses_list: list[Gaussian]
+    :param params_obj: Parameters object
+    :type params_obj: Parameters
+    :param outputpath: directory in which to save diagnostics
+    :return: SingleFitStats container with fit results and score
+    :rtype: SingleFitStats
+    """
+    current_fit, lmfit_output = perform_fit(x_data, y_data, cv, num_prot_pks, num_nonprot_pks, guesses_list, params_obj)
+
+    if params_obj.gaussian_4_save_diagnostics:
+        save_fit_diagnostics(current_fit, lmfit_output, x_data, num_prot_pks, num_nonprot_pks, outputpath, params_obj)
+    return current_fit
 
-    return output_fits
+
+def save_fit_diagnostics(current_fit, lmfit_output, x_data, num_prot_pks, num_nonprot_pks, outputpath, params_obj):
+    """
+    Save the diagnostic plot for a single combination of protein and non-protein peaks. The component
+    curves are computed here, as LMFit output cannot be sent to the plot rendering service.
+    :param current_fit: fit stats container
+    :type current_fit: SingleFitStats
+    :param lmfit_output: LMFit output (ModelResult) from the fitting, or None if not fit with LMFit, in which
+    case components are plotted from the fit container.
+    :param x_data: DT (x) data that was fit (ndarray)
+    :param num_prot_pks: (int) number of protein components fit
+    :param num_nonprot_pks: (int) number of nonprotein components fit
+    :param outputpath: directory in which to save diagnostics
+    :param params_obj: Parameters object
+    :type params_obj: Parameters
+    :return: void
+    """
+    if num_nonprot_pks == 0:
+        outputname = os.path.join(outputpath, '{}_p{}_fits.png'.format(current_fit.cv, num_prot_pks))
+    else:
+        outputname = os.path.join(outputpath, '{}_p{}_np{}_fits.png'.format(current_fit.cv, num_prot_pks, num_nonprot_pks))
+
+    component_curves = []
+    if lmfit_output is not None:
+        for component_name, comp_value in lmfit_output.eval_components(x=x_data).items():
+            # baseline component will only have a single value, so plot it at all x-axis points
+            component_curves.append((component_name, np.broadcast_to(comp_value, x_data.shape)))
+    else:
+        for index, gaussian in enumerate(current_fit.gaussians):
+            prefix = protein_prefix if gaussian.is_protein else nonprotein_prefix
+            component_curves.append(('{}{}'.format(prefix, index + 1), gaussfunc(x_data, *gaussian.return_popt())))
+        if current_fit.baseline_val != 0:
+            component_curves.append((baseline_prefix, np.full(len(x_data), current_fit.baseline_val)))
+    CIU_Plot_Service.submit_plot(params_obj, outputpath, plot_fit_result, current_fit, x_data, current_fit.y_data, component_curves, outputname)
 
 
 def perform_fit(x_data, y_data, cv, num_prot_pks, num_nonprot_pks, guesses_list, params_obj):
@@ -582,8 +1605,13 @@ def perform_fit(x_data, y_data, cv, num_prot_pks, num_nonprot_pks, guesses_list,
     :type guesses_list: list[Gaussian]
     :param params_obj: Parameters object
     :type params_obj: Parameters
-    :return: SingleFitStats container with fit results and score, LMFit output (ModelResult) from fitting
+    :return: SingleFitStats container with fit results and score, LMFit output (ModelResult) from fitting (None if
+    not fit with LMFit)
     """
+    if params_obj.gaussian_63_fit_engine == 'least_squares':
+        current_fit = perform_fit_least_squares(x_data, y_data, cv, num_prot_pks, num_nonprot_pks, guesses_list, params_obj)
+        return current_fit, None
+
     # assemble the models and fit parameters for this number of protein/non-protein peaks
     models_list, fit_params = assemble_models(num_prot_pks, num_nonprot_pks, params_obj, guesses_list, cv, dt_axis=x_data, dt_profile=y_data)
 
@@ -604,44 +1632,366 @@ def perform_fit(x_data, y_data, cv, num_prot_pks, num_nonprot_pks, guesses_list,
     return current_fit, output
 
 
-def plot_fit_result(current_fit, output, x_data, outputname):
+def perform_fit_least_squares(x_data, y_data, cv, num_prot_pks, num_nonprot_pks, guesses_list, params_obj):
+    """
+    Alternative to the LMFit fitting in perform_fit. Fits the same components, initial guesses, and bounds
+    as assemble_models, but with a single vectorized multi-Gaussian residual and its analytical Jacobian
+    in scipy.optimize.least_squares, avoiding LMFit model construction and finite difference derivatives.
+    :param x_data: DT (x) data to fit (ndarray)
+    :param y_data: intensity (y) data to fit (ndarray)
+    :param cv: collision voltage (float)
+    :param num_prot_pks: (int) number of protein components to fit in this iteration
+    :param num_nonprot_pks: (int) number of nonprotein components to fit in this iteration
+    :param guesses_list: list of peak initial guesses (list of Gaussian objects)
+    :type guesses_list: list[Gaussian]
+    :param params_obj: Parameters object
+    :type params_obj: Parameters
+    :return: SingleFitStats container with fit results and score
+    :rtype: SingleFitStats
+    """
+    components = assign_components(num_prot_pks, num_nonprot_pks, params_obj, guesses_list, cv, dt_axis=x_data, dt_profile=y_data)
+    use_baseline = bool(params_obj.gaussian_75_baseline)
+    initial_values, lower_bounds, upper_bounds = get_fit_values_and_bounds(components, params_obj, x_data)
+
+    # omit missing data, as in LMFit (nan_policy='omit')
+    finite_mask = np.isfinite(y_data)
+    fit_x = np.asarray(x_data, dtype=float)[finite_mask]
+    fit_y = np.asarray(y_data, dtype=float)[finite_mask]
+
+    result = least_squares(multi_gauss_residual, initial_values, jac=multi_gauss_jacobian, bounds=(lower_bounds, upper_bounds),
+                           method='trf', max_nfev=1000, args=(fit_x, fit_y, use_baseline))
+
+    return make_fit_from_values(x_data, y_data, cv, components, result.x, params_obj)
+
+
+def get_fit_values_and_bounds(components, params_obj, dt_axis):
+    """
+    Initial values and bounds for fitting a list of components (from assign_components) without LMFit.
+    Uses the same bounds as the LMFit models.
+    :param components: list of (prefix, guess Gaussian, protein_bool) tuples
+    :param params_obj: Parameters object
+    :type params_obj: Parameters
+    :param dt_axis: x-axis for the fitting
+    :return: initial values, lower bounds, upper bounds (ndarrays in popt order [amp1, cent1, sigma1, amp2, ... ] with
+    the baseline last if used)
+    """
+    prot_width_center = fwhm_to_sigma(params_obj.gaussian_72_prot_peak_width)
+    prot_width_tol = fwhm_to_sigma(params_obj.gaussian_73_prot_width_tol)
+    min_nonprot_width = fwhm_to_sigma(params_obj.gaussian_83_nonprot_width_min)
+
+    initial_values, lower_bounds, upper_bounds = [], [], []
+    for _, guess_gaussian, protein_bool in components:
+        if protein_bool:
+            lower, upper = get_protein_bounds(prot_width_center, prot_width_tol, dt_axis)
+        else:
+            lower, upper = get_nonprotein_bounds(min_nonprot_width, dt_axis)
+        initial_values.extend(guess_gaussian.return_popt())
+        lower_bounds.extend(lower)
+        upper_bounds.extend(upper)
+    if params_obj.gaussian_75_baseline:
+        lower, upper = get_baseline_bounds()
+        initial_values.append(0.1)
+        lower_bounds.append(lower)
+        upper_bounds.append(upper)
+
+    # guesses outside the bounds are moved to the nearest bound, as in LMFit
+    lower_bounds = np.asarray(lower_bounds, dtype=float)
+    upper_bounds = np.asarray(upper_bounds, dtype=float)
+    initial_values = np.clip(np.asarray(initial_values, dtype=float), lower_bounds, upper_bounds)
+    return initial_values, lower_bounds, upper_bounds
+
+
+def make_fit_from_values(x_data, y_data, cv, components, fit_values, params_obj):
+    """
+    Generate a scored SingleFitStats container from optimized values of a fit without LMFit
+    :param x_data: DT (x) data that was fit (ndarray)
+    :param y_data: intensity (y) data that was fit (ndarray)
+    :param cv: collision voltage (float)
+    :param components: list of (prefix, guess Gaussian, protein_bool) tuples that were fit
+    :param fit_values: optimized values in popt order [amp1, cent1, sigma1, amp2, ... ] with the baseline last if used
+    :param params_obj: Parameters object
+    :type params_obj: Parameters
+    :return: SingleFitStats container with fit results and score
+    :rtype: SingleFitStats
+    """
+    # split the optimized values into protein and non-protein Gaussians and the baseline
+    if params_obj.gaussian_75_baseline:
+        baseline_val = fit_values[-1]
+    else:
+        baseline_val = 0
+    protein_popt, nonprotein_popt = [], []
+    for index, (_, _, protein_bool) in enumerate(components):
+        if protein_bool:
+            protein_popt.extend(fit_values[3 * index: 3 * index + 3].tolist())
+        else:
+            nonprotein_popt.extend(fit_values[3 * index: 3 * index + 3].tolist())
+    protein_popt = remove_low_amp(protein_popt, params_obj.gaussian_2_int_threshold)
+    nonprotein_popt = remove_low_amp(nonprotein_popt, params_obj.gaussian_2_int_threshold)
+
+    current_fit = SingleFitStats(x_data=x_data, y_data=y_data, cv=cv, amp_cutoff=params_obj.gaussian_2_int_threshold,
+                                 popt=protein_popt, nonprotein_popt=nonprotein_popt, baseline_val=baseline_val)
+    current_fit.compute_fit_score(params_obj, penalty_scaling=1)
+    return current_fit
+
+
+def multi_gauss_residual(fit_values, x_data, y_data, use_baseline):
+    """
+    Residual of a sum of Gaussians (plus optional flat baseline) for scipy.optimize.least_squares
+    :param fit_values: ndarray of [amp1, cent1, sigma1, amp2, ... ] with the baseline last if used
+    :param x_data: x (DT) data
+    :param y_data: y (intensity) data to fit
+    :param use_baseline: whether the last fit value is a baseline
+    :return: ndarray of (model - y) at each x
+    """
+    return multi_gauss_residual_batch(fit_values[np.newaxis, :], x_data, y_data[np.newaxis, :], use_baseline)[0]
+
+
+def multi_gauss_jacobian(fit_values, x_data, y_data, use_baseline):
+    """
+    Analytical Jacobian of multi_gauss_residual with respect to the fit values
+    :param fit_values: ndarray of [amp1, cent1, sigma1, amp2, ... ] with the baseline last if used
+    :param x_data: x (DT) data
+    :param y_data: y (intensity) data to fit (unused, but required to match the residual signature)
+    :param use_baseline: whether the last fit value is a baseline
+    :return: ndarray of shape (len(x_data), len(fit_values))
+    """
+    return multi_gauss_jacobian_batch(fit_values[np.newaxis, :], x_data, use_baseline)[0]
+
+
+def multi_gauss_residual_batch(fit_values, x_data, y_data, use_baseline):
+    """
+    Residuals of many independent sums of Gaussians on a common x axis
+    :param fit_values: ndarray (num fits x num values) of [amp1, cent1, sigma1, amp2, ... ] with the baseline last if used
+    :param x_data: x (DT) data shared by all fits
+    :param y_data: ndarray (num fits x len(x_data)) of y (intensity) data to fit
+    :param use_baseline: whether the last fit value is a baseline
+    :return: ndarray (num fits x len(x_data)) of (model - y)
+    """
+    amplitudes, _, exponentials = get_gauss_components_batch(fit_values, x_data, use_baseline)
+    model = np.einsum('bk,bkn->bn', amplitudes, exponentials)
+    if use_baseline:
+        model += fit_values[:, -1:]
+    return model - y_data
+
+
+def multi_gauss_jacobian_batch(fit_values, x_data, use_baseline):
+    """
+    Analytical Jacobians of multi_gauss_residual_batch with respect to the fit values
+    :param fit_values: ndarray (num fits x num values) of [amp1, cent1, sigma1, amp2, ... ] with the baseline last if used
+    :param x_data: x (DT) data shared by all fits
+    :param use_baseline: whether the last fit value is a baseline
+    :return: ndarray of shape (num fits, len(x_data), num values)
+    """
+    amplitudes, offsets, exponentials = get_gauss_components_batch(fit_values, x_data, use_baseline)
+    sigmas = fit_values[:, 2:3 * amplitudes.shape[1]:3, np.newaxis]
+    d_centroid = amplitudes[:, :, np.newaxis] * exponentials * offsets / sigmas ** 2
+
+    num_gauss_values = 3 * amplitudes.shape[1]
+    jacobian = np.empty((fit_values.shape[0], len(x_data), fit_values.shape[1]))
+    jacobian[:, :, 0:num_gauss_values:3] = exponentials.transpose(0, 2, 1)
+    jacobian[:, :, 1:num_gauss_values:3] = d_centroid.transpose(0, 2, 1)
+    jacobian[:, :, 2:num_gauss_values:3] = (d_centroid * offsets / sigmas).transpose(0, 2, 1)
+    if use_baseline:
+        jacobian[:, :, -1] = 1
+    return jacobian
+
+
+def get_gauss_components_batch(fit_values, x_data, use_baseline):
+    """
+    Helper for the batched residual and Jacobian: evaluate the unscaled Gaussian components of each fit
+    :param fit_values: ndarray (num fits x num values) of [amp1, cent1, sigma1, amp2, ... ] with the baseline last if used
+    :param x_data: x (DT) data shared by all fits
+    :param use_baseline: whether the last fit value is a baseline
+    :return: amplitudes (num fits x num Gaussians), x offsets from centroids and exponentials (both num fits x num Gaussians x len(x_data))
+    """
+    if use_baseline:
+        gaussian_values = fit_values[:, :-1]
+    else:
+        gaussian_values = fit_values
+    amplitudes = gaussian_values[:, 0::3]
+    centroids = gaussian_values[:, 1::3]
+    sigmas = gaussian_values[:, 2::3]
+    offsets = x_data[np.newaxis, np.newaxis, :] - centroids[:, :, np.newaxis]
+    exponentials = np.exp(-offsets ** 2 / (2 * sigmas[:, :, np.newaxis] ** 2))
+    return amplitudes, offsets, exponentials
+
+
+def fit_gaussians_batched(x_data, y_data, initial_values, lower_bounds, upper_bounds, free_mask, use_baseline,
+                          amp_cutoff=None, max_iterations=200, tolerance=1.49012e-08):
+    """
+    Fit many independent multi-Gaussian models to data on a common x axis at once, using a bounded
+    Levenberg-Marquardt method. Each iteration evaluates the residuals and Jacobians of all fits that
+    have not yet converged in a single set of array operations, then removes newly converged fits.
+    Values are kept within bounds by clipping each step, and values held at a bound by the gradient
+    are fixed for that step. A fit is converged once its (projected) gradient is negligible, or once
+    nearly undamped steps have changed neither its cost nor its values, for CONVERGENCE_ITERATIONS
+    iterations in a row. Fits that stop without converging (damping limit or maximum iterations), and fits in
+    which a component collapsed below the amplitude cutoff (typically a worse local minimum in which a peak was
+    pushed out of the data), are refit with scipy.optimize.least_squares from the same initial values (see
+    refit_least_squares) and the result with the lower cost is kept, unless only the refit has any component above the cutoff.
+    :param x_data: x (DT) data shared by all fits
+    :param y_data: ndarray (num fits x len(x_data)) of y data to fit. NaN values are omitted
+    :param initial_values: ndarray (num fits x num values) of initial values in popt order (baseline last if used)
+    :param lower_bounds: ndarray (num fits x num values) of lower bounds
+    :param upper_bounds: ndarray (num fits x num values) of upper bounds
+    :param free_mask: boolean ndarray (num fits x num values), False for values that are not fit (e.g. padding)
+    :param use_baseline: whether the last fit value is a baseline
+    :param amp_cutoff: (optional) minimum amplitude of a fit component (gaussian_2_int_threshold) for its fit to be
+    accepted without refitting
+    :param max_iterations: maximum number of iterations
+    :param tolerance: relative change in cost or values (and gradient size) below which an iteration passes the
+    convergence test (as in leastsq)
+    :return: ndarray (num fits x num values) of optimized values
+    """
+    values = np.array(initial_values, dtype=float)
+    finite_mask = np.isfinite(y_data)
+    y_data = np.where(finite_mask, y_data, 0)
+    damping = np.full(values.shape[0], 1e-3)
+    damping_growth = np.full(values.shape[0], 2.0)
+    diag_indices = np.arange(values.shape[1])
+    passed_counts = np.zeros(values.shape[0], dtype=int)
+    converged = np.zeros(values.shape[0], dtype=bool)
+
+    residuals = multi_gauss_residual_batch(values, x_data, y_data, use_baseline) * finite_mask
+    costs = np.sum(residuals ** 2, axis=1)
+    active = np.arange(values.shape[0])
+    for _ in range(max_iterations):
+        if len(active) == 0:
+            break
+        active_values = values[active]
+        jacobian = multi_gauss_jacobian_batch(active_values, x_data, use_baseline) * finite_mask[active][:, :, np.newaxis]
+        gradient = np.einsum('bnp,bn->bp', jacobian, residuals[active])
+
+        held = ~free_mask[active] | ((active_values <= lower_bounds[active]) & (gradient > 0)) \
+            | ((active_values >= upper_bounds[active]) & (gradient < 0))
+        jacobian *= ~held[:, np.newaxis, :]
+        gradient[held] = 0
+        # scale-invariant gradient test (as in leastsq): cosine between the residuals and each Jacobian column
+        column_norms = np.sqrt(np.einsum('bnp,bnp->bp', jacobian, jacobian))
+        residual_norms = np.sqrt(costs[active])[:, np.newaxis]
+        small_gradient = np.all(np.abs(gradient) <= tolerance * np.maximum(column_norms * residual_norms, 1e-300), axis=1)
+
+        # damped normal equations (held values get a unit diagonal and zero gradient, so do not move)
+        hessian = np.einsum('bnp,bnq->bpq', jacobian, jacobian)
+        hessian_diag = hessian[:, diag_indices, diag_indices]
+        hessian[:, diag_indices, diag_indices] += np.where(held, 1, damping[active][:, np.newaxis] * np.maximum(hessian_diag, 1e-8))
+        step = -np.linalg.solve(hessian, gradient[:, :, np.newaxis])[:, :, 0]
+
+        trial_values = np.clip(active_values + step, lower_bounds[active], upper_bounds[active])
+        trial_residuals = multi_gauss_residual_batch(trial_values, x_data, y_data[active], use_baseline) * finite_mask[active]
+        trial_costs = np.sum(trial_residuals ** 2, axis=1)
+
+        improved = trial_costs < costs[active]
+        # gain ratio (actual / predicted cost reduction) for the damping update (Nielsen)
+        actual_steps = trial_values - active_values
+        predicted_reductions = -2 * np.einsum('bp,bp->b', actual_steps, gradient) - np.sum(np.einsum('bnp,bp->bn', jacobian, actual_steps) ** 2, axis=1)
+        gain_ratios = (costs[active] - trial_costs) / np.maximum(predicted_reductions, 1e-300)
+        # small steps only indicate convergence if they are not small because of heavy damping
+        step_norms = np.linalg.norm(actual_steps, axis=1)
+        small_step = (costs[active] - np.minimum(trial_costs, costs[active]) <= tolerance * costs[active]) \
+            & (step_norms <= tolerance * (np.linalg.norm(active_values, axis=1) + tolerance)) & (damping[active] <= 1)
+        passed = small_gradient | small_step
+        passed_counts[active] = np.where(passed, passed_counts[active] + 1, np.where(improved, 0, passed_counts[active]))
+
+        improved_indices = active[improved]
+        values[improved_indices] = trial_values[improved]
+        residuals[improved_indices] = trial_residuals[improved]
+        costs[improved_indices] = trial_costs[improved]
+        # (the gain ratio update is only computed for improved steps, as rejected steps can have very negative ratios)
+        new_damping = damping[active] * damping_growth[active]
+        new_damping[improved] = damping[active][improved] * np.maximum(1 / 3.0, 1 - (2 * np.minimum(gain_ratios[improved], 1) - 1) ** 3)
+        damping[active] = new_damping
+        damping_growth[active] = np.where(improved, 2.0, damping_growth[active] * 2)
+
+        converged[active] = passed_counts[active] >= CONVERGENCE_ITERATIONS
+        # fits that can no longer improve (damping too large) stop here and are refit below
+        active = active[~converged[active] & (damping[active] <= 1e10)]
+
+    refit_mask = ~converged
+    num_gauss_values = values.shape[1] - (1 if use_baseline else 0)
+    free_amplitudes = free_mask[:, 0:num_gauss_values:3]
+    if amp_cutoff is not None:
+        refit_mask |= np.any(free_amplitudes & (values[:, 0:num_gauss_values:3] < amp_cutoff), axis=1)
+    for fit_index in np.flatnonzero(refit_mask):
+        refit_values = refit_least_squares(x_data, y_data[fit_index], finite_mask[fit_index], initial_values[fit_index], lower_bounds[fit_index],
+                                           upper_bounds[fit_index], free_mask[fit_index], use_baseline)
+        refit_residuals = multi_gauss_residual(refit_values, x_data, y_data[fit_index], use_baseline) * finite_mask[fit_index]
+        if amp_cutoff is not None:
+            # a fit with no components left above the cutoff has no peaks at all, so prefer the refit if it kept any
+            batched_lost_all = not np.any(values[fit_index, 0:num_gauss_values:3][free_amplitudes[fit_index]] >= amp_cutoff)
+            refit_kept_any = np.any(refit_values[0:num_gauss_values:3][free_amplitudes[fit_index]] >= amp_cutoff)
+            if batched_lost_all and refit_kept_any:
+                values[fit_index] = refit_values
+                continue
+        if np.sum(refit_residuals ** 2) < costs[fit_index]:
+            values[fit_index] = refit_values
+    return values
+
+
+def refit_least_squares(x_data, y_data, finite_mask, initial_values, lower_bounds, upper_bounds, free_mask, use_baseline):
+    """
+    Fit a single multi-Gaussian model from fit_gaussians_batched with scipy.optimize.least_squares (as in
+    perform_fit_least_squares), for fits that did not converge in the batched iterations or that lost a component
+    :param x_data: x (DT) data
+    :param y_data: y data to fit
+    :param finite_mask: boolean ndarray, False for (NaN) y values to omit
+    :param initial_values: initial values in popt order (baseline last if used)
+    :param lower_bounds: lower bounds
+    :param upper_bounds: upper bounds
+    :param free_mask: boolean ndarray, False for values that are not fit (held at their initial values)
+    :param use_baseline: whether the last fit value is a baseline
+    :return: ndarray of optimized values
+    """
+    fit_x = np.asarray(x_data, dtype=float)[finite_mask]
+    fit_y = np.asarray(y_data, dtype=float)[finite_mask]
+    values = np.array(initial_values, dtype=float)
+
+    def free_residual(free_values):
+        values[free_mask] = free_values
+        return multi_gauss_residual(values, fit_x, fit_y, use_baseline)
+
+    def free_jacobian(free_values):
+        values[free_mask] = free_values
+        return multi_gauss_jacobian(values, fit_x, fit_y, use_baseline)[:, free_mask]
+
+    result = least_squares(free_residual, values[free_mask], jac=free_jacobian, bounds=(lower_bounds[free_mask], upper_bounds[free_mask]),
+                           method='trf', max_nfev=1000)
+    values[free_mask] = result.x
+    return values
+
+
+def plot_fit_result(current_fit, x_data, y_data, component_curves, outputname):
     """
     Plotting method for diagnostics only. Creates a fit plot for an iteration.
     :param current_fit: fit stats container
     :type current_fit: SingleFitStats
-    :param output: LMFit output (ModelResult) from the fitting. Can't be saved to SingleFitStats without breaking pickle-ability
     :param x_data: (ndarray) x (drift axis) data from fitting to plot
+    :param y_data: (ndarray) y (intensity) data that was fit
+    :param component_curves: list of (label, curve (ndarray)) for each fit component to plot
     :param outputname: full output filename and path to save plot
     :return: void
     """
-    plt.clf()
-    model_components = output.eval_components(x=x_data)
-    output.plot_fit()
-    for component_name, comp_value in model_components.items():
-        try:
-            plt.plot(x_data, comp_value, '--', label=component_name)
-        except ValueError:
-            # baseline component will only have a single value, so plot it at all x-axis points
-            y_data = [comp_value for _ in range(len(x_data))]
-            plt.plot(x_data, y_data, '--', label=component_name)
-    plt.legend(loc='best')
+    # fits sent to the plot rendering service do not include their data
+    current_fit.set_data(x_data, y_data)
+
+    figure = CIU_Plot_Service.new_figure()
+    axes = figure.add_subplot()
+    axes.plot(x_data, y_data, '+', label='data')
+    axes.plot(x_data, current_fit.y_fit, '-', label='best fit')
+    for component_name, comp_value in component_curves:
+        axes.plot(x_data, comp_value, '--', label=component_name)
+    axes.legend(loc='best')
     penalty_string = ['{:.2f}'.format(x) for x in current_fit.peak_penalties]
-    plt.title('{}V, r2: {:.3f}, score: {:.4f}, peak pens: {}'.format(current_fit.cv, current_fit.adjrsq, current_fit.score,
-                                                                     ','.join(penalty_string)))
-    plt.savefig(outputname)
-    try:
-        plt.savefig(outputname)
-    except PermissionError:
-        messagebox.showerror('Please Close the File Before Saving', 'The file {} is being used by another process! Please close it, THEN press the OK button to retry saving'.format(outputname))
-        plt.savefig(outputname)
+    axes.set_title('{}V, r2: {:.3f}, score: {:.4f}, peak pens: {}'.format(current_fit.cv, current_fit.adjrsq, current_fit.score,
+                                                                          ','.join(penalty_string)))
+    CIU_Plot_Service.save_figure(figure, outputname)
 
 
 # def assemble_models(num_prot_pks, num_nonprot_pks, params_obj, guesses_list, extra_guesses, dt_axis, dt_profile):
 def assemble_models(num_prot_pks, num_nonprot_pks, params_obj, guesses_list, cv, dt_axis, dt_profile):
     """
-    Assign the peaks in the list of guesses to protein and non-protein components of the final model.
-    Guess list is assumed to be in decreasing order of amplitude. Guesses are assigned to non-protein peaks
-    if their width is larger than the expected protein width, and to protein peaks otherwise.
+    Make LMFit models and parameters for the protein and non-protein components assigned by
+    assign_components, plus a common baseline if requested.
     :param num_prot_pks: number of protein components to be fit in this iteration
     :param num_nonprot_pks: number of nonprotein components to be fit in this iteration
     :param params_obj: parameter container
@@ -656,10 +2006,6 @@ def assemble_models(num_prot_pks, num_nonprot_pks, params_obj, guesses_list, cv,
     :return: list of LMFit Models, LMFit Parameters() dictionary
     """
     fit_params = lmfit.Parameters()
-
-    # assemble models for this number of peaks
-    guess_index = 0
-    total_num_components = num_nonprot_pks + num_prot_pks
     models_list = []
 
     # Initialize a common baseline for all Gaussians if requested
@@ -668,6 +2014,50 @@ def assemble_models(num_prot_pks, num_nonprot_pks, params_obj, guesses_list, cv,
         models_list.append(model)
         fit_params.update(params)
 
+    # initialize width guesses (convert from FWHM [user input] to sigma [fitting input])
+    prot_width_center = fwhm_to_sigma(params_obj.gaussian_72_prot_peak_width)
+    prot_width_tol = fwhm_to_sigma(params_obj.gaussian_73_prot_width_tol)
+    min_nonprot_width = fwhm_to_sigma(params_obj.gaussian_83_nonprot_width_min)
+
+    components = assign_components(num_prot_pks, num_nonprot_pks, params_obj, guesses_list, cv, dt_axis, dt_profile)
+    for prefix, guess_gaussian, protein_bool in components:
+        if protein_bool:
+            model, params = make_protein_model(prefix=prefix,
+                                               guess_gaussian=guess_gaussian,
+                                               width_center=prot_width_center,
+                                               width_tol=prot_width_tol,
+                                               dt_axis=dt_axis)
+        else:
+            model, params = make_nonprotein_model(prefix=prefix,
+                                                  guess_gaussian=guess_gaussian,
+                                                  nonprot_width_min=min_nonprot_width,
+                                                  dt_axis=dt_axis)
+        models_list.append(model)
+        fit_params.update(params)
+
+    return models_list, fit_params
+
+
+def assign_components(num_prot_pks, num_nonprot_pks, params_obj, guesses_list, cv, dt_axis, dt_profile):
+    """
+    Assign the peaks in the list of guesses to protein and non-protein components of the final model.
+    Guess list is assumed to be in decreasing order of amplitude. Guesses are assigned to non-protein peaks
+    if their width is larger than the expected protein width, and to protein peaks otherwise.
+    :param num_prot_pks: number of protein components to be fit in this iteration
+    :param num_nonprot_pks: number of nonprotein components to be fit in this iteration
+    :param params_obj: parameter container
+    :type params_obj: Parameters
+    :param guesses_list: list of Gaussian objects containing guess information, in descending order of amplitude
+    :type guesses_list: list[Gaussian]
+    :param cv: collision voltage for Gaussians
+    :param dt_axis: x-axis for the fitting
+    :param dt_profile: y data for fitting (intensity values for DT profile)
+    :return: list of (prefix, guess Gaussian, protein_bool) tuples, one per component
+    """
+    guess_index = 0
+    total_num_components = num_nonprot_pks + num_prot_pks
+    components = []
+
     # counters for numbers of each peak type left to be fitted
     nonprots_remaining = num_nonprot_pks
     prots_remaining = num_prot_pks
@@ -690,46 +2080,20 @@ def assemble_models(num_prot_pks, num_nonprot_pks, params_obj, guesses_list, cv,
             if next_guess.width > (prot_width_center + prot_width_tol):
                 # the width of this guess is wider than protein - try fitting a nonprotein peak here
                 if nonprots_remaining > 0:
-                    model, params = make_nonprotein_model(
-                        prefix='{}{}'.format(nonprotein_prefix, guess_index),
-                        guess_gaussian=next_guess,
-                        nonprot_width_min=min_nonprot_width,
-                        dt_axis=dt_axis)
-                    models_list.append(model)
-                    fit_params.update(params)
-
+                    components.append(('{}{}'.format(nonprotein_prefix, guess_index), next_guess, False))
                     nonprots_remaining -= 1
                 else:
                     # no more non-protein peaks left, so add a protein peak
-                    model, params = make_protein_model(prefix='{}{}'.format(protein_prefix, guess_index),
-                                                       guess_gaussian=next_guess,
-                                                       width_center=prot_width_center,
-                                                       width_tol=prot_width_tol,
-                                                       dt_axis=dt_axis)
-                    models_list.append(model)
-                    fit_params.update(params)
+                    components.append(('{}{}'.format(protein_prefix, guess_index), next_guess, True))
                     prots_remaining -= 1
             else:
                 # guess peak width is narrow enough to be protein - guess it first
                 if prots_remaining > 0:
-                    model, params = make_protein_model(prefix='{}{}'.format(protein_prefix, guess_index),
-                                                       guess_gaussian=next_guess,
-                                                       width_center=prot_width_center,
-                                                       width_tol=prot_width_tol,
-                                                       dt_axis=dt_axis)
-                    models_list.append(model)
-                    fit_params.update(params)
+                    components.append(('{}{}'.format(protein_prefix, guess_index), next_guess, True))
                     prots_remaining -= 1
                 else:
                     # no protein peaks left, so guess non-protein
-                    model, params = make_nonprotein_model(
-                        prefix='{}{}'.format(nonprotein_prefix, guess_index),
-                        guess_gaussian=next_guess,
-                        nonprot_width_min=min_nonprot_width,
-                        dt_axis=dt_axis)
-                    models_list.append(model)
-                    fit_params.update(params)
-
+                    components.append(('{}{}'.format(nonprotein_prefix, guess_index), next_guess, False))
                     nonprots_remaining -= 1
 
     else:
@@ -743,16 +2107,45 @@ def assemble_models(num_prot_pks, num_nonprot_pks, params_obj, guesses_list, cv,
                 next_guess = guess_next_gaussian(dt_profile, dt_axis, prot_width_center, cv, guesses_list)
                 guess_index += 1
 
-            model, params = make_protein_model(prefix='{}{}'.format(protein_prefix, guess_index),
-                                               guess_gaussian=next_guess,
-                                               width_center=prot_width_center,
-                                               width_tol=prot_width_tol,
-                                               dt_axis=dt_axis)
-            models_list.append(model)
-            fit_params.update(params)
-            # guess_index += 1
+            components.append(('{}{}'.format(protein_prefix, guess_index), next_guess, True))
 
-    return models_list, fit_params
+    return components
+
+
+def get_protein_bounds(width_center, width_tol, dt_axis):
+    """
+    Bounds on the parameters of a protein Gaussian component
+    :param width_center: center of allowed width distribution
+    :param width_tol: tolerance (width) of allowed peak width distribution
+    :param dt_axis: dt_axis information for determining boundaries
+    :return: lower bounds [amplitude, centroid, sigma], upper bounds [amplitude, centroid, sigma]
+    """
+    min_width = width_center - width_tol
+    max_width = width_center + width_tol
+    if min_width < 0:
+        min_width = 1e-3
+    return [0, dt_axis[0], min_width], [1.5, dt_axis[-1], max_width]
+
+
+def get_nonprotein_bounds(nonprot_width_min, dt_axis):
+    """
+    Bounds on the parameters of a non-protein Gaussian component
+    :param nonprot_width_min: minimum width for non-protein peak
+    :param dt_axis: dt_axis information for determining boundaries
+    :return: lower bounds [amplitude, centroid, sigma], upper bounds [amplitude, centroid, sigma]
+    """
+    max_dt = dt_axis[-1]
+    min_dt = dt_axis[0]
+    max_width = (max_dt - min_dt) / 2.0     # should not approach the width of the whole DT axis
+    return [0, min_dt, nonprot_width_min], [1.5, max_dt, max_width]
+
+
+def get_baseline_bounds():
+    """
+    Bounds on the common baseline
+    :return: lower bound, upper bound
+    """
+    return 1e-10, 1.0
 
 
 def make_protein_model(prefix, guess_gaussian, width_center, width_tol, dt_axis):
@@ -767,21 +2160,14 @@ def make_protein_model(prefix, guess_gaussian, width_center, width_tol, dt_axis)
     :param dt_axis: dt_axis information for determining boundaries
     :return: LMFit model object with initialized parameters, bounds, and constraints
     """
-    max_dt = dt_axis[-1]
-    min_dt = dt_axis[0]
-
     model = lmfit.Model(gaussfunc, prefix=prefix)
     model_params = model.make_params()
-
-    min_width = width_center - width_tol
-    max_width = width_center + width_tol
-    if min_width < 0:
-        min_width = 1e-3
+    lower, upper = get_protein_bounds(width_center, width_tol, dt_axis)
 
     # set initial guesses and boundaries
-    model_params[prefix + 'centroid'].set(guess_gaussian.centroid, min=min_dt, max=max_dt)
-    model_params[prefix + 'sigma'].set(guess_gaussian.width, min=min_width, max=max_width)
-    model_params[prefix + 'amplitude'].set(guess_gaussian.amplitude, min=0, max=1.5)
+    model_params[prefix + 'centroid'].set(guess_gaussian.centroid, min=lower[1], max=upper[1])
+    model_params[prefix + 'sigma'].set(guess_gaussian.width, min=lower[2], max=upper[2])
+    model_params[prefix + 'amplitude'].set(guess_gaussian.amplitude, min=lower[0], max=upper[0])
 
     # return the model
     return model, model_params
@@ -798,17 +2184,14 @@ def make_nonprotein_model(prefix, guess_gaussian, nonprot_width_min, dt_axis):
     :param dt_axis: dt_axis information for determining boundaries
     :return: LMFit model object with initialized parameters, bounds, and constraints
     """
-    max_dt = dt_axis[-1]
-    min_dt = dt_axis[0]
-    max_width = (max_dt - min_dt) / 2.0     # should not approach the width of the whole DT axis
-
     model = lmfit.Model(gaussfunc, prefix=prefix)
     model_params = model.make_params()
+    lower, upper = get_nonprotein_bounds(nonprot_width_min, dt_axis)
 
     # set initial guesses and boundaries
-    model_params[prefix + 'centroid'].set(guess_gaussian.centroid, min=min_dt, max=max_dt)
-    model_params[prefix + 'sigma'].set(guess_gaussian.width, min=nonprot_width_min, max=max_width)
-    model_params[prefix + 'amplitude'].set(guess_gaussian.amplitude, min=0, max=1.5)
+    model_params[prefix + 'centroid'].set(guess_gaussian.centroid, min=lower[1], max=upper[1])
+    model_params[prefix + 'sigma'].set(guess_gaussian.width, min=lower[2], max=upper[2])
+    model_params[prefix + 'amplitude'].set(guess_gaussian.amplitude, min=lower[0], max=upper[0])
 
     # return the model
     return model, model_params
@@ -822,7 +2205,8 @@ def make_baseline_model(guess_baseline):
     """
     model = lmfit.Model(baseline_func, prefix=baseline_prefix)
     model_params = model.make_params()
-    model_params[baseline_prefix + 'baseline'].set(guess_baseline, min=1e-10, max=1.0)
+    min_baseline, max_baseline = get_baseline_bounds()
+    model_params[baseline_prefix + 'baseline'].set(guess_baseline, min=min_baseline, max=max_baseline)
 
     return model, model_params
 
@@ -1090,34 +2474,50 @@ def compute_area_penalty(gaussian, list_of_gaussians, dt_axis, penalty_mode):
     :param penalty_mode: (string) 'strict', 'relaxed', or 'none' - determines which function to use for computing area penalties
     :return: penalty (float)
     """
-    if penalty_mode == 'none':
-        return 0
+    gaussian_index = [index for index, other in enumerate(list_of_gaussians) if other is gaussian][0]
+    return compute_area_penalties(list_of_gaussians, dt_axis, penalty_mode)[gaussian_index]
+
 
-    # for this gaussian, compute how much area it shares with the rest of the list
-    total_penalty = 0
-    # for gaussian in list_of_gaussians:
-    my_area = scipy.integrate.trapz(gaussfunc(dt_axis, *gaussian.return_popt()), dt_axis)
+def compute_area_penalties(list_of_gaussians, dt_axis, penalty_mode):
+    """
+    Shared area penalties for all Gaussians in a list at once (see compute_area_penalty). The maximum
+    area each Gaussian shares with any other is taken from the shared area matrix.
+    :param list_of_gaussians: all gaussians currently fit at this CV (at least 2)
+    :type list_of_gaussians: list[Gaussian]
+    :param dt_axis: x axis array over which to compute overlap
+    :param penalty_mode: (string) 'strict', 'relaxed', or 'none' - determines which function to use for computing area penalties
+    :return: ndarray of penalties (one per Gaussian, in list order)
+    """
+    if penalty_mode == 'none':
+        return np.zeros(len(list_of_gaussians))
 
-    other_gaussians = [x for x in list_of_gaussians if x is not gaussian]
-    shared_areas = []
-    for other in other_gaussians:
-        shared_areas.append(shared_area_gauss(dt_axis, gaussian.return_popt(), other.return_popt()))
+    areas, shared_areas = compute_shared_area_matrix(dt_axis, np.array([x.return_popt() for x in list_of_gaussians]))
 
     # compute shared area (ratio from 0 to 1) and any penalties if > 0.25 (not much until 0.5)
-    max_shared_area = np.max(shared_areas)
-    shared_area_ratio = max_shared_area / my_area
-    if shared_area_ratio > 0.25:
-        if penalty_mode == 'strict':
-            my_penalty = (1.25 * shared_area_ratio - 0.25) ** 4
-        elif penalty_mode == 'relaxed':
-            my_penalty = (shared_area_ratio - 0.4) ** 4
-        else:
-            logger.error('invalid penalty mode: {}. Penalty set to 0'.format(penalty_mode))
-            my_penalty = 0
+    np.fill_diagonal(shared_areas, -np.inf)
+    shared_area_ratios = np.max(shared_areas, axis=1) / areas
+    if penalty_mode == 'strict':
+        penalties = (1.25 * shared_area_ratios - 0.25) ** 4
+    elif penalty_mode == 'relaxed':
+        penalties = (shared_area_ratios - 0.4) ** 4
+    else:
+        logger.error('invalid penalty mode: {}. Penalty set to 0'.format(penalty_mode))
+        penalties = np.zeros(len(list_of_gaussians))
+    return np.where(shared_area_ratios > 0.25, penalties, 0)
 
-        total_penalty += my_penalty
 
-    return total_penalty
+def compute_shared_area_matrix(x_axis, gaussian_params):
+    """
+    Compute the area of each Gaussian and the shared area (area under the lower curve) of every pair of
+    Gaussians, integrated over the provided axis in a single pass.
+    :param x_axis: x-axis on which to plot the gaussian functions (doesn't matter as long as it's sufficiently sampled)
+    :param gaussian_params: ndarray (num Gaussians x 3) of [amplitude, centroid, width] for each Gaussian
+    :return: ndarray of areas (num Gaussians), ndarray of shared areas (num Gaussians x num Gaussians)
+    """
+    curves = gaussfunc(x_axis[np.newaxis, :], gaussian_params[:, 0:1], gaussian_params[:, 1:2], gaussian_params[:, 2:3])
+    areas = scipy.integrate.trapezoid(curves, x_axis, axis=1)
+    shared_areas = scipy.integrate.trapezoid(np.minimum(curves[:, np.newaxis, :], curves[np.newaxis, :, :]), x_axis, axis=2)
+    return areas, shared_areas
 
 
 def shared_area_gauss(x_axis, gauss1_params, gauss2_params):
@@ -1130,19 +2530,10 @@ def shared_area_gauss(x_axis, gauss1_params, gauss2_params):
     :return: shared area
     """
     # shared area is the area under the lower curve
-    gauss1 = gaussfunc(x_axis, *gauss1_params)
-    gauss2 = gaussfunc(x_axis, *gauss2_params)
-    shared_area_arr = []
-
-    # for each point along the x (DT) axis, determine the amount of shared area
-    for index in np.arange(0, len(x_axis)):
-        if gauss1[index] > gauss2[index]:
-            shared_area_arr.append(gauss2[index])
-        else:
-            shared_area_arr.append(gauss1[index])
+    shared_area_arr = np.minimum(gaussfunc(x_axis, *gauss1_params), gaussfunc(x_axis, *gauss2_params))
 
     # return the integrated area over the provided axis
-    return scipy.integrate.trapz(shared_area_arr, x_axis)
+    return scipy.integrate.trapezoid(shared_area_arr, x_axis)
 
 
 def save_fits_pdf_new(analysis_obj, params_obj, best_fit_list, outputpath):
@@ -1166,46 +2557,47 @@ def save_fits_pdf_new(analysis_obj, params_obj, best_fit_list, outputpath):
         messagebox.showerror('Please Close the File Before Saving', 'The file {} is being used by another process! Please close it, THEN press the OK button to retry saving'.format(gauss_fig))
         pdf_fig = matplotlib.backends.backend_pdf.PdfPages(gauss_fig)
 
+    # fits sent to the plot rendering service do not include their data
+    attach_fit_data(best_fit_list, analysis_obj.ciu_data, analysis_obj.axes)
     intarray = np.swapaxes(analysis_obj.ciu_data, 0, 1)
     for cv_index in range(len(analysis_obj.axes[1])):
-        plt.figure(figsize=(params_obj.plot_03_figwidth, params_obj.plot_04_figheight), dpi=params_obj.plot_05_dpi)
+        figure = CIU_Plot_Service.new_figure(params_obj)
+        axes = figure.add_subplot()
 
         best_fit = best_fit_list[cv_index]
 
         # plot the original raw data as a scatter plot
-        plt.scatter(analysis_obj.axes[0], intarray[cv_index])
+        axes.scatter(analysis_obj.axes[0], intarray[cv_index])
 
         # plot the combined 'best fit' data
-        plt.plot(best_fit.x_data, best_fit.y_fit, color='black', label='Combined Fit')
+        axes.plot(best_fit.x_data, best_fit.y_fit, color='black', label='Combined Fit')
 
         # plot each component individually
         prot_index = 1
         for prot_gauss in best_fit.gaussians_protein:
             gauss_fit = gaussfunc(best_fit.x_data, prot_gauss.amplitude, prot_gauss.centroid, prot_gauss.width)
-            plt.plot(best_fit.x_data, gauss_fit, ls='--', label='Signal {}'.format(prot_index))
+            axes.plot(best_fit.x_data, gauss_fit, ls='--', label='Signal {}'.format(prot_index))
             prot_index += 1
         nonprot_index = 1
         for nonprot_gauss in best_fit.gaussians_nonprotein:
             gauss_fit = gaussfunc(best_fit.x_data, nonprot_gauss.amplitude, nonprot_gauss.centroid, nonprot_gauss.width)
-            plt.plot(best_fit.x_data, gauss_fit, ls='--', label='Noise {}'.format(nonprot_index))
+            axes.plot(best_fit.x_data, gauss_fit, ls='--', label='Noise {}'.format(nonprot_index))
             nonprot_index += 1
         if best_fit.baseline_val > 0:
-            plt.plot(best_fit.x_data, [best_fit.baseline_val for _ in range(len(best_fit.x_data))], ls='--', label='baseline: {:.2f}'.format(best_fit.baseline_val))
+            axes.plot(best_fit.x_data, [best_fit.baseline_val for _ in range(len(best_fit.x_data))], ls='--', label='baseline: {:.2f}'.format(best_fit.baseline_val))
 
         # plot titles, labels, and legends
         if params_obj.plot_08_show_axes_titles:
-            plt.xlabel(params_obj.plot_10_y_title, fontsize=params_obj.plot_13_font_size, fontweight='bold')
-            plt.ylabel('Relative Intensity', fontsize=params_obj.plot_13_font_size, fontweight='bold')
-        plt.xticks(fontsize=params_obj.plot_13_font_size)
-        plt.yticks(fontsize=params_obj.plot_13_font_size)
+            axes.set_xlabel(params_obj.plot_10_y_title, fontsize=params_obj.plot_13_font_size, fontweight='bold')
+            axes.set_ylabel('Relative Intensity', fontsize=params_obj.plot_13_font_size, fontweight='bold')
+        axes.tick_params(labelsize=params_obj.plot_13_font_size)
         if params_obj.plot_07_show_legend:
-            plt.legend(loc='best', fontsize=params_obj.plot_13_font_size)
+            axes.legend(loc='best', fontsize=params_obj.plot_13_font_size)
 
         # penalty_string = ['{:.2f}'.format(x) for x in best_fit.peak_penalties]
-        plt.title('{}V, r2: {:.3f}, score: {:.4f}'.format(analysis_obj.axes[1][cv_index], best_fit.adjrsq, best_fit.score))
+        axes.set_title('{}V, r2: {:.3f}, score: {:.4f}'.format(analysis_obj.axes[1][cv_index], best_fit.adjrsq, best_fit.score))
 
-        pdf_fig.savefig()
-        plt.close()
+        pdf_fig.savefig(figure)
     pdf_fig.close()
 
 
@@ -1221,19 +2613,19 @@ def plot_centroids(centroid_lists_by_cv, analysis_obj, params_obj, outputpath, n
     :param outputpath: directory in which to save output
     :return: void
     """
-    plt.clf()
-    plt.figure(figsize=(params_obj.plot_03_figwidth, params_obj.plot_04_figheight), dpi=params_obj.plot_05_dpi)
+    figure = CIU_Plot_Service.new_figure(params_obj)
+    axes = figure.add_subplot()
 
     # plot centroids at each collision voltage
     for x, y in zip(analysis_obj.axes[1], centroid_lists_by_cv):
-        plt.scatter([x] * len(y), y, color='b', s=params_obj.plot_14_dot_size ** 2, edgecolors='black')
+        axes.scatter([x] * len(y), y, color='b', s=params_obj.plot_14_dot_size ** 2, edgecolors='black')
 
     # plot non-protein components in red if they are present
     nonprotein_flag = False
     if nonprotein_centroids is not None:
         for x, y in zip(analysis_obj.axes[1], nonprotein_centroids):
             try:
-                plt.scatter([x] * len(y), y, color='r', s=params_obj.plot_14_dot_size ** 2, edgecolors='black')
+                axes.scatter([x] * len(y), y, color='r', s=params_obj.plot_14_dot_size ** 2, edgecolors='black')
                 if y:
                     # only label noise peaks if they are present (if any of the lists is non-empty)
                     nonprotein_flag = True
@@ -1244,47 +2636,26 @@ def plot_centroids(centroid_lists_by_cv, analysis_obj, params_obj, outputpath, n
     # plot titles, labels, and legends
     if params_obj.plot_12_custom_title is not None:
         plot_title = params_obj.plot_12_custom_title
-        plt.title(plot_title, fontsize=params_obj.plot_13_font_size, fontweight='bold')
+        axes.set_title(plot_title, fontsize=params_obj.plot_13_font_size, fontweight='bold')
     elif params_obj.plot_11_show_title:
         plot_title = analysis_obj.short_filename
-        plt.title(plot_title, fontsize=params_obj.plot_13_font_size, fontweight='bold')
+        axes.set_title(plot_title, fontsize=params_obj.plot_13_font_size, fontweight='bold')
     if params_obj.plot_08_show_axes_titles:
-        plt.xlabel(params_obj.plot_09_x_title, fontsize=params_obj.plot_13_font_size, fontweight='bold')
-        plt.ylabel('Peak Centroid', fontsize=params_obj.plot_13_font_size, fontweight='bold')
-    plt.xticks(fontsize=params_obj.plot_13_font_size)
-    plt.yticks(fontsize=params_obj.plot_13_font_size)
+        axes.set_xlabel(params_obj.plot_09_x_title, fontsize=params_obj.plot_13_font_size, fontweight='bold')
+        axes.set_ylabel('Peak Centroid', fontsize=params_obj.plot_13_font_size, fontweight='bold')
+    axes.tick_params(labelsize=params_obj.plot_13_font_size)
     if params_obj.plot_07_show_legend:
         handles = [matplotlib.patches.Patch(color='b', label='Signal Centroids')]
         if nonprotein_flag:
             handles.append(matplotlib.patches.Patch(color='r', label='Noise Centroids'))
-        plt.legend(handles=handles, loc='best', fontsize=params_obj.plot_13_font_size)
+        axes.legend(handles=handles, loc='best', fontsize=params_obj.plot_13_font_size)
     if params_obj.plot_15_grid_bool:
-        plt.grid('on')
-
-    # set x/y limits if applicable, allowing for partial limits
-    if params_obj.plot_16_xlim_lower is not None:
-        if params_obj.plot_17_xlim_upper is not None:
-            plt.xlim((params_obj.plot_16_xlim_lower, params_obj.plot_17_xlim_upper))
-        else:
-            plt.xlim(xmin=params_obj.plot_16_xlim_lower)
-    elif params_obj.plot_17_xlim_upper is not None:
-        plt.xlim(xmax=params_obj.plot_17_xlim_upper)
-    if params_obj.plot_18_ylim_lower is not None:
-        if params_obj.plot_19_ylim_upper is not None:
-            plt.ylim((params_obj.plot_18_ylim_lower, params_obj.plot_19_ylim_upper))
-        else:
-            plt.ylim(ymin=params_obj.plot_18_ylim_lower)
-    elif params_obj.plot_19_ylim_upper is not None:
-        plt.ylim(ymax=params_obj.plot_19_ylim_upper)
+        axes.grid(True)
+    CIU_Plot_Service.set_axis_limits(axes, params_obj)
 
     output_name = analysis_obj.short_filename + '_centroids' + params_obj.plot_02_extension
     output_path = os.path.join(outputpath, output_name)
-    try:
-        plt.savefig(output_path)
-    except PermissionError:
-        messagebox.showerror('Please Close the File Before Saving', 'The file {} is being used by another process! Please close it, THEN press the OK button to retry saving'.format(output_path))
-        plt.savefig(output_path)
-    plt.close()
+    CIU_Plot_Service.save_figure(figure, output_path)
 
 
 def save_gauss_params(analysis_obj, outputpath, sort_type, combine=False, protein_only=False):
@@ -1308,29 +2679,22 @@ def save_gauss_params(analysis_obj, outputpath, sort_type, combine=False, protei
     if not protein_only:
         output_string += '# Protein Gaussians\n'
     output_string += '# CV,Amplitude,Centroid,Peak Width (FWHM)\n'
-    index = 0
-    sorted_gaussians_by_cv = []
-    while index < len(analysis_obj.axes[1]):
-        if sort_type == 'amplitude':
-            # sort in decreasing amplitude order (rather than increasing, as in centroid/width)
-            sorted_gaussians = sorted(analysis_obj.raw_protein_gaussians[index], key=lambda x: x.__getattribute__(sort_type), reverse=True)
-        else:
-            sorted_gaussians = sorted(analysis_obj.raw_protein_gaussians[index], key=lambda x: x.__getattribute__(sort_type))
+    sorted_gaussians_by_cv = sort_gaussians(analysis_obj.raw_protein_gaussians, sort_type)
+    for sorted_gaussians in sorted_gaussians_by_cv:
         outputline = ','.join([gaussian.print_info() for gaussian in sorted_gaussians])
         output_string += outputline + '\n'
-        sorted_gaussians_by_cv.append(sorted_gaussians)
-        index += 1
 
     if not protein_only:
         index = 0
         output_string += '# Non-Protein Gaussians\n'
         output_string += '# CV,Amplitude,Centroid,Peak Width (FWHM)\n'
+        nonprotein_gaussians = analysis_obj.raw_nonprotein_gaussians
         while index < len(analysis_obj.axes[1]):
-            if len(analysis_obj.raw_nonprotein_gaussians[index]) > 0:
+            if len(nonprotein_gaussians[index]) > 0:
                 if sort_type == 'amplitude':
-                    sorted_gaussians = sorted(analysis_obj.raw_nonprotein_gaussians[index], key=lambda x: x.__getattribute__(sort_type), reverse=True)
+                    sorted_gaussians = sorted(nonprotein_gaussians[index], key=lambda x: x.__getattribute__(sort_type), reverse=True)
                 else:
-                    sorted_gaussians = sorted(analysis_obj.raw_nonprotein_gaussians[index], key=lambda x: x.__getattribute__(sort_type))
+                    sorted_gaussians = sorted(nonprotein_gaussians[index], key=lambda x: x.__getattribute__(sort_type))
                 gauss_line = ','.join([gaussian.print_info() for gaussian in sorted_gaussians])
                 output_string += gauss_line + '\n'
             index += 1
@@ -1346,7 +2710,25 @@ def save_gauss_params(analysis_obj, outputpath, sort_type, combine=False, protei
             messagebox.showerror('Please Close the File Before Saving', 'The file {} is being used by another process! Please close it, THEN press the OK button to retry saving'.format(os.path.join(outputpath, output_name)))
             with open(os.path.join(outputpath, output_name), 'w') as output:
                 output.write(output_string)
-        return ''
+        return '', sorted_gaussians_by_cv
+
+
+def sort_gaussians(gaussian_lists_by_cv, sort_type):
+    """
+    Sort the Gaussians at each CV for output
+    :param gaussian_lists_by_cv: list of lists of Gaussians at each CV
+    :param sort_type: string: 'centroid', 'amplitude', or 'width'
+    :return: list of sorted lists of Gaussians at each CV
+    """
+    sorted_gaussians_by_cv = []
+    for gaussian_list in gaussian_lists_by_cv:
+        if sort_type == 'amplitude':
+            # sort in decreasing amplitude order (rather than increasing, as in centroid/width)
+            sorted_gaussians = sorted(gaussian_list, key=lambda x: x.__getattribute__(sort_type), reverse=True)
+        else:
+            sorted_gaussians = sorted(gaussian_list, key=lambda x: x.__getattribute__(sort_type))
+        sorted_gaussians_by_cv.append(sorted_gaussians)
+    return sorted_gaussians_by_cv
 
 
 def print_combined_params(all_files_gaussians_by_cv, filenames):
@@ -1363,6 +2745,9 @@ def print_combined_params(all_files_gaussians_by_cv, filenames):
         param_string = 'File,CV,' + param + '\n'
         for index, file_lists in enumerate(all_files_gaussians_by_cv):
             for cv_list in file_lists:
+                if len(cv_list) == 0:
+                    # no Gaussians fit at this CV
+                    continue
                 cv_line = '{},{},'.format(filenames[index], cv_list[0].cv)
                 cv_line += ','.join([gaussian.print_single_param(param) for gaussian in cv_list])
                 # cv_line += ','.join(['{:.2f}'.format(gaussian.__getattribute__(param)) for gaussian in cv_list])
@@ -1371,72 +2756,60 @@ def print_combined_params(all_files_gaussians_by_cv, filenames):
     return output_string
 
 
-def reconstruct_from_fits(gaussian_lists_by_cv, axes, new_filename, params_obj):
+def reconstruct_from_fits(gaussian_table, axes, new_filename, params_obj):
     """
     Construct a new analysis object using the filtered Gaussian fits of the provided analysis object
     as the raw data. Must have previously performed Gaussian feature detection on the provided analysis_obj
-    :param gaussian_lists_by_cv: list of lists of Gaussian objects at each CV
+    :param gaussian_table: table of Gaussians to reconstruct from
+    :type gaussian_table: GaussianTable
     :param axes: [DT_axis, CV_axis]: two numpy arrays with drift and CV axes to use
     :param new_filename:
     :param params_obj: Parameters container with parameters to save into the new CIUAnalsis obj
     :return: new CIUAnalysisObj with reconstructed raw data
     :rtype: CIUAnalysisObj
     """
-    ciu_data_by_cols = []
-    dt_axis = axes[0]
-    # construct the raw data at each collision voltage to stitch together into a CIU matrix
-    for cv_gauss_list in gaussian_lists_by_cv:
-        # assemble all the parameters for Gaussians at this CV
-        all_params = []
-        for gaussian in cv_gauss_list:
-            all_params.extend(gaussian.return_popt())
+    dt_axis = np.asarray(axes[0], dtype=float)
+    rows = gaussian_table.rows
 
-        # Use the Gaussian function to construct intensity data at each DT
-        intensities = multi_gauss_func(dt_axis, *all_params)
+    # evaluate every Gaussian over the DT axis at once, then sum the curves at each CV into its column
+    curves = gaussfunc(dt_axis[np.newaxis, :], rows['amplitude'][:, np.newaxis], rows['centroid'][:, np.newaxis], rows['width'][:, np.newaxis])
+    final_data = np.zeros((len(dt_axis), len(gaussian_table.cv_axis)))
+    np.add.at(final_data.T, rows['cv_index'], curves)
 
-        ciu_data_by_cols.append(intensities)
-
-    # finally, transpose the CIU data to match the typical format, normalize, and return the object
-    final_data = np.asarray(ciu_data_by_cols).T
+    # finally, normalize and return the object
     final_data = Raw_Processing.normalize_by_col(final_data)
 
     raw_obj = CIU_raw.CIURaw(final_data, dt_axis, axes[1], new_filename)
     new_analysis_obj = CIU_analysis_obj.CIUAnalysisObj(raw_obj, final_data, axes, params_obj)
     new_analysis_obj.short_filename = new_analysis_obj.short_filename + '_gauss-recon'
 
+    gaussian_lists_by_cv = gaussian_table.to_gaussian_lists()
     new_analysis_obj.protein_gaussians = gaussian_lists_by_cv
     new_analysis_obj.gaussians = gaussian_lists_by_cv
     return new_analysis_obj
 
 
-def check_recon_for_crop(gaussian_lists_by_cv, axes):
+def check_recon_for_crop(gaussian_table, axes):
     """
     Crops any columns from the beginning or end of a fingerprint being reconstructed that
     have no Gaussians fit to them. Gaps with no Gaussians between features are left alone
     and are handled gracefully by Feature Detection and Classification (or by smoothing).
-    :param gaussian_lists_by_cv: list of Gaussian lists by CV
-    :param axes: axes from the original analysis object, CV axis must be same length as gaussian_lists_by_cv
-    :return: cropped gaussian_lists_by_cv, cropped axes
-    """
-    cv_axis = axes[1]
-    true_start_index = 0
-    true_end_index = 0
-    start_flag = True
-
-    for index, gaussian_list in enumerate(gaussian_lists_by_cv):
-        if len(gaussian_list) == 0:
-            if start_flag:
-                # this list is empty AND we haven't yet found a non-empty list, so crop it
-                true_start_index += 1
-        else:
-            # not empty, so this can't be the true end
-            true_end_index = index
-            start_flag = False
+    :param gaussian_table: table of Gaussians to reconstruct from
+    :type gaussian_table: GaussianTable
+    :param axes: axes from the original analysis object, CV axis must match the table's CV axis
+    :return: cropped GaussianTable, cropped axes
+    """
+    nonempty_indices = np.flatnonzero(gaussian_table.counts_by_cv())
+    if len(nonempty_indices) == 0:
+        # no Gaussians at all - keep only the first CV
+        true_start_index, true_end_index = 0, 0
+    else:
+        true_start_index, true_end_index = nonempty_indices[0], nonempty_indices[-1]
 
     # do the cropping
-    final_lists = gaussian_lists_by_cv[true_start_index: true_end_index + 1]
-    final_cv_axis = cv_axis[true_start_index: true_end_index + 1]
-    return final_lists, [axes[0], final_cv_axis]
+    final_table = gaussian_table.crop_cvs(true_start_index, true_end_index + 1)
+    final_cv_axis = axes[1][true_start_index: true_end_index + 1]
+    return final_table, [axes[0], final_cv_axis]
 
 
 def parse_gaussian_list_from_file(filepath):
@@ -8,20 +8,28 @@ with CIUAnalysisObj objects providing the primary basis for handling data.
 """
 import numpy as np
 import os
-import scipy.interpolate
+import tempfile
 from tkinter import messagebox
 import logging
 
 from CIU_analysis_obj import CIUAnalysisObj
 from CIU_Params import Parameters
 from CIU_raw import CIURaw
+from CIU_Fingerprint_Stack import FingerprintStack
+import CIU_File_IO
+import CIU_Plot_Service
+import Raw_Processing
+import RMSD_Matrix
+import RMSD_Clustering
 
 # use a non-interactive backend to prevent background windows from getting created and causing error messages
 import matplotlib
 matplotlib.use('Agg')
-from matplotlib import pyplot as plt
 logger = logging.getLogger('main')
 
+# memory budget for the differences computed in each chunk of StreamingAverage RMSD calculations (independent of the number of files)
+STREAMING_RMSD_CHUNK_BYTES = 16 * 1024 * 1024
+
 
 def ciu_plot(analysis_obj, params_obj, output_dir):
     """
@@ -33,16 +41,16 @@ def ciu_plot(analysis_obj, params_obj, output_dir):
     :param output_dir: directory in which to save the plot
     :return: void
     """
-    plt.clf()
-    plt.figure(figsize=(params_obj.plot_03_figwidth, params_obj.plot_04_figheight), dpi=params_obj.plot_05_dpi)
+    figure = CIU_Plot_Service.new_figure(params_obj)
+    axes = figure.add_subplot()
 
     # save filename as plot title, unless a specific title is provided
     if params_obj.plot_12_custom_title is not None:
         plot_title = params_obj.plot_12_custom_title
-        plt.title(plot_title, fontsize=params_obj.plot_13_font_size, fontweight='bold')
+        axes.set_title(plot_title, fontsize=params_obj.plot_13_font_size, fontweight='bold')
     elif params_obj.plot_11_show_title:
         plot_title = analysis_obj.short_filename
-        plt.title(plot_title, fontsize=params_obj.plot_13_font_size, fontweight='bold')
+        axes.set_title(plot_title, fontsize=params_obj.plot_13_font_size, fontweight='bold')
     else:
         plot_title = ''
 
@@ -52,41 +60,18 @@ def ciu_plot(analysis_obj, params_obj, output_dir):
 
     # Generate contours. Aiming for levels of ~ 0 - 1.0 in steps of 0.01, but merge the bottom 10 levels together for easier editing.
     levels = get_contour_levels(analysis_obj.ciu_data)
-    plt.contourf(analysis_obj.axes[1], analysis_obj.axes[0], analysis_obj.ciu_data, levels=levels, cmap=params_obj.ciuplot_cmap_override)
-    # plt.contourf(analysis_obj.axes[1], analysis_obj.axes[0], analysis_obj.ciu_data, 100, cmap=params_obj.ciuplot_cmap_override)
-
-    # set x/y limits if applicable, allowing for partial limits
-    if params_obj.plot_16_xlim_lower is not None:
-        if params_obj.plot_17_xlim_upper is not None:
-            plt.xlim((params_obj.plot_16_xlim_lower, params_obj.plot_17_xlim_upper))
-        else:
-            plt.xlim(xmin=params_obj.plot_16_xlim_lower)
-    elif params_obj.plot_17_xlim_upper is not None:
-        plt.xlim(xmax=params_obj.plot_17_xlim_upper)
-    if params_obj.plot_18_ylim_lower is not None:
-        if params_obj.plot_19_ylim_upper is not None:
-            plt.ylim((params_obj.plot_18_ylim_lower, params_obj.plot_19_ylim_upper))
-        else:
-            plt.ylim(ymin=params_obj.plot_18_ylim_lower)
-    elif params_obj.plot_19_ylim_upper is not None:
-        plt.ylim(ymax=params_obj.plot_19_ylim_upper)
+    contours = axes.contourf(analysis_obj.axes[1], analysis_obj.axes[0], analysis_obj.ciu_data, levels=levels, cmap=params_obj.ciuplot_cmap_override)
 
+    CIU_Plot_Service.set_axis_limits(axes, params_obj)
     if params_obj.plot_06_show_colorbar:
-        cbar = plt.colorbar(ticks=[0, .25, .5, .75, 1])
+        cbar = figure.colorbar(contours, ax=axes, ticks=[0, .25, .5, .75, 1])
         cbar.ax.tick_params(labelsize=params_obj.plot_13_font_size)
     if params_obj.plot_08_show_axes_titles:
-        plt.xlabel(params_obj.plot_09_x_title, fontsize=params_obj.plot_13_font_size, fontweight='bold')
-        plt.ylabel(params_obj.plot_10_y_title, fontsize=params_obj.plot_13_font_size, fontweight='bold')
-    plt.xticks(fontsize=params_obj.plot_13_font_size)
-    plt.yticks(fontsize=params_obj.plot_13_font_size)
-
-    try:
-        plt.savefig(output_path)
-    except PermissionError:
-        messagebox.showerror('Please Close the File Before Saving', 'The file {} is being used by another process! Please close it, THEN press the OK button to retry saving'.format(output_path))
-        plt.savefig(output_path)
-    plt.close()
+        axes.set_xlabel(params_obj.plot_09_x_title, fontsize=params_obj.plot_13_font_size, fontweight='bold')
+        axes.set_ylabel(params_obj.plot_10_y_title, fontsize=params_obj.plot_13_font_size, fontweight='bold')
+    axes.tick_params(labelsize=params_obj.plot_13_font_size)
 
+    CIU_Plot_Service.save_figure(figure, output_path)
     return 'returning a value so that the mainloop doesnt stop'
 
 
@@ -117,25 +102,20 @@ def get_contour_levels(ciu_data, merge_cutoff=10, num_contours=100):
     return levels
 
 
-def rmsd_difference(ciu_matrix_1, ciu_matrix_2, noise_cutoff):
+def rmsd_difference(ciu_matrix_1, ciu_matrix_2, noise_cutoff, out=None):
     """
-        Compute RMSD between an arbitrary number of fingerprints. Returns RMSD and either pairwise difference
-    matrix or standard deviation matrix depending on number of files passed.
+    Compute RMSD between two fingerprints after noise filtering (anything below the noise cutoff set to 0).
+    The input matrices are not modified.
     :param noise_cutoff: minimum relative intensity to consider (all values below cutoff set to 0)
     :param ciu_matrix_1: 2D numpy array of floats
     :param ciu_matrix_2: 2D numpy array of floats
+    :param out: (optional) array of the same shape in which to store the difference matrix (e.g. reused across pairs)
     :return: difference matrix (ndarray), rmsd (float) in percent
     """
-    # First, noise filter data by setting anything below noise cutoff (relative intensity) to 0
-    ciu_matrix_1[ciu_matrix_1 < noise_cutoff] = 0
-    ciu_matrix_2[ciu_matrix_2 < noise_cutoff] = 0
-
-    # Calculate difference matrix
-    dif = ciu_matrix_1 - ciu_matrix_2
-    num_values = np.count_nonzero(dif)
-
-    rmsd = (np.sum(dif ** 2) / num_values) ** 0.5 * 100
-    return dif, rmsd
+    dif = RMSD_Matrix.noise_filter(ciu_matrix_1, noise_cutoff, out=out)
+    filtered_2 = RMSD_Matrix.noise_filter(ciu_matrix_2, noise_cutoff)
+    np.subtract(dif, filtered_2, out=dif)
+    return dif, RMSD_Matrix.get_rmsd(dif)
 
 
 def rmsd_plot(difference_matrix, axes, rtext, outputdir, params_obj,
@@ -156,16 +136,16 @@ def rmsd_plot(difference_matrix, axes, rtext, outputdir, params_obj,
     :return: void
     """
     # initial plot setup
-    plt.clf()
-    plt.figure(figsize=(params_obj.plot_03_figwidth, params_obj.plot_04_figheight), dpi=params_obj.plot_05_dpi)
+    figure = CIU_Plot_Service.new_figure(params_obj)
+    plot_axes = figure.add_subplot()
 
     # save filename as plot title, unless a specific title is provided
     if params_obj.plot_12_custom_title is not None:
         plot_title = params_obj.plot_12_custom_title
-        plt.title(plot_title, fontsize=params_obj.plot_13_font_size, fontweight='bold')
+        plot_axes.set_title(plot_title, fontsize=params_obj.plot_13_font_size, fontweight='bold')
     elif params_obj.plot_11_show_title:
         plot_title = 'Red: {} \nBlue: {}'.format(file1, file2)
-        plt.title(plot_title, fontsize=params_obj.plot_13_font_size, fontweight='bold')
+        plot_axes.set_title(plot_title, fontsize=params_obj.plot_13_font_size, fontweight='bold')
 
     # scale plot to max difference value in high contrast mode, or max value (1) in default mode
     if params_obj.compare_3_high_contrast:
@@ -178,49 +158,27 @@ def rmsd_plot(difference_matrix, axes, rtext, outputdir, params_obj,
     colorbar_scaling = np.linspace(-rmsd_plot_scaling, rmsd_plot_scaling, 3, endpoint=True)
 
     # make the RMSD contour plot
-    plt.contourf(axes[1], axes[0], difference_matrix, contour_scaling, cmap="bwr", ticks="none")
-    plt.tick_params(axis='x', which='both', bottom='off', top='off', left='off', right='off')
-    plt.tick_params(axis='y', which='both', bottom='off', top='off', left='off', right='off')
+    contours = plot_axes.contourf(axes[1], axes[0], difference_matrix, contour_scaling, cmap="bwr")
+    plot_axes.tick_params(axis='both', which='both', bottom=False, top=False, left=False, right=False)
 
     # plot labels and legends
     if params_obj.plot_07_show_legend:
-        plt.annotate(rtext, xy=(200, 10), xycoords='axes points', fontsize=params_obj.plot_13_font_size)
+        plot_axes.annotate(rtext, xy=(200, 10), xycoords='axes points', fontsize=params_obj.plot_13_font_size)
     if params_obj.plot_06_show_colorbar:
-        colorbar = plt.colorbar(ticks=colorbar_scaling)
+        colorbar = figure.colorbar(contours, ax=plot_axes, ticks=colorbar_scaling)
         if blue_label is not None and red_label is not None:
             colorbar.ax.set_yticklabels([red_label, 'Equal', blue_label])
         colorbar.ax.tick_params(labelsize=params_obj.plot_13_font_size)
 
     if params_obj.plot_08_show_axes_titles:
-        plt.xlabel(params_obj.plot_09_x_title, fontsize=params_obj.plot_13_font_size, fontweight='bold')
-        plt.ylabel(params_obj.plot_10_y_title, fontsize=params_obj.plot_13_font_size, fontweight='bold')
-    plt.xticks(fontsize=params_obj.plot_13_font_size)
-    plt.yticks(fontsize=params_obj.plot_13_font_size)
-
-    # set x/y limits if applicable, allowing for partial limits
-    if params_obj.plot_16_xlim_lower is not None:
-        if params_obj.plot_17_xlim_upper is not None:
-            plt.xlim((params_obj.plot_16_xlim_lower, params_obj.plot_17_xlim_upper))
-        else:
-            plt.xlim(xmin=params_obj.plot_16_xlim_lower)
-    elif params_obj.plot_17_xlim_upper is not None:
-        plt.xlim(xmax=params_obj.plot_17_xlim_upper)
-    if params_obj.plot_18_ylim_lower is not None:
-        if params_obj.plot_19_ylim_upper is not None:
-            plt.ylim((params_obj.plot_18_ylim_lower, params_obj.plot_19_ylim_upper))
-        else:
-            plt.ylim(ymin=params_obj.plot_18_ylim_lower)
-    elif params_obj.plot_19_ylim_upper is not None:
-        plt.ylim(ymax=params_obj.plot_19_ylim_upper)
+        plot_axes.set_xlabel(params_obj.plot_09_x_title, fontsize=params_obj.plot_13_font_size, fontweight='bold')
+        plot_axes.set_ylabel(params_obj.plot_10_y_title, fontsize=params_obj.plot_13_font_size, fontweight='bold')
+    plot_axes.tick_params(labelsize=params_obj.plot_13_font_size)
+    CIU_Plot_Service.set_axis_limits(plot_axes, params_obj)
 
     # save and close
     output_path = os.path.join(outputdir, '{}-{}{}{}'.format(file1, file2, filename_append, params_obj.plot_02_extension))
-    try:
-        plt.savefig(output_path)
-    except PermissionError:
-        messagebox.showerror('Please Close the File Before Saving', 'The file {} is being used by another process! Please close it, THEN press the OK button to retry saving'.format(output_path))
-        plt.savefig(output_path)
-    plt.close()
+    CIU_Plot_Service.save_figure(figure, output_path)
 
 
 def std_dev_plot(analysis_obj, std_dev_matrix, pairwise_rmsds, params_obj, output_dir):
@@ -236,79 +194,61 @@ def std_dev_plot(analysis_obj, std_dev_matrix, pairwise_rmsds, params_obj, outpu
     :return: void
     """
     # initial plot setup
-    plt.clf()
-    plt.figure(figsize=(params_obj.plot_03_figwidth, params_obj.plot_04_figheight), dpi=params_obj.plot_05_dpi)
+    figure = CIU_Plot_Service.new_figure(params_obj)
+    axes = figure.add_subplot()
 
     # save filename as plot title, unless a specific title is provided
     if params_obj.plot_12_custom_title is not None:
         plot_title = params_obj.plot_12_custom_title
-        plt.title(plot_title, fontsize=params_obj.plot_13_font_size, fontweight='bold')
+        axes.set_title(plot_title, fontsize=params_obj.plot_13_font_size, fontweight='bold')
     elif params_obj.plot_11_show_title:
         plot_title = analysis_obj.short_filename + ' Replicate Standard Deviation Plot'
-        plt.title(plot_title, fontsize=params_obj.plot_13_font_size, fontweight='bold')
+        axes.set_title(plot_title, fontsize=params_obj.plot_13_font_size, fontweight='bold')
 
     # plot standard deviation contour plot, normalized to the maximum std dev observed
     max_std_dev = np.max(std_dev_matrix)
     cutoff = int(round(0.05 * max_std_dev * 100))   # combine lowest 5% into single contour
     contour_scale = get_contour_levels(std_dev_matrix, merge_cutoff=cutoff)
-    plt.contourf(analysis_obj.axes[1], analysis_obj.axes[0], std_dev_matrix, contour_scale, cmap=params_obj.plot_01_cmap)
-
-    # set x/y limits if applicable, allowing for partial limits
-    if params_obj.plot_16_xlim_lower is not None:
-        if params_obj.plot_17_xlim_upper is not None:
-            plt.xlim((params_obj.plot_16_xlim_lower, params_obj.plot_17_xlim_upper))
-        else:
-            plt.xlim(xmin=params_obj.plot_16_xlim_lower)
-    elif params_obj.plot_17_xlim_upper is not None:
-        plt.xlim(xmax=params_obj.plot_17_xlim_upper)
-    if params_obj.plot_18_ylim_lower is not None:
-        if params_obj.plot_19_ylim_upper is not None:
-            plt.ylim((params_obj.plot_18_ylim_lower, params_obj.plot_19_ylim_upper))
-        else:
-            plt.ylim(ymin=params_obj.plot_18_ylim_lower)
-    elif params_obj.plot_19_ylim_upper is not None:
-        plt.ylim(ymax=params_obj.plot_19_ylim_upper)
+    contours = axes.contourf(analysis_obj.axes[1], analysis_obj.axes[0], std_dev_matrix, contour_scale, cmap=params_obj.plot_01_cmap)
+    CIU_Plot_Service.set_axis_limits(axes, params_obj)
 
     # plot desired labels and legends
     if params_obj.plot_08_show_axes_titles:
-        plt.xlabel(params_obj.plot_09_x_title, fontsize=params_obj.plot_13_font_size, fontweight='bold')
-        plt.ylabel(params_obj.plot_10_y_title, fontsize=params_obj.plot_13_font_size, fontweight='bold')
-    plt.xticks(fontsize=params_obj.plot_13_font_size)
-    plt.yticks(fontsize=params_obj.plot_13_font_size)
+        axes.set_xlabel(params_obj.plot_09_x_title, fontsize=params_obj.plot_13_font_size, fontweight='bold')
+        axes.set_ylabel(params_obj.plot_10_y_title, fontsize=params_obj.plot_13_font_size, fontweight='bold')
+    axes.tick_params(labelsize=params_obj.plot_13_font_size)
     if params_obj.plot_06_show_colorbar:
         colorbar_scale = np.linspace(0, max_std_dev, 6, endpoint=True)   # plot colorbar
-        cbar = plt.colorbar(ticks=colorbar_scale, format='%.2f')
+        cbar = figure.colorbar(contours, ax=axes, ticks=colorbar_scale, format='%.2f')
         cbar.ax.tick_params(labelsize=params_obj.plot_13_font_size)
     if params_obj.plot_07_show_legend:
         mean_rmsd = np.mean(pairwise_rmsds)
         std_text = 'Average Pairwise RMSD: {:.2f}'.format(mean_rmsd)
-        plt.annotate(std_text, xy=(150, 10), xycoords='axes points', fontsize=params_obj.plot_13_font_size)
+        axes.annotate(std_text, xy=(150, 10), xycoords='axes points', fontsize=params_obj.plot_13_font_size)
 
     # save and close
     output_path = os.path.join(output_dir, analysis_obj.short_filename + '_stdev' + params_obj.plot_02_extension)
-    try:
-        plt.savefig(output_path)
-    except PermissionError:
-        messagebox.showerror('Please Close the File Before Saving', 'The file {} is being used by another process! Please close it, THEN press the OK button to retry saving'.format(output_path))
-        plt.savefig(output_path)
-    plt.close()
+    CIU_Plot_Service.save_figure(figure, output_path)
 
 
-def average_ciu(analysis_obj_list):
+def average_ciu(analysis_obj_list, fingerprint_stack=None):
     """
     Generate and save replicate object (a CIUAnalysisObj with averaged ciu_data and a list
     of raw_objs) that can be used for further analysis
     :param analysis_obj_list: list of CIUAnalysisObj's to average
     :type analysis_obj_list: list[CIUAnalysisObj]
+    :param fingerprint_stack: (optional) stack of the objects' data from axis equalization. Generated if not provided
+    :type fingerprint_stack: FingerprintStack
     :rtype: CIUAnalysisObj, numpy array of std data
     :return: averaged analysis object, standard deviation matrix, and replicate rmsd
     """
     raw_obj_list = [analysis_obj.raw_obj for analysis_obj in analysis_obj_list]
-    ciu_data_list = [analysis_obj.ciu_data for analysis_obj in analysis_obj_list]
+    if fingerprint_stack is None:
+        fingerprint_stack = FingerprintStack.from_analysis_objs(analysis_obj_list)
 
     # generate the average object and averaged Raw container
-    avg_data = np.mean(ciu_data_list, axis=0)
-    std_data = np.std(ciu_data_list, axis=0)
+    avg_data = fingerprint_stack.mean()
+    std_data = fingerprint_stack.std()
 
     # Avg raw data uses the averaged CIU data (NOT raw) to prevent crashes on uneven axes.
     raw_filename = raw_obj_list[0].filename.rstrip('_raw.csv') + '_Avg_raw.csv'
@@ -320,7 +260,125 @@ def average_ciu(analysis_obj_list):
     return averaged_obj, std_data
 
 
-def get_pairwise_rmsds(analysis_obj_list, params_obj):
+class StreamingAverage(object):
+    """
+    Running mean and variance (Welford's algorithm) of fingerprints added one at a time, along with the RMSD
+    between each new fingerprint and all previous ones. The previous fingerprints (noise-filtered) are kept in a
+    temporary file on disk rather than in memory for the RMSD calculations.
+    """
+    def __init__(self, shape, max_fingerprints, noise_cutoff):
+        """
+        Initialize an empty average
+        :param shape: shape of the fingerprints (DT x CV)
+        :param max_fingerprints: maximum number of fingerprints to be added (size of the temporary file)
+        :param noise_cutoff: relative intensity cutoff for RMSD calculations (compare_4_int_cutoff)
+        """
+        self.count = 0
+        self.mean = np.zeros(shape)
+        self.sum_squared_deviations = np.zeros(shape)
+        self.noise_cutoff = noise_cutoff
+        self.names = []
+        self.rmsds = []
+        self.rmsd_strings = ''
+        self.scratch_file = tempfile.TemporaryFile()
+        self.filtered_data = np.memmap(self.scratch_file, dtype=np.float64, mode='w+', shape=(max(max_fingerprints, 1), int(np.prod(shape))))
+        # differences are computed in one buffer of fixed size (STREAMING_RMSD_CHUNK_BYTES) reused for every chunk of previous fingerprints
+        num_points = int(np.prod(shape))
+        self.chunk_size = max(1, min(max_fingerprints, STREAMING_RMSD_CHUNK_BYTES // (8 * num_points)))
+        self.differences = np.empty((self.chunk_size, num_points))
+
+    def add(self, ciu_data, name):
+        """
+        Fold a fingerprint into the running mean and variance and compute its RMSD to each previous fingerprint
+        :param ciu_data: 2D array (DT x CV) on the same axes as all other fingerprints
+        :param name: fingerprint name (short filename) for RMSD outputs
+        :return: void
+        """
+        # filter once into this fingerprint's row of the scratch file, then compare to the rows before it
+        filtered_data = RMSD_Matrix.noise_filter(np.ravel(ciu_data), self.noise_cutoff, out=self.filtered_data[self.count])
+        for start_index in range(0, self.count, self.chunk_size):
+            end_index = min(start_index + self.chunk_size, self.count)
+            chunk_rmsds = RMSD_Matrix.get_rmsds_to_references(filtered_data, self.filtered_data[start_index:end_index],
+                                                              out=self.differences[:end_index - start_index])
+            for previous_name, rmsd in zip(self.names[start_index:end_index], chunk_rmsds):
+                self.rmsds.append(rmsd)
+                self.rmsd_strings += '{},{},{:.2f}\n'.format(name, previous_name, rmsd)
+        self.names.append(name)
+
+        self.count += 1
+        delta = ciu_data - self.mean
+        self.mean += delta / self.count
+        self.sum_squared_deviations += delta * (ciu_data - self.mean)
+
+    def std(self):
+        """
+        Standard deviation at each point across all fingerprints added (population, as numpy.std)
+        :return: 2D array (DT x CV)
+        """
+        return np.sqrt(self.sum_squared_deviations / self.count)
+
+    def close(self):
+        """
+        Remove the temporary file of previous fingerprints
+        :return: void
+        """
+        del self.filtered_data
+        self.scratch_file.close()
+
+
+def average_ciu_streaming(filepaths, params_obj):
+    """
+    Average .ciu files while loading only one at a time (for large sets of replicates). The shared axes are
+    determined from the axes of all files first, then each file is loaded, equalized onto them, and added to
+    a StreamingAverage. Gives the same average, standard deviation, and pairwise RMSDs as average_ciu and
+    get_pairwise_rmsds after check_axes_and_warn. Unlike average_ciu, the raw data of each file is not kept in
+    memory: the averaged object's raw_obj_list holds the paths of the averaged .ciu files instead, from which the
+    raw data can be loaded with CIU_File_IO.load_raw_obj.
+    :param filepaths: list of full paths to .ciu files to average
+    :param params_obj: Parameters object (for the RMSD intensity cutoff)
+    :type params_obj: Parameters
+    :return: averaged analysis object, standard deviation matrix, StreamingAverage (with input names and
+    pairwise RMSDs), and True if any file's axes were adjusted
+    :rtype: CIUAnalysisObj, numpy.ndarray, StreamingAverage, bool
+    :raises: ValueError if none of the files could be equalized onto the shared axes
+    """
+    axes_list = [CIU_File_IO.load_axes(filepath) for filepath in filepaths]
+    crop_vals, axes_spacings = Raw_Processing.check_axes_list_crop(axes_list)
+    final_axes = Raw_Processing.check_axes_interp(crop_vals, axes_spacings)
+
+    accumulator = StreamingAverage((len(final_axes[0]), len(final_axes[1])), len(filepaths), params_obj.compare_4_int_cutoff)
+    averaged_filepaths = []
+    avg_axes = None
+    avg_params = None
+    any_adjust_flag = False
+    for filepath in filepaths:
+        analysis_obj = CIU_File_IO.load_analysis_file(filepath)
+        try:
+            analysis_obj, adjust_flag = Raw_Processing.equalize_obj(analysis_obj, final_axes)
+        except ValueError as err:
+            messagebox.showerror('Axes Could Not Be Equalized',
+                                 message='{}. \nProblem: {}. This file will NOT be included in comparison. Please make sure axes overlap at least partially. Press OK to continue'.format(*err.args))
+            continue
+        any_adjust_flag = any_adjust_flag or adjust_flag
+        if avg_axes is None:
+            avg_axes = analysis_obj.axes
+            avg_params = analysis_obj.params
+            raw_filename = analysis_obj.raw_obj.filename.rstrip('_raw.csv') + '_Avg_raw.csv'
+        accumulator.add(analysis_obj.ciu_data, analysis_obj.short_filename)
+        averaged_filepaths.append(filepath)
+    accumulator.close()
+    if accumulator.count == 0:
+        raise ValueError('No files could be averaged', 'None of the files could be equalized onto shared axes')
+
+    avg_data = accumulator.mean
+    std_data = accumulator.std()
+    avg_raw_obj = CIURaw(avg_data, avg_axes[0], avg_axes[1], raw_filename)
+    averaged_obj = CIUAnalysisObj(avg_raw_obj, avg_data, avg_axes, avg_params)
+    averaged_obj.raw_obj_list = averaged_filepaths
+    return averaged_obj, std_data, accumulator, any_adjust_flag
+
+
+def get_pairwise_rmsds(analysis_obj_list, params_obj, fingerprint_stack=None):
     """
     Helper method to compute pairwise RMSD values for each replicate in an averaging analysis. Also
     generates strings for saving to CSV.
@@ -328,28 +386,120 @@ def get_pairwise_rmsds(analysis_obj_list, params_obj):
     :type analysis_obj_list: list[CIUAnalysisObj]
     :param params_obj: parameter container
     :type params_obj: Parameters
+    :param fingerprint_stack: (optional) stack of the objects' data, if already generated
+    :type fingerprint_stack: FingerprintStack
     :return: list of RMSD values (floats), list of RMSD strings
     """
-    f1_index = 0
-    rmsd_strings = ''
-    rmsds = []
-    for analysis_obj in analysis_obj_list:
-        f2_index = 0
-        while f2_index < len(analysis_obj_list):
-            # skip reverse and self comparisons
-            if f2_index >= f1_index:
-                f2_index += 1
-                continue
+    if fingerprint_stack is None:
+        try:
+            fingerprint_stack = FingerprintStack.from_analysis_objs(analysis_obj_list)
+        except ValueError:
+            # axes not equalized - compare each pair separately (interpolating as needed)
+            fingerprint_stack = None
 
-            rmsd = compare_basic_raw(analysis_obj, analysis_obj_list[f2_index], params_obj, outputdir='', no_plots=True)
+    rmsds = []
+    rmsd_strings = ''
+    if fingerprint_stack is not None:
+        engine, rmsd_matrix = RMSD_Matrix.compute_rmsd_matrix(fingerprint_stack, params_obj.compare_4_int_cutoff)
+    for f1_index, analysis_obj in enumerate(analysis_obj_list):
+        # skip reverse and self comparisons
+        for f2_index in range(f1_index):
+            if fingerprint_stack is not None:
+                rmsd = rmsd_matrix[f1_index, f2_index]
+            else:
+                rmsd = compare_basic_raw(analysis_obj, analysis_obj_list[f2_index], params_obj, outputdir='', no_plots=True)
             rmsds.append(rmsd)
             rmsd_strings += '{},{},{:.2f}\n'.format(analysis_obj.short_filename, analysis_obj_list[f2_index].short_filename, rmsd)
-            f2_index += 1
-        f1_index += 1
     return rmsds, rmsd_strings
 
 
-def save_avg_rmsd_data(analysis_obj_list, params_obj, avg_filename, output_dir):
+def batch_compare_all(fingerprint_stack, params_obj, output_dir):
+    """
+    Compare all fingerprints against each other. Saves the matrix of RMSDs (binary and CSV), the list of
+    pairwise RMSDs (batch_RMSDs.csv), and difference plots for the pairs selected in the
+    compare_batch_2_plot_pairs parameter. Also clusters the fingerprints by RMSD if requested (compare_batch_3_cluster).
+    :param fingerprint_stack: fingerprints (on shared axes) to compare
+    :type fingerprint_stack: FingerprintStack
+    :param params_obj: Parameters object with parameter information
+    :type params_obj: Parameters
+    :param output_dir: directory in which to save output
+    :return: 2D array of RMSDs (%) (N x N)
+    """
+    engine, rmsd_matrix = RMSD_Matrix.compute_rmsd_matrix(fingerprint_stack, params_obj.compare_4_int_cutoff)
+    names = fingerprint_stack.names
+    RMSD_Matrix.save_rmsd_matrix(rmsd_matrix, names, output_dir)
+
+    # list comparisons in both directions or only once (skipping reverse comparisons) depending on parameter
+    rmsd_print_list = ['File 1, File 2, RMSD (%)']
+    for f1_index in range(len(names)):
+        for f2_index in range(len(names)):
+            if f2_index == f1_index or (not params_obj.compare_batch_1_both_dirs and f2_index > f1_index):
+                continue
+            rmsd_print_list.append('{},{},{:.2f}'.format(names[f1_index], names[f2_index], rmsd_matrix[f1_index, f2_index]))
+    with open(os.path.join(output_dir, 'batch_RMSDs.csv'), 'w') as rmsd_file:
+        for rmsd_string in rmsd_print_list:
+            rmsd_file.write(rmsd_string + '\n')
+
+    for f1_index, f2_index in RMSD_Matrix.parse_plot_pairs(params_obj.compare_batch_2_plot_pairs, names, params_obj.compare_batch_1_both_dirs):
+        submit_rmsd_plot(engine.get_difference(f1_index, f2_index), rmsd_matrix[f1_index, f2_index], fingerprint_stack.axes,
+                         names[f1_index], names[f2_index], params_obj, output_dir)
+
+    if params_obj.compare_batch_3_cluster:
+        RMSD_Clustering.cluster_fingerprints(fingerprint_stack, params_obj, output_dir, rmsd_matrix=rmsd_matrix)
+    return rmsd_matrix
+
+
+def compare_to_standard(fingerprint_stack, params_obj, output_dir, std_index=0):
+    """
+    Compare a standard fingerprint against all others in a stack, plotting each difference. Each fingerprint
+    is noise filtered once (in the RMSD engine) rather than once per comparison, and the loaded data is
+    not modified.
+    :param fingerprint_stack: fingerprints (on shared axes) to compare
+    :type fingerprint_stack: FingerprintStack
+    :param params_obj: Parameters object with parameter information
+    :type params_obj: Parameters
+    :param output_dir: directory in which to save output
+    :param std_index: index of the standard in the stack
+    :return: list of (compared fingerprint index, RMSD) tuples, in stack order
+    """
+    engine = RMSD_Matrix.RMSDEngine(fingerprint_stack.data, params_obj.compare_4_int_cutoff)
+    compare_indices = [x for x in range(len(engine)) if x != std_index]
+    rmsds = engine.compute_block(np.array([std_index]), np.array(compare_indices))[0]
+
+    names = fingerprint_stack.names
+    for compare_index, rmsd in zip(compare_indices, rmsds):
+        submit_rmsd_plot(engine.get_difference(std_index, compare_index), rmsd, fingerprint_stack.axes,
+                         names[std_index], names[compare_index], params_obj, output_dir)
+    return list(zip(compare_indices, rmsds))
+
+
+def submit_rmsd_plot(difference_matrix, rmsd, axes, file1, file2, params_obj, output_dir):
+    """
+    Submit a difference plot (rmsd_plot) for one comparison to the plot service
+    :param difference_matrix: noise-filtered difference (file 1 - file 2)
+    :param rmsd: RMSD (%) of the comparison
+    :param axes: axes of the difference matrix [dt_axis, cv_axis]
+    :param file1: name of file 1
+    :param file2: name of file 2
+    :param params_obj: Parameters object with parameter information
+    :type params_obj: Parameters
+    :param output_dir: directory in which to save the plot
+    :return: void
+    """
+    rtext = "RMSD = " + '%2.2f' % rmsd
+    CIU_Plot_Service.submit_plot(params_obj, output_dir, rmsd_plot,
+                                 difference_matrix=difference_matrix,
+                                 axes=axes,
+                                 file1=file1,
+                                 file2=file2,
+                                 rtext=rtext,
+                                 outputdir=output_dir,
+                                 params_obj=params_obj,
+                                 blue_label=params_obj.compare_1_custom_blue,
+                                 red_label=params_obj.compare_2_custom_red)
+
+
+def save_avg_rmsd_data(analysis_obj_list, params_obj, avg_filename, output_dir, fingerprint_stack=None):
     """
     Generate a CSV file with information about the averaged file, including the input files,
     total replicate RMSD, and pairwise RMSDs from each file.
@@ -359,15 +509,29 @@ def save_avg_rmsd_data(analysis_obj_list, params_obj, avg_filename, output_dir):
     :type params_obj: Parameters
     :param avg_filename: filename of the average .ciu file
     :param output_dir: directory in which to save output.
+    :param fingerprint_stack: (optional) stack of the objects' data, if already generated
+    :type fingerprint_stack: FingerprintStack
     :return: void
     """
     # Determine pairwise comparison RMSDs for all file and save
-    rmsds, rmsd_strings = get_pairwise_rmsds(analysis_obj_list, params_obj)
+    rmsds, rmsd_strings = get_pairwise_rmsds(analysis_obj_list, params_obj, fingerprint_stack)
+    write_avg_rmsd_data([x.short_filename for x in analysis_obj_list], rmsds, rmsd_strings, avg_filename, output_dir)
 
+
+def write_avg_rmsd_data(input_names, rmsds, rmsd_strings, avg_filename, output_dir):
+    """
+    Write the averaged file information CSV (see save_avg_rmsd_data) from previously computed pairwise RMSDs
+    :param input_names: short filenames of the files averaged
+    :param rmsds: list of pairwise RMSDs
+    :param rmsd_strings: pairwise RMSD CSV lines (from get_pairwise_rmsds or StreamingAverage)
+    :param avg_filename: filename of the average .ciu file
+    :param output_dir: directory in which to save output.
+    :return: void
+    """
     # Format string output
     output_string = ''
     output_string += 'Avg File:,{}\n'.format(avg_filename)
-    output_string += 'Input Files:,{}\n'.format(','.join([x.short_filename for x in analysis_obj_list]))
+    output_string += 'Input Files:,{}\n'.format(','.join(input_names))
     output_string += 'Replicate RMSD (%):,{:.2f}\n'.format(np.mean(rmsds))
     output_string += 'RMSD Std Dev:,{:.2f}\n'.format(np.std(rmsds))
     output_string += 'Pairwise RMSDs:\n'
@@ -437,30 +601,14 @@ def compare_basic_raw(analysis_obj1, analysis_obj2, params_obj, outputdir, no_pl
 
     if interp_flag:
         # interpolate the original CIU data from each object onto the new (matched) axes
-        interp_fn1 = scipy.interpolate.interp2d(analysis_obj1.axes[1],
-                                                analysis_obj1.axes[0],
-                                                analysis_obj1.ciu_data)
-        interp_fn2 = scipy.interpolate.interp2d(analysis_obj2.axes[1],
-                                                analysis_obj2.axes[0],
-                                                analysis_obj2.ciu_data)
-        norm_data_1 = interp_fn1(cv_axis, dt_axis)
-        norm_data_2 = interp_fn2(cv_axis, dt_axis)
         axes = [dt_axis, cv_axis]
+        norm_data_1 = Raw_Processing.interpolate_2d(analysis_obj1.ciu_data, analysis_obj1.axes, axes)
+        norm_data_2 = Raw_Processing.interpolate_2d(analysis_obj2.ciu_data, analysis_obj2.axes, axes)
 
-    # dif, rmsd = rmsd_difference(norm_data_1, norm_data_2)
     dif, rmsd = rmsd_difference(norm_data_1, norm_data_2, params_obj.compare_4_int_cutoff)
 
     if not no_plots:
-        rtext = "RMSD = " + '%2.2f' % rmsd
-        rmsd_plot(difference_matrix=dif,
-                  axes=axes,
-                  file1=analysis_obj1.short_filename,
-                  file2=analysis_obj2.short_filename,
-                  rtext=rtext,
-                  outputdir=outputdir,
-                  params_obj=params_obj,
-                  blue_label=params_obj.compare_1_custom_blue,
-                  red_label=params_obj.compare_2_custom_red)
+        submit_rmsd_plot(dif, rmsd, axes, analysis_obj1.short_filename, analysis_obj2.short_filename, params_obj, outputdir)
 
     # if params_obj.output_1_save_csv:
     #     title = '{} - {}'.format(analysis_obj1.short_filename,
@@ -0,0 +1,190 @@
+"""
+This file is part of CIUSuite 2
+Copyright (C) 2018 Daniel Polasky
+
+Hierarchical clustering of fingerprints by RMSD (as defined in Original_CIU.rmsd_difference, using the
+compare_4_int_cutoff parameter). Works from the condensed (upper triangle) RMSD matrix computed in chunks by
+RMSD_Matrix, so that large sets of fingerprints can be clustered without an N x N matrix of pairwise comparisons.
+Outputs the linkage tree, the cluster assigned to each fingerprint, and a heatmap of all RMSDs ordered
+by the tree.
+"""
+import os
+import logging
+import numpy as np
+import scipy.cluster.hierarchy
+import scipy.spatial.distance
+from tkinter import messagebox
+
+import CIU_Plot_Service
+import RMSD_Matrix
+
+logger = logging.getLogger('main')
+
+CLUSTER_OUTPUT_NAME = 'RMSD_clusters'
+# fingerprint names are only shown on the heatmap if there are few enough to read
+MAX_LABELED_FINGERPRINTS = 50
+
+
+def get_linkage_method(params_obj):
+    """
+    Linkage method from parameters ('average' if not set, e.g. in older parameter files)
+    :param params_obj: Parameters
+    :type params_obj: CIU_Params.Parameters
+    :return: method name for scipy.cluster.hierarchy.linkage
+    """
+    if not params_obj.cluster_1_linkage_method:
+        return 'average'
+    return str(params_obj.cluster_1_linkage_method).lower()
+
+
+def assign_clusters(linkage, params_obj):
+    """
+    Cut the linkage tree into clusters, either into a set number of clusters (cluster_3_num_clusters) or
+    (if that is 0) at an RMSD cutoff (cluster_2_rmsd_cutoff)
+    :param linkage: linkage matrix from scipy.cluster.hierarchy.linkage
+    :param params_obj: Parameters
+    :type params_obj: CIU_Params.Parameters
+    :return: array of cluster numbers (starting at 1), one per fingerprint
+    """
+    if params_obj.cluster_3_num_clusters:
+        return scipy.cluster.hierarchy.fcluster(linkage, int(params_obj.cluster_3_num_clusters), criterion='maxclust')
+    rmsd_cutoff = params_obj.cluster_2_rmsd_cutoff if params_obj.cluster_2_rmsd_cutoff is not None else 5
+    return scipy.cluster.hierarchy.fcluster(linkage, rmsd_cutoff, criterion='distance')
+
+
+def cluster_fingerprints(fingerprint_stack, params_obj, output_dir, rmsd_matrix=None):
+    """
+    Cluster all fingerprints in a stack by RMSD and save the linkage tree, cluster assignments, and heatmap
+    :param fingerprint_stack: fingerprints (on shared axes) to cluster
+    :type fingerprint_stack: FingerprintStack
+    :param params_obj: Parameters
+    :type params_obj: CIU_Params.Parameters
+    :param output_dir: directory in which to save output
+    :param rmsd_matrix: (optional) full (N x N) RMSD matrix if already computed (e.g. from batch comparison)
+    :return: linkage matrix, array of cluster numbers (one per fingerprint)
+    """
+    names = fingerprint_stack.names
+    if len(names) < 2:
+        logger.warning('At least 2 fingerprints are required for clustering')
+        return None, None
+
+    if rmsd_matrix is not None:
+        condensed_rmsds = scipy.spatial.distance.squareform(rmsd_matrix, checks=False)
+    else:
+        logger.info('Computing RMSDs between {} fingerprints'.format(len(names)))
+        engine = RMSD_Matrix.RMSDEngine(fingerprint_stack.data, params_obj.compare_4_int_cutoff)
+        condensed_rmsds = engine.compute_condensed()
+        np.save(os.path.join(output_dir, RMSD_Matrix.RMSD_MATRIX_FILENAME + '_condensed.npy'), condensed_rmsds)
+
+    linkage = scipy.cluster.hierarchy.linkage(condensed_rmsds, method=get_linkage_method(params_obj))
+    clusters = assign_clusters(linkage, params_obj)
+    logger.info('Clustered {} fingerprints into {} clusters'.format(len(names), len(np.unique(clusters))))
+
+    leaf_order = scipy.cluster.hierarchy.leaves_list(linkage)
+    save_cluster_outputs(linkage, clusters, leaf_order, names, output_dir)
+    CIU_Plot_Service.submit_plot(params_obj, output_dir, cluster_heatmap_plot, condensed_rmsds, linkage, names, params_obj, output_dir)
+    return linkage, clusters
+
+
+def save_cluster_outputs(linkage, clusters, leaf_order, names, output_dir):
+    """
+    Save the linkage tree (binary .npy as returned by scipy and as CSV) and the cluster assigned to each
+    fingerprint (CSV, in heatmap order)
+    :param linkage: linkage matrix
+    :param clusters: array of cluster numbers, one per fingerprint
+    :param leaf_order: order of the fingerprints in the tree (and heatmap)
+    :param names: fingerprint names
+    :param output_dir: directory in which to save output
+    :return: void
+    """
+    np.save(os.path.join(output_dir, CLUSTER_OUTPUT_NAME + '_linkage.npy'), linkage)
+
+    # merged groups are numbered after the fingerprints (0 to N-1) in order of merging, as in scipy
+    linkage_string = 'Group,Joined 1,Joined 2,RMSD (%),Num Fingerprints\n'
+    num_fingerprints = len(names)
+    for index, (group1, group2, rmsd, num_joined) in enumerate(linkage):
+        linkage_string += '{},{},{},{:.2f},{}\n'.format(num_fingerprints + index, get_group_name(group1, names), get_group_name(group2, names), rmsd, int(num_joined))
+
+    cluster_string = 'File,Cluster,Heatmap Position\n'
+    for position, index in enumerate(leaf_order):
+        cluster_string += '{},{},{}\n'.format(names[index], clusters[index], position + 1)
+
+    for filename, output_string in [(CLUSTER_OUTPUT_NAME + '_linkage.csv', linkage_string), (CLUSTER_OUTPUT_NAME + '.csv', cluster_string)]:
+        save_path = os.path.join(output_dir, filename)
+        try:
+            with open(save_path, 'w') as outfile:
+                outfile.write(output_string)
+        except PermissionError:
+            messagebox.showerror('Please Close the File Before Saving', 'The file {} is being used by another process! Please close it, THEN press the OK button to retry saving'.format(save_path))
+            with open(save_path, 'w') as outfile:
+                outfile.write(output_string)
+
+
+def get_group_name(group_index, names):
+    """
+    Name of a fingerprint or merged group in the linkage tree
+    :param group_index: index from the linkage matrix (fingerprint index if less than N)
+    :param names: fingerprint names
+    :return: string
+    """
+    group_index = int(group_index)
+    if group_index < len(names):
+        return names[group_index]
+    return str(group_index)
+
+
+def cluster_heatmap_plot(condensed_rmsds, linkage, names, params_obj, output_dir):
+    """
+    Plot the RMSDs between all fingerprints as a heatmap ordered by the linkage tree, with the tree
+    (dendrogram) shown above it
+    :param condensed_rmsds: condensed RMSD matrix
+    :param linkage: linkage matrix
+    :param names: fingerprint names
+    :param params_obj: Parameters
+    :type params_obj: CIU_Params.Parameters
+    :param output_dir: directory in which to save the plot
+    :return: void
+    """
+    figure = CIU_Plot_Service.new_figure(params_obj)
+    grid = figure.add_gridspec(2, 2, height_ratios=[1, 4], width_ratios=[20, 1])
+    tree_axes = figure.add_subplot(grid[0, 0])
+    heatmap_axes = figure.add_subplot(grid[1, 0])
+
+    # dendrogram leaves are placed at 5, 15, 25, ... so the heatmap is drawn on the same scale to line up
+    num_fingerprints = len(names)
+    show_labels = num_fingerprints <= MAX_LABELED_FINGERPRINTS
+    tree = scipy.cluster.hierarchy.dendrogram(linkage, ax=tree_axes, no_labels=True, color_threshold=0, above_threshold_color='k')
+    tree_axes.set_xlim(0, 10 * num_fingerprints)
+    tree_axes.set_xticks([])
+    tree_axes.set_ylabel('RMSD (%)', fontsize=params_obj.plot_13_font_size)
+    tree_axes.tick_params(labelsize=params_obj.plot_13_font_size)
+    for spine in ['top', 'right', 'bottom']:
+        tree_axes.spines[spine].set_visible(False)
+
+    leaf_order = np.asarray(tree['leaves'])
+    rmsd_matrix = scipy.spatial.distance.squareform(condensed_rmsds, checks=False)
+    ordered_rmsds = rmsd_matrix[np.ix_(leaf_order, leaf_order)]
+    image = heatmap_axes.imshow(ordered_rmsds, cmap='viridis', aspect='auto', interpolation='nearest',
+                                extent=(0, 10 * num_fingerprints, 10 * num_fingerprints, 0))
+    if show_labels:
+        tick_positions = np.arange(num_fingerprints) * 10 + 5
+        ordered_names = [names[x] for x in leaf_order]
+        heatmap_axes.set_xticks(tick_positions)
+        heatmap_axes.set_xticklabels(ordered_names, rotation=90, fontsize=params_obj.plot_13_font_size)
+        heatmap_axes.set_yticks(tick_positions)
+        heatmap_axes.set_yticklabels(ordered_names, fontsize=params_obj.plot_13_font_size)
+    else:
+        heatmap_axes.set_xticks([])
+        heatmap_axes.set_yticks([])
+
+    if params_obj.plot_06_show_colorbar:
+        colorbar = figure.colorbar(image, cax=figure.add_subplot(grid[1, 1]))
+        colorbar.set_label('RMSD (%)', fontsize=params_obj.plot_13_font_size)
+        colorbar.ax.tick_params(labelsize=params_obj.plot_13_font_size)
+    if params_obj.plot_12_custom_title is not None:
+        tree_axes.set_title(params_obj.plot_12_custom_title, fontsize=params_obj.plot_13_font_size, fontweight='bold')
+    elif params_obj.plot_11_show_title:
+        tree_axes.set_title('RMSD Clusters ({} files)'.format(num_fingerprints), fontsize=params_obj.plot_13_font_size, fontweight='bold')
+
+    output_path = os.path.join(output_dir, CLUSTER_OUTPUT_NAME + '_heatmap' + params_obj.plot_02_extension)
+    CIU_Plot_Service.save_figure(figure, output_path)
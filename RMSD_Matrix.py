@@ -0,0 +1,259 @@
+"""
+This file is part of CIUSuite 2
+Copyright (C) 2018 Daniel Polasky
+
+All-vs-all RMSD comparison of fingerprints on shared axes. Gives the same RMSD as Original_CIU.rmsd_difference
+(differences after removing data below the intensity cutoff, averaged over the points that differ), but computes
+all pairs at once from matrix products of the whole set of fingerprints rather than comparing each pair separately:
+    sum of squared differences: |a|^2 + |b|^2 - 2 a.b
+    number of differing points: nonzero(a) + nonzero(b) - nonzero(a and b) - (points where a and b are equal and nonzero)
+"""
+import os
+import logging
+import numpy as np
+import scipy.sparse
+from tkinter import messagebox
+
+logger = logging.getLogger('main')
+
+RMSD_MATRIX_FILENAME = 'RMSD_matrix'
+# number of fingerprints to compare at once (limits memory use of the intermediate products)
+RMSD_CHUNK_SIZE = 1024
+# maximum number of data values to sort at once when finding equal values shared between fingerprints
+EQUAL_VALUE_CHUNK_SIZE = 2 ** 22
+
+
+class RMSDEngine(object):
+    """
+    Noise-filtered, flattened fingerprints (N x points) and the per-fingerprint values needed to compute
+    the RMSD between any two of them. The input data is not modified.
+    """
+    def __init__(self, fingerprint_data, noise_cutoff):
+        """
+        Prepare a set of fingerprints for comparison
+        :param fingerprint_data: 3D array (N x DT x CV) of fingerprints with identical axes (e.g. FingerprintStack.data)
+        :param noise_cutoff: relative intensity below which data is set to 0 before comparison (compare_4_int_cutoff)
+        """
+        self.shape = np.shape(fingerprint_data)[1:]
+        self.filtered_data = noise_filter(fingerprint_data, noise_cutoff).reshape(len(fingerprint_data), -1)
+
+        self.squared_norms = np.einsum('ij,ij->i', self.filtered_data, self.filtered_data)
+        # counts are exact in single precision up to 2^24 points per fingerprint
+        self.nonzero = (self.filtered_data != 0).astype(np.float32)
+        self.nonzero_counts = np.count_nonzero(self.filtered_data, axis=1)
+        self.equal_counts = get_equal_value_counts(self.filtered_data)
+
+    def __len__(self):
+        return len(self.filtered_data)
+
+    def compute_block(self, rows, cols):
+        """
+        Compute RMSDs between one set of fingerprints (rows) and another (cols)
+        :param rows: slice or index array of fingerprints
+        :param cols: slice or index array of fingerprints
+        :return: 2D array of RMSDs (%) (len(rows) x len(cols)). Identical fingerprints have RMSD 0
+        """
+        row_data = self.filtered_data[rows]
+        col_data = self.filtered_data[cols]
+        sum_squares = self.squared_norms[rows][:, np.newaxis] + self.squared_norms[cols][np.newaxis, :] - 2 * (row_data @ col_data.T)
+        # remove rounding error from (nearly) identical fingerprints
+        np.maximum(sum_squares, 0, out=sum_squares)
+
+        num_values = self.nonzero_counts[rows][:, np.newaxis] + self.nonzero_counts[cols][np.newaxis, :]
+        num_values = num_values - (self.nonzero[rows] @ self.nonzero[cols].T) - self.equal_counts[rows][:, cols].toarray()
+
+        rmsds = np.zeros(sum_squares.shape)
+        np.divide(sum_squares, num_values, out=rmsds, where=num_values > 0)
+        return np.sqrt(rmsds) * 100
+
+    def compute_matrix(self, chunk_size=RMSD_CHUNK_SIZE):
+        """
+        Compute the full (symmetric) matrix of RMSDs between all fingerprints
+        :param chunk_size: number of fingerprints (rows) to compute at once
+        :return: 2D array of RMSDs (%) (N x N)
+        """
+        num_fingerprints = len(self)
+        rmsd_matrix = np.zeros((num_fingerprints, num_fingerprints))
+        for start_index in range(0, num_fingerprints, chunk_size):
+            end_index = min(start_index + chunk_size, num_fingerprints)
+            # compute the upper triangle only and fill the lower triangle by symmetry
+            block = self.compute_block(slice(start_index, end_index), slice(start_index, num_fingerprints))
+            rmsd_matrix[start_index:end_index, start_index:] = block
+            rmsd_matrix[start_index:, start_index:end_index] = block.T
+        return rmsd_matrix
+
+    def compute_condensed(self, chunk_size=RMSD_CHUNK_SIZE):
+        """
+        Compute the RMSDs between all pairs of fingerprints as a condensed distance matrix (upper triangle in
+        row order, as used by scipy.spatial.distance and scipy.cluster.hierarchy). Avoids holding the full
+        N x N matrix for large numbers of fingerprints.
+        :param chunk_size: number of fingerprints (rows) to compute at once
+        :return: 1D array of RMSDs (%) (N * (N - 1) / 2)
+        """
+        num_fingerprints = len(self)
+        condensed = np.zeros(num_fingerprints * (num_fingerprints - 1) // 2)
+        for start_index in range(0, num_fingerprints, chunk_size):
+            end_index = min(start_index + chunk_size, num_fingerprints)
+            block = self.compute_block(slice(start_index, end_index), slice(start_index, num_fingerprints))
+            # the upper triangle of each block of rows is a contiguous section of the condensed matrix
+            first_value = start_index * num_fingerprints - start_index * (start_index + 1) // 2
+            last_value = end_index * num_fingerprints - end_index * (end_index + 1) // 2
+            condensed[first_value:last_value] = block[np.triu_indices(end_index - start_index, k=1, m=num_fingerprints - start_index)]
+        return condensed
+
+    def get_difference(self, index1, index2):
+        """
+        Noise-filtered difference between two fingerprints (as returned by Original_CIU.rmsd_difference)
+        :param index1: index of the first fingerprint
+        :param index2: index of the second fingerprint
+        :return: 2D difference array (DT x CV)
+        """
+        return (self.filtered_data[index1] - self.filtered_data[index2]).reshape(self.shape)
+
+
+def get_equal_value_counts(filtered_data):
+    """
+    Count the points at which each pair of fingerprints has exactly the same nonzero value (e.g. where
+    both have a normalized maximum of 1), which are not counted as differences in the RMSD. Nonzero values
+    are grouped by point and value; each group shared by several fingerprints adds 1 to every pair of them.
+    Each fingerprint is equal to itself at all of its nonzero points (diagonal).
+    :param filtered_data: 2D array of noise-filtered fingerprints (N x points)
+    :return: sparse matrix of counts (N x N)
+    :rtype: scipy.sparse.csr_matrix
+    """
+    num_fingerprints, num_points = filtered_data.shape
+    equal_counts = scipy.sparse.csr_matrix((num_fingerprints, num_fingerprints))
+    points_per_chunk = max(1, EQUAL_VALUE_CHUNK_SIZE // max(1, num_fingerprints))
+    for start_point in range(0, num_points, points_per_chunk):
+        # sort the fingerprints by value at each point and number the groups of identical values
+        point_values = filtered_data[:, start_point:start_point + points_per_chunk].T
+        order = np.argsort(point_values, axis=1)
+        sorted_values = np.take_along_axis(point_values, order, axis=1)
+        new_group = np.ones(sorted_values.shape, dtype=bool)
+        new_group[:, 1:] = sorted_values[:, 1:] != sorted_values[:, :-1]
+        group_ids = np.cumsum(new_group.ravel()) - 1
+
+        shared = (np.bincount(group_ids)[group_ids] > 1) & (sorted_values.ravel() != 0)
+        if not np.any(shared):
+            continue
+        membership = scipy.sparse.csr_matrix((np.ones(np.count_nonzero(shared)), (order.ravel()[shared], group_ids[shared])),
+                                             shape=(num_fingerprints, group_ids[-1] + 1))
+        equal_counts = equal_counts + membership @ membership.T
+    self_counts = np.count_nonzero(filtered_data, axis=1) - equal_counts.diagonal()
+    return (equal_counts + scipy.sparse.diags(self_counts)).tocsr()
+
+
+def noise_filter(ciu_data, noise_cutoff, out=None):
+    """
+    Copy of fingerprint data with values below the noise cutoff set to 0, as used for RMSD comparisons. The
+    input is not modified, so each fingerprint can be filtered once and the copy shared by all of its comparisons.
+    :param ciu_data: array of fingerprint data (any shape)
+    :param noise_cutoff: relative intensity cutoff (compare_4_int_cutoff)
+    :param out: (optional) array of the same shape in which to store the result (e.g. reused across fingerprints).
+    May be ciu_data itself to filter in place
+    :return: filtered array (out, if provided)
+    """
+    if out is None:
+        out = np.array(ciu_data, dtype=np.float64)
+    elif out is not ciu_data:
+        np.copyto(out, ciu_data)
+    out[out < noise_cutoff] = 0
+    return out
+
+
+def get_rmsd(difference):
+    """
+    RMSD (%) from the difference between two noise-filtered fingerprints: root mean square of the points that differ
+    :param difference: array of differences
+    :return: RMSD (float). 0 if the fingerprints are identical
+    """
+    num_values = np.count_nonzero(difference)
+    if num_values == 0:
+        return 0.
+    return (np.vdot(difference, difference) / num_values) ** 0.5 * 100
+
+
+def get_rmsds_to_references(filtered_query, filtered_references, out=None):
+    """
+    RMSD between one noise-filtered fingerprint and each of a set of noise-filtered references, exactly as in
+    Original_CIU.rmsd_difference (see noise_filter). The inputs are not modified.
+    :param filtered_query: 1D array of flattened query fingerprint
+    :param filtered_references: 2D array (N x points) of flattened references on the same axes
+    :param out: (optional) array of the same shape as filtered_references in which to compute the differences (may
+    be filtered_references itself if it is no longer needed)
+    :return: 1D array of RMSDs (%). Identical fingerprints have RMSD 0
+    """
+    differences = np.subtract(filtered_query, filtered_references, out=out)
+    num_values = np.count_nonzero(differences, axis=1)
+    sum_squares = np.einsum('ij,ij->i', differences, differences)
+    rmsds = np.zeros(len(differences))
+    np.divide(sum_squares, num_values, out=rmsds, where=num_values > 0)
+    return np.sqrt(rmsds) * 100
+
+
+def compute_rmsd_matrix(fingerprint_stack, noise_cutoff):
+    """
+    Compute the matrix of RMSDs between all fingerprints in a stack
+    :param fingerprint_stack: fingerprints on shared axes
+    :type fingerprint_stack: FingerprintStack
+    :param noise_cutoff: relative intensity cutoff (compare_4_int_cutoff)
+    :return: RMSDEngine (for difference plots of selected pairs), 2D array of RMSDs (%) (N x N)
+    """
+    engine = RMSDEngine(fingerprint_stack.data, noise_cutoff)
+    return engine, engine.compute_matrix()
+
+
+def save_rmsd_matrix(rmsd_matrix, names, output_dir, filename=RMSD_MATRIX_FILENAME):
+    """
+    Save an RMSD matrix in binary (.npy, full precision, can be loaded with numpy.load) and CSV formats
+    :param rmsd_matrix: 2D array of RMSDs (N x N)
+    :param names: list of fingerprint names for the CSV row and column headers
+    :param output_dir: directory in which to save output
+    :param filename: filename (without extension) for both output files
+    :return: void
+    """
+    save_path = os.path.join(output_dir, filename)
+    np.save(save_path + '.npy', rmsd_matrix)
+
+    output_string = 'RMSD (%),{}\n'.format(','.join([str(x) for x in names]))
+    for name, row in zip(names, rmsd_matrix):
+        output_string += '{},{}\n'.format(name, ','.join(['{:.2f}'.format(x) for x in row]))
+    try:
+        with open(save_path + '.csv', 'w') as outfile:
+            outfile.write(output_string)
+    except PermissionError:
+        messagebox.showerror('Please Close the File Before Saving', 'The file {} is being used by another process! Please close it, THEN press the OK button to retry saving'.format(save_path + '.csv'))
+        with open(save_path + '.csv', 'w') as outfile:
+            outfile.write(output_string)
+
+
+def parse_plot_pairs(plot_pairs_string, names, both_directions=False):
+    """
+    Get the pairs of fingerprints for which to plot differences from the compare_batch_2_plot_pairs parameter:
+    either 'all', or pairs of names separated by semicolons with the names of each pair separated by a colon
+    (e.g. file1:file2;file1:file3)
+    :param plot_pairs_string: parameter value (None or empty for no plots)
+    :param names: list of fingerprint names
+    :param both_directions: if plotting all pairs, plot each pair in both directions
+    :return: list of (index1, index2) tuples
+    """
+    if not plot_pairs_string:
+        return []
+    plot_pairs_string = str(plot_pairs_string).strip()
+    num_fingerprints = len(names)
+    if plot_pairs_string.lower() == 'all':
+        if both_directions:
+            return [(index1, index2) for index1 in range(num_fingerprints) for index2 in range(num_fingerprints) if index1 != index2]
+        return [(index1, index2) for index1 in range(num_fingerprints) for index2 in range(index1)]
+
+    name_indices = {str(name): index for index, name in enumerate(names)}
+    pairs = []
+    for pair_string in plot_pairs_string.split(';'):
+        if pair_string.strip() == '':
+            continue
+        pair_names = [x.strip() for x in pair_string.split(':')]
+        if len(pair_names) != 2 or pair_names[0] not in name_indices or pair_names[1] not in name_indices:
+            logger.warning('Could not find comparison pair "{}" in the compared files. Pairs must be two filenames separated by a colon'.format(pair_string))
+            continue
+        pairs.append((name_indices[pair_names[0]], name_indices[pair_names[1]]))
+    return pairs
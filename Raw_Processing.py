@@ -10,8 +10,10 @@ Date: 10/6/2017
 import numpy as np
 import os
 import scipy.signal
+import scipy.ndimage
 import scipy.interpolate
 import scipy.stats
+import pandas
 import pygubu
 import logging
 from tkinter import messagebox
@@ -19,6 +21,7 @@ import tkinter as tk
 
 import CIU_analysis_obj
 import CIU_raw
+from CIU_Fingerprint_Stack import FingerprintStack
 
 logger = logging.getLogger('main')
 
@@ -69,33 +72,90 @@ def get_data(filename):
     row_axis = rawdata[1:, 0]
     col_axis = rawdata[0, 1:]
 
-    # check for decreasing values in either axis
-    prev_val = 0
-    for value in row_axis:
-        if value < prev_val:
-            logger.error('Data import error in File: {}. Mobility axis has decreasing or negative values. All axis values must be positive and increasing. This file will NOT be processed'.format(os.path.basename(filename)))
-            raise ValueError('Data import error in File: ', os.path.basename(filename), 'Mobility axis has decreasing or negative values. All axis values must be positive and increasing. This file will NOT be processed')
-    prev_val = 0
-    for value in col_axis:
-        if value < prev_val:
-            logger.error('Data import error in File: {}. Activation axis has decreasing or negative values. All axis values must be positive and increasing. This file will NOT be processed'.format(os.path.basename(filename)))
-            raise ValueError('Data import error in File: ', os.path.basename(filename), 'Activation axis has decreasing or negative values. All axis values must be positive and increasing. This file will NOT be processed')
-
-    # check for duplicate values in axes
-    unique_row, row_counts = np.unique(row_axis, return_counts=True)
-    if np.max(row_counts) > 1:
-        logger.error('Data import error in File: {}. Duplicate row (DT) values. This file will NOT be processed'.format(os.path.basename(filename)))
-        raise ValueError('Data import error in File: ', os.path.basename(filename), 'Duplicate row (DT) values. This file will NOT be processed')
-    unique_col, col_counts = np.unique(col_axis, return_counts=True)
-    if np.max(col_counts) > 1:
-        logger.error('Data import error in File: {}. Duplicate column (CV) values. This file will NOT be processed.'.format(os.path.basename(filename)))
-        raise ValueError('Data import error in File: ', os.path.basename(filename), 'Duplicate column (CV) values. This file will NOT be processed.')
+    # check for decreasing, negative, or duplicate values in either axis
+    check_raw_axes(row_axis, col_axis, filename)
 
     raw_obj = CIU_raw.CIURaw(rawdata[1:, 1:], row_axis, col_axis, filename)
 
     return raw_obj
 
 
+def get_data_fast(filename):
+    """
+    Fast version of get_data for large batches of high resolution _raw.csv files. Parses the file
+    with the C-backed pandas CSV engine instead of np.genfromtxt and returns the same CIURaw object.
+    :param filename: string - path to _raw.csv file to read
+    :rtype: CIURaw
+    :return: CIURaw object with rawdata, axes, and filename initialized
+    :raises: ValueError
+    """
+    try:
+        rawdata = read_raw_csv_fast(filename)
+    except ValueError:
+        # bad characters in file, or other parsing errors
+        logger.error('Data import error in File: {}. Illegal characters or other error in importing data. This file will NOT be processed'.format(os.path.basename(filename)))
+        raise ValueError('Data import error in File: ', os.path.basename(filename), 'Illegal characters or other error in importing data. This file will NOT be processed')
+    row_axis = rawdata[1:, 0]
+    col_axis = rawdata[0, 1:]
+
+    check_raw_axes(row_axis, col_axis, filename)
+
+    raw_obj = CIU_raw.CIURaw(rawdata[1:, 1:], row_axis, col_axis, filename)
+    return raw_obj
+
+
+def read_raw_csv_fast(filename):
+    """
+    Read the full contents of a _raw.csv file (including the axes header row and column) into a
+    2D float array. Lines starting with '#' are ignored as comments. Empty values are read as in get_data
+    (np.genfromtxt with filling_values=[0]): 0 in the first (axis) column, including the empty top left corner
+    of the file, and NaN elsewhere. Unlike get_data, short rows are not rejected but read as ending in empty values.
+    :param filename: string - path to _raw.csv file to read
+    :return: 2D numpy array of all values in the file
+    :raises: ValueError if the file contains non-numeric values or rows that are too long
+    """
+    try:
+        # round_trip parsing gives the same (correctly rounded) values as np.genfromtxt
+        raw_frame = pandas.read_csv(filename, header=None, engine='c', dtype=np.float64, comment='#',
+                                    skip_blank_lines=True, float_precision='round_trip')
+    except pandas.errors.EmptyDataError:
+        raise ValueError('No data in file')
+    rawdata = raw_frame.to_numpy()
+
+    # empty values and short rows are read as NaN by pandas (long rows raise a ParserError, which is a ValueError)
+    rawdata[np.isnan(rawdata[:, 0]), 0] = 0
+    return rawdata
+
+
+def check_raw_axes(row_axis, col_axis, filename):
+    """
+    Vectorized check of the axes read from a _raw.csv file. Both axes must be non-negative, increasing,
+    and free of duplicate values. Logs and raises a ValueError describing the first problem found.
+    :param row_axis: 1D numpy array of mobility (DT) axis values
+    :param col_axis: 1D numpy array of activation (CV) axis values
+    :param filename: path to the file being checked (for error messages)
+    :return: void
+    :raises: ValueError
+    """
+    row_diffs = np.diff(row_axis)
+    col_diffs = np.diff(col_axis)
+
+    if np.any(row_axis < 0) or np.any(row_diffs < 0):
+        logger.error('Data import error in File: {}. Mobility axis has decreasing or negative values. All axis values must be positive and increasing. This file will NOT be processed'.format(os.path.basename(filename)))
+        raise ValueError('Data import error in File: ', os.path.basename(filename), 'Mobility axis has decreasing or negative values. All axis values must be positive and increasing. This file will NOT be processed')
+    if np.any(col_axis < 0) or np.any(col_diffs < 0):
+        logger.error('Data import error in File: {}. Activation axis has decreasing or negative values. All axis values must be positive and increasing. This file will NOT be processed'.format(os.path.basename(filename)))
+        raise ValueError('Data import error in File: ', os.path.basename(filename), 'Activation axis has decreasing or negative values. All axis values must be positive and increasing. This file will NOT be processed')
+
+    # axes are known to be non-decreasing here, so any duplicates must be adjacent
+    if np.any(row_diffs == 0):
+        logger.error('Data import error in File: {}. Duplicate row (DT) values. This file will NOT be processed'.format(os.path.basename(filename)))
+        raise ValueError('Data import error in File: ', os.path.basename(filename), 'Duplicate row (DT) values. This file will NOT be processed')
+    if np.any(col_diffs == 0):
+        logger.error('Data import error in File: {}. Duplicate column (CV) values. This file will NOT be processed.'.format(os.path.basename(filename)))
+        raise ValueError('Data import error in File: ', os.path.basename(filename), 'Duplicate column (CV) values. This file will NOT be processed.')
+
+
 def normalize_by_col(raw_data_matrix):
     """
     Generate a normalized dataset where each column has been normalized to 1 individually. Returns
@@ -119,31 +179,80 @@ def normalize_by_col(raw_data_matrix):
     return norm
 
 
-def sav_gol_smooth(ciu_data_matrix, smooth_window, smooth_order):
+# cached 1D Savitzky-Golay smoothing operators, keyed by (number of DT bins, window, order, iterations)
+sg_operator_cache = {}
+
+
+def sav_gol_smooth(ciu_data_matrix, smooth_window, smooth_order, iterations=1):
     """
     Apply savitsky-golay smoothing to each column (CV) of the 2D matrix supplied
     :param ciu_data_matrix: input matrix (2D, columns (axis 1) gets smoothed) - supply without axes
     :param smooth_window: Savitsky golay smoothing window to apply
     :param smooth_order: polynomial order to use for smoothing
+    :param iterations: number of times to apply the smoothing
+    :return: smoothed data (same size/format as input)
+    """
+    return sav_gol_smooth_stack(ciu_data_matrix, smooth_window, smooth_order, iterations)
+
+
+def sav_gol_smooth_stack(ciu_data, smooth_window, smooth_order, iterations=1):
+    """
+    Apply savitsky-golay smoothing along the DT axis of a fingerprint (2D, DT x CV) or a stack of fingerprints
+    with the same DT axis (3D, fingerprint x DT x CV) in a single pass. Repeated smoothing is applied at once
+    with the equivalent composite filter (the SG kernel convolved with itself once per iteration), giving
+    the same result as smoothing repeatedly (including the polynomial fits at the ends of the DT axis).
+    :param ciu_data: 2D or 3D array with DT along the second to last axis
+    :param smooth_window: Savitsky golay smoothing window to apply
+    :param smooth_order: polynomial order to use for smoothing
+    :param iterations: number of times to apply the smoothing
     :return: smoothed data (same size/format as input)
     """
     # ensure window length is odd
     if smooth_window % 2 == 0:
         smooth_window += 1
+    if iterations < 1:
+        return np.array(ciu_data, dtype=np.float64)
+
+    ciu_data = np.asarray(ciu_data, dtype=np.float64)
+    num_dt_bins = ciu_data.shape[-2]
+    # rows within edge_size of either end of the DT axis are affected by the end fits of savgol_filter
+    edge_size = iterations * (smooth_window // 2)
+    edge_length = 2 * edge_size + smooth_window
+    if num_dt_bins <= 2 * edge_length:
+        # small axis: apply the full operator matrix
+        operator = get_sg_operator(num_dt_bins, smooth_window, smooth_order, iterations)
+        return np.matmul(operator, ciu_data)
+
+    # interior rows: convolve with the composite kernel
+    kernel = scipy.signal.savgol_coeffs(smooth_window, smooth_order)
+    composite_kernel = kernel
+    for _ in range(iterations - 1):
+        composite_kernel = np.convolve(composite_kernel, kernel)
+    output_data = scipy.ndimage.convolve1d(ciu_data, composite_kernel, axis=-2, mode='constant')
+
+    # edge rows: apply the rows of the operator for a short axis, which match those of the full axis at the edges
+    edge_operator = get_sg_operator(edge_length, smooth_window, smooth_order, iterations)
+    output_data[..., :edge_size, :] = np.matmul(edge_operator[:edge_size], ciu_data[..., :edge_length, :])
+    output_data[..., -edge_size:, :] = np.matmul(edge_operator[-edge_size:], ciu_data[..., -edge_length:, :])
+    return output_data
 
-    # swap axes to access the columns
-    cv_data = np.swapaxes(ciu_data_matrix, 0, 1)
-    output_data = np.ndarray(np.shape(cv_data))
-
-    # smooth each column and return the data (axes swapped back to normal)
-    index = 0
-    while index < len(cv_data):
-        smoothed_col = scipy.signal.savgol_filter(cv_data[index], smooth_window, polyorder=smooth_order)
-        output_data[index] = smoothed_col
-        index += 1
-    output_data = np.swapaxes(output_data, 0, 1)
 
-    return output_data
+def get_sg_operator(num_points, smooth_window, smooth_order, iterations):
+    """
+    Get the matrix that applies savitsky-golay smoothing (savgol_filter, including its end fits) a given
+    number of times to data with num_points points, computing it on first use
+    :param num_points: length of the data to smooth
+    :param smooth_window: Savitsky golay smoothing window (odd)
+    :param smooth_order: polynomial order to use for smoothing
+    :param iterations: number of times to apply the smoothing
+    :return: operator matrix (num_points x num_points)
+    """
+    key = (num_points, smooth_window, smooth_order, iterations)
+    if key not in sg_operator_cache:
+        # smoothing the identity matrix gives the matrix of the (linear) filter
+        single_operator = scipy.signal.savgol_filter(np.eye(num_points), smooth_window, polyorder=smooth_order, axis=0)
+        sg_operator_cache[key] = np.linalg.matrix_power(single_operator, iterations)
+    return sg_operator_cache[key]
 
 
 def smooth_main(analysis_obj, params_obj):
@@ -162,27 +271,25 @@ def smooth_main(analysis_obj, params_obj):
         if params_obj.smoothing_2_window % 2 == 0:
             params_obj.smoothing_2_window += 1
 
-        i = 0
-        while i < params_obj.smoothing_3_iterations:
-            if params_obj.smoothing_1_method.lower() == '2d savitzky-golay':
-                # catch data with only 1 row or column
-                if len(analysis_obj.axes[0]) < params_obj.smoothing_2_window or len(analysis_obj.axes[1]) < 2:
+        if params_obj.smoothing_1_method.lower() == '2d savitzky-golay':
+            # catch data with only 1 row or column
+            if len(analysis_obj.axes[0]) < params_obj.smoothing_2_window or len(analysis_obj.axes[1]) < 2:
+                if params_obj.smoothing_3_iterations > 0:
                     logger.error('File {} has at least one axis too small for 2D smoothing. 2D smoothing requires at least 2 activation axis bins and at least the smoothing window size mobility bins. The file was NOT smoothed'.format(analysis_obj.short_filename))
-                    break
-                norm_data = sgolay2d(norm_data, params_obj.smoothing_2_window, order=2)
-
-            elif params_obj.smoothing_1_method.lower() == '1d savitzky-golay':
-                # catch data with only 1 row
-                if len(analysis_obj.axes[0]) < params_obj.smoothing_2_window:
-                    logger.error('The mobility axis in file {} has fewer bins than the smoothing window and cannot be smoothed. The file was NOT smoothed'.format(
-                            analysis_obj.short_filename))
-                    break
-                norm_data = sav_gol_smooth(norm_data, params_obj.smoothing_2_window, smooth_order=2)
+            else:
+                norm_data = sgolay2d(norm_data, params_obj.smoothing_2_window, order=2, iterations=params_obj.smoothing_3_iterations)
 
+        elif params_obj.smoothing_1_method.lower() == '1d savitzky-golay':
+            # catch data with only 1 row
+            if len(analysis_obj.axes[0]) < params_obj.smoothing_2_window:
+                logger.error('The mobility axis in file {} has fewer bins than the smoothing window and cannot be smoothed. The file was NOT smoothed'.format(
+                        analysis_obj.short_filename))
             else:
-                logger.error('Invalid smoothing method, no smoothing applied')
-                break
-            i += 1
+                # all iterations are applied in a single pass
+                norm_data = sav_gol_smooth_stack(norm_data, params_obj.smoothing_2_window, smooth_order=2, iterations=params_obj.smoothing_3_iterations)
+
+        else:
+            logger.error('Invalid smoothing method, no smoothing applied')
 
     # renormalize data
     norm_data = normalize_by_col(norm_data)
@@ -191,17 +298,79 @@ def smooth_main(analysis_obj, params_obj):
     return analysis_obj
 
 
-def sgolay2d(z, window_size, order, derivative=None):
+def sgolay2d(z, window_size, order, derivative=None, iterations=1):
     """
     ADAPTED FROM THE SCIPY COOKBOOK, at http://scipy-cookbook.readthedocs.io/items/SavitzkyGolay.html
     accessed 2/14/2018. Performs a 2D Savitzky-Golay smooth on the the provided 2D array z using parameters
-    window_size and polynomial order.
-    :param z: 2D numpy array of data to smooth
+    window_size and polynomial order. Also accepts a stack (3D array) of equal-shape fingerprints, which
+    are smoothed together in a single FFT convolution. Kernels are cached (see get_sgolay2d_kernel).
+    :param z: 2D numpy array of data to smooth, or 3D array of 2D arrays to smooth
     :param window_size: filter size (int), must be odd to use for smoothing
     :param order: polynomial order (int) to use
     :param derivative: optional (string), values = row, col, both, or None
-    :return: smoothed 2D numpy array
+    :param iterations: number of times to apply the smoothing (derivative None only)
+    :return: smoothed numpy array (same shape as z)
+    """
+    z = np.asarray(z, dtype=np.float64)
+    half_size = window_size // 2
+
+    if derivative is None:
+        kernel = get_sgolay2d_kernel(window_size, order)
+        # the borders are padded again for each iteration, so only the points further than this from the borders
+        # are the same as a single smooth with the composite kernel
+        edge_size = iterations * half_size
+        if iterations > 1 and 4 * edge_size * (z.shape[-2] + z.shape[-1]) < z.shape[-2] * z.shape[-1]:
+            # large data: smooth the interior at once with the composite kernel and only the border strips iteratively
+            composite_kernel = get_sgolay2d_kernel(window_size, order, iterations=iterations)
+            strip_size = 2 * edge_size
+            output = np.empty(z.shape)
+            output[..., edge_size:-edge_size, edge_size:-edge_size] = scipy.signal.fftconvolve(z, kernel_nd(composite_kernel, z), mode='valid', axes=(-2, -1))
+            output[..., :edge_size, :] = sgolay2d(z[..., :strip_size, :], window_size, order, iterations=iterations)[..., :edge_size, :]
+            output[..., -edge_size:, :] = sgolay2d(z[..., -strip_size:, :], window_size, order, iterations=iterations)[..., -edge_size:, :]
+            output[..., :, :edge_size] = sgolay2d(z[..., :, :strip_size], window_size, order, iterations=iterations)[..., :, :edge_size]
+            output[..., :, -edge_size:] = sgolay2d(z[..., :, -strip_size:], window_size, order, iterations=iterations)[..., :, -edge_size:]
+            return output
+
+        for _ in range(iterations):
+            z = scipy.signal.fftconvolve(pad_sgolay2d(z, half_size), kernel_nd(kernel, z), mode='valid', axes=(-2, -1))
+        return z
+
+    z_mat = pad_sgolay2d(z, half_size)
+    if derivative == 'both':
+        r = get_sgolay2d_kernel(window_size, order, 'row')
+        c = get_sgolay2d_kernel(window_size, order, 'col')
+        return scipy.signal.fftconvolve(z_mat, kernel_nd(r, z), mode='valid', axes=(-2, -1)), scipy.signal.fftconvolve(z_mat, kernel_nd(c, z), mode='valid', axes=(-2, -1))
+    else:
+        kernel = get_sgolay2d_kernel(window_size, order, derivative)
+        return scipy.signal.fftconvolve(z_mat, kernel_nd(kernel, z), mode='valid', axes=(-2, -1))
+
+
+# cached 2D Savitzky-Golay kernels, keyed by (window size, order, derivative, iterations)
+sgolay2d_kernel_cache = {}
+
+
+def get_sgolay2d_kernel(window_size, order, derivative=None, iterations=1):
+    """
+    Get the 2D Savitzky-Golay convolution kernel for the given window size, polynomial order, and derivative
+    (None, row, or col), computing it on first use. For multiple iterations (no derivative), returns the
+    composite kernel (the kernel convolved with itself once per iteration), which applies all iterations at once.
+    :param window_size: filter size (int), must be odd
+    :param order: polynomial order (int) to use
+    :param derivative: optional (string), values = row, col, or None
+    :param iterations: number of smoothing iterations to combine into the kernel
+    :return: 2D kernel array
     """
+    key = (window_size, order, derivative, iterations)
+    if key in sgolay2d_kernel_cache:
+        return sgolay2d_kernel_cache[key]
+
+    if iterations > 1:
+        single_kernel = get_sgolay2d_kernel(window_size, order, derivative)
+        kernel = single_kernel
+        for _ in range(iterations - 1):
+            kernel = scipy.signal.convolve2d(kernel, single_kernel)
+        sgolay2d_kernel_cache[key] = kernel
+        return kernel
 
     # number of terms in the polynomial expression
     n_terms = (order + 1) * (order + 2) / 2.0
@@ -234,51 +403,69 @@ def sgolay2d(z, window_size, order, derivative=None):
     for i, exp in enumerate(exps):
         a_mat[:, i] = (dx ** exp[0]) * (dy ** exp[1])
 
-    # pad input array with appropriate values at the four borders
-    new_shape = z.shape[0] + 2*half_size, z.shape[1] + 2*half_size
+    # solve system for the kernel
+    if derivative is None:
+        kernel = np.linalg.pinv(a_mat)[0].reshape((window_size, -1))
+    elif derivative == 'col':
+        kernel = -np.linalg.pinv(a_mat)[1].reshape((window_size, -1))
+    elif derivative == 'row':
+        kernel = -np.linalg.pinv(a_mat)[2].reshape((window_size, -1))
+    else:
+        raise ValueError('invalid derivative {}'.format(derivative))
+    sgolay2d_kernel_cache[key] = kernel
+    return kernel
+
+
+def kernel_nd(kernel, z):
+    """
+    Reshape a 2D kernel to match the number of dimensions of the data (for convolving a stack of 2D arrays)
+    :param kernel: 2D kernel
+    :param z: 2D or 3D data array
+    :return: kernel with leading dimensions of size 1 added as needed
+    """
+    return kernel.reshape((1,) * (z.ndim - 2) + kernel.shape)
+
+
+def pad_sgolay2d(z, half_size):
+    """
+    Pad the last two axes of an array by half_size at all four borders for 2D Savitzky-Golay smoothing,
+    extending the data at each border by reflecting it about the border value.
+    :param z: 2D numpy array, or 3D array of 2D arrays
+    :param half_size: number of rows/columns to add at each border
+    :return: padded array
+    """
+    if half_size == 0:
+        return np.array(z)
+    new_shape = z.shape[:-2] + (z.shape[-2] + 2*half_size, z.shape[-1] + 2*half_size)
     z_mat = np.zeros(new_shape)
     # top band
-    band = z[0, :]
-    z_mat[:half_size, half_size:-half_size] = band - np.abs(np.flipud(z[1:half_size+1, :]) - band)
+    band = z[..., 0:1, :]
+    z_mat[..., :half_size, half_size:-half_size] = band - np.abs(np.flip(z[..., 1:half_size+1, :], axis=-2) - band)
     # bottom band
-    band = z[-1, :]
-    z_mat[-half_size:, half_size:-half_size] = band + np.abs(np.flipud(z[-half_size-1:-1, :]) - band)
+    band = z[..., -1:, :]
+    z_mat[..., -half_size:, half_size:-half_size] = band + np.abs(np.flip(z[..., -half_size-1:-1, :], axis=-2) - band)
     # left band
-    band = np.tile(z[:, 0].reshape(-1, 1), [1, half_size])
-    z_mat[half_size:-half_size, :half_size] = band - np.abs(np.fliplr(z[:, 1:half_size+1]) - band)
+    band = z[..., :, 0:1]
+    z_mat[..., half_size:-half_size, :half_size] = band - np.abs(np.flip(z[..., :, 1:half_size+1], axis=-1) - band)
     # right band
-    band = np.tile(z[:, -1].reshape(-1, 1), [1, half_size])
-    z_mat[half_size:-half_size, -half_size:] = band + np.abs(np.fliplr(z[:, -half_size-1:-1]) - band)
+    band = z[..., :, -1:]
+    z_mat[..., half_size:-half_size, -half_size:] = band + np.abs(np.flip(z[..., :, -half_size-1:-1], axis=-1) - band)
     # central band
-    z_mat[half_size:-half_size, half_size:-half_size] = z
+    z_mat[..., half_size:-half_size, half_size:-half_size] = z
 
     # top left corner
-    band = z[0, 0]
-    z_mat[:half_size, :half_size] = band - np.abs(np.flipud(np.fliplr(z[1:half_size+1, 1:half_size+1])) - band)
+    band = z[..., 0:1, 0:1]
+    z_mat[..., :half_size, :half_size] = band - np.abs(np.flip(z[..., 1:half_size+1, 1:half_size+1], axis=(-2, -1)) - band)
     # bottom right corner
-    band = z[-1, -1]
-    z_mat[-half_size:, -half_size:] = band + np.abs(np.flipud(np.fliplr(z[-half_size-1:-1, -half_size-1:-1])) - band)
+    band = z[..., -1:, -1:]
+    z_mat[..., -half_size:, -half_size:] = band + np.abs(np.flip(z[..., -half_size-1:-1, -half_size-1:-1], axis=(-2, -1)) - band)
     # top right corner
-    band = z_mat[half_size, -half_size:]
-    z_mat[:half_size, -half_size:] = band - np.abs(np.flipud(z_mat[half_size+1:2*half_size+1, -half_size:]) - band)
+    band = z_mat[..., half_size:half_size+1, -half_size:]
+    z_mat[..., :half_size, -half_size:] = band - np.abs(np.flip(z_mat[..., half_size+1:2*half_size+1, -half_size:], axis=-2) - band)
     # bottom left corner
-    band = z_mat[-half_size:, half_size].reshape(-1, 1)
-    z_mat[-half_size:, :half_size] = band - np.abs(np.fliplr(z_mat[-half_size:, half_size+1:2*half_size+1]) - band)
-
-    # solve system and convolve
-    if derivative is None:
-        m = np.linalg.pinv(a_mat)[0].reshape((window_size, -1))
-        return scipy.signal.fftconvolve(z_mat, m, mode='valid')
-    elif derivative == 'col':
-        c = np.linalg.pinv(a_mat)[1].reshape((window_size, -1))
-        return scipy.signal.fftconvolve(z_mat, -c, mode='valid')
-    elif derivative == 'row':
-        r = np.linalg.pinv(a_mat)[2].reshape((window_size, -1))
-        return scipy.signal.fftconvolve(z_mat, -r, mode='valid')
-    elif derivative == 'both':
-        c = np.linalg.pinv(a_mat)[1].reshape((window_size, -1))
-        r = np.linalg.pinv(a_mat)[2].reshape((window_size, -1))
-        return scipy.signal.fftconvolve(z_mat, -r, mode='valid'), scipy.signal.fftconvolve(z_mat, -c, mode='valid')
+    band = z_mat[..., -half_size:, half_size:half_size+1]
+    z_mat[..., -half_size:, :half_size] = band - np.abs(np.flip(z_mat[..., -half_size:, half_size+1:2*half_size+1], axis=-1) - band)
+    return z_mat
 
 
 def find_nearest(array, value):
@@ -342,21 +529,19 @@ def crop(analysis_obj, crop_vals):
     return new_obj
 
 
-def interpolate_axes(analysis_obj, new_axes):
+def interpolate_axes(analysis_obj, new_axes, kind='linear'):
     """
     interpolate along the collision voltage (x) axis to allow for unevenly spaced data collection
     :param analysis_obj: input data object
     :type analysis_obj: CIUAnalysisObj
     :param new_axes: new axes onto which to interpolate in form [dt_axis, cv_axis]
+    :param kind: interpolation type (linear or cubic)
     :return: updated object with interpolate CIUData and axes
     :rtype: CIUAnalysisObj
+    :raises: ValueError if the new axes do not overlap the existing axes
     """
     # interpolate the existing data, then reframe on new axes
-    interp_func = scipy.interpolate.interp2d(analysis_obj.axes[0],
-                                             analysis_obj.axes[1],
-                                             analysis_obj.ciu_data.T)
-    interp_data = interp_func(new_axes[0], new_axes[1])
-    ciu_interp_data = np.asarray(interp_data).T
+    ciu_interp_data = interpolate_2d(analysis_obj.ciu_data, analysis_obj.axes, new_axes, kind)
 
     # save to analysis object and return
     analysis_obj.ciu_data = ciu_interp_data
@@ -365,35 +550,30 @@ def interpolate_axes(analysis_obj, new_axes):
     return analysis_obj
 
 
-def interpolate_axis_1d(analysis_obj, dt_axis_bool, new_axis):
+def interpolate_axis_1d(analysis_obj, dt_axis_bool, new_axis, kind='linear', clamp=False):
     """
-    Interpolate an axis in one dimension iteratively across the CIU dataset. 2D interpolation is
+    Interpolate an axis in one dimension across the CIU dataset. 2D interpolation is
     recommended in most cases, but sometimes (e.g. if only one CV) isn't good
     :param analysis_obj: data container
     :type analysis_obj: CIUAnalysisObj
     :param dt_axis_bool: Whether to interpolate DT axis (True) or CV axis (False)
     :param new_axis: new axis to interpolate, taken from compute_new_axes
+    :param kind: interpolation type (linear or cubic)
+    :param clamp: if True, points on the new axis outside the existing axis take the value of the nearest existing
+    axis point. If False (default, as with interp1d), a ValueError is raised for any such point
     :return: updated analysis_obj with ciu_data and axes edited to new values
+    :raises: ValueError if the new axis extends outside the existing axis (or does not overlap it if clamp is True)
     """
-    new_data = []
     if dt_axis_bool:
         # interpolate along the drift axis within each CV column using the new_axis provided
-        cv_col_data = analysis_obj.ciu_data.T
+        dt_weights = get_interpolation_weights(analysis_obj.axes[0], new_axis, kind, clamp)
         new_axes = [new_axis, analysis_obj.axes[1]]
-        for cv_col in cv_col_data:
-            interp_fn = scipy.interpolate.interp1d(analysis_obj.axes[0], cv_col)
-            new_col = interp_fn(new_axis)
-            new_data.append(new_col)
-        new_data = np.asarray(new_data).T
+        new_data = np.matmul(dt_weights, analysis_obj.ciu_data)
     else:
         # interpolate along the CV axis within each drift bin using the new_axis provided
-        dt_row_data = analysis_obj.ciu_data
+        cv_weights = get_interpolation_weights(analysis_obj.axes[1], new_axis, kind, clamp)
         new_axes = [analysis_obj.axes[0], new_axis]
-        for dt_row in dt_row_data:
-            interp_fn = scipy.interpolate.interp1d(analysis_obj.axes[1], dt_row)
-            new_row = interp_fn(new_axis)
-            new_data.append(new_row)
-        new_data = np.asarray(new_data)
+        new_data = np.matmul(analysis_obj.ciu_data, cv_weights.T)
 
     # save output to analysis object and return
     analysis_obj.axes = new_axes
@@ -402,6 +582,76 @@ def interpolate_axis_1d(analysis_obj, dt_axis_bool, new_axis):
     return analysis_obj
 
 
+def interpolate_2d(ciu_data, old_axes, new_axes, kind='linear', clamp=True):
+    """
+    Interpolate CIU data (or a stack of CIU data arrays with the same axes) from its axes onto new axes.
+    Interpolation is separable, so it is done by applying precomputed weights for each axis (see
+    get_interpolation_weights) as two matrix multiplications.
+    :param ciu_data: 2D array (DT x CV) or 3D array of 2D arrays
+    :param old_axes: current axes in form [dt_axis, cv_axis]
+    :param new_axes: new axes onto which to interpolate in form [dt_axis, cv_axis]
+    :param kind: interpolation type (linear or cubic)
+    :param clamp: if True (default, as the previous interp2d based interpolation), points on the new axes outside
+    the existing axes take the value of the nearest existing axis point. If False, a ValueError is raised for any such point
+    :return: interpolated data array
+    :raises: ValueError if the new axes extend outside the existing axes (or do not overlap them if clamp is True)
+    """
+    dt_weights = get_interpolation_weights(old_axes[0], new_axes[0], kind, clamp)
+    cv_weights = get_interpolation_weights(old_axes[1], new_axes[1], kind, clamp)
+    return np.matmul(np.matmul(dt_weights, ciu_data), cv_weights.T)
+
+
+# cached interpolation weights, keyed by (old axis, new axis, kind). Limited in size as many different axes
+# can be encountered over a session
+interp_weight_cache = {}
+MAX_INTERP_WEIGHT_CACHE_SIZE = 64
+
+
+def get_interpolation_weights(old_axis, new_axis, kind='linear', clamp=True):
+    """
+    Get the matrix that interpolates data on old_axis onto new_axis (new_data = weights @ old_data), computing
+    it on first use.
+    :param old_axis: current axis values
+    :param new_axis: new axis values
+    :param kind: interpolation type: linear, or cubic (not-a-knot cubic spline, as in interp1d. Linear is
+    used if old_axis has fewer than 4 points)
+    :param clamp: if True, points on new_axis outside the range of old_axis take the value of the nearest old axis
+    point (as the previous interp2d based interpolation did). If False, such points raise a ValueError (as interp1d)
+    :return: weights array (len(new_axis) x len(old_axis))
+    :raises: ValueError if new_axis does not overlap old_axis, or if clamp is False and new_axis extends outside old_axis
+    """
+    old_axis = np.asarray(old_axis, dtype=np.float64)
+    new_axis = np.asarray(new_axis, dtype=np.float64)
+    if kind not in ['linear', 'cubic']:
+        raise ValueError('Invalid interpolation type {}'.format(kind))
+    if np.max(new_axis) < np.min(old_axis) or np.min(new_axis) > np.max(old_axis):
+        raise ValueError('New axis does not overlap the existing axis')
+    if not clamp and (np.min(new_axis) < np.min(old_axis) or np.max(new_axis) > np.max(old_axis)):
+        raise ValueError('New axis values [{}, {}] are outside the interpolation range [{}, {}]'.format(np.min(new_axis), np.max(new_axis),
+                                                                                                      np.min(old_axis), np.max(old_axis)))
+
+    # clamped and unclamped weights are identical once the range has been checked
+    key = (old_axis.tobytes(), new_axis.tobytes(), kind)
+    if key in interp_weight_cache:
+        return interp_weight_cache[key]
+
+    if len(old_axis) == 1:
+        weights = np.ones((len(new_axis), 1))
+    else:
+        # the weights for each old axis point are the interpolation of a unit value at that point
+        sort_order = np.argsort(old_axis)
+        sorted_axis = old_axis[sort_order]
+        degree = 3 if kind == 'cubic' and len(old_axis) > 3 else 1
+        spline = scipy.interpolate.make_interp_spline(sorted_axis, np.eye(len(old_axis))[sort_order], k=degree)
+        weights = spline(np.clip(new_axis, sorted_axis[0], sorted_axis[-1]))
+
+    if len(interp_weight_cache) >= MAX_INTERP_WEIGHT_CACHE_SIZE:
+        # remove the oldest weights
+        del interp_weight_cache[next(iter(interp_weight_cache))]
+    interp_weight_cache[key] = weights
+    return weights
+
+
 def compute_new_axes(old_axes, interpolation_scaling, interp_cv=True, interp_dt=False):
     """
     Determine new (interpolated) axes based on the old axes and a scaling factor. Designed
@@ -443,6 +693,15 @@ def check_axes_crop(analysis_obj_list):
     different size axes but the same voltage step.
     :param analysis_obj_list: list of CIUAnalysis objects
     :type analysis_obj_list: list[CIUAnalysisObj]
+    :return: see check_axes_list_crop
+    """
+    return check_axes_list_crop([analysis_obj.axes for analysis_obj in analysis_obj_list])
+
+
+def check_axes_list_crop(axes_list):
+    """
+    Determine the shared dimensions (for cropping) and minimum bin spacings of a list of axes (see check_axes_crop)
+    :param axes_list: list of [dt_axis, cv_axis] axes
     :return: [dt_start, dt_end, cv_start, cv_end], [min_dt_spacing, min_cv_spacing] Maximum dimension DT/CV axes that are shared amongst all files, and the minimum axes sizes
     """
     # Dimensions to crop to (maximum shared area amongst all fingerprints)
@@ -457,25 +716,25 @@ def check_axes_crop(analysis_obj_list):
     min_cv_spacing = np.inf
 
     # take the smaller dimension as the shared area (e.g. if a file only goes to 100V and others go to 110V, sharing stops at 100V)
-    for analysis_obj in analysis_obj_list:
-        if analysis_obj.axes[0][0] > dt_start_max:
-            dt_start_max = analysis_obj.axes[0][0]
-        if analysis_obj.axes[0][-1] < dt_end_min:
-            dt_end_min = analysis_obj.axes[0][-1]
-        if analysis_obj.axes[1][0] > cv_start_max:
-            cv_start_max = analysis_obj.axes[1][0]
-        if analysis_obj.axes[1][-1] < cv_end_min:
-            cv_end_min = analysis_obj.axes[1][-1]
+    for axes in axes_list:
+        if axes[0][0] > dt_start_max:
+            dt_start_max = axes[0][0]
+        if axes[0][-1] < dt_end_min:
+            dt_end_min = axes[0][-1]
+        if axes[1][0] > cv_start_max:
+            cv_start_max = axes[1][0]
+        if axes[1][-1] < cv_end_min:
+            cv_end_min = axes[1][-1]
 
         # check bin SPACING for later interpolation (if needed).
-        bin_spacings_dt = [analysis_obj.axes[0][x + 1] - analysis_obj.axes[0][x] for x in range(len(analysis_obj.axes[0]) - 1)]
-        bin_spacings_cv = [analysis_obj.axes[1][x + 1] - analysis_obj.axes[1][x] for x in range(len(analysis_obj.axes[1]) - 1)]
+        bin_spacings_dt = [axes[0][x + 1] - axes[0][x] for x in range(len(axes[0]) - 1)]
+        bin_spacings_cv = [axes[1][x + 1] - axes[1][x] for x in range(len(axes[1]) - 1)]
 
         # using most common (mode) spacing in case of unevenly spaced data.
         if np.median(bin_spacings_dt) < min_dt_spacing:
-            min_dt_spacing = scipy.stats.mode(bin_spacings_dt)[0][0]
+            min_dt_spacing = np.atleast_1d(scipy.stats.mode(bin_spacings_dt)[0])[0]
         if np.median(bin_spacings_cv) < min_cv_spacing:
-            min_cv_spacing = scipy.stats.mode(bin_spacings_cv)[0][0]
+            min_cv_spacing = np.atleast_1d(scipy.stats.mode(bin_spacings_cv)[0])[0]
 
     crop_vals_all = [dt_start_max, dt_end_min, cv_start_max, cv_end_min, min_dt_spacing, min_cv_spacing]
     for val in crop_vals_all:
@@ -557,7 +816,8 @@ def equalize_axes_main(list_of_analysis_objs):
     will typically not be preserved.
     :param list_of_analysis_objs: list of CIUAnalysisObjs to equalize axes across
     :type list_of_analysis_objs: list[CIUAnalysisObj]
-    :return: list of analysis objects with axes updated, final axes
+    :return: list of analysis objects with axes updated, final axes, adjustment flag, FingerprintStack of the equalized data
+    :rtype: list[CIUAnalysisObj], list, bool, FingerprintStack
     """
     # check axes for cropping (ensure that region of interest is equal)
     crop_vals, axes_spacings = check_axes_crop(list_of_analysis_objs)
@@ -580,7 +840,9 @@ def equalize_axes_main(list_of_analysis_objs):
     else:
         any_adjust_flag = False
 
-    return list_of_analysis_objs, final_axes, any_adjust_flag
+    # the objects' data become views of the stack rows, so the equalized data is only held once
+    fingerprint_stack = FingerprintStack.from_analysis_objs(list_of_analysis_objs, final_axes, share_data=True)
+    return list_of_analysis_objs, final_axes, any_adjust_flag, fingerprint_stack
 
 
 def equalize_axes_2d_list_subclass(cl_input_list_by_label):
@@ -589,8 +851,9 @@ def equalize_axes_2d_list_subclass(cl_input_list_by_label):
     preserved. Axes are equalized across ALL sublists (every object anywhere in the 2D list)
     :param cl_input_list_by_label: list of lists of Classification.ClInput
     :type cl_input_list_by_label: list[list[Classification.ClInput]]
-    :return: updated list of lists with axes equalized, final axes list
-    :rtype: list[list[CIUAnalysisObj]], output_axes_list
+    :return: updated list of lists with axes equalized, final axes list, FingerprintStack of all equalized data
+    (labeled by class label and subclass key)
+    :rtype: list[list[CIUAnalysisObj]], output_axes_list, FingerprintStack
     """
     flat_cl_input_list = [x for cl_input_list in cl_input_list_by_label for x in cl_input_list]
     flat_obj_list = []
@@ -611,7 +874,14 @@ def equalize_axes_2d_list_subclass(cl_input_list_by_label):
                     # Raise error and cancel classification. Don't want to try to guarantee that data will still match, and user shouldn't be fitting things that don't overlap anyway.
                     raise ValueError(*err.args)
 
-    return cl_input_list_by_label, final_axes
+    stack_objs, stack_labels, stack_subclass_keys = [], [], []
+    for cl_input in flat_cl_input_list:
+        for subclass_label, subclass_obj in cl_input.subclass_dict.items():
+            stack_objs.append(subclass_obj)
+            stack_labels.append(cl_input.class_label)
+            stack_subclass_keys.append(subclass_label)
+    fingerprint_stack = FingerprintStack.from_analysis_objs(stack_objs, final_axes, stack_labels, stack_subclass_keys, share_data=True)
+    return cl_input_list_by_label, final_axes, fingerprint_stack
 
 
 def equalize_unk_axes_clinput(flat_unknown_list, final_axes, scheme_feats_list, gaussian_mode=False):
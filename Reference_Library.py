@@ -0,0 +1,348 @@
+"""
+This file is part of CIUSuite 2
+Copyright (C) 2018 Daniel Polasky
+
+Persistent library of reference fingerprints for finding the references closest to an unknown fingerprint.
+References are stored on shared axes in a single memory-mapped array, with an index of their principal
+components (PCA of the flattened ciu_data). A search finds candidate references by distance in the reduced
+(PCA) space, then ranks the candidates by their exact RMSD to the query (as in Original_CIU.rmsd_difference,
+using the compare_4_int_cutoff parameter), so only a small part of the library is read for each query.
+
+Library folder contents:
+    library_info.json           reference names, source files, and shared axes
+    library_fingerprints.npy    all reference fingerprints (N x DT x CV), opened memory-mapped
+    library_index.npz           PCA mean, components, and the projection of each reference
+
+Usage: python Reference_Library.py add library_folder file1.ciu file2.ciu ...
+       python Reference_Library.py search library_folder file1.ciu file2.ciu ... [--matches 5]
+       (search results are also saved to library_matches.csv in the current folder)
+"""
+import os
+import sys
+import json
+import logging
+import numpy as np
+from sklearn.decomposition import IncrementalPCA
+
+import CIU_File_IO
+import Raw_Processing
+import RMSD_Matrix
+
+logger = logging.getLogger('main')
+
+LIBRARY_INFO_FILE = 'library_info.json'
+LIBRARY_DATA_FILE = 'library_fingerprints.npy'
+LIBRARY_INDEX_FILE = 'library_index.npz'
+LIBRARY_VERSION = 1
+LIBRARY_MATCHES_FILE = 'library_matches.csv'
+# number of references read into memory at once when adding to the library or fitting the index (limits memory use)
+LIBRARY_CHUNK_SIZE = 1024
+# distance (fraction of the library axis spacing) by which a fingerprint's axes may fall short of the library axes
+LIBRARY_AXIS_TOLERANCE = 0.1
+
+
+class ReferenceLibrary(object):
+    """
+    Reference fingerprints (memory-mapped) with their names and PCA index. Loads an existing library from
+    its folder, or starts an empty library (saved when references are first added).
+    """
+    def __init__(self, library_dir):
+        """
+        Open the library in a folder
+        :param library_dir: library folder (created when references are first added if it does not exist)
+        :raises: ValueError if the folder contains a library saved by an incompatible version
+        """
+        self.library_dir = library_dir
+        self.names = []
+        self.source_files = []
+        self.axes = None
+        self.data = None
+        self.pca_mean = None
+        self.pca_components = None
+        self.projections = None
+
+        info_path = os.path.join(library_dir, LIBRARY_INFO_FILE)
+        if os.path.exists(info_path):
+            with open(info_path, 'r') as info_file:
+                info = json.load(info_file)
+            if info['version'] != LIBRARY_VERSION:
+                raise ValueError('Reference library {} was saved by an incompatible version'.format(library_dir))
+            self.names = info['names']
+            self.source_files = info['source_files']
+            self.axes = [np.asarray(info['axes'][0]), np.asarray(info['axes'][1])]
+            self.load_arrays()
+
+    def __len__(self):
+        return len(self.names)
+
+    def load_arrays(self):
+        """
+        Open the fingerprint array (memory-mapped, read only) and load the index from the library folder
+        :return: void
+        """
+        self.data = np.load(os.path.join(self.library_dir, LIBRARY_DATA_FILE), mmap_mode='r')
+        with np.load(os.path.join(self.library_dir, LIBRARY_INDEX_FILE)) as index:
+            self.pca_mean = index['mean']
+            self.pca_components = index['components']
+            self.projections = index['projections']
+
+    def get_fingerprint_data(self, analysis_obj):
+        """
+        Get the data of an analysis object on the library axes, interpolating if its axes do not match. The
+        object's axes must cover the full range of the library axes (within LIBRARY_AXIS_TOLERANCE), so that
+        no part of the fingerprint is extrapolated.
+        :param analysis_obj: CIUAnalysisObj
+        :return: 2D array (DT x CV) on the library axes
+        :raises: ValueError if the object's axes do not cover the library axes
+        """
+        if all(len(obj_axis) == len(lib_axis) and np.allclose(obj_axis, lib_axis) for obj_axis, lib_axis in zip(analysis_obj.axes, self.axes)):
+            return analysis_obj.ciu_data
+
+        for obj_axis, lib_axis, axis_name in zip(analysis_obj.axes, self.axes, ['DT', 'CV']):
+            tolerance = LIBRARY_AXIS_TOLERANCE * (lib_axis[-1] - lib_axis[0]) / max(len(lib_axis) - 1, 1)
+            if obj_axis[0] > lib_axis[0] + tolerance or obj_axis[-1] < lib_axis[-1] - tolerance:
+                raise ValueError('{} axis ({:.2f} to {:.2f}) does not cover the library {} axis ({:.2f} to {:.2f})'.format(axis_name, obj_axis[0], obj_axis[-1],
+                                                                                                                     axis_name, lib_axis[0], lib_axis[-1]))
+        # points within the tolerance outside the object's axes take the edge values
+        return Raw_Processing.interpolate_2d(analysis_obj.ciu_data, analysis_obj.axes, self.axes, clamp=True)
+
+    def add(self, analysis_obj_list, num_components=20):
+        """
+        Add fingerprints to the library and rebuild the index. The library axes are taken from the first
+        object added to an empty library; later objects are interpolated onto them if needed.
+        :param analysis_obj_list: list of CIUAnalysisObjs to add
+        :type analysis_obj_list: list[CIUAnalysisObj]
+        :param num_components: number of principal components in the index
+        :return: number of fingerprints added
+        """
+        if len(analysis_obj_list) == 0:
+            return 0
+        if self.axes is None:
+            self.axes = [np.asarray(analysis_obj_list[0].axes[0]), np.asarray(analysis_obj_list[0].axes[1])]
+
+        new_data = []
+        for analysis_obj in analysis_obj_list:
+            try:
+                new_data.append(self.get_fingerprint_data(analysis_obj))
+            except ValueError as err:
+                logger.warning('File {} was not added to the reference library: {}'.format(analysis_obj.short_filename, err))
+                continue
+            self.names.append(analysis_obj.short_filename)
+            self.source_files.append(analysis_obj.filename)
+        if len(new_data) == 0:
+            return 0
+
+        os.makedirs(self.library_dir, exist_ok=True)
+        self.save_data(np.stack(new_data))
+        self.build_index(num_components)
+        self.save_info()
+        self.load_arrays()
+        logger.info('Added {} references to library {} ({} total)'.format(len(new_data), self.library_dir, len(self)))
+        return len(new_data)
+
+    def save_data(self, new_data):
+        """
+        Write the library fingerprints followed by new fingerprints to the fingerprint file (via a temporary
+        file, so the existing library is unchanged if saving fails)
+        :param new_data: 3D array (M x DT x CV) of fingerprints to append
+        :return: void
+        """
+        old_data = self.data
+        num_old = 0 if old_data is None else len(old_data)
+        data_path = os.path.join(self.library_dir, LIBRARY_DATA_FILE)
+        temp_path = data_path + '.tmp.npy'
+        all_data = np.lib.format.open_memmap(temp_path, mode='w+', dtype=np.float64, shape=(num_old + len(new_data),) + new_data.shape[1:])
+        for start_index in range(0, num_old, LIBRARY_CHUNK_SIZE):
+            end_index = min(start_index + LIBRARY_CHUNK_SIZE, num_old)
+            all_data[start_index:end_index] = old_data[start_index:end_index]
+        all_data[num_old:] = new_data
+        all_data.flush()
+        # close both memory maps before replacing the file (required on Windows)
+        del all_data
+        self.data = None
+        del old_data
+        os.replace(temp_path, data_path)
+
+    def build_index(self, num_components):
+        """
+        Compute the principal components of the flattened library fingerprints (incremental PCA over chunks of
+        references, so only one chunk is in memory at a time) and the projection of each reference onto them,
+        and save the index
+        :param num_components: number of principal components (limited by the number of references)
+        :return: void
+        """
+        data = np.load(os.path.join(self.library_dir, LIBRARY_DATA_FILE), mmap_mode='r')
+        flat_data = data.reshape(len(data), -1)
+        num_components = max(1, min(num_components, flat_data.shape[0] - 1, flat_data.shape[1]))
+
+        # chunks of (nearly) equal size: at least LIBRARY_CHUNK_SIZE references (or all of them) and no fewer than the number of components
+        num_chunks = max(1, len(flat_data) // max(LIBRARY_CHUNK_SIZE, num_components))
+        chunk_bounds = np.linspace(0, len(flat_data), num_chunks + 1).astype(int)
+        pca = IncrementalPCA(n_components=num_components)
+        for start_index, end_index in zip(chunk_bounds[:-1], chunk_bounds[1:]):
+            # (the explained variance of a single reference library is undefined, but is not used)
+            with np.errstate(divide='ignore', invalid='ignore'):
+                pca.partial_fit(flat_data[start_index:end_index])
+        self.pca_mean = pca.mean_
+        self.pca_components = pca.components_
+
+        self.projections = np.zeros((len(flat_data), num_components))
+        for start_index, end_index in zip(chunk_bounds[:-1], chunk_bounds[1:]):
+            self.projections[start_index:end_index] = self.project(flat_data[start_index:end_index])
+        del data, flat_data
+        np.savez(os.path.join(self.library_dir, LIBRARY_INDEX_FILE), mean=self.pca_mean, components=self.pca_components, projections=self.projections)
+
+    def save_info(self):
+        """
+        Save the reference names, source files, and axes
+        :return: void
+        """
+        info = {'version': LIBRARY_VERSION,
+                'names': self.names,
+                'source_files': self.source_files,
+                'axes': [self.axes[0].tolist(), self.axes[1].tolist()]}
+        with open(os.path.join(self.library_dir, LIBRARY_INFO_FILE), 'w') as info_file:
+            json.dump(info, info_file)
+
+    def project(self, flat_data):
+        """
+        Project flattened fingerprints onto the index principal components
+        :param flat_data: 2D array (M x points) of flattened fingerprints on the library axes
+        :return: 2D array (M x components)
+        """
+        return (flat_data - self.pca_mean) @ self.pca_components.T
+
+    def search(self, query_data, noise_cutoff, num_matches=5, num_candidates=50):
+        """
+        Find the references with the lowest RMSD to each query fingerprint. The closest references in the
+        PCA index are taken as candidates, and ranked by their exact RMSDs.
+        :param query_data: 3D array (M x DT x CV) of query fingerprints on the library axes
+        :param noise_cutoff: relative intensity cutoff for RMSD calculation (compare_4_int_cutoff)
+        :param num_matches: number of matches to return for each query
+        :param num_candidates: number of candidates (from the index) for which to compute exact RMSDs
+        :return: list (one per query) of lists of (reference index, RMSD) tuples, lowest RMSD first
+        """
+        query_data = np.asarray(query_data, dtype=np.float64)
+        flat_queries = query_data.reshape(len(query_data), -1)
+        num_candidates = min(max(num_candidates, num_matches), len(self))
+
+        # squared distances in the reduced space between each query and every reference
+        query_projections = self.project(flat_queries)
+        distances = np.sum(query_projections ** 2, axis=1)[:, np.newaxis] + np.sum(self.projections ** 2, axis=1)[np.newaxis, :] - 2 * query_projections @ self.projections.T
+        if num_candidates < len(self):
+            candidates = np.argpartition(distances, num_candidates - 1, axis=1)[:, :num_candidates]
+        else:
+            candidates = np.tile(np.arange(len(self)), (len(flat_queries), 1))
+
+        all_matches = []
+        filtered_queries = RMSD_Matrix.noise_filter(flat_queries, noise_cutoff)
+        for filtered_query, query_candidates in zip(filtered_queries, candidates):
+            # read candidate references in file order from the memory-mapped array (a copy, so filtered in place)
+            query_candidates = np.sort(query_candidates)
+            candidate_data = self.data[query_candidates].reshape(len(query_candidates), -1)
+            RMSD_Matrix.noise_filter(candidate_data, noise_cutoff, out=candidate_data)
+            rmsds = RMSD_Matrix.get_rmsds_to_references(filtered_query, candidate_data, out=candidate_data)
+            best = np.argsort(rmsds, kind='stable')[:num_matches]
+            all_matches.append([(int(query_candidates[x]), float(rmsds[x])) for x in best])
+        return all_matches
+
+
+def get_library_params(params_obj):
+    """
+    Library search settings from parameters (defaults used if not set, e.g. in older parameter files)
+    :param params_obj: Parameters
+    :type params_obj: CIU_Params.Parameters
+    :return: number of matches, number of candidates, number of PCA components
+    """
+    num_matches = params_obj.library_1_num_matches if params_obj.library_1_num_matches else 5
+    num_candidates = params_obj.library_2_num_candidates if params_obj.library_2_num_candidates else 50
+    num_components = params_obj.library_3_pca_components if params_obj.library_3_pca_components else 20
+    return int(num_matches), int(num_candidates), int(num_components)
+
+
+def add_to_library(analysis_obj_list, params_obj, library_dir):
+    """
+    Add analysis objects to a reference library (creating the library if needed)
+    :param analysis_obj_list: list of CIUAnalysisObjs
+    :type analysis_obj_list: list[CIUAnalysisObj]
+    :param params_obj: Parameters
+    :type params_obj: CIU_Params.Parameters
+    :param library_dir: library folder
+    :return: ReferenceLibrary
+    :rtype: ReferenceLibrary
+    """
+    library = ReferenceLibrary(library_dir)
+    _, _, num_components = get_library_params(params_obj)
+    library.add(analysis_obj_list, num_components)
+    return library
+
+
+def search_library(analysis_obj_list, params_obj, library_dir, output_dir):
+    """
+    Find the closest references in a library to each analysis object and save the matches to CSV
+    :param analysis_obj_list: list of CIUAnalysisObjs to search for
+    :type analysis_obj_list: list[CIUAnalysisObj]
+    :param params_obj: Parameters
+    :type params_obj: CIU_Params.Parameters
+    :param library_dir: library folder
+    :param output_dir: directory in which to save output
+    :return: dict of query short filename: list of (reference name, RMSD) tuples, lowest RMSD first
+    """
+    library = ReferenceLibrary(library_dir)
+    if len(library) == 0:
+        logger.error('Reference library {} is empty or does not exist'.format(library_dir))
+        return {}
+    num_matches, num_candidates, _ = get_library_params(params_obj)
+
+    query_names = []
+    query_data = []
+    for analysis_obj in analysis_obj_list:
+        try:
+            query_data.append(library.get_fingerprint_data(analysis_obj))
+        except ValueError as err:
+            logger.warning('File {} was not searched against the reference library: {}'.format(analysis_obj.short_filename, err))
+            continue
+        query_names.append(analysis_obj.short_filename)
+    if len(query_data) == 0:
+        return {}
+
+    all_matches = library.search(np.stack(query_data), params_obj.compare_4_int_cutoff, num_matches, num_candidates)
+    results = {}
+    output_string = 'Query,Rank,Reference,RMSD (%)\n'
+    for query_name, matches in zip(query_names, all_matches):
+        results[query_name] = [(library.names[ref_index], rmsd) for ref_index, rmsd in matches]
+        for rank, (ref_name, rmsd) in enumerate(results[query_name]):
+            output_string += '{},{},{},{:.2f}\n'.format(query_name, rank + 1, ref_name, rmsd)
+    with open(os.path.join(output_dir, LIBRARY_MATCHES_FILE), 'w') as outfile:
+        outfile.write(output_string)
+    return results
+
+
+if __name__ == '__main__':
+    import CIU_Params
+
+    arguments = [x for x in sys.argv[1:]]
+    main_num_matches = None
+    if '--matches' in arguments:
+        match_index = arguments.index('--matches')
+        main_num_matches = int(arguments[match_index + 1])
+        del arguments[match_index:match_index + 2]
+    if len(arguments) < 3 or arguments[0] not in ['add', 'search']:
+        print(__doc__)
+        sys.exit(1)
+
+    main_logger = logging.getLogger('main')
+    main_logger.addHandler(logging.StreamHandler())
+    main_logger.setLevel(logging.INFO)
+    main_params = CIU_Params.Parameters()
+    main_params.set_params(CIU_Params.parse_params_file_newcsv(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'CIU2_param_info.csv')))
+    if main_num_matches is not None:
+        main_params.library_1_num_matches = main_num_matches
+
+    main_objs = [CIU_File_IO.load_analysis_file(x) for x in arguments[2:]]
+    if arguments[0] == 'add':
+        add_to_library(main_objs, main_params, arguments[1])
+    else:
+        main_results = search_library(main_objs, main_params, arguments[1], os.getcwd())
+        for main_query, main_matches in main_results.items():
+            print('{}: {}'.format(main_query, ', '.join(['{} ({:.2f})'.format(name, rmsd) for name, rmsd in main_matches])))
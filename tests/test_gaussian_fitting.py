@@ -0,0 +1,128 @@
+"""
+This file is part of CIUSuite 2
+Copyright (C) 2018 Daniel Polasky and Sugyan Dixit
+
+Checks of the batched Gaussian fitting engine (Gaussian_Fitting.fit_gaussians_batched) against
+scipy.optimize.least_squares on real CIU data columns (tests/data). Run with pytest from the
+CIUSuite 2 folder.
+"""
+import os
+import sys
+import glob
+import numpy as np
+import pytest
+from scipy.optimize import least_squares
+
+PACKAGE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, PACKAGE_DIR)
+import CIU_Params
+import Raw_Processing
+import Gaussian_Fitting
+
+DATA_DIR = os.path.join(PACKAGE_DIR, 'tests', 'data')
+RAW_FILES = sorted(glob.glob(os.path.join(DATA_DIR, '*_raw.csv')))
+# allowed relative excess of a batched fit's cost over the least_squares cost from the same start
+COST_TOLERANCE = 1e-6
+
+
+def get_fit_problems():
+    """
+    Run the batched fitting engine over all columns of the test files (default parameters) and record
+    every set of fits passed to fit_gaussians_batched along with its results
+    :return: list of (x_data, y_data, initial values, lower bounds, upper bounds, free mask, use_baseline, fit values)
+    """
+    params_obj = CIU_Params.Parameters()
+    params_obj.set_params(CIU_Params.parse_params_file(os.path.join(PACKAGE_DIR, 'CIU2_param_info.csv')))
+    params_obj.gaussian_4_save_diagnostics = False
+    params_obj.gaussian_63_fit_engine = 'batched'
+
+    ciu_data_list, axes_list = [], []
+    for raw_file in RAW_FILES:
+        analysis_obj = Raw_Processing.process_raw_obj(Raw_Processing.get_data_fast(raw_file), params_obj)
+        analysis_obj = Raw_Processing.smooth_main(analysis_obj, params_obj)
+        ciu_data_list.append(analysis_obj.ciu_data)
+        axes_list.append(analysis_obj.axes)
+
+    problems = []
+    fit_batched = Gaussian_Fitting.fit_gaussians_batched
+
+    def record_fit(x_data, y_data, initial_values, lower_bounds, upper_bounds, free_mask, use_baseline, **kwargs):
+        fit_values = fit_batched(x_data, y_data, initial_values, lower_bounds, upper_bounds, free_mask, use_baseline, **kwargs)
+        problems.append((x_data, np.array(y_data), np.array(initial_values), lower_bounds, upper_bounds, free_mask, use_baseline, fit_values))
+        return fit_values
+
+    Gaussian_Fitting.fit_gaussians_batched = record_fit
+    try:
+        Gaussian_Fitting.fit_files_batched(ciu_data_list, axes_list, params_obj, [None for _ in RAW_FILES])
+    finally:
+        Gaussian_Fitting.fit_gaussians_batched = fit_batched
+    return problems
+
+
+def get_cost(fit_values, x_data, y_data, use_baseline):
+    """
+    Sum of squared residuals of a fit
+    """
+    residuals = Gaussian_Fitting.multi_gauss_residual(fit_values, x_data, y_data, use_baseline)
+    return np.sum(residuals ** 2)
+
+
+def get_least_squares_values(x_data, y_data, initial_values, lower_bounds, upper_bounds, free_mask, use_baseline):
+    """
+    Fit the free values of one batched fit with least_squares from the same start (as perform_fit_least_squares)
+    """
+    values = np.array(initial_values, dtype=float)
+
+    def free_residual(free_values):
+        values[free_mask] = free_values
+        return Gaussian_Fitting.multi_gauss_residual(values, x_data, y_data, use_baseline)
+
+    def free_jacobian(free_values):
+        values[free_mask] = free_values
+        return Gaussian_Fitting.multi_gauss_jacobian(values, x_data, y_data, use_baseline)[:, free_mask]
+
+    result = least_squares(free_residual, values[free_mask], jac=free_jacobian, bounds=(lower_bounds[free_mask], upper_bounds[free_mask]),
+                           method='trf', max_nfev=1000)
+    values[free_mask] = result.x
+    return values
+
+
+@pytest.mark.skipif(len(RAW_FILES) == 0, reason='no test data files')
+def test_batched_costs_match_least_squares():
+    problems = get_fit_problems()
+    assert len(problems) > 0
+
+    worse_fits = []
+    for x_data, y_data, initial_values, lower_bounds, upper_bounds, free_mask, use_baseline, fit_values in problems:
+        for fit_index in range(len(y_data)):
+            ls_values = get_least_squares_values(x_data, y_data[fit_index], initial_values[fit_index], lower_bounds[fit_index],
+                                                 upper_bounds[fit_index], free_mask[fit_index], use_baseline)
+            batched_cost = get_cost(fit_values[fit_index], x_data, y_data[fit_index], use_baseline)
+            ls_cost = get_cost(ls_values, x_data, y_data[fit_index], use_baseline)
+            if batched_cost > ls_cost * (1 + COST_TOLERANCE) + 1e-12:
+                worse_fits.append(batched_cost / ls_cost)
+    assert worse_fits == [], 'batched fits with higher cost than least_squares (cost ratios): {}'.format(worse_fits)
+
+
+def test_batched_fit_stays_within_bounds():
+    x_data = np.linspace(0, 20, 60)
+    y_data = np.exp(-(x_data - 8) ** 2 / 2) + 0.5 * np.exp(-(x_data - 11) ** 2 / 2)
+    initial_values = np.array([[0.9, 7.5, 1.0, 0.4, 12.0, 1.0]])
+    lower_bounds = np.array([[0, 0, 0.5, 0, 0, 0.5]])
+    upper_bounds = np.array([[1.5, 20, 1.2, 1.5, 20, 1.2]])
+    free_mask = np.ones(initial_values.shape, dtype=bool)
+
+    fit_values = Gaussian_Fitting.fit_gaussians_batched(x_data, y_data[np.newaxis, :], initial_values, lower_bounds, upper_bounds, free_mask, False)
+    assert np.all(fit_values >= lower_bounds) and np.all(fit_values <= upper_bounds)
+    assert get_cost(fit_values[0], x_data, y_data, False) < 1e-8
+
+
+def test_peak_guesses_find_shoulder():
+    # a half-height peak 2 sigma from a larger one has no maximum of its own
+    x_data = np.linspace(0, 20, 100)
+    y_data = np.exp(-(x_data - 8) ** 2 / 2) + 0.5 * np.exp(-(x_data - 10) ** 2 / 2)
+
+    guesses = Gaussian_Fitting.guess_gauss_peaks(y_data, x_data, cv=10, amp_cutoff=0.05)
+    assert len(guesses) == 2
+    assert abs(guesses[0].centroid - 8) < 0.5 and abs(guesses[1].centroid - 10) < 0.5
+    assert abs(guesses[1].amplitude - 0.5) < 0.15